@@ -12,6 +12,8 @@ import subprocess
 import psutil
 import logging
 
+from core.db.ledger import LedgerError, transfer_tx
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.DEBUG,
@@ -491,15 +493,18 @@ class BotGUI:
                 
             user_id = result[0]
             
-            if currency == "Lumcoins":
-                cursor.execute("UPDATE user_profiles SET lumcoins = lumcoins + ? WHERE user_id = ?", (amount, user_id))
-                conn.commit()
-                logger.info(f"Выдано {amount} Lumcoins пользователю @{username} (ID: {user_id})")
-                messagebox.showinfo("Успех", f"Выдано {amount} Lumcoins пользователю @{username}")
-            elif currency == "Plumcoins":
-                # Реализация для Plumcoins
-                logger.info(f"Выдано {amount} Plumcoins пользователю @{username} (ID: {user_id})")
-                messagebox.showinfo("Успех", f"Выдано {amount} Plumcoins пользователю @{username}")
+            # Выдача - проводка со счёта admin, чтобы баланс сходился с журналом
+            debit, credit = ("admin", user_id) if amount > 0 else (user_id, "admin")
+            try:
+                with conn:
+                    transfer_tx(conn, debit, credit, abs(amount), "admin_grant", currency.lower())
+            except LedgerError as e:
+                logger.warning(f"Выдача {amount} {currency} пользователю @{username} отклонена: {e}")
+                messagebox.showerror("Ошибка", f"Операция не выполнена: {e}")
+                conn.close()
+                return
+            logger.info(f"Выдано {amount} {currency} пользователю @{username} (ID: {user_id})")
+            messagebox.showinfo("Успех", f"Выдано {amount} {currency} пользователю @{username}")
             
             conn.close()
             
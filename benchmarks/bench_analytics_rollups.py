@@ -0,0 +1,151 @@
+"""
+Бенчмарк /stats: агрегаты по сырым analytics_interactions vs свёртки компактора.
+
+Заполняет историю взаимодействий за --days дней, сворачивает её
+database.compact_analytics() (сверяя итоги с прямыми агрегатами по сырым
+строкам) и сравнивает время get_user_statistics_summary-подобного запроса и
+get_global_command_stats на сырых данных и на свёртках.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_analytics_rollups.py [--rows 1000000] [--users 2000] [--days 60]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+COMMANDS = ["start_command", "mode_command", "stats_command", "joke_command"]
+
+
+def _fill(path: str, rows: int, users: int, days: int) -> None:
+    rng = random.Random(7)
+    now = time.time()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, 'Bench')",
+        ((u, f"user{u}") for u in range(users)),
+    )
+
+    def interactions():
+        for i in range(rows):
+            ts = now - days * 86400 + days * 86400 * i / rows
+            if rng.random() < 0.05:
+                yield rng.randrange(users), ts, rng.choice(COMMANDS), "command"
+            else:
+                yield rng.randrange(users), ts, "group_message", "message"
+
+    conn.executemany(
+        "INSERT INTO analytics_interactions (user_id, timestamp, mode, action_type) VALUES (?, ?, ?, ?)",
+        interactions(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _raw_user(conn: sqlite3.Connection, user_id: int):
+    count = conn.execute("SELECT COUNT(*) FROM analytics_interactions WHERE user_id = ?", (user_id,)).fetchone()[0]
+    mode = conn.execute(
+        "SELECT mode FROM analytics_interactions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1", (user_id,)
+    ).fetchone()[0]
+    return count, mode
+
+
+def _raw_command(conn: sqlite3.Connection, command: str):
+    return conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM analytics_interactions WHERE action_type = 'command' AND mode = ?",
+        (command,),
+    ).fetchone()
+
+
+def _raw_all_commands(conn: sqlite3.Connection):
+    return conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM analytics_interactions WHERE action_type = 'command'"
+    ).fetchone()
+
+
+def _rollup_user(conn: sqlite3.Connection, user_id: int):
+    return conn.execute(
+        "SELECT interactions, last_mode FROM analytics_user_totals WHERE user_id = ?", (user_id,)
+    ).fetchone()
+
+
+def _rollup_command(conn: sqlite3.Connection, mode: str):
+    return conn.execute(
+        "SELECT usage_count, unique_users FROM analytics_action_totals WHERE action_type = 'command' AND mode = ?",
+        (mode,),
+    ).fetchone()
+
+
+def _time_us(func, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+async def run(rows: int, users: int, days: int) -> None:
+    import database as db
+    from core.db.analytics import ALL_MODES
+    from core.db.writer import stop_all_writers
+
+    await db.initialize_database()
+    _fill(db.DB_PATH, rows, users, days)
+
+    started = time.perf_counter()
+    # Компактор сворачивает историю в два захода, как при инкрементальной работе.
+    half = await db.compact_analytics(batch_size=rows // 2 + 1)
+    rest = await db.compact_analytics()
+    print(f"compacted {half + rest} rows in {time.perf_counter() - started:.2f} s")
+
+    conn = sqlite3.connect(db.DB_PATH)
+    for user_id in range(0, users, max(1, users // 50)):
+        assert _raw_user(conn, user_id) == _rollup_user(conn, user_id), user_id
+    for command in COMMANDS:
+        assert _raw_command(conn, command) == _rollup_command(conn, command), command
+    assert _raw_all_commands(conn) == _rollup_command(conn, ALL_MODES)
+    print("rollups match raw aggregates")
+
+    calls = 200
+    print(f"{rows} raw rows, {users} users, {days} days:")
+    for name, raw, rolled in (
+        ("user summary", lambda i: _raw_user(conn, i % users), lambda i: _rollup_user(conn, i % users)),
+        ("/stats <command>", lambda i: _raw_command(conn, COMMANDS[i % 4]), lambda i: _rollup_command(conn, COMMANDS[i % 4])),
+        ("/stats", lambda i: _raw_all_commands(conn), lambda i: _rollup_command(conn, ALL_MODES)),
+    ):
+        before = _time_us(raw, calls if name == "user summary" else 10)
+        after = _time_us(rolled, calls)
+        print(f"  {name:<18} raw {before:12.1f} us   rollup {after:8.1f} us   {before / after:10.1f}x")
+
+    purged = await db.purge_analytics()
+    remaining = conn.execute("SELECT COUNT(*) FROM analytics_interactions").fetchone()[0]
+    print(f"retention ({db.ANALYTICS_RAW_RETENTION_DAYS:g} days raw): purged {purged}, {remaining} raw rows left")
+    assert _raw_all_commands(conn)[0] < _rollup_command(conn, ALL_MODES)[0]
+    conn.close()
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=60)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.rows, args.users, args.days))
+
+
+if __name__ == "__main__":
+    main()
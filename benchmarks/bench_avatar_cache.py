@@ -0,0 +1,113 @@
+"""
+Бенчмарк кэша аватарок (core/group/stat/avatars.py).
+
+Поддельный бот отвечает на get_user_profile_photos, get_file и download_file
+с задержкой --latency мс и считает вызовы; аватарка - 640x640 JPEG.
+--users пользователей запрашивают аватарку --rounds раз подряд:
+  - прежний путь: три последовательных вызова Telegram и декодирование на каждый запрос;
+  - кэш: холодный старт, тёплая память, перезапуск процесса (память пуста, диск тёплый).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_avatar_cache.py [--users 100] [--rounds 3] [--latency 40]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from PIL import Image  # noqa: E402
+
+
+class _FakeBot:
+    def __init__(self, latency: float, avatar: bytes):
+        self.latency = latency
+        self.avatar = avatar
+        self.calls = 0
+
+    async def _call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    async def get_user_profile_photos(self, user_id, limit=1):
+        await self._call()
+        photo = SimpleNamespace(file_id=f"file-{user_id}", file_unique_id=f"uniq{user_id}")
+        return SimpleNamespace(total_count=1, photos=[[photo]])
+
+    async def get_file(self, file_id):
+        await self._call()
+        return SimpleNamespace(file_path=f"photos/{file_id}.jpg")
+
+    async def download_file(self, file_path):
+        await self._call()
+        return BytesIO(self.avatar)
+
+
+async def _legacy(user_id: int, bot: _FakeBot):
+    """Прежний путь из generate_profile_image: три вызова и декодирование на каждый запрос."""
+    from core.group.stat.render import prepare_avatar, run_in_render_pool
+
+    photos = await bot.get_user_profile_photos(user_id, limit=1)
+    file = await bot.get_file(photos.photos[0][-1].file_id)
+    data = await bot.download_file(file.file_path)
+    return await run_in_render_pool(prepare_avatar, data.getvalue())
+
+
+async def _cached(user_id: int, bot: _FakeBot):
+    from core.group.stat.avatars import get_avatar, get_avatar_photo
+
+    return await get_avatar(await get_avatar_photo(user_id, bot), bot)
+
+
+async def _round(name: str, fetch, users: int, bot: _FakeBot) -> None:
+    bot.calls = 0
+    started = time.perf_counter()
+    for user_id in random.Random(1).sample(range(users), users):
+        assert await fetch(user_id, bot) is not None
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<22} {elapsed / users * 1000:7.2f} ms/avatar   Telegram calls {bot.calls / users:4.1f} per request")
+
+
+async def run(users: int, rounds: int, latency: float) -> None:
+    from core.group.stat import avatars
+    from core.group.stat.render import shutdown_render_pool
+
+    source = BytesIO()
+    Image.effect_noise((640, 640), 64).convert("RGB").save(source, format="JPEG")
+    bot = _FakeBot(latency / 1000, source.getvalue())
+
+    print(f"{users} users, Telegram latency {latency:.0f} ms:")
+    for i in range(rounds):
+        await _round(f"legacy, round {i + 1}", _legacy, users, bot)
+    await _round("cache, cold", _cached, users, bot)
+    for i in range(rounds - 1):
+        await _round(f"cache, warm {i + 1}", _cached, users, bot)
+    avatars._memory.clear()
+    avatars._lookups.clear()
+    await _round("cache, restart (disk)", _cached, users, bot)
+    await _round("cache, warm after", _cached, users, bot)
+    print(f"avatar stats: {avatars.get_avatar_cache_stats()}")
+    shutdown_render_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=40)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.rounds, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Бенчмарк кэша балансов (database.get_balance): чтение баланса запросом к
+user_profiles на каждый вызов vs кэш со сквозной записью из проводок журнала.
+
+Моделирует --interactions взаимодействий с меню казино от --users
+пользователей: меню показывает баланс, проверка ставки читает его ещё раз,
+ставка списывается, выигрыш (каждый третий раз) зачисляется, итоговое
+сообщение снова показывает баланс. В конце каждый закэшированный баланс
+сверяется с БД.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_balance_cache.py [--users 500] [--interactions 5000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _fill(path: str, users: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO users (user_id, first_name) VALUES (?, 'Bench')", ((u,) for u in range(users)))
+    conn.executemany("INSERT INTO user_profiles (user_id) VALUES (?)", ((u,) for u in range(users)))
+    conn.commit()
+    conn.close()
+
+
+async def _direct_balance(db, user_id: int, currency: str = "lumcoins") -> int:
+    """Прежний ProfileManager.get_lumcoins: запрос на каждый вызов."""
+    async with db.get_pool().acquire() as conn:
+        cursor = await conn.execute(f"SELECT {currency} FROM user_profiles WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def _interactions(db, read, users: int, count: int, seed: int):
+    rng = random.Random(seed)
+
+    async def _one(i: int, user_id: int) -> None:
+        await read(user_id)                               # меню
+        if await read(user_id) >= 100:                    # проверка ставки
+            await db.adjust_balance(user_id, -100, "casino", "casino:bench:bet")
+            if i % 3 == 0:
+                await db.adjust_balance(user_id, 250, "casino", "casino:bench:win")
+        await read(user_id)                               # итог
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one(i, rng.randrange(users)) for i in range(count)))
+    return time.perf_counter() - started, 3 * count
+
+
+async def run(users: int, interactions: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+
+    await db.initialize_database()
+    _fill(db.DB_PATH, users)
+    await db.open_pool()
+    await db.transfer_many([("opening", u, 1000, "bench", "lumcoins") for u in range(users)])
+
+    print(f"{interactions} casino interactions from {users} users (3 balance reads each):")
+    elapsed, reads = await _interactions(db, lambda u: _direct_balance(db, u), users, interactions, 1)
+    print(f"  direct SELECT  {reads / elapsed:9.0f} reads/s incl. writes   {elapsed:6.2f} s")
+    db.invalidate_balances()  # холодный старт: первое чтение каждого пользователя - промах
+    elapsed, reads = await _interactions(db, db.get_balance, users, interactions, 2)
+    stats = db.get_balance_cache_stats()
+    print(f"  balance cache  {reads / elapsed:9.0f} reads/s incl. writes   {elapsed:6.2f} s   "
+          f"hit rate {stats['hit_rate']:.1%}")
+
+    started = time.perf_counter()
+    for _ in range(5):
+        for u in range(users):
+            await _direct_balance(db, u)
+    direct_only = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(5):
+        for u in range(users):
+            await db.get_balance(u)
+    cached_only = time.perf_counter() - started
+    print(f"  read-only: {5 * users / direct_only:9.0f} vs {5 * users / cached_only:9.0f} reads/s "
+          f"({direct_only / cached_only:.0f}x)")
+
+    stale = [u for u in range(users) if await db.get_balance(u) != await _direct_balance(db, u)]
+    assert not stale, f"cached balances diverged from the database for {len(stale)} users"
+    problems = await db.verify_ledger()
+    assert not problems, problems
+    print(f"every cached balance matches user_profiles; stats {db.get_balance_cache_stats()}")
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--interactions", type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.interactions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Бенчмарк массовой установки активных фонов: set_user_active_background на
+каждого пользователя (соединение из пула и коммит на вызов) vs
+database.sync_active_backgrounds (одно чтение, executemany по изменившимся
+строкам пачками через писателя).
+
+Заполняет --users профилей, меняет фон у --change-rate из них. Прежний путь
+прогоняется на --legacy-sample пользователях и пересчитывается на всех.
+Проверяет dry-run (ничего не пишет, разница совпадает) и итоговое состояние.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_bulk_sync.py [--users 100000] [--change-rate 0.3] [--legacy-sample 5000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+KEYS = ["default", "forest_1", "night_city_1", "mountains_1", "space_1"]
+
+
+def _fill(path: str, users: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO users (user_id, first_name) VALUES (?, 'Bench')", ((u,) for u in range(users)))
+    conn.executemany("INSERT INTO user_profiles (user_id, active_background) VALUES (?, 'default')",
+                     ((u,) for u in range(users)))
+    conn.commit()
+    conn.close()
+
+
+def _snapshot(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    rows = dict(conn.execute("SELECT user_id, active_background FROM user_profiles"))
+    conn.close()
+    return rows
+
+
+async def run(users: int, change_rate: float, legacy_sample: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+
+    await db.initialize_database()
+    _fill(db.DB_PATH, users)
+    await db.open_pool()
+    rng = random.Random(17)
+    target = {u: (rng.choice(KEYS[1:]) if rng.random() < change_rate else "default") for u in range(users)}
+    target[users + 1] = "space_1"  # профиля нет
+
+    started = time.perf_counter()
+    report = await db.sync_active_backgrounds(target, dry_run=True)
+    dry_elapsed = time.perf_counter() - started
+    assert all(key == "default" for key in _snapshot(db.DB_PATH).values()), "dry run must not write"
+    expected = sum(1 for u, key in target.items() if u < users and key != "default")
+    assert report["changed"] == expected and report["missing"] == 1, report
+    print(f"{users} users, {report['changed']} changed, dry run in {dry_elapsed * 1000:.0f} ms: "
+          f"{ {k: v for k, v in report.items() if k != 'diff'} }")
+
+    sample = list(range(legacy_sample))
+    started = time.perf_counter()
+    for user_id in sample:
+        await db.set_user_active_background(user_id, target[user_id])
+    legacy = (time.perf_counter() - started) / legacy_sample * users
+
+    started = time.perf_counter()
+    report = await db.sync_active_backgrounds(target)
+    bulk = time.perf_counter() - started
+    assert report["changed"] == expected - sum(1 for u in sample if target[u] != "default")
+    snapshot = _snapshot(db.DB_PATH)
+    assert all(snapshot[u] == target[u] for u in range(users)), "state mismatch after sync"
+    again = await db.sync_active_backgrounds(target)
+    assert again["changed"] == 0
+
+    print(f"  per-user calls (extrapolated from {legacy_sample}): {legacy:8.2f} s")
+    print(f"  sync_active_backgrounds:                   {bulk:8.2f} s   ({legacy / bulk:.0f}x)")
+    print("final state matches the target; a repeated sync changes 0 rows")
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--change-rate", type=float, default=0.3)
+    parser.add_argument("--legacy-sample", type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.change_rate, args.legacy_sample))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Бенчмарк загрузки кастомных фонов (core/group/stat/backgrounds.py).
+
+Локальный aiohttp-сервер отдаёт JPEG 3000x2000 с ETag и считает запросы.
+Сравнивается прежний путь (новая ClientSession, полное скачивание, полное
+декодирование и масштабирование на каждую отрисовку) с fetch_background:
+холодная загрузка, дисковый кэш, перепроверка условным GET (304).
+Затем проверяются ограничения: файл больше BACKGROUND_MAX_BYTES, не картинка,
+медленный сервер, 404 и отдача сохранённой копии при недоступном источнике.
+Картинка по той же ссылке меняется: после перепроверки у фона новый ключ
+(хэш содержимого), и фон из LRU отрисовки не переиспользуется.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_custom_background.py [--renders 20]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+from PIL import Image  # noqa: E402
+
+
+def _image_bytes() -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise((3000, 2000), 48).convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def _start_server(source: dict, counters: dict):
+    async def photo(request):
+        counters["requests"] += 1
+        if request.headers.get("If-None-Match") == source["etag"]:
+            counters["not_modified"] += 1
+            return web.Response(status=304)
+        return web.Response(body=source["image"], content_type="image/jpeg", headers={"ETag": source["etag"]})
+
+    async def huge(request):
+        return web.Response(body=b"\xff" * (11 * 1024 * 1024), content_type="image/jpeg")
+
+    async def html(request):
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    async def slow(request):
+        await asyncio.sleep(5)
+        return web.Response(body=source["image"], content_type="image/jpeg")
+
+    app = web.Application()
+    app.add_routes([web.get("/photo.jpg", photo), web.get("/huge.jpg", huge), web.get("/page.jpg", html),
+                    web.get("/slow.jpg", slow)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _legacy(url: str) -> Image.Image:
+    """Прежний путь из generate_profile_image."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            data = await response.read()
+    return Image.open(BytesIO(data)).convert("RGBA").resize((700, 280))
+
+
+async def run(renders: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+    from core.group.stat import backgrounds
+    from core.group.stat.render import get_background, shutdown_render_pool
+
+    await db.initialize_database()
+    await db.open_pool()
+    counters = {"requests": 0, "not_modified": 0}
+    image = _image_bytes()
+    source = {"image": image, "etag": '"v1"'}
+    runner, base = await _start_server(source, counters)
+    url = f"{base}/photo.jpg"
+    print(f"source: 3000x2000 JPEG, {len(image) / 1e6:.1f} MB; {renders} renders per case")
+
+    async def measure(name, fetch, prepare=None):
+        counters["requests"] = 0
+        started = time.perf_counter()
+        for _ in range(renders):
+            if prepare:
+                prepare()
+            await fetch(url)
+        elapsed = time.perf_counter() - started
+        print(f"  {name:<26} {elapsed / renders * 1000:8.2f} ms/render   HTTP requests {counters['requests']:3d}")
+
+    await measure("legacy", _legacy)
+    await measure("cold (disk wiped each time)", backgrounds.fetch_background,
+                  lambda: [path.unlink() for path in backgrounds.BACKGROUND_CACHE_DIR.glob("*.png")])
+    await measure("disk cache", backgrounds.fetch_background)
+    backgrounds.BACKGROUND_REVALIDATE_SECONDS = 0
+    await measure("revalidate every time", backgrounds.fetch_background)
+    print(f"  304 responses: {counters['not_modified']}")
+
+    # Новая картинка по той же ссылке: ключ фона (и дайджест карточки) меняется после перепроверки.
+    first = await backgrounds.background_content_hash(url)
+    old = await get_background(f"custom:{first}", lambda: backgrounds.fetch_background(url))
+    source["image"], source["etag"] = _image_bytes(), '"v2"'
+    second = await backgrounds.background_content_hash(url)
+    new = await get_background(f"custom:{second}", lambda: backgrounds.fetch_background(url))
+    assert first != second and old.tobytes() != new.tobytes(), "changed image kept the old background key"
+    print(f"  image replaced at the same URL: background key {first[:8]} -> {second[:8]}")
+
+    backgrounds.BACKGROUND_TIMEOUT = 1.0
+    await backgrounds.close_background_session()
+    for name in ("huge.jpg", "page.jpg", "slow.jpg", "missing.jpg"):
+        started = time.perf_counter()
+        try:
+            await backgrounds.fetch_background(f"{base}/{name}")
+            raise AssertionError(f"{name} should be rejected")
+        except backgrounds.BackgroundError as e:
+            print(f"  rejected {name:<12} in {time.perf_counter() - started:5.2f} s: {e}")
+
+    await runner.cleanup()
+    assert (await backgrounds.fetch_background(url)).size == (700, 280)
+    print(f"source down: cached copy served; stats: {backgrounds.get_background_fetch_stats()}")
+
+    await backgrounds.close_background_session()
+    shutdown_render_pool()
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--renders", type=int, default=20)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.renders))
+
+
+if __name__ == "__main__":
+    main()
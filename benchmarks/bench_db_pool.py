@@ -0,0 +1,98 @@
+"""
+Бенчмарк задержки вызовов database.py: соединение на каждый вызов vs общий пул.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_db_pool.py [--calls 500]
+
+Работает во временной директории и не трогает data/bot_database.db.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+class ConnectPerCall:
+    """Имитирует старое поведение: новое соединение aiosqlite на каждый вызов."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def acquire(self):
+        import aiosqlite
+        return aiosqlite.connect(self.path)
+
+
+async def _measure(name: str, calls: int, func) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        await func(i)
+    elapsed = time.perf_counter() - started
+    per_call_us = elapsed / calls * 1_000_000
+    print(f"  {name:<28} {per_call_us:10.1f} us/call")
+    return per_call_us
+
+
+async def run(calls: int) -> None:
+    import database as db
+
+    await db.open_pool()
+    await db.initialize_database()
+
+    def uncached(func):
+        # Сбрасываем кэш настроек групп, чтобы сравнивать именно путь до БД.
+        def call(i):
+            db.invalidate_group_settings()
+            return func(i)
+        return call
+
+    scenarios = {
+        "get_group_settings": uncached(lambda i: db.get_group_settings(-1000 - i % 10)),
+        "get_ai_status": uncached(lambda i: db.get_ai_status(-1000 - i % 10)),
+        "ensure_user_exists": lambda i: db.ensure_user_exists(i % 50, f"user{i % 50}", "Bench"),
+        "log_user_interaction": lambda i: db.log_user_interaction(i % 50, "group_message"),
+        "get_user_rp_stats": lambda i: db.get_user_rp_stats(i % 50),
+    }
+
+    pool = db.get_pool()
+    results = {}
+    for label, backend in (("connect-per-call", ConnectPerCall(db.DB_PATH)), ("pool", pool)):
+        db._pool = backend
+        print(f"{label}:")
+        for name, func in scenarios.items():
+            results[(label, name)] = await _measure(name, calls, func)
+    db._pool = pool
+
+    print("speedup:")
+    for name in scenarios:
+        before = results[("connect-per-call", name)]
+        after = results[("pool", name)]
+        print(f"  {name:<28} {before / after:10.1f}x")
+
+    db.invalidate_group_settings()
+    stats_before = db.get_group_settings_cache_stats()
+    print("group settings cache:")
+    await _measure("get_group_settings (cached)", calls, lambda i: db.get_group_settings(-1000 - i % 10))
+    stats_after = db.get_group_settings_cache_stats()
+    print(f"  hits: {stats_after['hits'] - stats_before['hits']}, misses: {stats_after['misses'] - stats_before['misses']}")
+
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Бенчмарк истории диалогов: чтение последних реплик и рост файла БД.
+
+- чтение: get_user_dialog_history после 1 тыс. и после --turns записанных реплик
+  (кольцевой буфер из миграции 11 держит DIALOG_HISTORY_LIMIT записей на
+  пользователя) против таблицы без ограничения;
+- рост файла: размер после срока хранения (purge_dialog_history) и
+  инкрементального VACUUM.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_dialog_history.py [--turns 1000000] [--users 1000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _fill(path: str, turns: int, users: int, start_ts: float) -> None:
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, 'Bench')",
+        ((u, f"user{u}") for u in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO dialog_history (user_id, timestamp, mode, role, content) VALUES (?, ?, 'saharoza', ?, ?)",
+        ((i % users, start_ts + i * 0.01, "user" if i % 2 == 0 else "assistant", "x" * 200) for i in range(turns)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _uncapped(path: str) -> None:
+    """Та же схема без триггера-ограничителя (как до миграции 11)."""
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TRIGGER trg_dialog_history_cap")
+    conn.commit()
+    conn.close()
+
+
+async def _read_us(db, users: int, calls: int = 500) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        await db.get_ollama_dialog_history(i % users)
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+async def run(turns: int, users: int) -> None:
+    import database as db
+    from core.db.maintenance import ensure_incremental_auto_vacuum
+    from core.db.migrations import DIALOG_HISTORY_LIMIT
+    from core.db.writer import stop_all_writers
+
+    ensure_incremental_auto_vacuum(db.DB_PATH)
+    await db.initialize_database()
+    # Путь записи через писателя: триггер держит буфер.
+    await db.ensure_user_exists(users + 1, "writer", "Bench")
+    for i in range(50):
+        await db.add_chat_history_entry(users + 1, "saharoza", f"q{i}", f"a{i}")
+    history = await db.get_user_dialog_history(users + 1, limit=100)
+    assert len(history) == DIALOG_HISTORY_LIMIT and history[-1]["content"] == "a49", history[-1]
+
+    old_ts = time.time() - 90 * 86400
+    print(f"{users} users, limit {DIALOG_HISTORY_LIMIT} rows per user:")
+    for label, capped in (("capped", True), ("uncapped", False)):
+        if not capped:
+            _uncapped(db.DB_PATH)
+        await db.get_pool().close()
+        conn = sqlite3.connect(db.DB_PATH)
+        conn.execute("DELETE FROM dialog_history")
+        conn.commit()
+        conn.close()
+        _fill(db.DB_PATH, 1000, users, old_ts)
+        small = await _read_us(db, users)
+        _fill(db.DB_PATH, turns - 1000, users, old_ts + 10)
+        large = await _read_us(db, users)
+        conn = sqlite3.connect(db.DB_PATH)
+        rows = conn.execute("SELECT COUNT(*) FROM dialog_history").fetchone()[0]
+        conn.close()
+        print(f"  {label:<9} read after 1k turns {small:7.1f} us, after {turns} turns {large:7.1f} us, {rows} rows stored")
+
+    size_before = os.path.getsize(db.DB_PATH)
+    purged = await db.purge_dialog_history()
+    await stop_all_writers()
+    await db.close_pool()
+    vacuum = db.incremental_vacuum(db.DB_PATH)
+    size_after = os.path.getsize(db.DB_PATH)
+    print(f"retention purged {purged} rows; incremental vacuum {vacuum}")
+    print(f"  file size {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.turns, args.users))
+
+
+if __name__ == "__main__":
+    main()
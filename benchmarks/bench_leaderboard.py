@@ -0,0 +1,142 @@
+"""
+Бенчмарк /top: ORDER BY по всей user_profiles vs рейтинги в памяти
+(core/group/stat/leaderboard.py).
+
+Заполняет --users профилей и участников --chats чатов, строит рейтинги
+leaderboard.load(), прогоняет поток обновлений через ProfileManager и сверяет
+топы и места с SQL. Затем замеряет топ-10, место пользователя (в SQL -
+COUNT по условию) и обновление значения.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_leaderboard.py [--users 100000] [--chats 50]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+LEVEL_ORDER = "ORDER BY up.level DESC, up.exp DESC, up.user_id"
+
+
+def _fill(path: str, users: int, chats: int) -> None:
+    rng = random.Random(5)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, 'Bench')",
+        ((u, f"user{u}") for u in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO user_profiles (user_id, level, exp, lumcoins, plumcoins, flames) VALUES (?, ?, ?, ?, ?, ?)",
+        ((u, rng.randint(1, 30), rng.randint(0, 99), rng.randint(0, 10 ** 6), rng.randint(0, 1000), rng.randint(0, 50))
+         for u in range(users)),
+    )
+    conn.executemany(
+        "INSERT INTO chat_members (chat_id, user_id) VALUES (?, ?)",
+        ((-(u % chats) - 1, u) for u in range(users)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _sql_top(conn: sqlite3.Connection, chat_id=None, limit: int = 10):
+    if chat_id is None:
+        rows = conn.execute(f"SELECT up.user_id FROM user_profiles up {LEVEL_ORDER} LIMIT ?", (limit,))
+    else:
+        rows = conn.execute(
+            f"SELECT up.user_id FROM user_profiles up JOIN chat_members cm ON cm.user_id = up.user_id "
+            f"WHERE cm.chat_id = ? {LEVEL_ORDER} LIMIT ?", (chat_id, limit)
+        )
+    return [row[0] for row in rows]
+
+
+def _sql_lumcoins_rank(conn: sqlite3.Connection, user_id: int) -> int:
+    return conn.execute(
+        "SELECT COUNT(*) + 1 FROM user_profiles WHERE lumcoins > (SELECT lumcoins FROM user_profiles WHERE user_id = ?) "
+        "OR (lumcoins = (SELECT lumcoins FROM user_profiles WHERE user_id = ?) AND user_id < ?)",
+        (user_id, user_id, user_id)
+    ).fetchone()[0]
+
+
+def _time_us(func, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+async def run(users: int, chats: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+    from core.group.stat.leaderboard import leaderboard
+    from core.group.stat.manager import ProfileManager
+
+    await db.initialize_database()
+    _fill(db.DB_PATH, users, chats)
+
+    profile_manager = ProfileManager()
+    await profile_manager.connect()
+    started = time.perf_counter()
+    await profile_manager.load_leaderboard()
+    print(f"leaderboard.load(): {users} users, {chats} chats in {time.perf_counter() - started:.2f} s")
+
+    rng = random.Random(9)
+    for i in range(2000):
+        user_id = rng.randrange(users)
+        action = i % 3
+        if action == 0:
+            await profile_manager.update_lumcoins(user_id, rng.randint(-500, 5000))
+        elif action == 1:
+            await profile_manager.update_exp(user_id, rng.randint(1, 5000))
+        else:
+            await profile_manager.record_message(SimpleNamespace(id=user_id, username=None, first_name="Bench"), -1)
+
+    conn = sqlite3.connect(db.DB_PATH)
+    assert [user_id for _, user_id, _ in leaderboard.top("level", 10)] == _sql_top(conn)
+    for chat_id in (-1, -2):
+        assert [user_id for _, user_id, _ in leaderboard.top("level", 10, chat_id)] == _sql_top(conn, chat_id)
+    for user_id in rng.sample(range(users), 50):
+        assert leaderboard.rank("lumcoins", user_id) == _sql_lumcoins_rank(conn, user_id), user_id
+    print("top-10 and ranks match SQL after 2000 incremental updates")
+
+    calls = 200
+    print("per call:")
+    for name, sql, memory in (
+        ("global top-10", lambda i: _sql_top(conn), lambda i: leaderboard.top("level", 10)),
+        ("chat top-10", lambda i: _sql_top(conn, -(i % chats) - 1), lambda i: leaderboard.top("level", 10, -(i % chats) - 1)),
+        ("rank of user", lambda i: _sql_lumcoins_rank(conn, i), lambda i: leaderboard.rank("lumcoins", i)),
+    ):
+        before = _time_us(sql, calls)
+        after = _time_us(memory, calls * 10)
+        print(f"  {name:<14} SQL {before:10.1f} us   memory {after:6.2f} us   {before / after:9.0f}x")
+    update = _time_us(lambda i: leaderboard.update(i % users, lumcoins=i), 100_000)
+    print(f"  leaderboard.update (global + chat): {update:.2f} us")
+    conn.close()
+
+    await profile_manager.close()
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--chats", type=int, default=50)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.chats))
+
+
+if __name__ == "__main__":
+    main()
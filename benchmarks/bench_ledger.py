@@ -0,0 +1,142 @@
+"""
+Бенчмарк журнала валют (core/db/ledger.py): прежние траты "прочитать баланс,
+проверить в Python, UPDATE ... MAX(0, lumcoins - ?)" vs database.adjust_balance
+и database.transfer (проверка баланса в самом UPDATE, проводка в транзакции
+писателя).
+
+У --users пользователей по --balance LUM; на каждого приходит --spends
+одновременных покупок по --price. Прежний путь отдаёт товар чаще, чем хватает
+денег (баланс обрезается нулём), журнал - никогда. Затем --transfers случайных
+переводов между пользователями идут параллельно, после чего check_ledger()
+должен вернуть пустой список, а сумма балансов - не измениться.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_ledger.py [--users 200] [--balance 1000] [--price 300] [--spends 8] [--transfers 5000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _fill(path: str, users: int, balance: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO users (user_id, first_name) VALUES (?, 'Bench')", ((u,) for u in range(users)))
+    conn.executemany("INSERT INTO user_profiles (user_id, lumcoins) VALUES (?, ?)",
+                     ((u, balance) for u in range(users)))
+    conn.commit()
+    conn.close()
+
+
+def _balances(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    rows = dict(conn.execute("SELECT user_id, lumcoins FROM user_profiles"))
+    conn.close()
+    return rows
+
+
+async def _legacy_spend(db, user_id: int, price: int) -> bool:
+    """Старый путь: чтение баланса, проверка в Python, отдельный UPDATE с коммитом."""
+    async with db.get_pool().acquire() as conn:
+        cursor = await conn.execute("SELECT lumcoins FROM user_profiles WHERE user_id = ?", (user_id,))
+        balance = (await cursor.fetchone())[0]
+    if balance < price:
+        return False
+    await asyncio.sleep(0)  # обработчик ждёт что-то ещё между проверкой и списанием
+    async with db.get_pool().acquire() as conn:
+        await conn.execute("UPDATE user_profiles SET lumcoins = MAX(0, lumcoins - ?) WHERE user_id = ?",
+                           (price, user_id))
+        await conn.commit()
+    return True
+
+
+async def _ledger_spend(db, user_id: int, price: int) -> bool:
+    await asyncio.sleep(0)
+    return await db.adjust_balance(user_id, -price, "shop", "bench")
+
+
+async def _spend_round(name, spend, db, users, balance, price, spends):
+    jobs = [spend(db, user_id, price) for user_id in range(users) for _ in range(spends)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+    sold = sum(results)
+    affordable = users * (balance // price)
+    after = _balances(db.DB_PATH)
+    print(f"  {name:<7} sold {sold:5d} items (affordable {affordable}), "
+          f"lost revenue {max(0, sold * price - (users * balance - sum(after.values()))):7d} LUM, "
+          f"min balance {min(after.values())}, {len(jobs) / elapsed:7.0f} spends/s")
+    return sold, affordable
+
+
+async def run(users: int, balance: int, price: int, spends: int, transfers: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+
+    await db.initialize_database()
+    _fill(db.DB_PATH, users, balance)
+    await db.open_pool()
+
+    print(f"{users} users x {spends} concurrent purchases of {price} LUM with {balance} LUM each:")
+    sold, affordable = await _spend_round("legacy", _legacy_spend, db, users, balance, price, spends)
+    assert sold > affordable, "legacy path was expected to oversell under concurrency"
+
+    # Новый прогон на чистых балансах, проведённых через журнал.
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("UPDATE user_profiles SET lumcoins = 0")
+    conn.commit()
+    conn.close()
+    await db.transfer_many([("opening", u, balance, "bench", "lumcoins") for u in range(users)])
+    sold, affordable = await _spend_round("ledger", _ledger_spend, db, users, balance, price, spends)
+    assert sold == affordable, (sold, affordable)
+
+    total = sum(_balances(db.DB_PATH).values())
+    rng = random.Random(5)
+
+    async def _one():
+        debit, credit = rng.sample(range(users), 2)
+        try:
+            await db.transfer(debit, credit, rng.randint(1, 2 * price), "bench:give")
+        except db.InsufficientFunds:
+            pass
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(transfers)))
+    elapsed = time.perf_counter() - started
+    after = _balances(db.DB_PATH)
+    assert sum(after.values()) == total and min(after.values()) >= 0
+    problems = await db.verify_ledger()
+    assert not problems, problems
+    entries = await db.get_ledger_entries(reason="bench:give", limit=5)
+    print(f"{transfers} concurrent user-to-user transfers: {transfers / elapsed:.0f}/s, "
+          f"total balance unchanged, check_ledger() clean, last entry {entries[0] if entries else None}")
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--balance", type=int, default=1000)
+    parser.add_argument("--price", type=int, default=300)
+    parser.add_argument("--spends", type=int, default=8)
+    parser.add_argument("--transfers", type=int, default=5000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.balance, args.price, args.spends, args.transfers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Бенчмарк кэша карточек профиля (core/group/stat/card_cache.py).
+
+--users пользователей по очереди запрашивают карточку --requests раз; между
+запросами у части пользователей меняется видимое поле (--change-rate), что
+даёт новый дайджест. Бот и сообщение поддельные: аватарки нет, answer_photo
+возвращает фото с file_id и считает загрузки. Сравнивается отрисовка и
+загрузка на каждый запрос (прежнее поведение) с send_profile_card.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_profile_card_cache.py [--users 50] [--requests 400] [--change-rate 0.2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+class _FakeBot:
+    async def get_user_profile_photos(self, user_id, limit=1):
+        return SimpleNamespace(total_count=0, photos=[])
+
+
+class _FakeMessage:
+    def __init__(self, user, counters):
+        self.from_user = user
+        self._counters = counters
+
+    async def answer_photo(self, photo, **kwargs):
+        if isinstance(photo, str):
+            self._counters["by_file_id"] += 1
+        else:
+            self._counters["uploads"] += 1
+            self._counters["uploaded_bytes"] += len(photo.data)
+        self._counters["file_seq"] += 1
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{self._counters['file_seq']}")])
+
+
+async def run(users: int, requests: int, change_rate: float) -> None:
+    from core.group.stat.card_cache import get_card_cache_stats
+    from core.group.stat.manager import ProfileManager
+    from core.group.stat.render import shutdown_render_pool
+
+    backgrounds = ["default", "forest_1", "night_city_1", "mountains_1", "space_1"]
+    rng = random.Random(13)
+    manager, bot = ProfileManager(), _FakeBot()
+    people = [SimpleNamespace(id=i, username=f"user{i}", first_name="Bench") for i in range(users)]
+    profiles = {
+        person.id: {"active_background": rng.choice(backgrounds), "hp": 100, "level": rng.randint(1, 30),
+                    "exp": rng.randint(0, 99), "lumcoins": rng.randint(0, 10 ** 4), "plumcoins": 0,
+                    "daily_messages": 0, "total_messages": rng.randint(0, 10 ** 4), "flames": 0}
+        for person in people
+    }
+    plan = []
+    for _ in range(requests):
+        person = rng.choice(people)
+        if rng.random() < change_rate:
+            profiles[person.id]["total_messages"] += 1
+        plan.append((person, dict(profiles[person.id])))
+
+    from core.group.stat import card_cache
+
+    results = {}
+    for name in ("render every time", "card cache"):
+        counters = {"uploads": 0, "by_file_id": 0, "uploaded_bytes": 0, "file_seq": 0}
+        started = time.perf_counter()
+        for person, profile in plan:
+            message = _FakeMessage(person, counters)
+            if name == "card cache":
+                await manager.send_profile_card(message, profile, bot)
+            else:
+                # Прежний путь: отрисовка и загрузка файла на каждый запрос.
+                from aiogram.types import BufferedInputFile
+                card_cache._cache.clear()
+                image = await manager.generate_profile_image(person, profile, bot)
+                await message.answer_photo(BufferedInputFile(image.getvalue(), filename="profile.png"))
+        elapsed = time.perf_counter() - started
+        if name == "render every time":
+            card_cache._cache.clear()
+            card_cache._stats.update(dict.fromkeys(card_cache._stats, 0))
+        results[name] = elapsed
+        print(f"  {name:<18} {elapsed / requests * 1000:7.2f} ms/request   uploads {counters['uploads']:4d} "
+              f"({counters['uploaded_bytes'] / 1e6:6.1f} MB)   sent by file_id {counters['by_file_id']:4d}")
+    print(f"speedup {results['render every time'] / results['card cache']:.1f}x; cache stats: {get_card_cache_stats()}")
+    shutdown_render_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--change-rate", type=float, default=0.2)
+    args = parser.parse_args()
+    os.chdir(REPO_ROOT)
+    asyncio.run(run(args.users, args.requests, args.change_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Бенчмарк карточки профиля: прежняя отрисовка прямо в цикле событий vs
+конвейер core/group/stat/render.py (LRU фонов, готовые маски и градиент,
+пул потоков).
+
+Прежний путь воспроизведён по старому generate_profile_image: на каждую
+карточку открывается и масштабируется фон, заново строятся маски, полоса
+опыта рисуется линией на каждый пиксель. Оба пути получают один и тот же
+аватар по умолчанию (бот без фотографий профиля). Сначала сверяются пиксели
+результата, затем --cards карточек отрисовываются по --concurrency сразу,
+пока отдельная задача меряет задержку цикла событий (тик 5 мс).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_profile_render.py [--cards 200] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont  # noqa: E402
+
+BACKGROUNDS = ["background/defolt.jpg", "background/SPACE.png", "background/PICK.jpg",
+               "background/forest(day).jpg", "background/Night_City(japan).webp"]
+
+
+def _legacy_render(background_path: str, data: dict) -> BytesIO:
+    """Синхронная отрисовка по старому generate_profile_image."""
+    from core.group.stat.config import ProfileConfig
+    from core.group.stat.progression import level_progress
+
+    fonts = {}
+
+    def get_font(size):
+        if size not in fonts:
+            fonts[size] = ImageFont.truetype(ProfileConfig.FONT_PATH, size)
+        return fonts[size]
+
+    def text(draw, xy, value, size):
+        draw.text(xy, value, fill=ProfileConfig.TEXT_COLOR, font=get_font(size), stroke_width=1,
+                  stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
+
+    size = (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT)
+    background = Image.open(background_path).convert("RGBA").resize(size)
+    card = Image.new("RGBA", size, (0, 0, 0, 0))
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).rounded_rectangle([(0, 0), size], radius=ProfileConfig.CARD_RADIUS, fill=255)
+    card.paste(background, (0, 0), mask)
+    draw = ImageDraw.Draw(card)
+
+    avatar_box = (ProfileConfig.AVATAR_SIZE, ProfileConfig.AVATAR_SIZE)
+    avatar = Image.open(ProfileConfig.DEFAULT_AVATAR_PATH).convert("RGBA").resize(avatar_box)
+    avatar_mask = Image.new("L", avatar_box, 0)
+    ImageDraw.Draw(avatar_mask).ellipse([(0, 0), avatar_box], fill=255)
+    card.paste(avatar, ProfileConfig.AVATAR_OFFSET, avatar_mask)
+
+    text(draw, (ProfileConfig.TEXT_BLOCK_LEFT_X, ProfileConfig.USERNAME_Y), data['display_name'], 30)
+    hp_x = ProfileConfig.AVATAR_X + ProfileConfig.AVATAR_SIZE + ProfileConfig.MARGIN // 2
+    hp_y = ProfileConfig.USERNAME_Y + 40
+    text(draw, (hp_x, hp_y), f"HP: {data['hp']}/{ProfileConfig.MAX_HP}", 22)
+    text(draw, (hp_x, hp_y + 30), f"LUM: {data['lumcoins']}", 22)
+    text(draw, (hp_x, hp_y + 60), f"PLUM: {data['plumcoins']}", 22)
+
+    level = data['level']
+    exp, exp_needed, fraction = level_progress(level, data['exp'])
+    x = ProfileConfig.MARGIN
+    y = ProfileConfig.CARD_HEIGHT - ProfileConfig.MARGIN - ProfileConfig.EXP_BAR_HEIGHT
+    width = ProfileConfig.CARD_WIDTH - (ProfileConfig.MARGIN * 2) - 80
+    height = ProfileConfig.EXP_BAR_HEIGHT
+    draw.rounded_rectangle([(x, y), (x + width, y + height)], radius=height // 2,
+                           fill=(100, 100, 100, ProfileConfig.EXP_BAR_ALPHA))
+    start, end = ProfileConfig.EXP_GRADIENT_START, ProfileConfig.EXP_GRADIENT_END
+    for i in range(int(width * fraction)):
+        color = tuple(int(start[c] + (end[c] - start[c]) * (i / (width * fraction + 1e-6))) for c in range(3))
+        draw.line([(x + i, y), (x + i, y + height)], fill=color + (ProfileConfig.EXP_BAR_ALPHA,))
+    exp_text = f"Уровень: {level} | EXP: {exp}/{exp_needed}"
+    bbox = draw.textbbox((0, 0), exp_text, font=get_font(18))
+    text(draw, (x + (width - (bbox[2] - bbox[0])) // 2, y + (height - (bbox[3] - bbox[1])) // 2), exp_text, 18)
+
+    current_y = ProfileConfig.RIGHT_COLUMN_TOP_Y
+    for label, value in (("Сообщения (день):", data['daily_messages']),
+                         ("Сообщения (всего):", data['total_messages']), ("Пламя:", data['flames'])):
+        bbox = draw.textbbox((0, 0), label, font=get_font(20))
+        text(draw, (ProfileConfig.RIGHT_COLUMN_X - (bbox[2] - bbox[0]), current_y), label, 20)
+        bbox = draw.textbbox((0, 0), str(value), font=get_font(22))
+        text(draw, (ProfileConfig.RIGHT_COLUMN_X - (bbox[2] - bbox[0]), current_y + 25), str(value), 22)
+        current_y += ProfileConfig.ITEM_SPACING_Y
+
+    output = BytesIO()
+    card.save(output, format='PNG')
+    output.seek(0)
+    return output
+
+
+def _profile(rng: random.Random, user_id: int) -> dict:
+    return {
+        "display_name": f"@user{user_id}", "first_name": "Bench", "hp": rng.randint(0, 150),
+        "lumcoins": rng.randint(0, 10 ** 5), "plumcoins": rng.randint(0, 100), "level": rng.randint(1, 40),
+        "exp": rng.randint(0, 99), "daily_messages": rng.randint(0, 500), "total_messages": rng.randint(0, 10 ** 5),
+        "flames": rng.randint(0, 30),
+    }
+
+
+async def _lag_probe(stop: asyncio.Event, lags: list) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - started - 0.005)
+
+
+async def _measure(name: str, render, jobs, concurrency: int) -> None:
+    stop, lags = asyncio.Event(), []
+    probe = asyncio.create_task(_lag_probe(stop, lags))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(job):
+        async with semaphore:
+            await render(*job)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one(job) for job in jobs))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0
+    print(f"  {name:<8} {len(jobs) / elapsed:7.1f} cards/s   loop lag p99 {p99:7.1f} ms   max {lags[-1] * 1000 if lags else 0:7.1f} ms")
+
+
+async def run(cards: int, concurrency: int) -> None:
+    from core.group.stat.render import get_background, get_render_stats, render_card, shutdown_render_pool
+
+    async def _new(path: str, data: dict) -> BytesIO:
+        async def _load():
+            return Path(path)
+        return await render_card(await get_background(path, _load), None, data)
+
+    async def _old(path: str, data: dict) -> BytesIO:
+        return _legacy_render(path, data)
+
+    rng = random.Random(11)
+    for path in BACKGROUNDS:
+        data = _profile(rng, 1)
+        old = Image.open(await _old(path, data))
+        new = Image.open(await _new(path, data))
+        diff = ImageChops.difference(old, new).getbbox()
+        assert diff is None, (path, diff)
+    print(f"new pipeline output is pixel-identical to the legacy card on {len(BACKGROUNDS)} backgrounds")
+
+    jobs = [(rng.choice(BACKGROUNDS), _profile(rng, i)) for i in range(cards)]
+    print(f"{cards} cards, concurrency {concurrency}:")
+    await _measure("legacy", _old, jobs, concurrency)
+    await _measure("pipeline", _new, jobs, concurrency)
+    print(f"render stats: {get_render_stats()}")
+    shutdown_render_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    os.chdir(REPO_ROOT)
+    asyncio.run(run(args.cards, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
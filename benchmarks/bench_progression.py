@@ -0,0 +1,70 @@
+"""
+Бенчмарк разрешения повышения уровня: цикл по LEVEL_UP_EXP_REQUIREMENT vs
+таблица накопленного опыта с bisect (core/group/stat/progression.py).
+
+Сначала сверяет оба способа на случайных (уровень, опыт, начисление),
+затем замеряет типичное начисление за сообщение и крупную выдачу опыта.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_progression.py [--calls 200000]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _loop_apply_exp(level: int, exp: int, gained: int):
+    """Прежний итеративный расчёт из record_message, с потолком MAX_LEVEL."""
+    from core.group.stat.config import ProfileConfig
+
+    exp += gained
+    lumcoins = 0
+    while level < ProfileConfig.MAX_LEVEL and exp >= ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(level):
+        exp -= ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(level)
+        level += 1
+        lumcoins += ProfileConfig.LUMCOINS_PER_LEVEL.get(level, 0)
+    return level, exp, lumcoins
+
+
+def _time_us(func, cases) -> float:
+    started = time.perf_counter()
+    for level, exp, gained in cases:
+        func(level, exp, gained)
+    return (time.perf_counter() - started) / len(cases) * 1_000_000
+
+
+def run(calls: int) -> None:
+    from core.group.stat.progression import CUMULATIVE_EXP, MAX_LEVEL, apply_exp
+
+    rng = random.Random(3)
+    checks = []
+    for _ in range(20000):
+        level = rng.randint(1, 60)
+        exp = rng.randint(0, int(CUMULATIVE_EXP[level] - CUMULATIVE_EXP[level - 1]) - 1)
+        checks.append((level, exp, rng.choice([1, 10, 100, 10_000, 10 ** 9])))
+    for case in checks:
+        assert apply_exp(*case) == _loop_apply_exp(*case), case
+    print(f"table matches the loop on {len(checks)} random cases (MAX_LEVEL={MAX_LEVEL})")
+
+    per_message = [(rng.randint(1, 30), 0, 1) for _ in range(calls)]
+    big_grant = [(1, 0, 10 ** 12) for _ in range(calls // 10)]
+    for name, cases in (("+1 exp per message", per_message), ("grant to max level", big_grant)):
+        before = _time_us(_loop_apply_exp, cases)
+        after = _time_us(apply_exp, cases)
+        print(f"  {name:<20} loop {before:8.2f} us   table {after:6.2f} us   {before / after:7.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200_000)
+    args = parser.parse_args()
+    run(args.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Бенчмарк накладных расходов инструментирования SQL (core/db/querystats.py).
+
+Сравнивает точечный SELECT и INSERT на обычном sqlite3-соединении и на
+InstrumentedConnection, затем прогоняет типичную нагрузку бота через пул и
+писателя и печатает сводку format_query_stats() и журнал медленного запроса.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_query_stats.py [--calls 50000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _per_call_us(conn: sqlite3.Connection, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        conn.execute("SELECT username FROM users WHERE user_id = ?", (i % 1000,)).fetchone()
+        conn.execute("INSERT INTO analytics_interactions (user_id, timestamp, mode) VALUES (?, ?, 'bench')", (i % 1000, i))
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+async def _workload(db) -> None:
+    for i in range(300):
+        await db.ensure_user_exists(i, f"user{i}", "Bench")
+        await db.log_user_interaction(i, "group_message")
+        await db.get_group_settings(-100 - i % 10)
+        await db.get_user_by_username(f"user{i}")
+    await db.compact_analytics()
+    # Заведомо медленный запрос без индекса попадает в журнал вместе с планом.
+    async with db.get_pool().acquire() as conn:
+        await conn.execute(
+            "SELECT COUNT(*) FROM analytics_interactions a JOIN analytics_interactions b ON a.mode = b.mode"
+        )
+
+
+async def run(calls: int) -> None:
+    import database as db
+    from core.db import querystats
+    from core.db.writer import stop_all_writers
+
+    await db.initialize_database()
+    seed = sqlite3.connect(db.DB_PATH)
+    seed.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)", ((i, f"u{i}") for i in range(1000)))
+    seed.executemany(
+        "INSERT INTO analytics_interactions (user_id, timestamp, mode) VALUES (?, ?, ?)",
+        ((i % 1000, i, f"m{i % 50}") for i in range(20000)),
+    )
+    seed.commit()
+    seed.close()
+
+    plain = sqlite3.connect(db.DB_PATH)
+    instrumented = sqlite3.connect(db.DB_PATH, factory=querystats.InstrumentedConnection)
+    _per_call_us(plain, 1000)
+    plain.rollback()
+    before = _per_call_us(plain, calls)
+    plain.rollback()
+    after = _per_call_us(instrumented, calls)
+    instrumented.rollback()
+    plain.close()
+    instrumented.close()
+    print(f"SELECT + INSERT pair, {calls} calls:")
+    print(f"  plain sqlite3:        {before:8.2f} us")
+    print(f"  instrumented:         {after:8.2f} us  (+{after - before:.2f} us per pair)")
+
+    querystats.reset_query_stats()
+    await _workload(db)
+    await db.flush_last_active()
+    print("\nformat_query_stats(8):")
+    print(querystats.format_query_stats(8))
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=50_000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.calls))
+
+
+if __name__ == "__main__":
+    main()
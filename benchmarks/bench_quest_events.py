@@ -0,0 +1,147 @@
+"""
+Бенчмарк хуков прогресса заданий: прежний путь (get_user_quests с разбором
+JSON всех активных заданий на каждое событие и отдельная запись на каждое
+подходящее задание) vs движок core/group/stat/quest_engine.py (индекс в
+памяти, пакетная запись).
+
+Для --users пользователей выдаются настоящие задания
+(quest_rollover.generate_for), затем --events событий (80% - сообщения,
+остальное - казино, RP, работа, крафт) прогоняются по --concurrency сразу
+сначала старым путём, потом через движок, с обнулением прогресса между
+прогонами. Итоговый прогресс и статистика выполнений в БД должны совпасть -
+в том числе у движка с маленьким индексом (вытеснение) и forget() посреди
+потока, пока прогресс ещё не записан.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_quest_events.py [--users 300] [--events 20000] [--concurrency 200]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+KINDS = ["message_count"] * 16 + ["casino_games", "rp_actions", "work", "crafting"]
+
+
+def _snapshot(path: str) -> tuple:
+    conn = sqlite3.connect(path)
+    progress = dict(conn.execute("SELECT user_quest_id, progress || ':' || completed FROM user_quests"))
+    stats = sorted(conn.execute("SELECT user_id, original_quest_id, completed_count FROM quests_statistics"))
+    conn.close()
+    return progress, stats
+
+
+def _reset(path: str) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE user_quests SET progress = 0, completed = FALSE")
+    conn.execute("DELETE FROM quests_statistics")
+    conn.execute("DELETE FROM quest_user_totals")
+    conn.execute("DELETE FROM quest_totals")
+    conn.commit()
+    conn.close()
+
+
+async def _run_events(emit, events, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(event):
+        async with semaphore:
+            await emit(*event)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one(event) for event in events))
+    return time.perf_counter() - started
+
+
+async def run(users: int, events: int, concurrency: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+    from core.group.stat import quests_handlers as qh
+    from core.group.stat.quest_engine import QuestEngine
+
+    await db.initialize_database()
+    await db.open_pool()
+    try:
+        await qh.quest_rollover.generate_for(range(1, users + 1))
+
+        rng = random.Random(3)
+        stream = [(rng.randint(1, users), rng.choice(KINDS), 1) for _ in range(events)]
+
+        async def _legacy(user_id: int, kind: str, amount: int) -> None:
+            quests = await qh.get_user_quests(user_id)
+            for quest_type in ("daily", "weekly"):
+                for quest in quests[quest_type]:
+                    if quest["type"] == kind and not quest["completed"]:
+                        await qh.increment_quest_progress(user_id, quest_type, quest["user_quest_id"], amount)
+
+        print(f"{events} quest events from {users} users, concurrency {concurrency}:")
+        legacy = await _run_events(_legacy, stream, concurrency)
+        expected = _snapshot(db.DB_PATH)
+        print(f"  per-event reads and writes  {events / legacy:8.0f} events/s")
+
+        _reset(db.DB_PATH)
+        engine = qh.quest_engine
+        engine.forget()
+        elapsed = await _run_events(engine.emit, stream, concurrency)
+        await engine.flush()
+        print(f"  quest engine                {events / elapsed:8.0f} events/s   ({legacy / elapsed:.0f}x), "
+              f"stats {engine.get_stats()}")
+
+        # Тёплый индекс: события без единого обращения к БД до сброса.
+        started = time.perf_counter()
+        for user_id, kind, amount in stream:
+            await engine.emit(user_id, kind, amount)
+        warm = time.perf_counter() - started
+        print(f"  warm emit: {warm / events * 1e6:.1f} us/event")
+        await engine.flush()
+
+        _reset(db.DB_PATH)
+        engine.forget()
+        await _run_events(engine.emit, stream, concurrency)
+        await engine.close()
+        assert _snapshot(db.DB_PATH) == expected, "engine progress differs from the per-event path"
+        print("final quest progress and completion statistics match the per-event path")
+
+        # Перезагрузки посреди потока: вытеснение из индекса на 1/10 пользователей и forget()
+        # (как после смены заданий или прямого обновления) при незаписанном и записываемом прогрессе.
+        _reset(db.DB_PATH)
+        reloading = QuestEngine(index_size=max(1, users // 10), flush_batch=50)
+
+        async def _emit_and_forget(user_id: int, kind: str, amount: int) -> None:
+            await reloading.emit(user_id, kind, amount)
+            if rng.random() < 0.05:
+                reloading.forget(user_id)
+
+        await _run_events(_emit_and_forget, stream, concurrency)
+        await reloading.close()
+        assert _snapshot(db.DB_PATH) == expected, "progress was lost across index reloads"
+        print(f"  with evictions and forget() mid-stream: same result, stats {reloading.get_stats()}")
+
+    finally:
+        await stop_all_writers()
+        await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.events, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Бенчмарк уведомлений о заданиях: прежнее сообщение на каждое изменение
+прогресса vs сводки core/group/stat/quest_notifier.py.
+
+--users пользователей получают настоящие задания, затем --events событий
+(как в bench_quest_events.py) идут через движок заданий в течение --seconds
+секунд. Бот подменён счётчиком вызовов send_message; время сжато: окно сводки
+--window секунд вместо 300, отправка не чаще --rate в секунду, а одна отправка
+получает TelegramRetryAfter. Проверяется, что сводок на порядки меньше, чем
+изменений, что пользователь получает не больше одной сводки за окно, что общий
+темп отправки не выше --rate, и что последнее, что пользователь увидел по
+каждому заданию, совпадает с итоговым прогрессом в БД (выполнения не теряются).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_quest_notifications.py [--users 300] [--events 30000] [--seconds 4]
+        [--window 1] [--rate 100]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+KINDS = ["message_count"] * 16 + ["casino_games", "rp_actions", "work", "crafting"]
+
+
+class CountingBot:
+    """Вместо Telegram: запоминает отправки; одна отправка получает флуд-контроль."""
+
+    def __init__(self, retry_after_at: int) -> None:
+        self.sent = []
+        self._retry_after_at = retry_after_at
+
+    async def send_message(self, chat_id: int, text: str, parse_mode=None) -> None:
+        from aiogram.exceptions import TelegramRetryAfter
+        from aiogram.methods import SendMessage
+
+        if len(self.sent) == self._retry_after_at:
+            self._retry_after_at = -1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Too Many Requests", 1)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+
+def _final_progress(path: str) -> dict:
+    from core.group.stat.quests_config import QuestsConfig
+
+    conn = sqlite3.connect(path)
+    final = {}
+    for user_id, original_id, required, progress, completed in conn.execute(
+            "SELECT user_id, original_quest_id, required_count, progress, completed FROM user_quests WHERE progress > 0"):
+        name = QuestsConfig.quest_view(original_id, required)["name"]
+        final[(user_id, name)] = "done" if completed else f"{progress}/{required}"
+    conn.close()
+    return final
+
+
+def _seen(sent: list) -> dict:
+    """Последнее состояние каждого задания по тексту сводок."""
+    seen = {}
+    for _, user_id, text in sent:
+        lines = text.splitlines()
+        for i, line in enumerate(lines):
+            if line.startswith("✅ "):
+                seen[(user_id, line[2:].rsplit(" - ", 1)[0])] = "done"
+            elif line.startswith("🎯 "):
+                seen[(user_id, line[2:])] = lines[i + 1].split(": ", 1)[1]
+    return seen
+
+
+async def run(users: int, events: int, seconds: float, window: float, rate: float) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+    from core.group.stat import quests_handlers as qh
+    from core.group.stat.quest_engine import QuestEngine
+    from core.group.stat.quest_notifier import QuestNotifier
+
+    await db.initialize_database()
+    await db.open_pool()
+    await qh.quest_rollover.generate_for(range(1, users + 1))
+
+    bot = CountingBot(retry_after_at=5)
+    notifier = QuestNotifier(send=qh.send_quest_digest, window=window, delay=window / 5, rate=rate)
+    engine = QuestEngine(notify=notifier.notify)
+    sender = asyncio.ensure_future(notifier.run_sender())
+    flusher = asyncio.ensure_future(engine.run_flusher(0.1))
+
+    rng = random.Random(3)
+    stream = [(rng.randint(1, users), rng.choice(KINDS)) for _ in range(events)]
+    step = max(1, events // 100)
+    started = time.monotonic()
+    for i in range(0, events, step):
+        for user_id, kind in stream[i:i + step]:
+            await engine.emit(user_id, kind, 1, bot)
+        await asyncio.sleep(seconds / 100)
+    flusher.cancel()
+    await engine.close()
+    # Досылаем то, что ещё ждёт окна, как при остановке бота.
+    sender.cancel()
+    closing = time.monotonic()
+    await notifier.close(timeout=60)
+    elapsed = time.monotonic() - started
+
+    stats = notifier.get_stats()
+    changes = engine.get_stats()["advanced"]
+    print(f"{events} quest events from {users} users over {elapsed:.1f} s "
+          f"(window {window} s, rate limit {rate}/s):")
+    print(f"  message per progress change (previous)  {changes:7d} send_message calls")
+    print(f"  message per quest per engine flush      {stats['updates']:7d} send_message calls")
+    print(f"  digests                                 {len(bot.sent):7d} send_message calls "
+          f"({changes / max(1, len(bot.sent)):.0f}x fewer), stats {stats}")
+    assert stats["retry_after"] == 1 and stats["failed"] == 0 and stats["dropped"] == 0, stats
+
+    # За окно - не больше одной сводки на пользователя (кроме досылки при остановке).
+    last = {}
+    for ts, user_id, _ in bot.sent:
+        if ts < closing and user_id in last:
+            assert ts - last[user_id] >= window * 0.99, f"user {user_id} got two digests within the window"
+        last[user_id] = ts
+    times = [ts for ts, _, _ in bot.sent if ts < closing]
+    peak = max((sum(1 for t in times if start <= t < start + 1) for start in times), default=0)
+    assert peak <= rate + 1, f"{peak} sends within one second"
+    print(f"  at most one digest per user per window, peak {peak} sends/s")
+
+    final, seen = _final_progress(db.DB_PATH), _seen(bot.sent)
+    assert seen == final, f"{len(set(final.items()) ^ set(seen.items()))} quest states differ from the database"
+    print("the last digest for every quest matches its final progress in the database")
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--events", type=int, default=30000)
+    parser.add_argument("--seconds", type=float, default=4)
+    parser.add_argument("--window", type=float, default=1)
+    parser.add_argument("--rate", type=float, default=100)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.events, args.seconds, args.window, args.rate))
+
+
+if __name__ == "__main__":
+    main()
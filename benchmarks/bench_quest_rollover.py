@@ -0,0 +1,156 @@
+"""
+Бенчмарк смены заданий: прежний ленивый refresh_user_quests (DELETE,
+INSERT на каждое задание и UPDATE quest_refresh_times в первом /quests
+пользователя за день) vs плановая смена core/group/stat/quest_rollover.py
+(все активные пользователи на границе периода, пакетами в намерениях писателя).
+
+--users пользователей активны в последние дни (и ещё столько же - давно
+неактивны). Замеряется смена на новый день прежним способом для всех активных
+(время первого /quests) и одним прогоном run_once(). После прогона у каждого
+активного пользователя должны быть ровно задания
+QuestsConfig.get_*_quests_for_user на эту дату, у неактивных - никаких новых,
+повторный прогон ничего не вставляет, а прогресс, накопленный в движке до
+границы, записан до удаления старых заданий.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_quest_rollover.py [--users 20000] [--chunk 500]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _fill(path: str, users: int, now: datetime) -> None:
+    conn = sqlite3.connect(path)
+    recent, stale = now.timestamp() - 3600, (now - timedelta(days=60)).timestamp()
+    conn.executemany("INSERT INTO users (user_id, first_name, last_active_ts) VALUES (?, 'Bench', ?)",
+                     ((u, recent if u <= users else stale) for u in range(1, 2 * users + 1)))
+    conn.commit()
+    conn.close()
+
+
+async def _legacy_refresh(db, user_id: int, now: datetime) -> None:
+    """Прежний refresh_user_quests для пользователя, у которого наступил новый день и новая неделя."""
+    from core.group.stat.quests_config import QuestsConfig
+
+    async with db.get_pool().acquire() as conn:
+        await conn.execute('INSERT OR IGNORE INTO quest_refresh_times (user_id, last_daily_refresh, '
+                           'last_weekly_refresh) VALUES (?, ?, ?)', (user_id, now.isoformat(), now.isoformat()))
+        for quest_type, quests, days in (("daily", QuestsConfig.get_daily_quests_for_user(user_id, now=now), 1),
+                                         ("weekly", QuestsConfig.get_weekly_quests_for_user(user_id, now=now), 7)):
+            await conn.execute('DELETE FROM user_quests WHERE user_id = ? AND quest_type = ?', (user_id, quest_type))
+            for quest in quests:
+                await conn.execute('''
+                    INSERT INTO user_quests (user_id, user_quest_id, original_quest_id, quest_type, quest_kind,
+                                             required_count, difficulty, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, quest['user_quest_id'], quest['original_id'], quest_type, quest['type'],
+                      quest['required']['count'], quest['difficulty'], (now + timedelta(days=days)).isoformat()))
+            await conn.execute(f'UPDATE quest_refresh_times SET last_{quest_type}_refresh = ? WHERE user_id = ?',
+                               (now.isoformat(), user_id))
+        await conn.commit()
+
+
+def _quests(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    quests = {}
+    for user_id, quest_type, user_quest_id, required in conn.execute(
+            "SELECT user_id, quest_type, user_quest_id, required_count FROM user_quests ORDER BY user_quest_id"):
+        quests.setdefault((user_id, quest_type), []).append((user_quest_id, required))
+    conn.close()
+    return quests
+
+
+async def run(users: int, chunk: int) -> None:
+    import database as db
+    from core.db.writer import stop_all_writers
+    from core.group.stat import quests_handlers as qh
+    from core.group.stat.quest_rollover import QuestRollover
+    from core.group.stat.quests_config import QuestsConfig
+
+    # Понедельник 00:00:05: сменяются и ежедневные, и еженедельные задания.
+    monday = datetime(2026, 10, 19, 0, 0, 5)
+    await db.initialize_database()
+    _fill(db.DB_PATH, users, monday)
+    await db.open_pool()
+
+    print(f"day and week rollover for {users} active users ({users} more inactive):")
+    started = time.perf_counter()
+    for user_id in range(1, users + 1):
+        await _legacy_refresh(db, user_id, monday)
+    legacy = time.perf_counter() - started
+    print(f"  lazy per-user refresh   {legacy:6.2f} s   ({legacy / users * 1000:.2f} ms added to a first /quests)")
+    legacy_quests = _quests(db.DB_PATH)
+
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("DELETE FROM user_quests")
+    conn.commit()
+    conn.close()
+
+    # Вчерашние задания с прогрессом, который ещё в памяти движка.
+    engine = qh.quest_engine
+    rollover = QuestRollover(engine, chunk=chunk)
+    sunday = monday - timedelta(minutes=10)
+    await rollover.generate_for(range(1, 11), now=sunday)
+    old = {user_id: await engine.emit(user_id, "message_count", 1) for user_id in range(1, 11)}
+
+    loop_stalls = []
+
+    async def _watch():
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0)
+            loop_stalls.append(time.perf_counter() - tick)
+
+    watcher = asyncio.ensure_future(_watch())
+    started = time.perf_counter()
+    assert engine.get_stats()["pending"] == sum(old.values())
+    inserted = await rollover.run_once(now=monday)
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    assert engine.get_stats()["pending"] == 0, "engine progress was not flushed before the rollover"
+    print(f"  scheduled rollover      {elapsed:6.2f} s   ({legacy / elapsed:.0f}x), {inserted} quests, "
+          f"longest event loop stall {max(loop_stalls) * 1000:.0f} ms, stats {rollover.get_stats()}")
+
+    expected = {}
+    for user_id in range(1, users + 1):
+        for quest_type, generate in (("daily", QuestsConfig.get_daily_quests_for_user),
+                                     ("weekly", QuestsConfig.get_weekly_quests_for_user)):
+            expected[(user_id, quest_type)] = sorted(
+                (quest["user_quest_id"], quest["required"]["count"]) for quest in generate(user_id, now=monday))
+    assert _quests(db.DB_PATH) == expected == legacy_quests, "rollover quests differ from QuestsConfig generation"
+    print("every active user got exactly the QuestsConfig quests for the new period, inactive users none")
+
+    assert await rollover.run_once(now=monday + timedelta(minutes=1)) == 0, "second run inserted quests again"
+    rollover.request(users + 1)
+    assert await rollover.run_once(now=monday + timedelta(minutes=2)) == len(expected[(1, "daily")]) + len(
+        expected[(1, "weekly")]), "requested user did not get quests"
+    print("repeated run is a no-op; a requested inactive user gets quests on the next run")
+
+    await stop_all_writers()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=500)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.chunk))
+
+
+if __name__ == "__main__":
+    main()
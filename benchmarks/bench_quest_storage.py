@@ -0,0 +1,151 @@
+"""
+Бенчмарк хранения заданий: прежний user_quests с копией шаблона в JSON
+(quest_data) vs колонки миграции 016 (quest_kind, required_count, difficulty).
+
+Создаётся БД со схемой до миграции 015 включительно, в неё пишутся задания
+--users пользователей в прежнем виде (как их писал refresh_user_quests), затем
+замеряются размер таблицы и загрузка активных заданий пользователя (с разбором
+JSON). После этого применяется миграция 016: каждая строка должна перенестись
+с теми же id, типом, требованием, сложностью и прогрессом, а загрузка
+сравнивается на новой схеме. В конце проверяется, что генерация заданий
+детерминирована и не меняет шаблоны.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_quest_storage.py [--users 5000] [--loads 20000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _legacy_rows(users: int):
+    """Строки в прежнем формате: полная копия шаблона с подставленным описанием."""
+    from core.group.stat.quests_config import QuestsConfig
+
+    expires = (datetime.now() + timedelta(days=1)).isoformat()
+    rng = random.Random(11)
+    for user_id in range(1, users + 1):
+        for quest_type, quests in (("daily", QuestsConfig.get_daily_quests_for_user(user_id)),
+                                   ("weekly", QuestsConfig.get_weekly_quests_for_user(user_id))):
+            for quest in quests:
+                template = QuestsConfig.get_template(quest["original_id"])
+                data = {**copy.deepcopy(template), **quest}
+                data["required"] = {"count": quest["required"]["count"]}
+                yield (quest["user_quest_id"], user_id, quest_type, quest["original_id"], json.dumps(data),
+                       rng.randint(0, quest["required"]["count"] - 1), expires)
+
+
+def _table_bytes(conn: sqlite3.Connection) -> int:
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = 'user_quests'").fetchone()[0]
+    except sqlite3.OperationalError:  # SQLite без dbstat
+        return conn.execute("SELECT SUM(LENGTH(quest_data)) FROM user_quests").fetchone()[0] or 0
+
+
+def _time_loads(conn: sqlite3.Connection, load, users: int, loads: int) -> float:
+    rng = random.Random(7)
+    started = time.perf_counter()
+    for _ in range(loads):
+        load(conn, rng.randint(1, users))
+    return time.perf_counter() - started
+
+
+def _legacy_load(conn: sqlite3.Connection, user_id: int) -> dict:
+    quests = {}
+    for user_quest_id, quest_data, progress in conn.execute(
+        "SELECT user_quest_id, quest_data, progress FROM user_quests WHERE user_id = ? AND completed = FALSE",
+        (user_id,)
+    ):
+        data = json.loads(quest_data)
+        quests.setdefault(data["type"], []).append((user_quest_id, data["required"]["count"], progress))
+    return quests
+
+
+def _column_load(conn: sqlite3.Connection, user_id: int) -> dict:
+    quests = {}
+    for user_quest_id, quest_kind, required, progress in conn.execute(
+        "SELECT user_quest_id, quest_kind, required_count, progress FROM user_quests "
+        "WHERE user_id = ? AND completed = FALSE",
+        (user_id,)
+    ):
+        quests.setdefault(quest_kind, []).append((user_quest_id, required, progress))
+    return quests
+
+
+def run(users: int, loads: int) -> None:
+    from core.db.migrations import MIGRATIONS, apply_migrations
+    from core.group.stat.quests_config import QuestsConfig
+
+    path = os.path.abspath("quests.db")
+    apply_migrations(path, [m for m in MIGRATIONS if m[0] <= 15])
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO user_quests (user_quest_id, user_id, quest_type, original_quest_id, quest_data, progress, "
+        "expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        _legacy_rows(users)
+    )
+    conn.commit()
+    rows = conn.execute("SELECT COUNT(*) FROM user_quests").fetchone()[0]
+    legacy_bytes = _table_bytes(conn)
+    expected = {uid: (original, json.loads(data)["type"], json.loads(data)["required"]["count"],
+                      json.loads(data)["difficulty"], progress)
+                for uid, original, data, progress in conn.execute(
+                    "SELECT user_quest_id, original_quest_id, quest_data, progress FROM user_quests")}
+    legacy_loads = _time_loads(conn, _legacy_load, users, loads)
+    conn.close()
+
+    started = time.perf_counter()
+    assert apply_migrations(path, [m for m in MIGRATIONS if m[0] <= 16]) == [16]
+    migrated = time.perf_counter() - started
+
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    column_bytes = _table_bytes(conn)
+    actual = {uid: rest for uid, *rest in conn.execute(
+        "SELECT user_quest_id, original_quest_id, quest_kind, required_count, difficulty, progress FROM user_quests")}
+    assert actual == {uid: list(values) for uid, values in expected.items()}, "migration 016 changed quest rows"
+    column_loads = _time_loads(conn, _column_load, users, loads)
+    conn.close()
+
+    print(f"{rows} quests of {users} users:")
+    print(f"  quest_data JSON  {legacy_bytes / rows:6.0f} bytes/row   {loads / legacy_loads:8.0f} loads/s")
+    print(f"  columns          {column_bytes / rows:6.0f} bytes/row   {loads / column_loads:8.0f} loads/s   "
+          f"({legacy_bytes / column_bytes:.1f}x smaller, {legacy_loads / column_loads:.1f}x faster)")
+    print(f"migration 016 converted every row in {migrated * 1000:.0f} ms")
+
+    templates = copy.deepcopy((QuestsConfig.DAILY_QUESTS, QuestsConfig.WEEKLY_QUESTS))
+    random.seed(1)
+    state = random.getstate()
+    for user_id in range(1, 200):
+        assert QuestsConfig.get_daily_quests_for_user(user_id) == QuestsConfig.get_daily_quests_for_user(user_id)
+        assert QuestsConfig.get_weekly_quests_for_user(user_id) == QuestsConfig.get_weekly_quests_for_user(user_id)
+    assert (QuestsConfig.DAILY_QUESTS, QuestsConfig.WEEKLY_QUESTS) == templates, "generation mutated templates"
+    assert random.getstate() == state, "generation reseeded the global random"
+    print("quest generation is deterministic and leaves templates and global random untouched")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--loads", type=int, default=20000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        run(args.users, args.loads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Бенчмарк статистики заданий: прежняя агрегация quests_statistics на каждый
+запрос vs материализованные счётчики core/db/quest_totals.py.
+
+В quests_statistics пишутся выполнения --users пользователей, свёртки
+пересобираются, затем --reads раз читаются статистика пользователя (экран
+"Статистика заданий") и общие итоги по типам заданий - прежним запросом с
+агрегацией и из свёрток; результаты должны совпасть. После этого для части
+пользователей выдаются настоящие задания и закрываются конкурентно через
+движок заданий и прямые increment_quest_progress: свёртки обновляются в той
+же транзакции, что и отметка completed, и сверка должна быть пустой.
+В конце счётчики портятся вручную, сверка это находит, пересборка чинит.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_quest_totals.py [--users 20000] [--reads 2000] [--active 300]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _populate(path: str, users: int) -> int:
+    from core.group.stat.quests_config import QuestsConfig
+
+    quests = [("daily", q["id"]) for group in QuestsConfig.DAILY_QUESTS.values() for q in group]
+    quests += [("weekly", q["id"]) for q in QuestsConfig.WEEKLY_QUESTS]
+    rng = random.Random(5)
+    now = datetime.now().isoformat()
+    rows = [(user_id, quest_type, quest_id, rng.randint(1, 40), now)
+            for user_id in range(1, users + 1)
+            for quest_type, quest_id in rng.sample(quests, rng.randint(1, len(quests)))]
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO quests_statistics (user_id, quest_type, original_quest_id, completed_count, "
+                     "last_completed) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return len(rows)
+
+
+async def _legacy_user_stats(user_id: int) -> dict:
+    """Как прежний get_quest_statistics: все строки пользователя и сумма в Python."""
+    import database as db
+
+    async with db.get_pool().acquire() as conn:
+        cursor = await conn.execute(
+            "SELECT quest_type, completed_count FROM quests_statistics WHERE user_id = ?", (user_id,))
+        by_type = {}
+        for quest_type, count in await cursor.fetchall():
+            by_type[quest_type] = by_type.get(quest_type, 0) + count
+    return by_type
+
+
+async def _legacy_global_stats() -> dict:
+    import database as db
+
+    async with db.get_pool().acquire() as conn:
+        cursor = await conn.execute(
+            "SELECT quest_type, SUM(completed_count), COUNT(DISTINCT user_id) FROM quests_statistics "
+            "GROUP BY quest_type")
+        return {quest_type: (count, users) for quest_type, count, users in await cursor.fetchall()}
+
+
+async def _timed(coro_fn, reads: int) -> float:
+    started = time.perf_counter()
+    for _ in range(reads):
+        await coro_fn()
+    return (time.perf_counter() - started) / reads
+
+
+async def run(users: int, reads: int, active: int) -> None:
+    import database as db
+    from core.db.quest_totals import ALL_QUESTS
+    from core.db.writer import stop_all_writers
+    from core.group.stat import quests_handlers as qh
+
+    await db.initialize_database()
+    await db.open_pool()
+    try:
+        rows = _populate(db.DB_PATH, users)
+        started = time.perf_counter()
+        totals = await db.rebuild_quest_totals()
+        print(f"{rows} quests_statistics rows of {users} users, rebuilt {totals} quest_totals rows "
+              f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        rng = random.Random(9)
+        sample = [rng.randint(1, users) for _ in range(reads)]
+        for user_id in sample[:200]:
+            stats = await qh.get_quest_statistics(user_id, detailed=False)
+            assert stats["quests_by_type"] == await _legacy_user_stats(user_id), f"user {user_id} differs"
+        current = {r["quest_type"]: (r["completed_count"], r["unique_users"])
+                   for r in await qh.get_global_quest_stats() if r["quest_type"] != ALL_QUESTS}
+        assert current == await _legacy_global_stats(), "global quest totals differ from the aggregation"
+
+        it = iter(sample * 2)
+        legacy_user = await _timed(lambda: _legacy_user_stats(next(it)), reads)
+        it = iter(sample * 2)
+        user = await _timed(lambda: qh.get_quest_statistics(next(it), detailed=False), reads)
+        legacy_global = await _timed(_legacy_global_stats, max(1, reads // 20))
+        global_ = await _timed(qh.get_global_quest_stats, reads)
+        print(f"  user stats    aggregation {legacy_user * 1e6:9.0f} us   counters {user * 1e6:6.0f} us "
+              f"({legacy_user / user:.1f}x)")
+        print(f"  global stats  aggregation {legacy_global * 1e6:9.0f} us   counters {global_ * 1e6:6.0f} us "
+              f"({legacy_global / global_:.0f}x)")
+
+        # Конкурентные выполнения: движок и прямые обновления вперемешку.
+        await qh.quest_rollover.generate_for(range(users + 1, users + active + 1))
+        engine = qh.quest_engine
+        direct = []
+        for user_id in range(users + 1, users + active + 1):
+            quests = await qh.get_user_quests(user_id)
+            for quest_type in ("daily", "weekly"):
+                for quest in quests[quest_type]:
+                    if rng.random() < 0.5:
+                        direct.append(qh.increment_quest_progress(user_id, quest_type, quest["user_quest_id"], 10 ** 6))
+        events = [engine.emit(rng.randint(users + 1, users + active), kind, 10 ** 6)
+                  for kind in ("message_count", "casino_games", "rp_actions", "work", "crafting")
+                  for _ in range(active)]
+        started = time.perf_counter()
+        await asyncio.gather(*direct, *events)
+        await engine.close()
+        completed = await qh.get_global_quest_stats()
+        print(f"  {len(direct)} direct updates and {len(events)} engine events in "
+              f"{time.perf_counter() - started:.1f} s, totals now "
+              f"{[(r['quest_type'], r['completed_count'], r['unique_users']) for r in completed]}")
+        problems = await db.verify_quest_totals()
+        assert not problems, problems[:5]
+        print("counters match quests_statistics after concurrent completions")
+
+        conn = sqlite3.connect(db.DB_PATH)
+        conn.execute("UPDATE quest_totals SET completed_count = completed_count + 1 WHERE quest_type = ?",
+                     (ALL_QUESTS,))
+        conn.execute("DELETE FROM quest_user_totals WHERE user_id = 1")
+        conn.commit()
+        conn.close()
+        problems = await db.verify_quest_totals()
+        assert len(problems) >= 2, problems
+        await db.rebuild_quest_totals()
+        assert not await db.verify_quest_totals()
+        print(f"checker found {len(problems)} corrupted counters, rebuild restored them")
+    finally:
+        await stop_all_writers()
+        await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--active", type=int, default=300)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.reads, args.active))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Проверка и бенчмарк атомарного ProfileManager._record_message_tx (один UPSERT).
+
+1. Гонка: --threads потоков со своими соединениями параллельно записывают
+   сообщения одного пользователя. Старая схема SELECT -> Python -> UPDATE теряет
+   инкременты, UPSERT - нет.
+2. Параллельная нагрузка через ProfileManager.record_message (писатель БД):
+   total_messages/daily_messages/exp сходятся с числом сообщений, огоньки и
+   сброс дневного счётчика корректны для пользователей, активных сегодня,
+   вчера и давно.
+3. Стоимость одного сообщения внутри транзакции: старая схема vs UPSERT.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_record_message.py [--threads 8] [--messages 2000]
+
+Работает во временной директории и не трогает рабочие БД. Завершается
+AssertionError, если инкременты потеряны.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _legacy_record_message_tx(conn: sqlite3.Connection, user_id: int) -> None:
+    """Прежняя логика: чтение профиля, расчёт в Python и UPDATE."""
+    from core.group.stat.config import ProfileConfig
+
+    current_date = datetime.now().date().isoformat()
+    row = conn.execute(
+        'SELECT level, exp, lumcoins, daily_messages, total_messages, flames, last_activity_date FROM user_profiles WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    level, exp, lumcoins, daily_messages, total_messages, flames, last_activity_date = row
+    if last_activity_date != current_date:
+        daily_messages = 0
+        yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
+        flames = flames + 1 if last_activity_date == yesterday else 1
+    total_messages += 1
+    daily_messages += 1
+    if total_messages % ProfileConfig.EXP_PER_MESSAGES_COUNT == 0:
+        exp += ProfileConfig.EXP_PER_MESSAGE_INTERVAL
+        while exp >= ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(level):
+            exp -= ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(level)
+            level += 1
+            lumcoins += ProfileConfig.LUMCOINS_PER_LEVEL.get(level, 0)
+        conn.execute(
+            'INSERT OR REPLACE INTO user_activity_log (user_id, date, exp_gained) VALUES (?, ?, ?)',
+            (user_id, current_date, ProfileConfig.EXP_PER_MESSAGE_INTERVAL)
+        )
+    conn.execute(
+        '''UPDATE user_profiles SET level = ?, exp = ?, lumcoins = ?, daily_messages = ?, total_messages = ?,
+           flames = ?, last_activity_date = ? WHERE user_id = ?''',
+        (level, exp, lumcoins, daily_messages, total_messages, flames, current_date, user_id)
+    )
+
+
+def _new_record_message_tx(conn: sqlite3.Connection, user_id: int) -> None:
+    from core.group.stat.manager import ProfileManager
+
+    ProfileManager._record_message_tx(conn, user_id, None, None, ensure_user=False)
+
+
+def _reset_profile(path: str, user_id: int, last_activity_date=None, flames: int = 0) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute('INSERT OR IGNORE INTO users (user_id, first_name) VALUES (?, ?)', (user_id, 'Bench'))
+    conn.execute('DELETE FROM user_profiles WHERE user_id = ?', (user_id,))
+    conn.execute(
+        'INSERT INTO user_profiles (user_id, flames, last_activity_date) VALUES (?, ?, ?)',
+        (user_id, flames, last_activity_date)
+    )
+    conn.commit()
+    conn.close()
+
+
+def _profile(path: str, user_id: int):
+    conn = sqlite3.connect(path)
+    row = conn.execute(
+        'SELECT total_messages, daily_messages, exp, level, flames FROM user_profiles WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    conn.close()
+    return row
+
+
+def _race(path: str, tx, threads: int, per_thread: int) -> int:
+    """Параллельные записи одного пользователя из разных соединений. Возвращает итоговый total_messages."""
+    _reset_profile(path, 1, datetime.now().date().isoformat())
+    barrier = threading.Barrier(threads)
+
+    def worker() -> None:
+        conn = sqlite3.connect(path, timeout=30)
+        barrier.wait()
+        for _ in range(per_thread):
+            while True:
+                try:
+                    tx(conn, 1)
+                    conn.commit()
+                    break
+                except sqlite3.OperationalError:
+                    # Конфликт блокировок - повторяем, как повторил бы вызывающий код.
+                    conn.rollback()
+        conn.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return _profile(path, 1)[0]
+
+
+async def _parallel_load(messages: int) -> None:
+    import database as db
+    from core.group.stat.config import ProfileConfig
+    from core.group.stat.manager import ProfileManager
+
+    today = datetime.now().date()
+    cases = {
+        10: (today.isoformat(), 2, 2),
+        11: ((today - timedelta(days=1)).isoformat(), 3, 4),
+        12: ((today - timedelta(days=3)).isoformat(), 5, 1),
+    }
+    for user_id, (last_date, flames, _) in cases.items():
+        _reset_profile(db.DB_PATH, user_id, last_date, flames)
+    # Пользователь без профиля: первое сообщение создаёт строку.
+    users = list(cases) + [13]
+
+    profile_manager = ProfileManager()
+    await profile_manager.connect()
+    await asyncio.gather(*(
+        profile_manager.record_message(SimpleNamespace(id=users[i % len(users)], username=None, first_name="Bench"))
+        for i in range(messages)
+    ))
+    await profile_manager.close()
+
+    per_user = messages // len(users)
+    for user_id in users:
+        total, daily, exp, level, flames = _profile(db.DB_PATH, user_id)
+        assert total == per_user and daily == per_user, (user_id, total, daily)
+        earned = (per_user // ProfileConfig.EXP_PER_MESSAGES_COUNT) * ProfileConfig.EXP_PER_MESSAGE_INTERVAL
+        spent = sum(ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(lvl) for lvl in range(1, level))
+        assert exp + spent == earned, (user_id, exp, level, earned)
+        assert flames == cases.get(user_id, (None, None, 1))[2], (user_id, flames)
+    print(f"parallel record_message: {messages} messages over {len(users)} users, no lost increments, flames ok")
+
+
+def _per_message_us(path: str, tx, calls: int) -> float:
+    _reset_profile(path, 2, datetime.now().date().isoformat())
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    for _ in range(calls):
+        tx(conn, 2)
+    elapsed = time.perf_counter() - started
+    conn.rollback()
+    conn.close()
+    return elapsed / calls * 1_000_000
+
+
+def run(threads: int, messages: int) -> None:
+    import database as db
+    from core.db.migrations import apply_migrations
+
+    apply_migrations(db.DB_PATH)
+    per_thread = 200
+    expected = threads * per_thread
+    legacy = _race(db.DB_PATH, _legacy_record_message_tx, threads, per_thread)
+    upsert = _race(db.DB_PATH, _new_record_message_tx, threads, per_thread)
+    print(f"race, {threads} threads x {per_thread} messages (expected {expected}):")
+    print(f"  read-modify-write:  total_messages={legacy} ({expected - legacy} lost)")
+    print(f"  single UPSERT:      total_messages={upsert} ({expected - upsert} lost)")
+    assert upsert == expected
+
+    asyncio.run(_parallel_load(messages))
+
+    before = _per_message_us(db.DB_PATH, _legacy_record_message_tx, 20000)
+    after = _per_message_us(db.DB_PATH, _new_record_message_tx, 20000)
+    print("per message inside one transaction:")
+    print(f"  read-modify-write:  {before:8.2f} us")
+    print(f"  single UPSERT:      {after:8.2f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        run(args.threads, args.messages)
+
+
+if __name__ == "__main__":
+    main()
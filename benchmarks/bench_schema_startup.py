@@ -0,0 +1,118 @@
+"""
+Бенчмарк стоимости DDL: старт бота и горячий путь RPG-инвентаря.
+
+- старт: раньше каждый запуск заново выполнял все CREATE TABLE IF NOT EXISTS
+  и проверки колонок; теперь apply_migrations() на актуальной схеме читает
+  только schema_version;
+- горячий путь: раньше каждое чтение инвентаря открывало отдельное соединение
+  и выполняло пять CREATE TABLE IF NOT EXISTS с commit (ensure_db_initialized).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_schema_startup.py [--runs 50] [--calls 300]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _rerun_all_ddl(path: str) -> None:
+    """Имитирует старый старт: все DDL и проверки колонок на каждом запуске."""
+    from core.db.migrations import MIGRATIONS
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # Только идемпотентные DDL прежнего старта: 016 и 018 перестраивают данные и повторно не выполняются.
+        for version, _, migration in MIGRATIONS:
+            if version <= 15:
+                migration(conn)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def _time_ms(func, runs: int) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - started) / runs * 1000
+
+
+def _legacy_ensure(path: str) -> None:
+    """Имитирует старый rpg_utils.ensure_db_initialized: новое соединение, DDL и commit перед каждым запросом."""
+    from core.db.merge import UNIFIED_TABLES
+    from core.db.migrations import _m007_rpg
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(UNIFIED_TABLES["user_inventory"].format(name="user_inventory"))
+        _m007_rpg(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def _hot_path(calls: int) -> None:
+    import database as db
+    from core.group.RPG.inventory import add_item_to_inventory_db, get_user_inventory_db
+
+    for i in range(20):
+        await add_item_to_inventory_db(1, {"item_key": f"item{i}", "type": "material", "name": f"Item {i}"})
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        await asyncio.to_thread(_legacy_ensure, db.DB_PATH)
+        await get_user_inventory_db(1)
+    before = (time.perf_counter() - started) / calls * 1_000_000
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        await get_user_inventory_db(1)
+    after = (time.perf_counter() - started) / calls * 1_000_000
+
+    print("inventory read (hot path):")
+    print(f"  with per-call DDL:    {before:10.1f} us/call")
+    print(f"  without DDL:          {after:10.1f} us/call")
+    print(f"  speedup:              {before / after:10.1f}x")
+
+
+def run(runs: int, calls: int) -> None:
+    import database as db
+    from core.db.migrations import apply_migrations
+
+    started = time.perf_counter()
+    apply_migrations(db.DB_PATH)
+    print(f"fresh database, all migrations:     {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+    before = _time_ms(lambda: _rerun_all_ddl(db.DB_PATH), runs)
+    after = _time_ms(lambda: apply_migrations(db.DB_PATH), runs)
+    print("startup with current schema:")
+    print(f"  re-running all DDL:   {before:10.2f} ms")
+    print(f"  migration runner:     {after:10.2f} ms")
+    print(f"  speedup:              {before / after:10.1f}x")
+
+    asyncio.run(_hot_path(calls))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--calls", type=int, default=300)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        run(args.runs, args.calls)
+
+
+if __name__ == "__main__":
+    main()
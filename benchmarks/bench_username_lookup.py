@@ -0,0 +1,86 @@
+"""
+Бенчмарк поиска пользователя по @нику на большой таблице users.
+
+Сравнивает старый запрос WHERE LOWER(username) = ? (полный скан), индекс по
+users.username_lower и LRU перед ним (database.get_user_by_username).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_username_lookup.py [--users 200000] [--lookups 2000]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+async def _measure(name: str, lookups: int, func) -> float:
+    started = time.perf_counter()
+    for i in range(lookups):
+        assert await func(i) is not None
+    per_call_us = (time.perf_counter() - started) / lookups * 1_000_000
+    print(f"  {name:<28} {per_call_us:10.1f} us/lookup")
+    return per_call_us
+
+
+async def run(users: int, lookups: int) -> None:
+    import sqlite3
+    import database as db
+
+    await db.initialize_database()
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.executemany(
+        "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+        ((i, f"User_{i}", "Bench") for i in range(users)),
+    )
+    conn.commit()
+    conn.close()
+
+    rng = random.Random(42)
+    # Упоминания в чатах повторяются: небольшой пул активных ников.
+    hot = [f"@user_{rng.randrange(users)}" for _ in range(200)]
+    names = [rng.choice(hot) for _ in range(lookups)]
+
+    async def legacy_scan(i: int):
+        async with db.get_pool().acquire() as conn:
+            cursor = await conn.execute(
+                "SELECT user_id, username, first_name FROM users WHERE LOWER(username) = ? LIMIT 1",
+                (db.normalize_username(names[i]),),
+            )
+            return await cursor.fetchone()
+
+    def uncached(i: int):
+        db._username_cache.clear()
+        return db.get_user_by_username(names[i])
+
+    print(f"{users} users, {lookups} lookups:")
+    scan = await _measure("LOWER(username) scan", lookups, legacy_scan)
+    index = await _measure("username_lower index", lookups, uncached)
+    db._username_cache.clear()
+    cached = await _measure("index + LRU", lookups, lambda i: db.get_user_by_username(names[i]))
+    print(f"  speedup index vs scan:       {scan / index:10.1f}x")
+    print(f"  speedup LRU vs scan:         {scan / cached:10.1f}x")
+    print(f"  {db.get_username_cache_stats()}")
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.users, args.lookups))
+
+
+if __name__ == "__main__":
+    main()
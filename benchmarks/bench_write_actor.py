@@ -0,0 +1,109 @@
+"""
+Бенчмарк пропускной способности пути записи на каждое групповое сообщение:
+коммит на каждый вызов vs единственный писатель с групповым коммитом.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_write_actor.py [--messages 3000] [--concurrency 1000] [--window-ms 30]
+
+Работает во временной директории и не трогает рабочие БД.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+class CommitPerCallWriter:
+    """Имитирует старое поведение: каждое намерение в своей транзакции с отдельным commit."""
+
+    def __init__(self, path: str):
+        from core.db.pool import connection_pragmas
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        for pragma in connection_pragmas():
+            self.conn.execute(pragma)
+        self.lock = asyncio.Lock()
+
+    def _write(self, intent):
+        result = intent(self.conn)
+        self.conn.commit()
+        return result
+
+    async def submit(self, intent):
+        async with self.lock:
+            return await asyncio.to_thread(self._write, intent)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+async def _simulate(messages: int, concurrency: int, profile_manager, db) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    # Каждый прогон начинается с холодного кэша пользователей.
+    db._identity_cache.clear()
+
+    async def one_message(i: int) -> None:
+        user = SimpleNamespace(id=i % 500, username=f"user{i % 500}", first_name="Bench")
+        async with semaphore:
+            await asyncio.gather(
+                profile_manager.record_message(user),
+                db.ensure_user_exists(user.id, user.username, user.first_name),
+                db.log_user_interaction(user.id, "group_message", "message"),
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_message(i) for i in range(messages)))
+    return messages / (time.perf_counter() - started)
+
+
+async def run(messages: int, concurrency: int, window_ms: float) -> None:
+    import database as db
+    from core.db.writer import WriteActor
+    from core.group.stat.manager import ProfileManager
+
+    await db.open_pool()
+    await db.initialize_database()
+    profile_manager = ProfileManager()
+    await profile_manager.connect()
+
+    baseline_writer = CommitPerCallWriter(db.DB_PATH)
+    db._writer = profile_manager._writer = baseline_writer
+    before = await _simulate(messages, concurrency, profile_manager, db)
+    print(f"commit-per-call:      {before:10.1f} msg/s")
+    baseline_writer.close()
+
+    writer = WriteActor(db.DB_PATH, window_ms=window_ms)
+    db._writer = profile_manager._writer = writer
+    after = await _simulate(messages, concurrency, profile_manager, db)
+    print(f"group commit ({window_ms:g} ms): {after:10.1f} msg/s")
+    print(f"speedup:              {after / before:10.1f}x")
+    await db.flush_last_active()
+    await writer.stop()
+    print(f"  {writer.intents} intents in {writer.batches} transactions")
+    print(f"  identity cache: {db.get_identity_cache_stats()}")
+
+    await profile_manager.close()
+    await db.close_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--window-ms", type=float, default=30)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args.messages, args.concurrency, args.window_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Свёртки analytics_interactions.
+
+Сырые строки пишутся по одной на каждое сообщение (database.log_user_interaction).
+Компактор инкрементально переносит их в агрегаты по водяному знаку
+analytics_rollup_state.last_interaction_id:
+
+- analytics_hourly / analytics_daily — число взаимодействий по (бакет, пользователь, mode, action_type);
+- analytics_user_totals — итог и последний режим пользователя (/stats в личке);
+- analytics_user_actions / analytics_action_totals — использования и уникальные
+  пользователи по (action_type, mode) для /stats в группах; строка с mode = '*'
+  агрегирует все режимы одного action_type.
+
+Запросы статистики читают только эти таблицы и не зависят от длины истории.
+Сырые строки старше срока хранения и уже учтённые в свёртках удаляются.
+Все функции синхронные и рассчитаны на выполнение как намерения WriteActor.
+"""
+import sqlite3
+from typing import Dict
+
+ALL_MODES = "*"
+HOUR = 3600
+DAY = 86400
+
+# Диапазон сырых строк текущего прохода: (last_interaction_id, hi].
+_BATCH_RANGE = "interaction_id > :lo AND interaction_id <= :hi"
+
+
+def _bucket_rollup(conn: sqlite3.Connection, table: str, width: int, bounds: Dict[str, int]) -> None:
+    conn.execute(f'''
+        INSERT INTO {table} (bucket_ts, user_id, mode, action_type, count)
+        SELECT CAST(timestamp / {width} AS INTEGER) * {width}, user_id, mode, action_type, COUNT(*)
+        FROM analytics_interactions
+        WHERE {_BATCH_RANGE}
+        GROUP BY 1, user_id, mode, action_type
+        ON CONFLICT (bucket_ts, user_id, mode, action_type) DO UPDATE SET count = count + excluded.count
+    ''', bounds)
+
+
+def _action_rollup(conn: sqlite3.Connection, bounds: Dict[str, int]) -> None:
+    batch = f'''
+        WITH batch AS (
+            SELECT user_id, action_type, mode, timestamp FROM analytics_interactions WHERE {_BATCH_RANGE}
+            UNION ALL
+            SELECT user_id, action_type, '{ALL_MODES}', timestamp FROM analytics_interactions WHERE {_BATCH_RANGE}
+        )
+    '''
+    # Сначала итоги: пользователь новый для (action_type, mode), если его ещё нет в analytics_user_actions.
+    conn.execute(batch + '''
+        INSERT INTO analytics_action_totals (action_type, mode, usage_count, unique_users)
+        SELECT b.action_type, b.mode, COUNT(*), COUNT(DISTINCT CASE WHEN ua.user_id IS NULL THEN b.user_id END)
+        FROM batch b
+        LEFT JOIN analytics_user_actions ua
+            ON ua.user_id = b.user_id AND ua.action_type = b.action_type AND ua.mode = b.mode
+        WHERE true
+        GROUP BY b.action_type, b.mode
+        ON CONFLICT (action_type, mode) DO UPDATE SET
+            usage_count = usage_count + excluded.usage_count,
+            unique_users = unique_users + excluded.unique_users
+    ''', bounds)
+    conn.execute(batch + '''
+        INSERT INTO analytics_user_actions (user_id, action_type, mode, count, last_ts)
+        SELECT user_id, action_type, mode, COUNT(*), MAX(timestamp)
+        FROM batch
+        WHERE true
+        GROUP BY user_id, action_type, mode
+        ON CONFLICT (user_id, action_type, mode) DO UPDATE SET
+            count = count + excluded.count,
+            last_ts = MAX(last_ts, excluded.last_ts)
+    ''', bounds)
+
+
+def _user_rollup(conn: sqlite3.Connection, bounds: Dict[str, int]) -> None:
+    # mode рядом с MAX(timestamp) берётся из той же строки (документированное поведение SQLite).
+    conn.execute(f'''
+        INSERT INTO analytics_user_totals (user_id, interactions, last_ts, last_mode)
+        SELECT user_id, COUNT(*), MAX(timestamp), mode
+        FROM analytics_interactions
+        WHERE {_BATCH_RANGE}
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            interactions = interactions + excluded.interactions,
+            last_mode = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_mode ELSE last_mode END,
+            last_ts = MAX(last_ts, excluded.last_ts)
+    ''', bounds)
+
+
+def compact_interactions(conn: sqlite3.Connection, batch_size: int) -> int:
+    """Сворачивает до batch_size новых сырых строк и сдвигает водяной знак. Возвращает число строк."""
+    lo = conn.execute('SELECT last_interaction_id FROM analytics_rollup_state WHERE id = 1').fetchone()[0]
+    hi, rows = conn.execute('''
+        SELECT MAX(interaction_id), COUNT(*) FROM (
+            SELECT interaction_id FROM analytics_interactions
+            WHERE interaction_id > ? ORDER BY interaction_id LIMIT ?
+        )
+    ''', (lo, batch_size)).fetchone()
+    if not rows:
+        return 0
+    bounds = {"lo": lo, "hi": hi}
+    _bucket_rollup(conn, "analytics_hourly", HOUR, bounds)
+    _bucket_rollup(conn, "analytics_daily", DAY, bounds)
+    _action_rollup(conn, bounds)
+    _user_rollup(conn, bounds)
+    conn.execute('UPDATE analytics_rollup_state SET last_interaction_id = ? WHERE id = 1', (hi,))
+    return rows
+
+
+def purge_expired_raw(conn: sqlite3.Connection, before_ts: float, batch_size: int) -> int:
+    """Удаляет до batch_size уже свёрнутых сырых строк старше before_ts (самые старые id). Возвращает число строк."""
+    watermark = conn.execute('SELECT last_interaction_id FROM analytics_rollup_state WHERE id = 1').fetchone()[0]
+    hi = conn.execute('''
+        SELECT MAX(interaction_id) FROM (
+            SELECT interaction_id FROM analytics_interactions
+            WHERE interaction_id <= ? AND timestamp < ? ORDER BY interaction_id LIMIT ?
+        )
+    ''', (watermark, before_ts, batch_size)).fetchone()[0]
+    if hi is None:
+        return 0
+    return conn.execute(
+        'DELETE FROM analytics_interactions WHERE interaction_id <= ? AND timestamp < ?', (hi, before_ts)
+    ).rowcount
+
+
+def purge_expired_hourly(conn: sqlite3.Connection, before_ts: float, batch_size: int) -> int:
+    """Удаляет самые старые часовые бакеты старше before_ts: около batch_size строк (бакеты целиком)."""
+    hi = conn.execute('''
+        SELECT MAX(bucket_ts) FROM (
+            SELECT bucket_ts FROM analytics_hourly WHERE bucket_ts < ? ORDER BY bucket_ts LIMIT ?
+        )
+    ''', (before_ts, batch_size)).fetchone()[0]
+    if hi is None:
+        return 0
+    return conn.execute('DELETE FROM analytics_hourly WHERE bucket_ts <= ?', (hi,)).rowcount
@@ -0,0 +1,207 @@
+"""
+Двойная запись для внутренних валют (lumcoins, plumcoins).
+
+Каждое движение денег - одна строка ledger_journal: счёт списания, счёт
+зачисления, сумма. Счета пользователей - их user_id, баланс хранится в
+колонке валюты user_profiles (её читают профиль, рейтинги и магазины).
+Системные счета (SYSTEM_ACCOUNTS) - отрицательные id, их балансы в
+ledger_system_balances и могут уходить в минус: это эмитенты наград и
+получатели трат. Сумма всех балансов по валюте всегда равна нулю, а баланс
+пользователя - сумме его проводок (начальные остатки внесены миграцией
+проводками со счёта opening); check_ledger() это проверяет.
+
+Функции синхронные и не делают commit: они выполняются внутри намерения
+писателя (core/db/writer.py), поэтому списание, зачисление и запись в журнал
+атомарны, а ошибка откатывает всё намерение. Проверка баланса - условие в
+самом UPDATE, без чтения в Python, так что параллельные траты не уводят
+баланс в минус.
+"""
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# Валюта -> колонка баланса в user_profiles.
+CURRENCIES: Dict[str, str] = {"lumcoins": "lumcoins", "plumcoins": "plumcoins"}
+
+# Номера системных счетов неизменны: они хранятся в журнале.
+SYSTEM_ACCOUNTS: Dict[str, int] = {
+    "opening": -1,       # начальные остатки до появления журнала
+    "rewards": -2,       # работа и прочие награды
+    "levels": -3,        # награды за уровни
+    "quests": -4,
+    "promo": -5,
+    "shop": -6,          # фоны, предметы, plum-магазин
+    "casino": -7,
+    "investments": -8,
+    "crafting": -9,
+    "heal": -10,
+    "duels": -11,
+    "admin": -12,        # ручные выдачи из админки
+}
+_ACCOUNT_NAMES = {account_id: name for name, account_id in SYSTEM_ACCOUNTS.items()}
+
+Account = Union[int, str]
+
+
+class LedgerError(Exception):
+    """Проводка невозможна: неизвестный счёт или валюта, неверная сумма, нет профиля."""
+
+
+class InsufficientFunds(LedgerError):
+    """На счёте пользователя недостаточно средств; ничего не списано."""
+
+
+def account_id(account: Account) -> int:
+    """user_id пользователя или имя системного счёта -> id счёта в журнале."""
+    if isinstance(account, str):
+        try:
+            return SYSTEM_ACCOUNTS[account]
+        except KeyError:
+            raise LedgerError(f"Unknown system account: {account}") from None
+    if account < 0:
+        raise LedgerError(f"User account id must be non-negative: {account}")
+    return account
+
+
+def account_name(account: int) -> str:
+    return _ACCOUNT_NAMES.get(account, str(account))
+
+
+def _apply(conn: sqlite3.Connection, account: int, currency: str, delta: int) -> Optional[int]:
+    """Меняет баланс счёта; для пользователя возвращает новый баланс."""
+    if account < 0:
+        conn.execute(
+            '''INSERT INTO ledger_system_balances (account_id, currency, balance) VALUES (?, ?, ?)
+               ON CONFLICT(account_id, currency) DO UPDATE SET balance = balance + excluded.balance''',
+            (account, currency, delta)
+        )
+        return None
+    column = CURRENCIES[currency]
+    if delta < 0:
+        row = conn.execute(
+            f'UPDATE user_profiles SET {column} = {column} + ? WHERE user_id = ? AND {column} >= ? RETURNING {column}',
+            (delta, account, -delta)
+        ).fetchone()
+        if row is None:
+            raise InsufficientFunds(f"Account {account} has less than {-delta} {currency}")
+    else:
+        row = conn.execute(
+            f'UPDATE user_profiles SET {column} = {column} + ? WHERE user_id = ? RETURNING {column}',
+            (delta, account)
+        ).fetchone()
+        if row is None:
+            raise LedgerError(f"No profile for account {account}")
+    return row[0]
+
+
+def transfer_tx(conn: sqlite3.Connection, debit: Account, credit: Account, amount: int, reason: str,
+                currency: str = "lumcoins", ts: Optional[float] = None) -> Dict[int, int]:
+    """
+    Переводит amount со счёта debit на счёт credit с записью в журнал.
+    Возвращает новые балансы затронутых пользователей {user_id: баланс}.
+    InsufficientFunds, если у пользователя-плательщика не хватает средств.
+    """
+    if currency not in CURRENCIES:
+        raise LedgerError(f"Unknown currency: {currency}")
+    amount = int(amount)
+    if amount <= 0:
+        raise LedgerError(f"Transfer amount must be positive: {amount}")
+    debit_id, credit_id = account_id(debit), account_id(credit)
+    if debit_id == credit_id:
+        raise LedgerError("Debit and credit accounts are the same")
+
+    balances: Dict[int, int] = {}
+    # Сначала списание: при нехватке средств зачисление даже не начинается.
+    for account, delta in ((debit_id, -amount), (credit_id, amount)):
+        balance = _apply(conn, account, currency, delta)
+        if balance is not None:
+            balances[account] = balance
+    conn.execute(
+        'INSERT INTO ledger_journal (ts, debit_account, credit_account, currency, amount, reason) VALUES (?, ?, ?, ?, ?, ?)',
+        (ts if ts is not None else time.time(), debit_id, credit_id, currency, amount, reason)
+    )
+    return balances
+
+
+def post_tx(conn: sqlite3.Connection, legs: Iterable[Tuple[Account, Account, int, str, str]]) -> Dict[Tuple[int, str], int]:
+    """
+    Несколько переводов (debit, credit, amount, reason, currency) одной транзакцией: либо все, либо ни одного.
+    Возвращает итоговые балансы {(user_id, валюта): баланс}.
+    """
+    balances: Dict[Tuple[int, str], int] = {}
+    for debit, credit, amount, reason, currency in legs:
+        for account, balance in transfer_tx(conn, debit, credit, amount, reason, currency).items():
+            balances[(account, currency)] = balance
+    return balances
+
+
+def journal_sql(account: Optional[Account] = None, currency: Optional[str] = None, reason: Optional[str] = None,
+                since: Optional[float] = None, limit: int = 50) -> Tuple[str, List[Any]]:
+    """SQL и параметры выборки проводок для journal_query (и для async-соединений пула)."""
+    where, params = [], []
+    if account is not None:
+        where.append('entry_id IN (SELECT entry_id FROM ledger_journal WHERE debit_account = ? '
+                     'UNION ALL SELECT entry_id FROM ledger_journal WHERE credit_account = ?)')
+        params += [account_id(account)] * 2
+    if currency is not None:
+        where.append('currency = ?')
+        params.append(currency)
+    if reason is not None:
+        # Префикс через диапазон, чтобы работал индекс по reason.
+        where.append('reason >= ? AND reason < ?')
+        params += [reason, reason + "\uffff"]
+    if since is not None:
+        where.append('ts >= ?')
+        params.append(since)
+    sql = 'SELECT entry_id, ts, debit_account, credit_account, currency, amount, reason FROM ledger_journal'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return sql + ' ORDER BY entry_id DESC LIMIT ?', params + [limit]
+
+
+def journal_entry(row: Tuple) -> Dict[str, Any]:
+    entry_id, ts, debit, credit, currency, amount, reason = row
+    return {"entry_id": entry_id, "ts": ts, "debit": account_name(debit), "credit": account_name(credit),
+            "currency": currency, "amount": amount, "reason": reason}
+
+
+def journal_query(conn: sqlite3.Connection, account: Optional[Account] = None, currency: Optional[str] = None,
+                  reason: Optional[str] = None, since: Optional[float] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Последние проводки, новые первыми; reason сравнивается как префикс ("casino" найдёт "casino:slots")."""
+    sql, params = journal_sql(account, currency, reason, since, limit)
+    return [journal_entry(row) for row in conn.execute(sql, params)]
+
+
+def check_ledger(conn: sqlite3.Connection) -> List[str]:
+    """Сверяет балансы с журналом. Пустой список - всё сходится."""
+    problems = []
+    for currency, column in CURRENCIES.items():
+        for user_id, balance, journal in conn.execute(f'''
+            WITH moves AS (
+                SELECT credit_account AS account, amount FROM ledger_journal WHERE currency = :currency
+                UNION ALL
+                SELECT debit_account, -amount FROM ledger_journal WHERE currency = :currency
+            ), sums AS (
+                SELECT account, SUM(amount) AS total FROM moves WHERE account >= 0 GROUP BY account
+            )
+            SELECT up.user_id, up.{column}, IFNULL(s.total, 0) FROM user_profiles up
+            LEFT JOIN sums s ON s.account = up.user_id
+            WHERE IFNULL(up.{column}, 0) != IFNULL(s.total, 0)
+        ''', {"currency": currency}):
+            problems.append(f"{currency}: user {user_id} balance {balance} != journal {journal}")
+        for account, balance, journal in conn.execute('''
+            SELECT b.account_id, b.balance,
+                   (SELECT IFNULL(SUM(CASE WHEN credit_account = b.account_id THEN amount ELSE -amount END), 0)
+                    FROM ledger_journal WHERE currency = b.currency
+                      AND (credit_account = b.account_id OR debit_account = b.account_id))
+            FROM ledger_system_balances b WHERE b.currency = ?
+        ''', (currency,)):
+            if balance != journal:
+                problems.append(f"{currency}: system account {account_name(account)} balance {balance} != journal {journal}")
+        users_total = conn.execute(f'SELECT IFNULL(SUM({column}), 0) FROM user_profiles').fetchone()[0]
+        system_total = conn.execute(
+            'SELECT IFNULL(SUM(balance), 0) FROM ledger_system_balances WHERE currency = ?', (currency,)
+        ).fetchone()[0]
+        if users_total + system_total != 0:
+            problems.append(f"{currency}: balances do not sum to zero ({users_total} + {system_total})")
+    return problems
@@ -0,0 +1,66 @@
+"""
+Обслуживание файла БД: инкрементальный VACUUM и усечение WAL.
+
+Удалённые строки (срок хранения аналитики и истории диалогов) освобождают
+страницы во freelist, но файл сам не уменьшается. В режиме
+auto_vacuum=INCREMENTAL свободные страницы возвращаются порциями через
+PRAGMA incremental_vacuum без долгой эксклюзивной блокировки полного VACUUM.
+Функции синхронные; из асинхронного кода вызываются через asyncio.to_thread.
+"""
+import logging
+import sqlite3
+from typing import Dict
+
+from core.db.pool import DEFAULT_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _connect(path: str, busy_timeout_ms: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None, timeout=busy_timeout_ms / 1000)
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    return conn
+
+
+def _pragma(conn: sqlite3.Connection, name: str) -> int:
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def ensure_incremental_auto_vacuum(path: str, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS) -> bool:
+    """
+    Переводит БД в auto_vacuum=INCREMENTAL. Для существующего файла режим меняется
+    только полным VACUUM, поэтому вызывается один раз при старте до открытия пула.
+    Возвращает True, если файл был перестроен.
+    """
+    conn = _connect(path, busy_timeout_ms)
+    try:
+        if _pragma(conn, "auto_vacuum") == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}")
+        conn.execute("VACUUM")
+        logger.info("Database %s switched to incremental auto_vacuum.", path)
+        return True
+    finally:
+        conn.close()
+
+
+def incremental_vacuum(path: str, max_pages: int = 0, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS) -> Dict[str, int]:
+    """
+    Возвращает до max_pages свободных страниц файлу (0 - все) и усекает WAL.
+    Возвращает размер freelist до и после и число страниц файла.
+    """
+    conn = _connect(path, busy_timeout_ms)
+    try:
+        before = _pragma(conn, "freelist_count")
+        # incremental_vacuum освобождает по странице на каждый шаг курсора: выбираем все строки.
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return {
+            "freelist_before": before,
+            "freelist_after": _pragma(conn, "freelist_count"),
+            "page_count": _pragma(conn, "page_count"),
+        }
+    finally:
+        conn.close()
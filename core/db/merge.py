@@ -0,0 +1,285 @@
+"""
+Одноразовое слияние profiles.db в основную БД бота (data/bot_database.db).
+
+Раньше users, user_inventory и user_profiles жили в обоих файлах, а связанные
+записи (сообщение, профиль, аналитика) коммитились в разные БД. Теперь всё
+хранится в одном файле: одна транзакция покрывает связанные записи, а WAL
+сохраняет атомарность при сбое (у ATTACH-баз в режиме WAL её нет).
+
+Запуск вручную из корня репозитория:
+    python -m core.db.merge [--db data/bot_database.db] [--legacy profiles.db] [--keep-legacy]
+
+При старте бота merge_profiles_db() вызывается автоматически и ничего не делает,
+если profiles.db уже слит.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from core.db.pool import DEFAULT_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+LEGACY_PROFILES_DB_PATH = 'profiles.db'
+
+# Общие таблицы в объединённой форме: берём более полную схему из двух файлов.
+UNIFIED_TABLES: Dict[str, str] = {
+    "users": '''
+        CREATE TABLE IF NOT EXISTS {name} (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            last_active_ts REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    "user_inventory": '''
+        CREATE TABLE IF NOT EXISTS {name} (
+            user_id INTEGER NOT NULL,
+            item_key TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            quantity INTEGER DEFAULT 1,
+            item_data TEXT,
+            acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, item_key),
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''',
+    "user_profiles": '''
+        CREATE TABLE IF NOT EXISTS {name} (
+            profile_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            hp INTEGER DEFAULT 100 CHECK(hp >= 0 AND hp <= 150),
+            level INTEGER DEFAULT 1 CHECK(level >= 1 AND level <= 169),
+            exp INTEGER DEFAULT 0,
+            lumcoins INTEGER DEFAULT 0,
+            plumcoins INTEGER DEFAULT 0,
+            daily_messages INTEGER DEFAULT 0,
+            total_messages INTEGER DEFAULT 0,
+            flames INTEGER DEFAULT 0,
+            last_work_time REAL DEFAULT 0,
+            active_background TEXT DEFAULT 'default',
+            last_activity_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''',
+}
+
+UNIFIED_INDEXES: List[str] = [
+    'CREATE INDEX IF NOT EXISTS idx_user_profiles_user_id ON user_profiles(user_id)',
+]
+
+# Как разрешать дубликаты по ключу при слиянии: (ключ, {колонка: политика}).
+#   keep - значение основной БД, пустое дополняется из profiles.db
+#   take - значение profiles.db (ProfileManager писал туда), пустое берётся из основной
+#   max/min - большее/меньшее из двух
+# Колонки без явной политики получают "take".
+_MERGE_POLICIES: Dict[str, Tuple[Tuple[str, ...], Dict[str, str]]] = {
+    "users": (("user_id",), {
+        "username": "keep",
+        "first_name": "keep",
+        "last_active_ts": "max",
+        "created_at": "min",
+    }),
+    "user_profiles": (("user_id",), {}),
+    "user_inventory": (("user_id", "item_key"), {
+        "item_type": "keep",
+        "quantity": "max",
+        "acquired_at": "min",
+    }),
+}
+
+_POLICY_SQL = {
+    "keep": "COALESCE({t}.{c}, excluded.{c})",
+    "take": "COALESCE(excluded.{c}, {t}.{c})",
+    "max": "MAX(IFNULL({t}.{c}, excluded.{c}), IFNULL(excluded.{c}, {t}.{c}))",
+    "min": "MIN(IFNULL({t}.{c}, excluded.{c}), IFNULL(excluded.{c}, {t}.{c}))",
+}
+
+
+def _columns(conn: sqlite3.Connection, table: str, schema: str = "main") -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info("{table}")')]
+
+
+def _tables(conn: sqlite3.Connection, schema: str) -> Dict[str, str]:
+    rows = conn.execute(
+        f"SELECT name, sql FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )
+    return {name: sql for name, sql in rows}
+
+
+def ensure_unified_tables(conn: sqlite3.Connection) -> None:
+    """
+    Создаёт общие таблицы в объединённой форме; таблицы старой формы
+    (например, users без last_name) пересобираются с сохранением данных.
+    Вызывать внутри транзакции.
+    """
+    for table, ddl in UNIFIED_TABLES.items():
+        existing = _columns(conn, table)
+        if not existing:
+            conn.execute(ddl.format(name=table))
+            continue
+        tmp = f"{table}__unified"
+        conn.execute(f"DROP TABLE IF EXISTS {tmp}")
+        conn.execute(ddl.format(name=tmp))
+        expected = _columns(conn, tmp)
+        if set(expected) <= set(existing):
+            conn.execute(f"DROP TABLE {tmp}")
+            continue
+        common = ", ".join(c for c in expected if c in existing)
+        # OR IGNORE: строки, нарушающие новые CHECK, не должны срывать миграцию.
+        conn.execute(f"INSERT OR IGNORE INTO {tmp} ({common}) SELECT {common} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+        logger.info("Rebuilt table %s in unified shape.", table)
+    for ddl in UNIFIED_INDEXES:
+        conn.execute(ddl)
+
+
+def _merge_shared_table(conn: sqlite3.Connection, table: str) -> Tuple[int, int]:
+    """Переносит строки legacy.<table> в основную таблицу с разрешением дубликатов. Возвращает (строк, дубликатов)."""
+    key, policies = _MERGE_POLICIES[table]
+    legacy_columns = set(_columns(conn, table, "legacy"))
+    columns = [c for c in _columns(conn, table) if c in legacy_columns and c != "profile_id"]
+    if not all(k in columns for k in key):
+        logger.warning("Legacy table %s has no key columns %s, skipped.", table, key)
+        return 0, 0
+
+    join = " AND ".join(f"m.{k} = l.{k}" for k in key)
+    total = conn.execute(f"SELECT COUNT(*) FROM legacy.{table}").fetchone()[0]
+    duplicates = conn.execute(
+        f"SELECT COUNT(*) FROM legacy.{table} l JOIN main.{table} m ON {join}"
+    ).fetchone()[0]
+
+    updates = ", ".join(
+        f"{c} = " + _POLICY_SQL[policies.get(c, "take")].format(t=table, c=c)
+        for c in columns if c not in key
+    )
+    column_list = ", ".join(columns)
+    # WHERE true нужен парсеру SQLite, чтобы отличить ON CONFLICT от JOIN ... ON.
+    conn.execute(f'''
+        INSERT INTO main.{table} ({column_list})
+        SELECT {column_list} FROM legacy.{table} WHERE true
+        ON CONFLICT({", ".join(key)}) DO {"UPDATE SET " + updates if updates else "NOTHING"}
+    ''')
+    return total, duplicates
+
+
+def _copy_table(conn: sqlite3.Connection, table: str, legacy_sql: str, main_tables: Dict[str, str]) -> int:
+    """Копирует таблицу, которая была только в profiles.db (квесты, RPG, кастомные фоны и т.п.)."""
+    if table not in main_tables:
+        conn.execute(legacy_sql)
+    legacy_columns = set(_columns(conn, table, "legacy"))
+    columns = ", ".join(c for c in _columns(conn, table) if c in legacy_columns)
+    cursor = conn.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM legacy.{table}")
+    return cursor.rowcount
+
+
+def _copy_indexes(conn: sqlite3.Connection) -> None:
+    rows = conn.execute("SELECT sql FROM legacy.sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    for (sql,) in rows:
+        if "IF NOT EXISTS" not in sql.upper():
+            sql = sql.replace("INDEX", "INDEX IF NOT EXISTS", 1)
+        try:
+            conn.execute(sql)
+        except sqlite3.OperationalError as e:
+            logger.warning("Legacy index not copied (%s): %s", e, sql)
+
+
+def _checkpoint_legacy(path: str) -> None:
+    """Сливает WAL profiles.db в основной файл, чтобы после переименования не осталось -wal/-shm."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+
+
+def _retire_legacy(path: str) -> str:
+    target = f"{path}.merged"
+    if os.path.exists(target):
+        target = f"{path}.merged-{int(time.time())}"
+    os.replace(path, target)
+    return target
+
+
+def merge_profiles_db(
+    db_path: str,
+    legacy_path: str = LEGACY_PROFILES_DB_PATH,
+    keep_legacy: bool = False,
+) -> Optional[Dict[str, Tuple[int, int]]]:
+    """
+    Приводит общие таблицы основной БД к объединённой форме и, если profiles.db
+    ещё существует, переносит его в основную БД одной транзакцией.
+
+    Возвращает отчёт {таблица: (строк в profiles.db, из них дубликатов)} или None,
+    если переносить было нечего. После успешного слияния profiles.db
+    переименовывается в profiles.db.merged (если не задан keep_legacy).
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout={DEFAULT_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ensure_unified_tables(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if not os.path.exists(legacy_path) or os.path.samefile(legacy_path, db_path):
+            return None
+
+        _checkpoint_legacy(legacy_path)
+        conn.execute("ATTACH DATABASE ? AS legacy", (legacy_path,))
+        report: Dict[str, Tuple[int, int]] = {}
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                main_tables = _tables(conn, "main")
+                for table, sql in _tables(conn, "legacy").items():
+                    if table in _MERGE_POLICIES:
+                        report[table] = _merge_shared_table(conn, table)
+                    else:
+                        report[table] = (_copy_table(conn, table, sql, main_tables), 0)
+                _copy_indexes(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute("DETACH DATABASE legacy")
+    finally:
+        conn.close()
+
+    for table, (rows, duplicates) in report.items():
+        logger.info("Merged %s: %d rows from %s (%d duplicates resolved).", table, rows, legacy_path, duplicates)
+    if not keep_legacy:
+        retired = _retire_legacy(legacy_path)
+        logger.info("Legacy %s merged into %s and moved to %s.", legacy_path, db_path, retired)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Слить profiles.db в основную БД бота.")
+    parser.add_argument("--db", default=os.path.join("data", "bot_database.db"))
+    parser.add_argument("--legacy", default=LEGACY_PROFILES_DB_PATH)
+    parser.add_argument("--keep-legacy", action="store_true", help="не переименовывать profiles.db после слияния")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    report = merge_profiles_db(args.db, args.legacy, keep_legacy=args.keep_legacy)
+    if report is None:
+        print(f"{args.legacy} не найден: сливать нечего, схема {args.db} проверена.")
+        return
+    for table, (rows, duplicates) in sorted(report.items()):
+        print(f"{table:<32} {rows:8d} rows  {duplicates:8d} duplicates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,660 @@
+"""
+Версионированные миграции схемы единой БД бота.
+
+Каждая миграция - синхронная функция над sqlite3-соединением, выполняется
+один раз в своей транзакции и записывается в schema_version. При старте
+apply_migrations() читает текущую версию одним запросом и, если схема
+актуальна, больше ничего не делает. Хендлеры DDL не выполняют.
+
+Миграции, добавленные до появления schema_version, идемпотентны: существующая
+БД без версии проходит их все и получает недостающие таблицы и колонки.
+Новые изменения схемы добавляются в конец MIGRATIONS со следующим номером.
+"""
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, List, Tuple
+
+from core.db.merge import ensure_unified_tables
+from core.db.pool import DEFAULT_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+Migration = Callable[[sqlite3.Connection], None]
+
+# Записей dialog_history на пользователя (реплики пользователя и бота). Зашито в триггер
+# миграции 11: изменение лимита - новая миграция, пересоздающая trg_dialog_history_cap.
+DIALOG_HISTORY_LIMIT = 20
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+    existing = set(_columns(conn, table))
+    for column, definition in columns.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info("Added '%s' column to %s.", column, table)
+
+
+def _m001_core_tables(conn: sqlite3.Connection) -> None:
+    # users, user_inventory и user_profiles общие для всех модулей (см. core/db/merge.py).
+    ensure_unified_tables(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS value_subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            subscribed_ts REAL NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dialog_history (
+            history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            mode TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('user', 'assistant')),
+            content TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_dialog_history_user_ts ON dialog_history (user_id, timestamp DESC)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_modes (
+            user_id INTEGER PRIMARY KEY,
+            mode TEXT NOT NULL DEFAULT 'saharoza',
+            rating_opportunities_count INTEGER DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_interactions (
+            interaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            mode TEXT NOT NULL,
+            action_type TEXT NOT NULL DEFAULT 'message',
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_interactions_user_ts_mode ON analytics_interactions (user_id, timestamp DESC, mode)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_ratings (
+            rating_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            rated_message_id INTEGER,
+            dialog_history_id INTEGER,
+            timestamp REAL NOT NULL,
+            rating INTEGER NOT NULL CHECK(rating IN (0, 1)),
+            message_preview TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY(dialog_history_id) REFERENCES dialog_history(history_id) ON DELETE SET NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rp_user_stats (
+            user_id INTEGER PRIMARY KEY,
+            hp INTEGER NOT NULL DEFAULT 100,
+            heal_cooldown_ts REAL NOT NULL DEFAULT 0,
+            recovery_end_ts REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity_log (
+            user_id INTEGER,
+            date TEXT,
+            exp_gained INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, date),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def _m002_promo_codes(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS used_promocodes (
+            user_id INTEGER,
+            promocode TEXT,
+            used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, promocode)
+        )
+    ''')
+
+
+def _m003_group_settings(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS group_settings (
+            chat_id INTEGER PRIMARY KEY,
+            bot_enabled INTEGER NOT NULL DEFAULT 1,
+            ai_enabled INTEGER NOT NULL DEFAULT 1,
+            rp_enabled INTEGER NOT NULL DEFAULT 1,
+            economy_enabled INTEGER NOT NULL DEFAULT 1,
+            casino_enabled INTEGER NOT NULL DEFAULT 1,
+            promo_enabled INTEGER NOT NULL DEFAULT 1,
+            stt_enabled INTEGER NOT NULL DEFAULT 1,
+            work_cooldown_seconds INTEGER NOT NULL DEFAULT 900,
+            transfer_cooldown_seconds INTEGER NOT NULL DEFAULT 36000
+        )
+    ''')
+    _add_missing_columns(conn, "group_settings", {
+        "bot_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "ai_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "rp_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "economy_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "casino_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "promo_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "stt_enabled": "INTEGER NOT NULL DEFAULT 1",
+        "work_cooldown_seconds": "INTEGER NOT NULL DEFAULT 900",
+        "transfer_cooldown_seconds": "INTEGER NOT NULL DEFAULT 36000",
+    })
+
+
+def _m004_relationships(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS group_relationships (
+            chat_id INTEGER NOT NULL,
+            user1_id INTEGER NOT NULL,
+            user2_id INTEGER NOT NULL,
+            relation_type TEXT NOT NULL CHECK (relation_type IN ('friend', 'romantic', 'married')),
+            intimacy_level INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user1_id, user2_id)
+        )
+    ''')
+    _add_missing_columns(conn, "group_relationships", {"intimacy_level": "INTEGER NOT NULL DEFAULT 0"})
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS relationship_action_cooldowns (
+            chat_id INTEGER NOT NULL,
+            user1_id INTEGER NOT NULL,
+            user2_id INTEGER NOT NULL,
+            action_key TEXT NOT NULL,
+            last_used_ts REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user1_id, user2_id, action_key)
+        )
+    ''')
+
+
+def _m005_duel_stats(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS duel_stats (
+            user_id INTEGER PRIMARY KEY,
+            strength INTEGER NOT NULL DEFAULT 0,
+            agility INTEGER NOT NULL DEFAULT 0,
+            stamina INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+_USER_QUESTS_DDL = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        user_id INTEGER,
+        user_quest_id TEXT PRIMARY KEY,
+        original_quest_id TEXT,
+        quest_type TEXT,
+        quest_data TEXT,
+        progress INTEGER DEFAULT 0,
+        completed BOOLEAN DEFAULT FALSE,
+        reward_claimed BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP
+    )
+'''
+
+
+def _m006_quests(conn: sqlite3.Connection) -> None:
+    columns = _columns(conn, "user_quests")
+    if columns and "user_quest_id" not in columns:
+        # Старая таблица без user_quest_id: генерируем ключи и пересобираем с PRIMARY KEY.
+        logger.info("Migrating user_quests to user_quest_id primary key.")
+        conn.execute('ALTER TABLE user_quests ADD COLUMN user_quest_id TEXT')
+        conn.execute('''
+            UPDATE user_quests
+            SET user_quest_id =
+                CASE
+                    WHEN original_quest_id IS NOT NULL THEN
+                        original_quest_id || '_' || user_id || '_' || strftime('%s', COALESCE(created_at, datetime('now')))
+                    ELSE
+                        'legacy_' || user_id || '_' || strftime('%s', COALESCE(created_at, datetime('now')))
+                END
+            WHERE user_quest_id IS NULL
+        ''')
+        conn.execute(_USER_QUESTS_DDL.format(name="user_quests_new"))
+        copied = ", ".join(c for c in _columns(conn, "user_quests_new") if c in columns or c == "user_quest_id")
+        conn.execute(f"INSERT OR IGNORE INTO user_quests_new ({copied}) SELECT {copied} FROM user_quests")
+        conn.execute('DROP TABLE user_quests')
+        conn.execute('ALTER TABLE user_quests_new RENAME TO user_quests')
+    conn.execute(_USER_QUESTS_DDL.format(name="user_quests"))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quests_statistics (
+            user_id INTEGER,
+            quest_type TEXT,
+            original_quest_id TEXT,
+            completed_count INTEGER DEFAULT 0,
+            last_completed TIMESTAMP,
+            PRIMARY KEY (user_id, original_quest_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quest_refresh_times (
+            user_id INTEGER PRIMARY KEY,
+            last_daily_refresh TIMESTAMP,
+            last_weekly_refresh TIMESTAMP
+        )
+    ''')
+
+
+def _m007_rpg(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_active_background (
+            user_id INTEGER PRIMARY KEY,
+            bg_key TEXT DEFAULT 'default'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS auction_listings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER,
+            item_key TEXT,
+            item_data TEXT,
+            start_price INTEGER,
+            current_bid INTEGER,
+            current_bidder_id INTEGER,
+            end_time TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_listings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER,
+            item_key TEXT,
+            item_data TEXT,
+            price INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_investments (
+            user_id INTEGER,
+            amount INTEGER,
+            term_days INTEGER,
+            interest_rate REAL,
+            risk REAL DEFAULT 0,
+            invested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            PRIMARY KEY (user_id, invested_at)
+        )
+    ''')
+
+
+def _m008_economy(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_transfer_cooldowns (
+            user_id INTEGER PRIMARY KEY,
+            last_transfer_ts REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS custom_backgrounds (
+            user_id INTEGER PRIMARY KEY,
+            background_url TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _m009_username_lower(conn: sqlite3.Connection) -> None:
+    # Нормализованный username под уникальный индекс: поиск по @упоминанию без LOWER() и полного скана.
+    _add_missing_columns(conn, "users", {"username_lower": "TEXT"})
+    # Один ник мог остаться у нескольких строк (пользователь сменил ник, другой его занял):
+    # за самым недавно активным сохраняем, остальным обнуляем.
+    conn.execute('''
+        UPDATE users SET username_lower = LOWER(username)
+        WHERE user_id IN (
+            SELECT user_id FROM (
+                SELECT user_id, ROW_NUMBER() OVER (
+                    PARTITION BY LOWER(username) ORDER BY last_active_ts DESC, user_id DESC
+                ) AS rank
+                FROM users WHERE username IS NOT NULL AND username != ''
+            ) WHERE rank = 1
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lower ON users(username_lower)')
+    # Триггеры поддерживают колонку при любом upsert/обновлении ника; прежний владелец ника
+    # освобождает его, чтобы не нарушать уникальность.
+    for event in ("INSERT", "UPDATE OF username"):
+        suffix = "insert" if event == "INSERT" else "update"
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_users_username_lower_{suffix}
+            AFTER {event} ON users
+            BEGIN
+                UPDATE users SET username_lower = NULL
+                WHERE username_lower = LOWER(NEW.username) AND user_id != NEW.user_id;
+                UPDATE users SET username_lower = NULLIF(LOWER(NEW.username), '')
+                WHERE user_id = NEW.user_id;
+            END
+        ''')
+
+
+def _m010_analytics_rollups(conn: sqlite3.Connection) -> None:
+    # Свёртки analytics_interactions, которые ведёт компактор (core/db/analytics.py).
+    for table in ("analytics_hourly", "analytics_daily"):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket_ts INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                mode TEXT NOT NULL,
+                action_type TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket_ts, user_id, mode, action_type)
+            ) WITHOUT ROWID
+        ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_user_totals (
+            user_id INTEGER PRIMARY KEY,
+            interactions INTEGER NOT NULL DEFAULT 0,
+            last_ts REAL NOT NULL DEFAULT 0,
+            last_mode TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_user_actions (
+            user_id INTEGER NOT NULL,
+            action_type TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            last_ts REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, action_type, mode)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_action_totals (
+            action_type TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            usage_count INTEGER NOT NULL DEFAULT 0,
+            unique_users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (action_type, mode)
+        ) WITHOUT ROWID
+    ''')
+    # Водяной знак: всё до last_interaction_id включительно уже учтено в свёртках.
+    # Существующая история сворачивается компактором с нуля при первом проходе.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_rollup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_interaction_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO analytics_rollup_state (id, last_interaction_id) VALUES (1, 0)')
+
+
+def _m011_dialog_history_cap(conn: sqlite3.Connection) -> None:
+    # История диалога - кольцевой буфер: триггер оставляет DIALOG_HISTORY_LIMIT последних записей
+    # пользователя, чтобы чтение и размер таблицы не зависели от длины переписки.
+    conn.execute('''
+        DELETE FROM dialog_history WHERE history_id IN (
+            SELECT history_id FROM (
+                SELECT history_id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id ORDER BY timestamp DESC, history_id DESC
+                ) AS rank
+                FROM dialog_history
+            ) WHERE rank > ?
+        )
+    ''', (DIALOG_HISTORY_LIMIT,))
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_dialog_history_cap
+        AFTER INSERT ON dialog_history
+        BEGIN
+            DELETE FROM dialog_history
+            WHERE user_id = NEW.user_id AND timestamp <= (
+                SELECT timestamp FROM dialog_history WHERE user_id = NEW.user_id
+                ORDER BY timestamp DESC LIMIT 1 OFFSET {DIALOG_HISTORY_LIMIT}
+            );
+        END
+    ''')
+
+
+def _m012_chat_members(conn: sqlite3.Connection) -> None:
+    # Участники чатов, которых бот видел в группе: рейтинги /top по чату (core/group/stat/leaderboard.py).
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_members (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            first_seen_ts REAL NOT NULL DEFAULT (strftime('%s', 'now')),
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_members_user ON chat_members (user_id)')
+
+
+def _m013_background_assets(conn: sqlite3.Connection) -> None:
+    # Скачанные кастомные фоны: URL -> файл в дисковом кэше по хэшу содержимого и валидаторы HTTP для перепроверки.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS background_assets (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            checked_at REAL NOT NULL
+        )
+    ''')
+
+
+def _m014_ledger(conn: sqlite3.Connection) -> None:
+    # Журнал двойной записи для валют (core/db/ledger.py); текущие балансы вносятся проводками opening.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_journal (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            debit_account INTEGER NOT NULL,
+            credit_account INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            amount INTEGER NOT NULL CHECK (amount > 0),
+            reason TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ledger_debit ON ledger_journal (debit_account, entry_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ledger_credit ON ledger_journal (credit_account, entry_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ledger_reason ON ledger_journal (reason)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_system_balances (
+            account_id INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            balance INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, currency)
+        ) WITHOUT ROWID
+    ''')
+    # Начальные остатки: проводки со счёта opening (-1) на каждого пользователя с ненулевым балансом.
+    # Значения зашиты: изменения CURRENCIES и SYSTEM_ACCOUNTS в core/db/ledger.py эту миграцию не меняют.
+    for column in ("lumcoins", "plumcoins"):
+        conn.execute(f'''
+            INSERT INTO ledger_journal (ts, debit_account, credit_account, currency, amount, reason)
+            SELECT (julianday('now') - 2440587.5) * 86400.0, -1, user_id, '{column}', {column}, 'opening'
+            FROM user_profiles WHERE {column} > 0
+        ''')
+        conn.execute(f'''
+            INSERT INTO ledger_system_balances (account_id, currency, balance)
+            SELECT -1, '{column}', -IFNULL(SUM({column}), 0) FROM user_profiles WHERE {column} > 0
+            ON CONFLICT(account_id, currency) DO UPDATE SET balance = balance + excluded.balance
+        ''')
+
+
+def _m015_user_quests_index(conn: sqlite3.Connection) -> None:
+    # Загрузка активных заданий пользователя в индекс движка квестов (core/group/stat/quest_engine.py).
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_quests_user ON user_quests (user_id, quest_type)')
+
+
+def _m016_user_quests_columns(conn: sqlite3.Connection) -> None:
+    # Вместо копии шаблона в JSON (quest_data) - только поля, нужные для прогресса и награды;
+    # название и описание берутся из QuestsConfig при показе.
+    conn.execute('''
+        CREATE TABLE user_quests_new (
+            user_quest_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            quest_type TEXT NOT NULL,
+            original_quest_id TEXT NOT NULL,
+            quest_kind TEXT NOT NULL,
+            required_count INTEGER NOT NULL,
+            difficulty TEXT NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            reward_claimed BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP
+        )
+    ''')
+    # Строки с битым JSON и раньше не обрабатывались - они не переносятся.
+    conn.execute('''
+        INSERT OR IGNORE INTO user_quests_new
+            (user_quest_id, user_id, quest_type, original_quest_id, quest_kind, required_count, difficulty,
+             progress, completed, reward_claimed, created_at, expires_at)
+        SELECT user_quest_id, user_id, quest_type,
+               COALESCE(original_quest_id, json_extract(quest_data, '$.original_id')),
+               json_extract(quest_data, '$.type'), json_extract(quest_data, '$.required.count'),
+               COALESCE(json_extract(quest_data, '$.difficulty'), 'easy'),
+               COALESCE(progress, 0), COALESCE(completed, FALSE), COALESCE(reward_claimed, FALSE),
+               created_at, expires_at
+        FROM user_quests
+        WHERE json_valid(quest_data) AND user_id IS NOT NULL AND quest_type IS NOT NULL
+          AND json_extract(quest_data, '$.type') IS NOT NULL
+          AND json_extract(quest_data, '$.required.count') IS NOT NULL
+          AND COALESCE(original_quest_id, json_extract(quest_data, '$.original_id')) IS NOT NULL
+    ''')
+    conn.execute('DROP TABLE user_quests')
+    conn.execute('ALTER TABLE user_quests_new RENAME TO user_quests')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_quests_user ON user_quests (user_id, quest_type)')
+
+
+def _m017_users_last_active_index(conn: sqlite3.Connection) -> None:
+    # Выборка недавно активных пользователей для смены заданий (core/group/stat/quest_rollover.py).
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active_ts)')
+
+
+def _m018_quest_totals(conn: sqlite3.Connection) -> None:
+    # Свёртки выполнения заданий (core/db/quest_totals.py); заполняются из quests_statistics.
+    # SQL заполнения зашит здесь, а не берётся из rebuild_quest_totals_tx: изменения модуля миграцию не меняют.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quest_user_totals (
+            user_id INTEGER NOT NULL,
+            quest_type TEXT NOT NULL,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, quest_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS quest_totals (
+            quest_type TEXT NOT NULL,
+            original_quest_id TEXT NOT NULL,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            unique_users INTEGER NOT NULL DEFAULT 0,
+            last_completed TIMESTAMP,
+            PRIMARY KEY (quest_type, original_quest_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO quest_user_totals (user_id, quest_type, completed_count)
+        SELECT user_id, quest_type, SUM(completed_count)
+        FROM quests_statistics
+        WHERE quest_type IS NOT NULL AND completed_count > 0
+        GROUP BY user_id, quest_type
+    ''')
+    conn.execute('''
+        INSERT INTO quest_totals (quest_type, original_quest_id, completed_count, unique_users, last_completed)
+        WITH stats AS (
+            SELECT user_id, quest_type, original_quest_id, completed_count, last_completed
+            FROM quests_statistics
+            WHERE quest_type IS NOT NULL AND original_quest_id IS NOT NULL AND completed_count > 0
+        )
+        SELECT quest_type, original_quest_id, SUM(completed_count), COUNT(*), MAX(last_completed)
+        FROM stats GROUP BY quest_type, original_quest_id
+        UNION ALL
+        SELECT quest_type, '*', SUM(completed_count), COUNT(DISTINCT user_id), MAX(last_completed)
+        FROM stats GROUP BY quest_type
+        UNION ALL
+        SELECT '*', '*', SUM(completed_count), COUNT(DISTINCT user_id), MAX(last_completed)
+        FROM stats HAVING COUNT(*) > 0
+    ''')
+
+
+def _m019_last_group_chat(conn: sqlite3.Connection) -> None:
+    # Последний групповой чат пользователя: туда уходят сводки о выполненных заданиях, если ЛС закрыты.
+    _add_missing_columns(conn, "user_profiles", {"last_group_chat_id": "INTEGER"})
+    # Пока точной истории нет, берём чат, где пользователь появился позже всего.
+    conn.execute('''
+        UPDATE user_profiles SET last_group_chat_id = (
+            SELECT chat_id FROM chat_members m WHERE m.user_id = user_profiles.user_id
+            ORDER BY first_seen_ts DESC LIMIT 1
+        )
+        WHERE last_group_chat_id IS NULL
+    ''')
+
+
+# Порядок и номера неизменны: применённые миграции не переписываются, новые - только в конец.
+MIGRATIONS: List[Tuple[int, str, Migration]] = [
+    (1, "core_tables", _m001_core_tables),
+    (2, "promo_codes", _m002_promo_codes),
+    (3, "group_settings", _m003_group_settings),
+    (4, "relationships", _m004_relationships),
+    (5, "duel_stats", _m005_duel_stats),
+    (6, "quests", _m006_quests),
+    (7, "rpg", _m007_rpg),
+    (8, "economy", _m008_economy),
+    (9, "username_lower", _m009_username_lower),
+    (10, "analytics_rollups", _m010_analytics_rollups),
+    (11, "dialog_history_cap", _m011_dialog_history_cap),
+    (12, "chat_members", _m012_chat_members),
+    (13, "background_assets", _m013_background_assets),
+    (14, "ledger", _m014_ledger),
+    (15, "user_quests_index", _m015_user_quests_index),
+    (16, "user_quests_columns", _m016_user_quests_columns),
+    (17, "users_last_active_index", _m017_users_last_active_index),
+    (18, "quest_totals", _m018_quest_totals),
+    (19, "last_group_chat", _m019_last_group_chat),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at REAL NOT NULL
+        )
+    ''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(path: str, migrations: List[Tuple[int, str, Migration]] = MIGRATIONS) -> List[int]:
+    """Применяет недостающие миграции к файлу БД. Возвращает номера применённых."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    applied: List[int] = []
+    try:
+        conn.execute(f"PRAGMA busy_timeout={DEFAULT_BUSY_TIMEOUT_MS}")
+        version = current_version(conn)
+        for number, name, migration in migrations:
+            if number <= version:
+                continue
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (number, name, time.time())
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                logger.critical("Schema migration %03d_%s failed for %s.", number, name, path)
+                raise
+            applied.append(number)
+            logger.info("Applied schema migration %03d_%s to %s in %.1f ms.",
+                        number, name, path, (time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+    if not applied:
+        logger.debug("Schema of %s is up to date (version %d).", path, version)
+    return applied
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import aiosqlite
+
+from core.db.querystats import connection_factory
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+
+
+def connection_pragmas(busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS) -> List[str]:
+    """PRAGMA, которые нужны каждому долгоживущему соединению."""
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={int(busy_timeout_ms)}",
+    ]
+
+
+async def configure_connection(conn: aiosqlite.Connection, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS) -> None:
+    for pragma in connection_pragmas(busy_timeout_ms):
+        await conn.execute(pragma)
+
+
+def open_connection(path: str, **kwargs) -> aiosqlite.Connection:
+    """aiosqlite.connect с замером запросов (core/db/querystats.py); используется как aiosqlite.connect."""
+    factory = connection_factory()
+    if factory is not None:
+        kwargs.setdefault("factory", factory)
+    return aiosqlite.connect(path, **kwargs)
+
+
+class SQLitePool:
+    """
+    Пул долгоживущих соединений aiosqlite к одному файлу БД.
+
+    Соединения открываются один раз (лениво при первом acquire или явно через open())
+    и переиспользуются, поэтому на каждый запрос не создаётся новый поток aiosqlite.
+    """
+
+    def __init__(self, path: str, size: int = DEFAULT_POOL_SIZE, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS):
+        self.path = str(path)
+        self.size = max(1, int(size))
+        self.busy_timeout_ms = busy_timeout_ms
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._idle is not None
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._idle is not None:
+                return
+            idle: asyncio.Queue = asyncio.Queue()
+            try:
+                for _ in range(self.size):
+                    conn = await open_connection(self.path)
+                    self._connections.append(conn)
+                    await configure_connection(conn, self.busy_timeout_ms)
+                    idle.put_nowait(conn)
+            except Exception:
+                await self._close_all()
+                raise
+            self._idle = idle
+            logger.info("SQLite pool for %s opened (%d connections).", self.path, self.size)
+
+    async def close(self) -> None:
+        async with self._open_lock:
+            if self._idle is None:
+                return
+            self._idle = None
+            await self._close_all()
+            logger.info("SQLite pool for %s closed.", self.path)
+
+    async def _close_all(self) -> None:
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning("Error closing pooled connection to %s: %s", self.path, e)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдаёт соединение из пула; незакоммиченная транзакция откатывается при возврате."""
+        if self._idle is None:
+            await self.open()
+        idle = self._idle
+        conn = await idle.get()
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    await conn.rollback()
+            except Exception as e:
+                logger.warning("Rollback on release failed for %s: %s", self.path, e)
+            idle.put_nowait(conn)
@@ -0,0 +1,178 @@
+"""
+Инструментирование SQL: задержка по отпечатку запроса и журнал медленных запросов.
+
+Все соединения бота (пул, писатель, ProfileManager, модули квестов и RPG)
+создаются с factory=InstrumentedConnection (см. core.db.pool.open_connection).
+Каждый execute/executemany замеряется и учитывается по отпечатку - тексту
+запроса с литералами, заменёнными на ?, и схлопнутыми пробелами и списками IN.
+Для отпечатка копятся число вызовов, суммарное время и последние
+QUERY_STATS_SAMPLES замеров для p50/p95/p99.
+
+Запросы дольше QUERY_SLOW_MS пишутся в лог вместе с EXPLAIN QUERY PLAN
+(не чаще раза в QUERY_SLOW_LOG_INTERVAL секунд на отпечаток). Для SELECT
+замеряется шаг до первой строки, выборка остальных строк не учитывается.
+Сводку по суммарной стоимости отдаёт format_query_stats() (команда /querystats
+и лог при остановке).
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUERY_STATS_ENABLED = os.getenv("QUERY_STATS", "1") != "0"
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", 100))
+QUERY_SLOW_LOG_INTERVAL = float(os.getenv("QUERY_SLOW_LOG_INTERVAL", 60))
+QUERY_STATS_SAMPLES = int(os.getenv("QUERY_STATS_SAMPLES", 1000))
+
+_FINGERPRINT_CACHE_SIZE = 4096
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_fingerprints: Dict[str, str] = {}
+# Отпечаток -> {"count", "total", "max", "samples", "last_slow_log"}
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def fingerprint(sql: str) -> str:
+    """Нормализованный текст запроса: литералы -> ?, IN (?, ?, ...) -> IN (?...), пробелы схлопнуты."""
+    cached = _fingerprints.get(sql)
+    if cached is not None:
+        return cached
+    normalized = _STRING_RE.sub("?", sql)
+    normalized = _NUMBER_RE.sub("?", normalized)
+    normalized = _SPACE_RE.sub(" ", normalized).strip()
+    normalized = _IN_LIST_RE.sub("IN (?...)", normalized)
+    if len(_fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+        # Тексты с подставленными f-строкой значениями не должны раздувать кэш.
+        _fingerprints.clear()
+    _fingerprints[sql] = normalized
+    return normalized
+
+
+def _explain(conn: sqlite3.Connection, sql: str, params: Any) -> str:
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return "-"
+    if params is None:
+        params = (None,) * sql.count("?")
+    try:
+        # Базовый execute: сам EXPLAIN не замеряется.
+        rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        return f"(explain failed: {e})"
+    return "; ".join(row[3] for row in rows) or "-"
+
+
+def _record(conn: sqlite3.Connection, sql: str, params: Any, elapsed: float) -> None:
+    key = fingerprint(sql)
+    now = time.monotonic()
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = {
+                "count": 0, "total": 0.0, "max": 0.0,
+                "samples": deque(maxlen=QUERY_STATS_SAMPLES), "last_slow_log": None,
+            }
+        entry["count"] += 1
+        entry["total"] += elapsed
+        entry["max"] = max(entry["max"], elapsed)
+        entry["samples"].append(elapsed)
+        log_slow = elapsed * 1000 >= QUERY_SLOW_MS and (
+            entry["last_slow_log"] is None or now - entry["last_slow_log"] >= QUERY_SLOW_LOG_INTERVAL
+        )
+        if log_slow:
+            entry["last_slow_log"] = now
+    if log_slow:
+        logger.warning(
+            "Slow query %.1f ms: %s | plan: %s", elapsed * 1000, key, _explain(conn, sql, params)
+        )
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql: str, parameters: Any = ()) -> "InstrumentedCursor":
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> "InstrumentedCursor":
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # План для executemany строим без параметров: последовательность уже израсходована.
+            _record(self.connection, sql, None, time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.Connection, чьи курсоры замеряют каждый запрос. Передаётся как factory= в connect."""
+
+    def cursor(self, factory: type = InstrumentedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory() -> Optional[type]:
+    """factory для sqlite3.connect/aiosqlite.connect; None, если инструментирование отключено (QUERY_STATS=0)."""
+    return InstrumentedConnection if QUERY_STATS_ENABLED else None
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def get_query_stats(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Отпечатки запросов по убыванию суммарного времени; время в миллисекундах."""
+    with _lock:
+        snapshot = [(key, dict(entry), sorted(entry["samples"])) for key, entry in _stats.items()]
+    result = []
+    for key, entry, ordered in snapshot:
+        result.append({
+            "query": key,
+            "count": entry["count"],
+            "total_ms": entry["total"] * 1000,
+            "avg_ms": entry["total"] / entry["count"] * 1000,
+            "p50_ms": _percentile(ordered, 0.50) * 1000,
+            "p95_ms": _percentile(ordered, 0.95) * 1000,
+            "p99_ms": _percentile(ordered, 0.99) * 1000,
+            "max_ms": entry["max"] * 1000,
+        })
+    result.sort(key=lambda row: row["total_ms"], reverse=True)
+    return result[:limit] if limit else result
+
+
+def format_query_stats(limit: int = 15, query_width: int = 120) -> str:
+    """Текстовая сводка самых дорогих запросов для лога и /querystats."""
+    rows = get_query_stats(limit)
+    if not rows:
+        return "Нет данных о запросах."
+    lines = []
+    for i, row in enumerate(rows, 1):
+        query = row["query"] if len(row["query"]) <= query_width else row["query"][:query_width - 3] + "..."
+        lines.append(
+            f"{i}. total {row['total_ms']:.1f} ms, {row['count']} calls, "
+            f"p50 {row['p50_ms']:.2f} / p95 {row['p95_ms']:.2f} / p99 {row['p99_ms']:.2f} ms, "
+            f"max {row['max_ms']:.1f} ms\n   {query}"
+        )
+    return "\n".join(lines)
+
+
+def reset_query_stats() -> None:
+    with _lock:
+        _stats.clear()
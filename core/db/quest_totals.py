@@ -0,0 +1,120 @@
+"""
+Материализованные счётчики выполнения заданий.
+
+Источник правды - quests_statistics (пользователь x задание: сколько раз
+выполнено). Поверх него хранятся свёртки, чтобы экраны статистики читали
+одну-две строки вместо агрегации:
+
+- quest_user_totals - выполнено пользователем по типу (daily/weekly);
+- quest_totals - по всем пользователям: на задание, на тип (original_quest_id
+  = '*') и всего (quest_type = original_quest_id = '*'); completed_count,
+  число разных выполнивших и время последнего выполнения.
+
+record_completion_tx() обновляет quests_statistics и все свёртки в одной
+транзакции с отметкой completed (намерение писателя движка заданий или
+_apply_quest_progress), поэтому свёртки не расходятся с источником.
+check_quest_totals() сверяет их с пересчётом из quests_statistics,
+rebuild_quest_totals_tx() пересобирает.
+"""
+import sqlite3
+from typing import List
+
+# Значение ключа "все задания" / "все типы" в quest_totals.
+ALL_QUESTS = "*"
+
+# Свёртки, пересчитанные из quests_statistics: общий SQL для пересборки и сверки.
+_USER_TOTALS_SQL = '''
+    SELECT user_id, quest_type, SUM(completed_count)
+    FROM quests_statistics
+    WHERE quest_type IS NOT NULL AND completed_count > 0
+    GROUP BY user_id, quest_type
+'''
+_QUEST_TOTALS_SQL = f'''
+    WITH stats AS (
+        SELECT user_id, quest_type, original_quest_id, completed_count, last_completed
+        FROM quests_statistics
+        WHERE quest_type IS NOT NULL AND original_quest_id IS NOT NULL AND completed_count > 0
+    )
+    SELECT quest_type, original_quest_id, SUM(completed_count), COUNT(*), MAX(last_completed)
+    FROM stats GROUP BY quest_type, original_quest_id
+    UNION ALL
+    SELECT quest_type, '{ALL_QUESTS}', SUM(completed_count), COUNT(DISTINCT user_id), MAX(last_completed)
+    FROM stats GROUP BY quest_type
+    UNION ALL
+    SELECT '{ALL_QUESTS}', '{ALL_QUESTS}', SUM(completed_count), COUNT(DISTINCT user_id), MAX(last_completed)
+    FROM stats HAVING COUNT(*) > 0
+'''
+
+
+def record_completion_tx(conn: sqlite3.Connection, user_id: int, quest_type: str, original_quest_id: str,
+                         completed_at: str) -> None:
+    """Засчитывает выполнение задания в quests_statistics и свёртках; без commit."""
+    first_ever = conn.execute(
+        'SELECT 1 FROM quest_user_totals WHERE user_id = ? LIMIT 1', (user_id,)
+    ).fetchone() is None
+    per_quest = conn.execute('''
+        INSERT INTO quests_statistics (user_id, quest_type, original_quest_id, completed_count, last_completed)
+        VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(user_id, original_quest_id)
+        DO UPDATE SET completed_count = completed_count + 1, last_completed = excluded.last_completed
+        RETURNING completed_count
+    ''', (user_id, quest_type, original_quest_id, completed_at)).fetchone()[0]
+    per_type = conn.execute('''
+        INSERT INTO quest_user_totals (user_id, quest_type, completed_count) VALUES (?, ?, 1)
+        ON CONFLICT(user_id, quest_type) DO UPDATE SET completed_count = completed_count + 1
+        RETURNING completed_count
+    ''', (user_id, quest_type)).fetchone()[0]
+    # Первое выполнение на своём уровне добавляет пользователя в unique_users.
+    conn.executemany('''
+        INSERT INTO quest_totals (quest_type, original_quest_id, completed_count, unique_users, last_completed)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(quest_type, original_quest_id) DO UPDATE SET
+            completed_count = completed_count + 1,
+            unique_users = unique_users + excluded.unique_users,
+            last_completed = MAX(IFNULL(last_completed, ''), excluded.last_completed)
+    ''', [
+        (quest_type, original_quest_id, int(per_quest == 1), completed_at),
+        (quest_type, ALL_QUESTS, int(per_type == 1), completed_at),
+        (ALL_QUESTS, ALL_QUESTS, int(first_ever), completed_at),
+    ])
+
+
+def rebuild_quest_totals_tx(conn: sqlite3.Connection) -> int:
+    """Пересобирает свёртки из quests_statistics; без commit. Возвращает число строк quest_totals."""
+    conn.execute('DELETE FROM quest_user_totals')
+    conn.execute('DELETE FROM quest_totals')
+    conn.execute(f'INSERT INTO quest_user_totals (user_id, quest_type, completed_count) {_USER_TOTALS_SQL}')
+    return conn.execute(f'''
+        INSERT INTO quest_totals (quest_type, original_quest_id, completed_count, unique_users, last_completed)
+        {_QUEST_TOTALS_SQL}
+    ''').rowcount
+
+
+def check_quest_totals(conn: sqlite3.Connection) -> List[str]:
+    """Сверяет свёртки с пересчётом из quests_statistics. Пустой список - всё сходится."""
+    problems = []
+    for user_id, quest_type, stored, expected in conn.execute(f'''
+        WITH expected(user_id, quest_type, completed_count) AS ({_USER_TOTALS_SQL}),
+        keys AS (SELECT user_id, quest_type FROM expected UNION SELECT user_id, quest_type FROM quest_user_totals)
+        SELECT k.user_id, k.quest_type, t.completed_count, e.completed_count
+        FROM keys k
+        LEFT JOIN quest_user_totals t ON t.user_id = k.user_id AND t.quest_type = k.quest_type
+        LEFT JOIN expected e ON e.user_id = k.user_id AND e.quest_type = k.quest_type
+        WHERE t.completed_count IS NOT e.completed_count
+    '''):
+        problems.append(f"user {user_id} {quest_type}: {stored} completed != statistics {expected}")
+    for quest_type, quest_id, count, users, expected_count, expected_users in conn.execute(f'''
+        WITH expected(quest_type, original_quest_id, completed_count, unique_users, last_completed) AS (
+            {_QUEST_TOTALS_SQL}
+        ),
+        keys AS (SELECT quest_type, original_quest_id FROM expected
+                 UNION SELECT quest_type, original_quest_id FROM quest_totals)
+        SELECT k.quest_type, k.original_quest_id, t.completed_count, t.unique_users, e.completed_count, e.unique_users
+        FROM keys k
+        LEFT JOIN quest_totals t ON t.quest_type = k.quest_type AND t.original_quest_id = k.original_quest_id
+        LEFT JOIN expected e ON e.quest_type = k.quest_type AND e.original_quest_id = k.original_quest_id
+        WHERE t.completed_count IS NOT e.completed_count OR t.unique_users IS NOT e.unique_users
+    '''):
+        problems.append(f"{quest_type}/{quest_id}: {count} completed by {users} users "
+                        f"!= statistics {expected_count} by {expected_users}")
+    return problems
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.db.pool import DEFAULT_BUSY_TIMEOUT_MS, connection_pragmas
+from core.db.querystats import connection_factory
+
+logger = logging.getLogger(__name__)
+
+# Намерение записи: синхронная функция, выполняющая SQL на переданном соединении без commit.
+# Весь пакет намерений выполняется одним переходом в поток писателя.
+WriteIntent = Callable[[sqlite3.Connection], Any]
+
+DEFAULT_WINDOW_MS = float(os.getenv("DB_WRITE_WINDOW_MS", 30))
+DEFAULT_MAX_BATCH = int(os.getenv("DB_WRITE_MAX_BATCH", 500))
+
+_STOP = object()
+
+
+class WriteActor:
+    """
+    Единственный писатель в файл БД с групповым коммитом.
+
+    Хендлеры отправляют намерения через submit(); фоновая задача собирает всё,
+    что пришло за окно window_ms, выполняет в одной транзакции (каждое намерение
+    под своим SAVEPOINT, чтобы ошибка одного не откатывала остальные) и
+    разрешает futures только после COMMIT.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        window_ms: float = DEFAULT_WINDOW_MS,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS,
+    ):
+        self.path = str(path)
+        self.window = max(0.0, float(window_ms)) / 1000
+        self.max_batch = max(1, int(max_batch))
+        self.busy_timeout_ms = busy_timeout_ms
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.intents = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        if self._executor is None:
+            # Один поток: sqlite3-соединение писателя всегда используется из него.
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run(self._queue), name=f"db-writer:{self.path}")
+
+    async def stop(self) -> None:
+        """Дожидается записи всех поставленных намерений и закрывает соединение."""
+        if self.is_running:
+            self._queue.put_nowait(_STOP)
+            await self._task
+        self._task = None
+        self._queue = None
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._close_sync)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            logger.info("DB writer for %s stopped (%d batches, %d intents).", self.path, self.batches, self.intents)
+
+    async def submit(self, intent: WriteIntent) -> Any:
+        """Ставит намерение в очередь и ждёт коммита пакета, в который оно попало."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((intent, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is _STOP:
+                stopping = True
+                batch: List[Tuple[WriteIntent, asyncio.Future]] = []
+            else:
+                batch = [item]
+                deadline = loop.time() + self.window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    try:
+                        item = queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(queue.get(), timeout)
+                    except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+            if stopping:
+                # Всё, что успели поставить до остановки, тоже должно быть записано.
+                while len(batch) < self.max_batch and not queue.empty():
+                    item = queue.get_nowait()
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                await self._flush(batch)
+            if stopping and not queue.empty():
+                stopping = False
+                queue.put_nowait(_STOP)
+
+    async def _flush(self, batch: List[Tuple[WriteIntent, asyncio.Future]]) -> None:
+        pending = [(intent, future) for intent, future in batch if not future.cancelled()]
+        if not pending:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            outcomes = await loop.run_in_executor(self._executor, self._flush_sync, [intent for intent, _ in pending])
+        except Exception as e:
+            logger.error("DB writer for %s failed to commit a batch of %d: %s", self.path, len(pending), e)
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.intents += len(pending)
+        for (_, future), (result, error) in zip(pending, outcomes):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            factory = connection_factory()
+            kwargs = {"factory": factory} if factory is not None else {}
+            conn = sqlite3.connect(self.path, isolation_level=None, **kwargs)
+            try:
+                for pragma in connection_pragmas(self.busy_timeout_ms):
+                    conn.execute(pragma)
+            except Exception:
+                conn.close()
+                raise
+            self._conn = conn
+        return self._conn
+
+    def _flush_sync(self, intents: List[WriteIntent]) -> List[Tuple[Any, Optional[BaseException]]]:
+        conn = self._connection()
+        outcomes: List[Tuple[Any, Optional[BaseException]]] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for intent in intents:
+                conn.execute("SAVEPOINT write_intent")
+                try:
+                    result = intent(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_intent")
+                    conn.execute("RELEASE write_intent")
+                    outcomes.append((None, e))
+                else:
+                    conn.execute("RELEASE write_intent")
+                    outcomes.append((result, None))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return outcomes
+
+    def _close_sync(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_writers: Dict[str, WriteActor] = {}
+
+
+def writer_for(path: str) -> WriteActor:
+    """Возвращает общий WriteActor для файла БД (по одному писателю на файл)."""
+    key = os.path.abspath(str(path))
+    writer = _writers.get(key)
+    if writer is None:
+        writer = _writers[key] = WriteActor(str(path))
+    return writer
+
+
+async def stop_all_writers() -> None:
+    for writer in list(_writers.values()):
+        await writer.stop()
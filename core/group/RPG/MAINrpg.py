@@ -11,7 +11,7 @@ import asyncio
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
-from .rpg_utils import ensure_db_initialized, quick_purchase_cache, shop_pages_cache, quick_sell_cache
+from .rpg_utils import quick_purchase_cache, shop_pages_cache, quick_sell_cache
 
 logger = logging.getLogger(__name__)
 rpg_router = Router(name="rpg_router")
@@ -28,5 +28,4 @@ def setup_rpg_handlers(main_dp, bot_instance, profile_manager_instance, database
     logger.info("RPG router included.")
 
 async def initialize_on_startup():
-    await ensure_db_initialized()
     logger.info("✅ RPG system initialized")
@@ -1,7 +1,6 @@
 # Import shared resources first
 from .MAINrpg import rpg_router, setup_rpg_handlers, initialize_on_startup
 from .item import ItemSystem
-from .rpg_utils import ensure_db_initialized
 
 # Import feature modules
 from .inventory import show_inventory, get_user_lumcoins, get_user_inventory_db, remove_item_from_inventory
@@ -16,7 +15,6 @@ __all__ = [
     'rpg_router',
     'setup_rpg_handlers',
     'initialize_on_startup',
-    'ensure_db_initialized',
     'ItemSystem',
     
     # Feature handlers
@@ -7,7 +7,8 @@ from typing import Dict, List, Tuple
 import random
 import time
 import json
-import aiosqlite
+from core.db.pool import open_connection
+from database import DB_PATH
 import asyncio
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -22,9 +23,7 @@ from core.group.RPG.trade import *
 
 async def get_active_auctions() -> List[dict]:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute('''
                 SELECT * FROM auction_listings 
                 WHERE end_time > ? OR end_time IS NULL
@@ -46,9 +45,7 @@ async def get_active_auctions() -> List[dict]:
 
 async def get_market_listings() -> List[dict]:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute('''
                 SELECT * FROM market_listings 
                 ORDER BY created_at DESC
@@ -356,8 +353,7 @@ async def create_auction_listing(user_id, item_key, price, message, state):
             return
         
         # Добавляем в аукцион
-        await ensure_db_initialized()
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             await conn.execute('''
                 INSERT INTO auction_listings (seller_id, item_key, item_data, start_price, current_bid, end_time)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -399,8 +395,7 @@ async def handle_auction_set_price(callback: types.CallbackQuery, profile_manage
             await callback.answer("❌ Ошибка при удалении предмета")
             return
         
-        await ensure_db_initialized()
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             await conn.execute('''
                 INSERT INTO auction_listings (seller_id, item_key, item_data, start_price, current_bid, end_time)
                 VALUES (?, ?, ?, ?, ?, ?)
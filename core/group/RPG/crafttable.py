@@ -1,5 +1,4 @@
 from core.group.RPG.MAINrpg import rpg_router
-from core.group.RPG.rpg_utils import ensure_db_initialized
 from aiogram import Router, types, F, Bot
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
@@ -85,7 +84,7 @@ async def show_craft_info(callback: types.CallbackQuery, profile_manager):
                 "crafted_at": time.time()
             }
             
-            success = await update_user_lumcoins(profile_manager, user_id, -5000)
+            success = await update_user_lumcoins(profile_manager, user_id, -5000, "crafting", "craft:custom_item")
             if not success:
                 await callback.answer("❌ Ошибка при списании")
                 return
@@ -140,7 +139,7 @@ async def show_craft_info(callback: types.CallbackQuery, profile_manager):
             await callback.answer(f"❌ Не хватает:\n" + "\n".join(missing_materials))
             return
         
-        success = await update_user_lumcoins(profile_manager, user_id, -recipe['cost'])
+        success = await update_user_lumcoins(profile_manager, user_id, -recipe['cost'], "crafting", f"craft:{recipe_key}")
         if not success:
             await callback.answer("❌ Ошибка при списании")
             return
@@ -1,5 +1,4 @@
 from core.group.RPG.MAINrpg import rpg_router
-from core.group.RPG.rpg_utils import ensure_db_initialized
 from .item import ItemSystem
 from core.group.stat.shop_config import ShopConfig
 from .rpg_utils import quick_purchase_cache
@@ -12,10 +11,10 @@ from typing import Dict, List, Tuple
 import random
 import time
 import json
-import aiosqlite
 import asyncio
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from core.db.pool import open_connection
 import database as db
 
 logger = logging.getLogger(__name__)
@@ -28,22 +27,20 @@ async def get_user_lumcoins(profile_manager, user_id: int) -> int:
         logger.error(f"Error getting lumcoins for user {user_id}: {e}")
         return 0
 
-async def update_user_lumcoins(profile_manager, user_id: int, amount: int) -> bool:
+async def update_user_lumcoins(profile_manager, user_id: int, amount: int,
+                               account: str = "shop", reason: str = "adjust") -> bool:
     try:
-        await profile_manager.update_lumcoins(user_id, amount)
-        return True
+        return await profile_manager.update_lumcoins(user_id, amount, account, reason)
     except Exception as e:
         logger.error(f"Error updating lumcoins for user {user_id}: {e}")
         return False
 
 async def add_item_to_inventory_db(user_id: int, item_data: dict, quantity: int = 1) -> bool:
     try:
-        await ensure_db_initialized()
-        
         item_key = item_data.get('item_key', 'unknown')
         item_type = item_data.get('type', 'material')
         
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(db.DB_PATH) as conn:
             cursor = await conn.execute(
                 'SELECT quantity FROM user_inventory WHERE user_id = ? AND item_key = ?',
                 (user_id, item_key)
@@ -78,9 +75,7 @@ async def add_item_to_inventory_db(user_id: int, item_data: dict, quantity: int
 
 async def remove_item_from_inventory(user_id: int, item_key: str, quantity: int = 1) -> bool:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(db.DB_PATH) as conn:
             cursor = await conn.execute(
                 'SELECT quantity FROM user_inventory WHERE user_id = ? AND item_key = ?',
                 (user_id, item_key)
@@ -113,9 +108,7 @@ async def remove_item_from_inventory(user_id: int, item_key: str, quantity: int
 
 async def get_user_inventory_db(user_id: int) -> List[dict]:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(db.DB_PATH) as conn:
             cursor = await conn.execute(
                 'SELECT item_key, item_type, quantity, item_data FROM user_inventory WHERE user_id = ?',
                 (user_id,)
@@ -147,9 +140,7 @@ async def get_user_inventory_db(user_id: int) -> List[dict]:
 
 async def get_user_backgrounds_inventory(user_id: int) -> List[dict]:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(db.DB_PATH) as conn:
             cursor = await conn.execute(
                 'SELECT item_key, item_data FROM user_inventory WHERE user_id = ? AND item_type = ?',
                 (user_id, 'background')
@@ -179,9 +170,7 @@ async def get_user_backgrounds_inventory(user_id: int) -> List[dict]:
 
 async def get_user_active_background(user_id: int) -> str:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(db.DB_PATH) as conn:
             cursor = await conn.execute(
                 'SELECT bg_key FROM user_active_background WHERE user_id = ?',
                 (user_id,)
@@ -194,9 +183,7 @@ async def get_user_active_background(user_id: int) -> str:
 
 async def set_user_active_background(user_id: int, bg_key: str) -> bool:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(db.DB_PATH) as conn:
             await conn.execute('''
                 INSERT OR REPLACE INTO user_active_background (user_id, bg_key)
                 VALUES (?, ?)
@@ -675,7 +662,7 @@ async def handle_buy_background(callback: types.CallbackQuery, profile_manager):
             await callback.answer("❌ У вас уже есть этот фон")
             return
         
-        success = await update_user_lumcoins(profile_manager, user_id, -bg_price)
+        success = await update_user_lumcoins(profile_manager, user_id, -bg_price, "shop", f"background:{bg_key}")
         if not success:
             await callback.answer("❌ Ошибка при списании")
             return
@@ -727,7 +714,7 @@ async def handle_shop_item_info(callback: types.CallbackQuery, profile_manager):
                 await callback.answer(f"❌ Недостаточно LUM. Нужно: {item_info['cost']}")
                 return
             
-            success = await update_user_lumcoins(profile_manager, user_id, -item_info['cost'])
+            success = await update_user_lumcoins(profile_manager, user_id, -item_info['cost'], "shop", f"item:{item_key}")
             if not success:
                 await callback.answer("❌ Ошибка при списании")
                 return
@@ -1,5 +1,4 @@
 from core.group.RPG.MAINrpg import rpg_router
-from core.group.RPG.rpg_utils import ensure_db_initialized
 from .rpg_utils import investment_amounts, quick_purchase_cache
 
 from aiogram import Router, types, F, Bot
@@ -15,7 +14,8 @@ from typing import Dict, List, Tuple
 import random
 import time
 import json
-import aiosqlite
+from core.db.pool import open_connection
+from database import DB_PATH
 import asyncio
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -31,9 +31,7 @@ INVESTMENT_TERM_DAYS = 14
 
 async def add_investment(user_id: int, amount: int, term_days: int, interest_rate: float, risk: float = 0) -> bool:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             await conn.execute('''
                 INSERT INTO user_investments (user_id, amount, term_days, interest_rate, risk, invested_at, status)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -47,9 +45,7 @@ async def add_investment(user_id: int, amount: int, term_days: int, interest_rat
 
 async def get_user_active_investments(user_id: int) -> List[dict]:
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute('''
                 SELECT * FROM user_investments 
                 WHERE user_id = ? AND status = 'active'
@@ -71,8 +67,7 @@ async def get_user_active_investments(user_id: int) -> List[dict]:
 
 async def get_user_investment_history(user_id: int, limit: int = 20) -> List[dict]:
     try:
-        await ensure_db_initialized()
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute(
                 '''
                 SELECT * FROM user_investments
@@ -333,7 +328,7 @@ async def handle_investment_actions(callback: types.CallbackQuery, profile_manag
                 time.time() - quick_invest['timestamp'] <= 10):
                 
                 # Списание средств
-                success = await update_user_lumcoins(profile_manager, user_id, -amount)
+                success = await update_user_lumcoins(profile_manager, user_id, -amount, "investments", "invest")
                 if not success:
                     await callback.answer("❌ Ошибка при списании")
                     return
@@ -400,8 +395,7 @@ async def handle_invest_claim_all(callback: types.CallbackQuery, profile_manager
                 
                 if investment['risk'] > 0 and random.random() < investment['risk']:
                     # Провал
-                    await ensure_db_initialized()
-                    async with aiosqlite.connect('profiles.db') as conn:
+                    async with open_connection(DB_PATH) as conn:
                         await conn.execute('''
                             UPDATE user_investments SET status = 'failed' 
                             WHERE user_id = ? AND invested_at = ?
@@ -410,11 +404,10 @@ async def handle_invest_claim_all(callback: types.CallbackQuery, profile_manager
                     failed_count += 1
                 else:
                     # Успех
-                    success = await update_user_lumcoins(profile_manager, user_id, expected_return)
+                    success = await update_user_lumcoins(profile_manager, user_id, expected_return, "investments", "invest:return")
                     if success:
                         total_profit += profit
-                        await ensure_db_initialized()
-                        async with aiosqlite.connect('profiles.db') as conn:
+                        async with open_connection(DB_PATH) as conn:
                             await conn.execute('''
                                 UPDATE user_investments SET status = 'completed' 
                                 WHERE user_id = ? AND invested_at = ?
@@ -597,7 +590,7 @@ async def handle_sell_item_info(callback: types.CallbackQuery, profile_manager):
                 await callback.answer("❌ Ошибка при удалении предмета")
                 return
             
-            success = await update_user_lumcoins(profile_manager, user_id, sell_price)
+            success = await update_user_lumcoins(profile_manager, user_id, sell_price, "shop", f"sell:{item_key}")
             if not success:
                 await callback.answer("❌ Ошибка при начислении средств")
                 return
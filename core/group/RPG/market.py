@@ -15,7 +15,6 @@ from core.group.stat.shop_config import ShopConfig
 # Import from our own package using relative imports
 from .MAINrpg import rpg_router
 from .item import ItemSystem
-from .rpg_utils import ensure_db_initialized
 from .inventory import get_user_lumcoins, get_user_inventory_db, remove_item_from_inventory
 from .market_db import (
     get_market_listings, 
@@ -1,10 +1,10 @@
 import logging
 import json
-import aiosqlite
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
-from .rpg_utils import ensure_db_initialized
+from core.db.pool import open_connection
+from database import DB_PATH
 from .item import ItemSystem
 
 logger = logging.getLogger(__name__)
@@ -31,9 +31,7 @@ async def validate_item_for_market(item_key: str, item_data: dict) -> Tuple[bool
 async def get_market_listings() -> List[dict]:
     """Get all active market listings"""
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute('''
                 SELECT 
                     id, seller_id, item_key, item_data, price, created_at
@@ -69,9 +67,7 @@ async def add_market_listing(seller_id: int, item_key: str, item_data: dict, pri
         if not valid:
             return False, error_msg
             
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             # Check if seller already has too many listings
             cursor = await conn.execute(
                 'SELECT COUNT(*) FROM market_listings WHERE seller_id = ?', 
@@ -96,9 +92,7 @@ async def add_market_listing(seller_id: int, item_key: str, item_data: dict, pri
 async def remove_market_listing(listing_id: int, seller_id: Optional[int] = None) -> Tuple[bool, str]:
     """Remove a market listing. If seller_id is provided, verify ownership."""
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             # If seller_id provided, verify ownership
             if seller_id is not None:
                 cursor = await conn.execute(
@@ -122,9 +116,7 @@ async def remove_market_listing(listing_id: int, seller_id: Optional[int] = None
 async def get_listing(listing_id: int) -> Optional[Dict]:
     """Get a specific market listing by ID"""
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute('''
                 SELECT id, seller_id, item_key, item_data, price, created_at
                 FROM market_listings 
@@ -151,9 +143,7 @@ async def get_listing(listing_id: int) -> Optional[Dict]:
 async def get_seller_listings(seller_id: int) -> List[Dict]:
     """Get all market listings for a specific seller"""
     try:
-        await ensure_db_initialized()
-        
-        async with aiosqlite.connect('profiles.db') as conn:
+        async with open_connection(DB_PATH) as conn:
             cursor = await conn.execute('''
                 SELECT id, seller_id, item_key, item_data, price, created_at
                 FROM market_listings 
@@ -1,5 +1,4 @@
 from core.group.RPG.MAINrpg import rpg_router
-from core.group.RPG.rpg_utils import ensure_db_initialized
 from .rpg_utils import trade_sessions
 from aiogram import Router, types, F, Bot
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -664,7 +664,9 @@ async def slots_bet_handler(callback: types.CallbackQuery, profile_manager: Prof
         return
 
     try:
-        await profile_manager.update_lumcoins(user_id, -bet_amount)
+        if not await profile_manager.update_lumcoins(user_id, -bet_amount, "casino", "casino:slots:bet"):
+            await safe_answer_callback(callback, "❌ Недостаточно Lumcoins!")
+            return
     except Exception as e:
         logger.error(f"Error deducting bet for user {user_id}: {e}")
         await safe_answer_callback(callback, "❌ Ошибка при списании средств!")
@@ -691,7 +693,7 @@ async def slots_bet_handler(callback: types.CallbackQuery, profile_manager: Prof
         logger.error(f"❌ Ошибка обновления заданий казино: {e}")
 
     if result["won"]:
-        await profile_manager.update_lumcoins(user_id, result["win_amount"])
+        await profile_manager.update_lumcoins(user_id, result["win_amount"], "casino", "casino:slots:win")
         new_balance = await profile_manager.get_lumcoins(user_id)
 
         result_text = (
@@ -783,7 +785,9 @@ async def roulette_bet_handler(callback: types.CallbackQuery, profile_manager: P
         return
 
     try:
-        await profile_manager.update_lumcoins(user_id, -bet_amount)
+        if not await profile_manager.update_lumcoins(user_id, -bet_amount, "casino", "casino:roulette:bet"):
+            await safe_answer_callback(callback, "❌ Недостаточно Lumcoins!")
+            return
     except Exception as e:
         logger.error(f"Error deducting bet for user {user_id}: {e}")
         await safe_answer_callback(callback, "❌ Ошибка при списании средств!")
@@ -816,7 +820,7 @@ async def roulette_bet_handler(callback: types.CallbackQuery, profile_manager: P
         return "🔴" if number in red_numbers else "⚫"
 
     if result["won"]:
-        await profile_manager.update_lumcoins(user_id, result["win_amount"])
+        await profile_manager.update_lumcoins(user_id, result["win_amount"], "casino", "casino:roulette:win")
         new_balance = await profile_manager.get_lumcoins(user_id)
 
         result_text = (
@@ -868,7 +872,9 @@ async def blackjack_bet_handler(callback: types.CallbackQuery, profile_manager:
         return
 
     try:
-        await profile_manager.update_lumcoins(user_id, -bet_amount)
+        if not await profile_manager.update_lumcoins(user_id, -bet_amount, "casino", "casino:blackjack:bet"):
+            await safe_answer_callback(callback, "❌ Недостаточно Lumcoins!")
+            return
     except Exception as e:
         logger.error(f"Error deducting bet for user {user_id}: {e}")
         await safe_answer_callback(callback, "❌ Ошибка при списании средств!")
@@ -968,9 +974,9 @@ async def blackjack_callback_handler(callback: types.CallbackQuery, profile_mana
             await update_casino_quests(user_id, "blackjack", won, win_amount, callback.bot)
 
             if result["state"] == "finished" and result["win_amount"] > 0:
-                await profile_manager.update_lumcoins(user_id, result["win_amount"])
+                await profile_manager.update_lumcoins(user_id, result["win_amount"], "casino", "casino:blackjack:win")
             elif result["state"] == "surrender":
-                await profile_manager.update_lumcoins(user_id, result["win_amount"])
+                await profile_manager.update_lumcoins(user_id, result["win_amount"], "casino", "casino:blackjack:win")
 
             new_balance = await profile_manager.get_lumcoins(user_id)
 
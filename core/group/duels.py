@@ -40,7 +40,9 @@ async def cmd_sharpen_knife(message: types.Message, profile_manager):
     if lum < cost:
         await message.reply(f"❌ Нужно {cost} LUM для заточки ножа.")
         return
-    await profile_manager.update_lumcoins(user_id, -cost)
+    if not await profile_manager.update_lumcoins(user_id, -cost, "duels", "sharp_knife"):
+        await message.reply(f"❌ Нужно {cost} LUM для заточки ножа.")
+        return
     stats = await db.update_duel_stats(user_id, strength_delta=5)
     await message.reply(f"🔪 Сила увеличена! Текущая сила: {stats['strength']}")
 
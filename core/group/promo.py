@@ -122,7 +122,7 @@ async def handle_promo_command(message: types.Message, bot: Bot, profile_manager
             return
             
         # Начисляем награду
-        await profile_manager.update_lumcoins(user_id, amount)
+        await profile_manager.update_lumcoins(user_id, amount, "promo", f"promo:{code_upper}")
         
         # Обновляем счетчик использований промокода
         still_valid = await update_promocode_use_count(promocode)
@@ -0,0 +1,156 @@
+"""
+Кэш аватарок для карточек профиля.
+
+- Список фото пользователя (get_user_profile_photos) кэшируется на
+  AVATAR_LOOKUP_TTL секунд, включая ответ "фото нет"; ошибки не кэшируются.
+- Сама аватарка хранится по file_unique_id уже обработанной render.prepare_avatar
+  (размер AVATAR_BOX, круглая альфа-маска): в памяти LRU на AVATAR_CACHE_SIZE
+  записей и на диске в AVATAR_CACHE_DIR, не больше AVATAR_DISK_MAX_FILES файлов.
+  file_unique_id у одного и того же файла не меняется, поэтому запись не
+  устаревает; новая аватарка приходит с новым file_unique_id.
+- Одновременные запросы одной аватарки ждут одну загрузку.
+
+Тёплый запрос профиля не обращается к Telegram вовсе.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot, types
+from PIL import Image
+
+from core.group.stat.render import prepare_avatar, run_in_render_pool
+
+logger = logging.getLogger(__name__)
+
+AVATAR_LOOKUP_TTL = float(os.getenv("AVATAR_LOOKUP_TTL", 600))
+AVATAR_CACHE_SIZE = int(os.getenv("AVATAR_CACHE_SIZE", 512))
+AVATAR_CACHE_DIR = Path(os.getenv("AVATAR_CACHE_DIR", "data/avatars"))
+AVATAR_DISK_MAX_FILES = int(os.getenv("AVATAR_DISK_MAX_FILES", 5000))
+AVATAR_TIMEOUT = 3
+
+_lookups: Dict[int, Tuple[float, Optional[types.PhotoSize]]] = {}
+_memory: "OrderedDict[str, Image.Image]" = OrderedDict()
+_inflight: Dict[str, "asyncio.Future[Optional[Image.Image]]"] = {}
+_disk_writes = 0
+_stats = {"lookup_hits": 0, "lookup_calls": 0, "memory_hits": 0, "disk_hits": 0, "downloads": 0, "errors": 0}
+
+
+def get_avatar_cache_stats() -> Dict[str, Any]:
+    return {**_stats, "memory": len(_memory), "lookups": len(_lookups)}
+
+
+def _remember(file_unique_id: str, avatar: Image.Image) -> None:
+    _memory[file_unique_id] = avatar
+    _memory.move_to_end(file_unique_id)
+    while len(_memory) > AVATAR_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def _disk_path(file_unique_id: str) -> Path:
+    # file_unique_id состоит из символов base64url, безопасных для имени файла.
+    return AVATAR_CACHE_DIR / f"{file_unique_id}.png"
+
+
+def _read_disk(file_unique_id: str) -> Optional[Image.Image]:
+    path = _disk_path(file_unique_id)
+    if not path.exists():
+        return None
+    try:
+        with Image.open(path) as image:
+            image.load()
+            return image.copy()
+    except Exception as e:
+        logger.warning(f"Broken cached avatar {path}, dropping: {e}")
+        path.unlink(missing_ok=True)
+        return None
+
+
+def _prune_disk() -> None:
+    files = sorted(AVATAR_CACHE_DIR.glob("*.png"), key=lambda path: path.stat().st_mtime)
+    for path in files[:max(0, len(files) - AVATAR_DISK_MAX_FILES)]:
+        path.unlink(missing_ok=True)
+
+
+def _prepare_and_store(file_unique_id: str, data: bytes, prune: bool) -> Image.Image:
+    avatar = prepare_avatar(data)
+    try:
+        AVATAR_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = _disk_path(file_unique_id).with_suffix(".tmp")
+        avatar.save(tmp_path, format="PNG")
+        os.replace(tmp_path, _disk_path(file_unique_id))
+        if prune:
+            _prune_disk()
+    except OSError as e:
+        logger.warning(f"Failed to store avatar {file_unique_id} on disk: {e}")
+    return avatar
+
+
+async def get_avatar_photo(user_id: int, bot: Bot) -> Optional[types.PhotoSize]:
+    """Самая крупная версия текущей аватарки пользователя или None; список фото кэшируется на TTL."""
+    cached = _lookups.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        _stats["lookup_hits"] += 1
+        return cached[1]
+    _stats["lookup_calls"] += 1
+    try:
+        photos = await asyncio.wait_for(bot.get_user_profile_photos(user_id, limit=1), timeout=AVATAR_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"Failed to get profile photos for user {user_id}: {e}")
+        return None
+    photo = photos.photos[0][-1] if photos.total_count > 0 and photos.photos else None
+    if len(_lookups) >= AVATAR_CACHE_SIZE * 4:
+        now = time.monotonic()
+        for stale_id in [uid for uid, (expires, _) in _lookups.items() if expires <= now]:
+            del _lookups[stale_id]
+    _lookups[user_id] = (time.monotonic() + AVATAR_LOOKUP_TTL, photo)
+    return photo
+
+
+async def _fetch(photo: types.PhotoSize, bot: Bot) -> Optional[Image.Image]:
+    global _disk_writes
+    file_unique_id = photo.file_unique_id
+    avatar = await run_in_render_pool(_read_disk, file_unique_id)
+    if avatar is not None:
+        _stats["disk_hits"] += 1
+        return avatar
+    try:
+        file = await asyncio.wait_for(bot.get_file(photo.file_id), timeout=AVATAR_TIMEOUT)
+        data = await asyncio.wait_for(bot.download_file(file.file_path), timeout=AVATAR_TIMEOUT)
+        _disk_writes += 1
+        avatar = await run_in_render_pool(_prepare_and_store, file_unique_id, data.getvalue(), _disk_writes % 100 == 0)
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.debug(f"Failed to download avatar {file_unique_id}: {e}")
+        return None
+    _stats["downloads"] += 1
+    return avatar
+
+
+async def get_avatar(photo: Optional[types.PhotoSize], bot: Bot) -> Optional[Image.Image]:
+    """Готовый к вставке аватар (render.prepare_avatar) из памяти, с диска или из Telegram; None при ошибке."""
+    if photo is None:
+        return None
+    file_unique_id = photo.file_unique_id
+    avatar = _memory.get(file_unique_id)
+    if avatar is not None:
+        _memory.move_to_end(file_unique_id)
+        _stats["memory_hits"] += 1
+        return avatar
+
+    pending = _inflight.get(file_unique_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    pending = asyncio.ensure_future(_fetch(photo, bot))
+    _inflight[file_unique_id] = pending
+    try:
+        avatar = await asyncio.shield(pending)
+    finally:
+        _inflight.pop(file_unique_id, None)
+    if avatar is not None:
+        _remember(file_unique_id, avatar)
+    return avatar
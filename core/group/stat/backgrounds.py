@@ -0,0 +1,222 @@
+"""
+Загрузка кастомных фонов карточки по ссылке пользователя.
+
+- Одна общая aiohttp-сессия с пулом соединений (BACKGROUND_HTTP_CONNECTIONS).
+- Скачивание потоком с ограничением размера (BACKGROUND_MAX_BYTES) и общего
+  времени (BACKGROUND_TIMEOUT); картинки больше BACKGROUND_MAX_PIXELS не
+  декодируются.
+- Изображение декодируется (для JPEG - сразу в уменьшенном масштабе через
+  draft) и приводится к размеру карточки один раз; результат хранится на диске
+  в BACKGROUND_CACHE_DIR под sha256 исходного файла, одинаковые картинки по
+  разным ссылкам делят один файл.
+- Таблица background_assets связывает URL с хэшем и хранит ETag/Last-Modified:
+  не чаще раза в BACKGROUND_REVALIDATE_SECONDS запрос повторяется условным GET,
+  ответ 304 только обновляет время проверки. Если источник недоступен,
+  используется уже сохранённая копия, следующая попытка - через тот же срок.
+- Ключ фона в LRU и в дайджесте карточки - хэш содержимого
+  (background_content_hash), а не URL: новая картинка по той же ссылке после
+  перепроверки получает новый ключ, и старые фон и карточка не используются.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+from PIL import Image
+
+from core.db.writer import writer_for
+from core.group.stat.render import CARD_SIZE, run_in_render_pool
+from database import DB_PATH, get_pool
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_MAX_BYTES = int(os.getenv("BACKGROUND_MAX_BYTES", 10 * 1024 * 1024))
+BACKGROUND_MAX_PIXELS = int(os.getenv("BACKGROUND_MAX_PIXELS", 40_000_000))
+BACKGROUND_TIMEOUT = float(os.getenv("BACKGROUND_TIMEOUT", 10))
+BACKGROUND_REVALIDATE_SECONDS = float(os.getenv("BACKGROUND_REVALIDATE_SECONDS", 24 * 3600))
+BACKGROUND_HTTP_CONNECTIONS = int(os.getenv("BACKGROUND_HTTP_CONNECTIONS", 8))
+BACKGROUND_CACHE_DIR = Path(os.getenv("BACKGROUND_CACHE_DIR", "data/backgrounds"))
+_CHUNK_SIZE = 64 * 1024
+
+_session: Optional[aiohttp.ClientSession] = None
+_stats = {"disk_hits": 0, "downloads": 0, "not_modified": 0, "stale_served": 0, "errors": 0, "bytes": 0}
+
+
+class BackgroundError(Exception):
+    """Фон по ссылке недоступен или не годится; текст показывается пользователю."""
+
+
+def get_background_fetch_stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=BACKGROUND_HTTP_CONNECTIONS, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=BACKGROUND_TIMEOUT),
+        )
+    return _session
+
+
+async def close_background_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def _asset_path(content_hash: str) -> Path:
+    return BACKGROUND_CACHE_DIR / f"{content_hash}.png"
+
+
+def _load_asset(content_hash: str) -> Optional[Image.Image]:
+    path = _asset_path(content_hash)
+    if not path.exists():
+        return None
+    try:
+        with Image.open(path) as image:
+            image.load()
+            return image.copy()
+    except Exception as e:
+        logger.warning(f"Broken cached background {path}, dropping: {e}")
+        path.unlink(missing_ok=True)
+        return None
+
+
+def _decode_and_store(data: bytes) -> Tuple[str, Image.Image]:
+    """Декодирует скачанный файл, приводит к размеру карточки и сохраняет под хэшем содержимого."""
+    content_hash = hashlib.sha256(data).hexdigest()
+    cached = _load_asset(content_hash)
+    if cached is not None:
+        return content_hash, cached
+    try:
+        image = Image.open(BytesIO(data))
+        width, height = image.size
+        if width * height > BACKGROUND_MAX_PIXELS:
+            raise BackgroundError(f"слишком большое изображение ({width}x{height})")
+        image.draft("RGB", CARD_SIZE)
+        image = image.convert("RGBA").resize(CARD_SIZE)
+    except BackgroundError:
+        raise
+    except Exception as e:
+        raise BackgroundError("файл не является изображением") from e
+
+    BACKGROUND_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = _asset_path(content_hash).with_suffix(".tmp")
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, _asset_path(content_hash))
+    return content_hash, image
+
+
+async def _download(url: str, etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> Optional[Tuple[bytes, Optional[str], Optional[str]]]:
+    """(содержимое, ETag, Last-Modified) или None, если сервер ответил 304."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        async with _get_session().get(url, headers=headers) as response:
+            if response.status == 304:
+                return None
+            if response.status != 200:
+                raise BackgroundError(f"сервер ответил {response.status}")
+            if response.content_type and not response.content_type.startswith("image/") \
+                    and response.content_type != "application/octet-stream":
+                raise BackgroundError(f"ссылка ведёт не на изображение ({response.content_type})")
+            if response.content_length and response.content_length > BACKGROUND_MAX_BYTES:
+                raise BackgroundError(f"файл больше {BACKGROUND_MAX_BYTES // (1024 * 1024)} МБ")
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                data += chunk
+                if len(data) > BACKGROUND_MAX_BYTES:
+                    raise BackgroundError(f"файл больше {BACKGROUND_MAX_BYTES // (1024 * 1024)} МБ")
+            _stats["bytes"] += len(data)
+            return bytes(data), response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except asyncio.TimeoutError as e:
+        raise BackgroundError(f"сервер не ответил за {BACKGROUND_TIMEOUT:g} с") from e
+    except aiohttp.ClientError as e:
+        raise BackgroundError("не удалось скачать файл") from e
+
+
+async def _get_asset_row(url: str) -> Optional[Tuple[str, Optional[str], Optional[str], float]]:
+    async with get_pool().acquire() as conn:
+        cursor = await conn.execute(
+            'SELECT content_hash, etag, last_modified, checked_at FROM background_assets WHERE url = ?', (url,)
+        )
+        return await cursor.fetchone()
+
+
+async def _save_asset_row(url: str, content_hash: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+    checked_at = time.time()
+    await writer_for(DB_PATH).submit(lambda conn: conn.execute(
+        '''INSERT INTO background_assets (url, content_hash, etag, last_modified, checked_at)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(url) DO UPDATE SET content_hash = excluded.content_hash, etag = excluded.etag,
+               last_modified = excluded.last_modified, checked_at = excluded.checked_at''',
+        (url, content_hash, etag, last_modified, checked_at)
+    ))
+
+
+async def _touch_asset_row(url: str) -> None:
+    checked_at = time.time()
+    await writer_for(DB_PATH).submit(lambda conn: conn.execute(
+        'UPDATE background_assets SET checked_at = ? WHERE url = ?', (checked_at, url)
+    ))
+
+
+async def fetch_background(url: str) -> Image.Image:
+    """
+    Фон по ссылке в размере карточки: из дискового кэша (с перепроверкой раз в
+    BACKGROUND_REVALIDATE_SECONDS) или свежей загрузкой. BackgroundError, если фона нет.
+    """
+    row = await _get_asset_row(url)
+    cached = await run_in_render_pool(_load_asset, row[0]) if row else None
+    if cached is not None and time.time() - row[3] < BACKGROUND_REVALIDATE_SECONDS:
+        _stats["disk_hits"] += 1
+        return cached
+
+    try:
+        result = await _download(url, *(row[1:3] if cached is not None else (None, None)))
+        if result is None:
+            _stats["not_modified"] += 1
+            await _touch_asset_row(url)
+            return cached
+        data, etag, last_modified = result
+        content_hash, image = await run_in_render_pool(_decode_and_store, data)
+    except BackgroundError as e:
+        if cached is not None:
+            _stats["stale_served"] += 1
+            logger.warning(f"Revalidation of background {url} failed ({e}), serving cached copy.")
+            # Не долбим недоступный источник на каждой отрисовке: следующая попытка - через срок перепроверки.
+            await _touch_asset_row(url)
+            return cached
+        _stats["errors"] += 1
+        raise
+
+    _stats["downloads"] += 1
+    await _save_asset_row(url, content_hash, etag, last_modified)
+    return image
+
+
+async def background_content_hash(url: str) -> Optional[str]:
+    """
+    Хэш содержимого фона по ссылке - ключ фона для LRU и дайджеста карточки. Когда подходит срок
+    перепроверки, сначала перепроверяет источник (fetch_background). None, если фона нет.
+    """
+    row = await _get_asset_row(url)
+    if row is None or time.time() - row[3] >= BACKGROUND_REVALIDATE_SECONDS:
+        try:
+            await fetch_background(url)
+        except BackgroundError:
+            return None
+        row = await _get_asset_row(url)
+    return row[0] if row else None
@@ -0,0 +1,83 @@
+"""
+Кэш готовых карточек профиля.
+
+Ключ - дайджест видимых на карточке полей (источник фона, file_unique_id
+аватарки, имя, уровень, опыт, HP, монеты, счётчики). Значение - PNG до
+первой отправки и file_id фотографии в Telegram после неё: повторная
+отправка той же карточки не требует ни отрисовки, ни загрузки файла, а PNG
+после получения file_id больше не хранится. Любое изменение поля даёт новый
+дайджест, старые записи вытесняются LRU по числу записей (CARD_CACHE_SIZE)
+и суммарному размеру хранимых PNG (CARD_CACHE_MAX_BYTES).
+"""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", 2048))
+CARD_CACHE_MAX_BYTES = int(os.getenv("CARD_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Поля профиля, которые видны на карточке (см. render._compose).
+CARD_FIELDS = ("display_name", "hp", "level", "exp", "lumcoins", "plumcoins",
+               "daily_messages", "total_messages", "flames")
+
+_cache: "OrderedDict[str, List[Any]]" = OrderedDict()  # digest -> [png | None, file_id | None]
+_stats = {"hits": 0, "file_id_hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def card_digest(background_key: str, avatar_id: Optional[str], data: Dict[str, Any]) -> str:
+    """Дайджест карточки; без аватарки на ней первая буква имени."""
+    avatar = avatar_id or f"initial:{(data.get('first_name') or 'U')[:1]}"
+    parts = [background_key, avatar] + [str(data.get(field)) for field in CARD_FIELDS]
+    return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).hexdigest()
+
+
+def get_card(digest: str) -> Optional[List[Any]]:
+    """[png, file_id] или None; попадание поднимает запись в LRU."""
+    entry = _cache.get(digest)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+    _cache.move_to_end(digest)
+    _stats["hits"] += 1
+    if entry[1] is not None:
+        _stats["file_id_hits"] += 1
+    return entry
+
+
+def _drop(entry: List[Any]) -> None:
+    if entry[0] is not None:
+        _stats["bytes"] -= len(entry[0])
+
+
+def put_card(digest: str, png: bytes) -> None:
+    old = _cache.pop(digest, None)
+    if old is not None:
+        _drop(old)
+    _cache[digest] = [png, old[1] if old else None]
+    _stats["bytes"] += len(png)
+    while _cache and (len(_cache) > CARD_CACHE_SIZE or _stats["bytes"] > CARD_CACHE_MAX_BYTES):
+        _drop(_cache.popitem(last=False)[1])
+        _stats["evictions"] += 1
+
+
+def set_file_id(digest: str, file_id: str) -> None:
+    """Запоминает file_id отправленной карточки; PNG больше не нужен."""
+    entry = _cache.get(digest)
+    if entry is not None:
+        _drop(entry)
+        entry[0], entry[1] = None, file_id
+
+
+def forget_card(digest: str) -> None:
+    """Удаляет запись, например если Telegram отверг сохранённый file_id."""
+    entry = _cache.pop(digest, None)
+    if entry is not None:
+        _drop(entry)
+
+
+def get_card_cache_stats() -> Dict[str, Any]:
+    return {**_stats, "cached": len(_cache)}
@@ -0,0 +1,182 @@
+"""
+Таблицы лидеров в памяти: глобальные и по чатам.
+
+Для каждой метрики (METRICS) держится отсортированный список ключей
+(-значение, user_id), поэтому топ-N, место пользователя и соседи по рейтингу
+находятся bisect за O(log n), а обновление значения - удаление и вставка в
+список без ORDER BY по всей user_profiles. Рейтинг чата содержит только
+участников, которых бот видел в этом чате (таблица chat_members).
+
+Значения обновляются из мест записи профиля (ProfileManager, update_duel_stats)
+после коммита; при старте всё строится заново из БД через load().
+Метрика "level" хранит накопленный опыт (progression.total_exp), что
+упорядочивает игроков по уровню, а внутри уровня - по опыту.
+"""
+import logging
+import sqlite3
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from core.group.stat.progression import total_exp
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("level", "lumcoins", "plumcoins", "flames", "strength")
+
+# (место, user_id, значение)
+RankEntry = Tuple[int, int, int]
+
+
+class _Ranking:
+    """Рейтинг по одной метрике: отсортированные (-значение, user_id) и текущее значение пользователя."""
+
+    def __init__(self) -> None:
+        self._keys: List[Tuple[int, int]] = []
+        self._values: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def bulk_load(self, values: Iterable[Tuple[int, int]]) -> None:
+        self._values = dict(values)
+        self._keys = sorted((-value, user_id) for user_id, value in self._values.items())
+
+    def update(self, user_id: int, value: int) -> None:
+        old = self._values.get(user_id)
+        if old == value:
+            return
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        insort(self._keys, (-value, user_id))
+        self._values[user_id] = value
+
+    def remove(self, user_id: int) -> None:
+        old = self._values.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        value = self._values.get(user_id)
+        if value is None:
+            return None
+        return bisect_left(self._keys, (-value, user_id)) + 1
+
+    def slice(self, start: int, stop: int) -> List[RankEntry]:
+        start = max(0, start)
+        return [(start + i + 1, user_id, -neg) for i, (neg, user_id) in enumerate(self._keys[start:stop])]
+
+
+class Leaderboard:
+    def __init__(self) -> None:
+        self._global: Dict[str, _Ranking] = {metric: _Ranking() for metric in METRICS}
+        self._chats: Dict[int, Dict[str, _Ranking]] = {}
+        self._user_chats: Dict[int, Set[int]] = {}
+        self._values: Dict[int, Dict[str, int]] = {}
+
+    def _rankings(self, metric: str, chat_id: Optional[int]) -> Optional[_Ranking]:
+        if metric not in self._global:
+            raise ValueError(f"Unknown leaderboard metric: {metric}")
+        if chat_id is None:
+            return self._global[metric]
+        chat = self._chats.get(chat_id)
+        return chat[metric] if chat else None
+
+    def update(self, user_id: int, **values: int) -> None:
+        """Обновляет значения метрик пользователя во всех его рейтингах. level передаётся как накопленный опыт."""
+        current = self._values.setdefault(user_id, {})
+        for metric, value in values.items():
+            if value is None:
+                continue
+            value = int(value)
+            current[metric] = value
+            self._global[metric].update(user_id, value)
+            for chat_id in self._user_chats.get(user_id, ()):
+                self._chats[chat_id][metric].update(user_id, value)
+
+    def update_profile(self, user_id: int, level: int, exp: int, **values: int) -> None:
+        """update() для строки user_profiles: уровень и опыт внутри уровня сводятся в накопленный опыт."""
+        self.update(user_id, level=total_exp(level, exp), **values)
+
+    def is_member(self, chat_id: int, user_id: int) -> bool:
+        return chat_id in self._user_chats.get(user_id, ())
+
+    def add_member(self, chat_id: int, user_id: int) -> bool:
+        """Добавляет пользователя в рейтинги чата. False, если он уже там."""
+        chats = self._user_chats.setdefault(user_id, set())
+        if chat_id in chats:
+            return False
+        chats.add(chat_id)
+        chat = self._chats.setdefault(chat_id, {metric: _Ranking() for metric in METRICS})
+        for metric, value in self._values.get(user_id, {}).items():
+            chat[metric].update(user_id, value)
+        return True
+
+    def remove_member(self, chat_id: int, user_id: int) -> None:
+        """Убирает пользователя из рейтингов чата (откат add_member при неудачной записи)."""
+        self._user_chats.get(user_id, set()).discard(chat_id)
+        for ranking in self._chats.get(chat_id, {}).values():
+            ranking.remove(user_id)
+
+    def top(self, metric: str, limit: int = 10, chat_id: Optional[int] = None) -> List[RankEntry]:
+        ranking = self._rankings(metric, chat_id)
+        return ranking.slice(0, limit) if ranking else []
+
+    def rank(self, metric: str, user_id: int, chat_id: Optional[int] = None) -> Optional[int]:
+        """Место пользователя (с 1) или None, если его нет в рейтинге."""
+        ranking = self._rankings(metric, chat_id)
+        return ranking.rank(user_id) if ranking else None
+
+    def around(self, metric: str, user_id: int, radius: int = 2, chat_id: Optional[int] = None) -> List[RankEntry]:
+        """Пользователь и до radius соседей выше и ниже него."""
+        ranking = self._rankings(metric, chat_id)
+        position = ranking.rank(user_id) if ranking else None
+        if position is None:
+            return []
+        return ranking.slice(position - 1 - radius, position + radius)
+
+    def size(self, metric: str, chat_id: Optional[int] = None) -> int:
+        ranking = self._rankings(metric, chat_id)
+        return len(ranking) if ranking else 0
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        """Перестраивает все рейтинги из БД (синхронно, при старте)."""
+        values: Dict[int, Dict[str, int]] = {}
+        for user_id, level, exp, lumcoins, plumcoins, flames in conn.execute(
+            'SELECT user_id, level, exp, lumcoins, plumcoins, flames FROM user_profiles'
+        ):
+            values[user_id] = {
+                "level": total_exp(level or 1, exp or 0),
+                "lumcoins": lumcoins or 0,
+                "plumcoins": plumcoins or 0,
+                "flames": flames or 0,
+            }
+        for user_id, strength in conn.execute('SELECT user_id, strength FROM duel_stats'):
+            values.setdefault(user_id, {})["strength"] = strength or 0
+
+        user_chats: Dict[int, Set[int]] = {}
+        for chat_id, user_id in conn.execute('SELECT chat_id, user_id FROM chat_members'):
+            user_chats.setdefault(user_id, set()).add(chat_id)
+
+        by_chat: Dict[int, Dict[str, List[Tuple[int, int]]]] = {}
+        for user_id, chats in user_chats.items():
+            for chat_id in chats:
+                chat = by_chat.setdefault(chat_id, {metric: [] for metric in METRICS})
+                for metric, value in values.get(user_id, {}).items():
+                    chat[metric].append((user_id, value))
+
+        self._values = values
+        self._user_chats = user_chats
+        for metric in METRICS:
+            self._global[metric].bulk_load(
+                (user_id, user_values[metric]) for user_id, user_values in values.items() if metric in user_values
+            )
+        self._chats = {}
+        for chat_id, chat_values in by_chat.items():
+            self._chats[chat_id] = {metric: _Ranking() for metric in METRICS}
+            for metric in METRICS:
+                self._chats[chat_id][metric].bulk_load(chat_values[metric])
+        logger.info("Leaderboard loaded: %d users, %d chats.", len(values), len(self._chats))
+
+
+# Общий экземпляр на процесс.
+leaderboard = Leaderboard()
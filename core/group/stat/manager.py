@@ -6,26 +6,34 @@ import os
 import sqlite3
 from pathlib import Path
 from io import BytesIO
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 from datetime import datetime, timedelta
 
-import aiosqlite
-import aiohttp
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 from aiogram import types, Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
 
 from core.group.stat.config import ProfileConfig
 from core.group.stat.shop_config import ShopConfig
-from database import get_user_rp_stats, add_item_to_inventory, get_user_inventory, set_user_active_background
+from core.group.stat.progression import apply_exp, level_from_total_exp
+from core.group.stat.leaderboard import leaderboard
+from core.group.stat.render import BackgroundSource, get_background, render_card
+from core.group.stat.backgrounds import background_content_hash, fetch_background
+from core.group.stat.avatars import get_avatar, get_avatar_photo
+from core.group.stat.card_cache import card_digest, forget_card, get_card, put_card, set_file_id
+from core.db.pool import configure_connection, open_connection
+from core.db.writer import writer_for
+from core.db.ledger import InsufficientFunds, transfer_tx
+from database import get_user_rp_stats, add_item_to_inventory, get_user_inventory, is_user_known, DB_PATH, adjust_balance, transfer, cache_balances, get_balance
 logger = logging.getLogger(__name__)
 
 
-
 class ProfileManager:
     def __init__(self):
         logger.info("ProfileManager instance initialized.")
         self._conn = None
-        self.font_cache = {}
+        self._writer = writer_for(DB_PATH)
 
     async def connect(self):
         logger.debug("Attempting to connect to profiles database asynchronously.")
@@ -33,14 +41,24 @@ class ProfileManager:
             logger.warning("Profiles database connection already exists, skipping reconnection.")
             return
         try:
-            self._conn = await aiosqlite.connect('profiles.db')
+            self._conn = await open_connection(DB_PATH)
+            await configure_connection(self._conn)
             logger.info("Profiles database connected asynchronously.")
-            await self._init_db_async()
-            logger.info("Asynchronous profiles database schema check/initialization completed.")
         except Exception as e:
-            logger.critical(f"Failed to connect or initialize profiles database: {e}", exc_info=True)
+            logger.critical(f"Failed to connect to profiles database: {e}", exc_info=True)
             raise
 
+    async def load_leaderboard(self) -> None:
+        """Строит рейтинги в памяти из БД. Вызывается один раз при старте после миграций."""
+        def _load() -> None:
+            conn = sqlite3.connect(DB_PATH)
+            try:
+                leaderboard.load(conn)
+            finally:
+                conn.close()
+
+        await asyncio.to_thread(_load)
+
     async def close(self):
         logger.debug("Attempting to close profiles database connection.")
         if self._conn:
@@ -48,68 +66,6 @@ class ProfileManager:
             self._conn = None
             logger.info("Profiles database connection closed.")
 
-    async def _init_db_async(self):
-        if self._conn is None: 
-            raise RuntimeError("DB not connected")
-        
-        await self._conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        await self._conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                profile_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE,
-                hp INTEGER DEFAULT 100 CHECK(hp >= 0 AND hp <= 150),
-                level INTEGER DEFAULT 1 CHECK(level >= 1 AND level <= 169),
-                exp INTEGER DEFAULT 0,
-                lumcoins INTEGER DEFAULT 0,
-                plumcoins INTEGER DEFAULT 0, -- <<< ДОБАВЛЕНО
-                daily_messages INTEGER DEFAULT 0,
-                total_messages INTEGER DEFAULT 0,
-                flames INTEGER DEFAULT 0,
-                last_work_time REAL DEFAULT 0,
-                active_background TEXT DEFAULT 'default',
-                last_activity_date TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        await self._conn.execute('CREATE INDEX IF NOT EXISTS idx_user_profiles_user_id ON user_profiles(user_id)')
-        
-        await self._conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_activity_log (
-                user_id INTEGER,
-                date TEXT,
-                exp_gained INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, date),
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-            )
-        ''')
-        
-        try:
-            await self._conn.execute('SELECT last_activity_date FROM user_profiles LIMIT 1')
-            logger.debug("Column last_activity_date already exists in user_profiles table.")
-        except Exception:
-            logger.debug("Adding last_activity_date column to user_profiles table.")
-            await self._conn.execute('ALTER TABLE user_profiles ADD COLUMN last_activity_date TEXT')
-        
-        # <<< ДОБАВЛЕНО: Миграция для plumcoins
-        try:
-            await self._conn.execute('SELECT plumcoins FROM user_profiles LIMIT 1')
-            logger.debug("Column plumcoins already exists in user_profiles table.")
-        except Exception:
-            logger.debug("Adding plumcoins column to user_profiles table.")
-            await self._conn.execute('ALTER TABLE user_profiles ADD COLUMN plumcoins INTEGER DEFAULT 0')
-        
-        await self._conn.commit()
-
     async def ensure_user_profile_exists(self, user: types.User) -> None:
         """Ensures a user profile exists in the database"""
         if self._conn is None:
@@ -167,121 +123,154 @@ class ProfileManager:
             logger.error(f"Error getting user profile for {user_id}: {e}")
             return None
 
-    async def record_message(self, user: types.User) -> None:
+    async def record_message(self, user: types.User, chat_id: Optional[int] = None) -> None:
         if self._conn is None: 
             raise RuntimeError("DB not connected")
-        
-        user_id = user.id
-        current_time = time.time()
-        current_date = datetime.now().date().isoformat()
+        # Запись идёт через общий писатель БД: сообщения от многих пользователей
+        # коалесцируются в одну транзакцию, а вызов возвращается после её коммита.
+        # Строку users для уже известного пользователя повторно не вставляем.
+        ensure_user = not is_user_known(user.id)
+        # Участника чата записываем один раз: рейтинг чата в памяти уже знает о нём.
+        new_member = chat_id is not None and leaderboard.add_member(chat_id, user.id)
+        try:
+            level, exp, flames, lumcoins, plumcoins = await self._writer.submit(
+                lambda conn: self._record_message_tx(
+                    conn, user.id, user.username, user.first_name, ensure_user,
+                    chat_id=chat_id, new_member=new_member
+                )
+            )
+        except Exception:
+            if new_member:
+                leaderboard.remove_member(chat_id, user.id)
+            raise
+        leaderboard.update_profile(user.id, level, exp, flames=flames, lumcoins=lumcoins, plumcoins=plumcoins)
+        cache_balances(user.id, lumcoins=lumcoins, plumcoins=plumcoins)
+
+    @staticmethod
+    def _record_message_tx(conn: sqlite3.Connection, user_id: int, username: Optional[str], first_name: Optional[str],
+                           ensure_user: bool = True, chat_id: Optional[int] = None,
+                           new_member: bool = False) -> Tuple[int, int, int, int, int]:
+        """Учитывает сообщение; возвращает (level, exp, flames, lumcoins, plumcoins) после записи для рейтингов."""
+        today = datetime.now().date()
+        current_date = today.isoformat()
 
         # Ensure user exists
-        await self._conn.execute(
-            'INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
-            (user_id, user.username, user.first_name)
+        if ensure_user:
+            conn.execute(
+                'INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+                (user_id, username, first_name)
+            )
+        if chat_id is not None and new_member:
+            conn.execute('INSERT OR IGNORE INTO chat_members (chat_id, user_id) VALUES (?, ?)', (chat_id, user_id))
+
+        # Счётчики, сброс дневного счётчика, огоньки и EXP за каждое EXP_PER_MESSAGES_COUNT-е
+        # сообщение - одним UPSERT без чтения в Python: параллельные сообщения не теряют инкременты.
+        # В DO UPDATE все выражения видят старые значения строки.
+        # last_group_chat_id - куда слать сводки заданий, если ЛС с ботом закрыты.
+        level, exp, total_messages, flames, lumcoins, plumcoins = conn.execute(
+            '''INSERT INTO user_profiles
+                (user_id, level, exp, lumcoins, plumcoins, daily_messages, total_messages, flames, last_work_time, active_background, last_activity_date,
+                 last_group_chat_id)
+            VALUES (:user_id, 1, 0, 0, 0, 1, 1, 1, 0, 'default', :today, :chat_id)
+            ON CONFLICT(user_id) DO UPDATE SET
+                daily_messages = CASE WHEN last_activity_date = :today THEN daily_messages + 1 ELSE 1 END,
+                flames = CASE
+                    WHEN last_activity_date = :today THEN flames
+                    WHEN last_activity_date = :yesterday THEN flames + 1
+                    ELSE 1
+                END,
+                total_messages = total_messages + 1,
+                exp = exp + CASE WHEN (total_messages + 1) % :every = 0 THEN :exp_gain ELSE 0 END,
+                last_activity_date = :today,
+                last_group_chat_id = COALESCE(:chat_id, last_group_chat_id)
+            RETURNING level, exp, total_messages, flames, lumcoins, plumcoins''',
+            {
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "today": current_date,
+                "yesterday": (today - timedelta(days=1)).isoformat(),
+                "every": ProfileConfig.EXP_PER_MESSAGES_COUNT,
+                "exp_gain": ProfileConfig.EXP_PER_MESSAGE_INTERVAL,
+            }
+        ).fetchone()
+
+        if total_messages == 1 or total_messages % ProfileConfig.EXP_PER_MESSAGES_COUNT != 0:
+            return level, exp, flames, lumcoins, plumcoins
+
+        # Логируем начисление EXP
+        conn.execute(
+            'INSERT OR REPLACE INTO user_activity_log (user_id, date, exp_gained) VALUES (?, ?, ?)',
+            (user_id, current_date, ProfileConfig.EXP_PER_MESSAGE_INTERVAL)
         )
-        await self._conn.commit()
 
-        # Get current profile data
-        cursor = await self._conn.execute(
-            'SELECT level, exp, lumcoins, plumcoins, daily_messages, total_messages, flames, last_activity_date FROM user_profiles WHERE user_id = ?', # <<< ИЗМЕНЕНО
-            (user_id,)
-        )
-        profile_data = await cursor.fetchone()
+        # Повышение уровня - редкая ветка; выполняется в той же транзакции писателя.
+        new_level, new_exp, lumcoins_gained = apply_exp(level, exp, 0)
+        if new_level != level:
+            conn.execute('UPDATE user_profiles SET level = ?, exp = ? WHERE user_id = ?', (new_level, new_exp, user_id))
+            if lumcoins_gained > 0:
+                lumcoins = transfer_tx(conn, "levels", user_id, lumcoins_gained, f"level_up:{new_level}")[user_id]
+        return new_level, new_exp, flames, lumcoins, plumcoins
 
-        if profile_data:    
-            level, exp, lumcoins, plumcoins, daily_messages, total_messages, flames, last_activity_date = profile_data # <<< ИЗМЕНЕНО
-            
-            # Reset daily messages and handle flames logic if it's a new day
-            if last_activity_date != current_date:
-                daily_messages = 0
-                
-                # Calculate yesterday's date
-                yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
-                
-                # If user was active yesterday, increase flames
-                if last_activity_date == yesterday:
-                    flames += 1
-                else:
-                    # If missed a day, reset flames to 1 (for today's activity)
-                    flames = 1
-            
-            # Add XP and increment message counters
-            total_messages += 1
-            daily_messages += 1
-            
-            # Начисляем EXP только за каждое 10-е сообщение
-            if total_messages % ProfileConfig.EXP_PER_MESSAGES_COUNT == 0:
-                exp_gained = ProfileConfig.EXP_PER_MESSAGE_INTERVAL
-                exp += exp_gained
-                
-                # Логика повышения уровня
-                new_level = level
-                while exp >= ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(new_level):
-                    exp -= ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(new_level)
-                    new_level += 1
-                    lumcoins += ProfileConfig.LUMCOINS_PER_LEVEL.get(new_level, 0)
-                
-                # Обновляем уровень и EXP
-                level = new_level
-                
-                # Логируем начисление EXP
-                await self._conn.execute(
-                    'INSERT OR REPLACE INTO user_activity_log (user_id, date, exp_gained) VALUES (?, ?, ?)',
-                    (user_id, current_date, exp_gained)
-                )
-            
-            # Обновляем профиль
-            await self._conn.execute(
-                '''UPDATE user_profiles 
-                SET level = ?, exp = ?, lumcoins = ?, plumcoins = ?, daily_messages = ?, total_messages = ?, flames = ?, last_activity_date = ?
-                WHERE user_id = ?''', # <<< ИЗМЕНЕНО
-                (level, exp, lumcoins, plumcoins, daily_messages, total_messages, flames, current_date, user_id) # <<< ИЗМЕНЕНО
-            )
-        else:
-            # Создаем новый профиль
-            await self._conn.execute(
-                '''INSERT INTO user_profiles 
-                (user_id, level, exp, lumcoins, plumcoins, daily_messages, total_messages, flames, last_work_time, active_background, last_activity_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', # <<< ИЗМЕНЕНО
-                (user_id, 1, 0, 0, 0, 1, 1, 1, 0, 'default', current_date)  # <<< ИЗМЕНЕНО (добавлен plumcoins=0)
-            )
-        
-        await self._conn.commit()
+    async def update_exp(self, user_id: int, amount: int) -> None:
+        """Начисляет опыт (награды квестов, админские выдачи) с повышением уровня по таблице прогрессии."""
+        if self._conn is None:
+            raise RuntimeError("DB not connected")
+
+        def _write(conn: sqlite3.Connection) -> Optional[Tuple[int, int, int]]:
+            row = conn.execute('SELECT level, exp FROM user_profiles WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+            new_level, new_exp, lumcoins_gained = apply_exp(row[0], row[1], amount)
+            conn.execute('UPDATE user_profiles SET level = ?, exp = ? WHERE user_id = ?', (new_level, new_exp, user_id))
+            lumcoins = None
+            if lumcoins_gained > 0:
+                lumcoins = transfer_tx(conn, "levels", user_id, lumcoins_gained, f"level_up:{new_level}")[user_id]
+            return new_level, new_exp, lumcoins
+
+        # Через писателя: не пересекается с начислением опыта в record_message.
+        result = await self._writer.submit(_write)
+        if result is not None:
+            level, exp, lumcoins = result
+            leaderboard.update_profile(user_id, level, exp, lumcoins=lumcoins)
+            cache_balances(user_id, lumcoins=lumcoins)
+        logger.info(f"User {user_id} EXP updated by {amount}.")
 
 
     # <<< ДОБАВЛЕНО: Методы для PLUMcoins
-    async def update_plumcoins(self, user_id: int, amount: int) -> None:
-        """Обновляет баланс PLUMcoins пользователя. (amount может быть отрицательным)"""
-        if self._conn is None: 
-            raise RuntimeError("DB not connected")
-        # Используем MAX(0, ...) для предотвращения отрицательного баланса
-        await self._conn.execute('UPDATE user_profiles SET plumcoins = MAX(0, plumcoins + ?) WHERE user_id = ?', (amount, user_id))
-        await self._conn.commit()
-        logger.info(f"User {user_id} PLUMcoins updated by {amount}.")
+    async def update_plumcoins(self, user_id: int, amount: int, account: str = "rewards", reason: str = "adjust") -> bool:
+        """Начисляет (amount > 0) или списывает PLUMcoins через журнал. False, если средств не хватает."""
+        changed = await adjust_balance(user_id, amount, account, reason, currency="plumcoins")
+        if changed:
+            logger.info(f"User {user_id} PLUMcoins updated by {amount} ({reason}).")
+        return changed
 
     async def get_plumcoins(self, user_id: int) -> int:
-        """Получает баланс PLUMcoins пользователя."""
-        if self._conn is None: 
-            raise RuntimeError("DB not connected")
-        cursor = await self._conn.execute('SELECT plumcoins FROM user_profiles WHERE user_id = ?', (user_id,))
-        result = await cursor.fetchone()
-        return result[0] if result else 0
+        """Баланс PLUMcoins пользователя (из кэша балансов, см. database.get_balance)."""
+        return await get_balance(user_id, "plumcoins")
     # --- Конец методов PLUMcoins ---
 
-    async def update_lumcoins(self, user_id: int, amount: int) -> None:
-        if self._conn is None: 
-            raise RuntimeError("DB not connected")
-        await self._conn.execute('UPDATE user_profiles SET lumcoins = MAX(0, lumcoins + ?) WHERE user_id = ?', (amount, user_id))
-        await self._conn.commit()
-        logger.info(f"User {user_id} Lumcoins updated by {amount}.")
+    async def update_lumcoins(self, user_id: int, amount: int, account: str = "rewards", reason: str = "adjust") -> bool:
+        """
+        Начисляет (amount > 0) со системного счёта account или списывает на него Lumcoins через журнал
+        (core/db/ledger.py). False, если средств не хватает; баланс тогда не меняется.
+        """
+        changed = await adjust_balance(user_id, amount, account, reason)
+        if changed:
+            logger.info(f"User {user_id} Lumcoins updated by {amount} ({reason}).")
+        return changed
+
+    async def transfer_lumcoins(self, from_user_id: int, to_user_id: int, amount: int, reason: str = "give") -> bool:
+        """Перевод между пользователями одной проводкой. False, если у отправителя не хватает средств."""
+        try:
+            await transfer(from_user_id, to_user_id, amount, reason)
+        except InsufficientFunds:
+            return False
+        logger.info(f"User {from_user_id} transferred {amount} Lumcoins to {to_user_id} ({reason}).")
+        return True
 
     async def get_lumcoins(self, user_id: int) -> int:
-        if self._conn is None: 
-            raise RuntimeError("DB not connected")
-        cursor = await self._conn.execute('SELECT lumcoins FROM user_profiles WHERE user_id = ?', (user_id,))
-        result = await cursor.fetchone()
-        return result[0] if result else 0
+        """Баланс Lumcoins пользователя (из кэша балансов, см. database.get_balance)."""
+        return await get_balance(user_id, "lumcoins")
 
     async def set_user_background(self, user_id: int, background_key: str) -> None:
         """Устанавливает активный фон для пользователя."""
@@ -303,11 +292,8 @@ class ProfileManager:
                 (background_key, user_id)
             )
             await self._conn.commit()
-            logger.info(f"User {user_id} active background set to '{background_key}' in profiles database.")
-            
-            # Также обновляем в основной базе данных
-            await set_user_active_background(user_id, background_key)
-            
+            logger.info(f"User {user_id} active background set to '{background_key}'.")
+
         except Exception as e:
             logger.error(f"Error setting background for user {user_id}: {e}")
 
@@ -324,41 +310,50 @@ class ProfileManager:
         await self._conn.execute('UPDATE user_profiles SET last_work_time = ? WHERE user_id = ?', (timestamp, user_id))
         await self._conn.commit()
 
-    async def get_top_users_by_level(self, limit: int = 10) -> List[Dict[str, Any]]:
-        if self._conn is None: 
-            raise RuntimeError("DB not connected")
-        cursor = await self._conn.execute('''
-            SELECT u.username, u.first_name, up.level, up.exp
-            FROM user_profiles up JOIN users u ON up.user_id = u.user_id
-            ORDER BY up.level DESC, up.exp DESC LIMIT ?
-        ''', (limit,))
-        rows = await cursor.fetchall()
-        columns = [d[0] for d in cursor.description]
-        
+    async def _leaderboard_rows(self, entries: List[Tuple[int, int, int]], metric: str) -> List[Dict[str, Any]]:
+        """Дополняет записи рейтинга (место, user_id, значение) именами из users одним запросом."""
+        if not entries:
+            return []
+        user_ids = [user_id for _, user_id, _ in entries]
+        cursor = await self._conn.execute(
+            f'SELECT user_id, username, first_name FROM users WHERE user_id IN ({",".join("?" * len(user_ids))})',
+            user_ids
+        )
+        names = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+
         results = []
-        for row in rows:
-            user_data = {columns[i]: row[i] for i in range(len(columns))}
-            user_data['display_name'] = user_data.get('username') or user_data.get('first_name')
+        for rank, user_id, value in entries:
+            username, first_name = names.get(user_id, (None, None))
+            user_data = {'rank': rank, 'user_id': user_id, 'username': username, 'first_name': first_name}
+            if metric == 'level':
+                user_data['level'], user_data['exp'] = level_from_total_exp(value)
+            else:
+                user_data[metric] = value
+            user_data['display_name'] = username or first_name
             results.append(user_data)
         return results
 
-    async def get_top_users_by_lumcoins(self, limit: int = 10) -> List[Dict[str, Any]]:
+    async def get_top_users(self, metric: str, limit: int = 10, chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Топ по метрике рейтинга (см. leaderboard.METRICS), глобальный или по чату."""
         if self._conn is None: 
             raise RuntimeError("DB not connected")
-        cursor = await self._conn.execute('''
-            SELECT u.username, u.first_name, up.lumcoins
-            FROM user_profiles up JOIN users u ON up.user_id = u.user_id
-            ORDER BY up.lumcoins DESC LIMIT ?
-        ''', (limit,))
-        rows = await cursor.fetchall()
-        columns = [d[0] for d in cursor.description]
-        
-        results = []
-        for row in rows:
-            user_data = {columns[i]: row[i] for i in range(len(columns))}
-            user_data['display_name'] = user_data.get('username') or user_data.get('first_name')
-            results.append(user_data)
-        return results
+        return await self._leaderboard_rows(leaderboard.top(metric, limit, chat_id), metric)
+
+    async def get_users_around(self, metric: str, user_id: int, radius: int = 2,
+                               chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Пользователь и его соседи по рейтингу."""
+        if self._conn is None: 
+            raise RuntimeError("DB not connected")
+        return await self._leaderboard_rows(leaderboard.around(metric, user_id, radius, chat_id), metric)
+
+    def get_user_rank(self, metric: str, user_id: int, chat_id: Optional[int] = None) -> Optional[int]:
+        return leaderboard.rank(metric, user_id, chat_id)
+
+    async def get_top_users_by_level(self, limit: int = 10, chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self.get_top_users('level', limit, chat_id)
+
+    async def get_top_users_by_lumcoins(self, limit: int = 10, chat_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self.get_top_users('lumcoins', limit, chat_id)
 
     def get_available_backgrounds(self) -> Dict[str, Any]:
         return ShopConfig.SHOP_BACKGROUNDS
@@ -367,226 +362,132 @@ class ProfileManager:
         return await get_user_inventory(user_id, 'background')
 
 
+    @staticmethod
+    def _first_existing(paths: List[Path]) -> Optional[Path]:
+        return next((path for path in paths if path.exists()), None)
+
+    async def _resolve_background(self, user_id: int, active_background_key: str) -> Tuple[str, Callable[[], Awaitable[Optional[BackgroundSource]]]]:
+        """
+        (ключ источника, загрузчик) фона карточки. Ключ определяет картинку однозначно
+        (для кастомного фона - хэш содержимого, см. background_content_hash) и служит ключом
+        LRU фонов и частью дайджеста карточки.
+        """
+        # 1. Сначала проверяем кастомные фоны
+        if active_background_key.startswith("custom:"):
+            cursor = await self._conn.execute('SELECT background_url FROM custom_backgrounds WHERE user_id = ?', (user_id,))
+            custom_bg = await cursor.fetchone()
+            if custom_bg:
+                custom_bg_url = custom_bg[0]
+
+                async def _download() -> Image.Image:
+                    return await fetch_background(custom_bg_url)
+
+                # Без скачанной копии ключ - URL: загрузка не удастся, и такая карточка не кэшируется.
+                content_hash = await background_content_hash(custom_bg_url)
+                return f"custom:{content_hash or custom_bg_url}", _download
+
+        # 2. Если не кастомный, проверяем фоны из магазина
+        if active_background_key != 'default':
+            background_info = ShopConfig.SHOP_BACKGROUNDS.get(active_background_key)
+            background_url = background_info.get('url') if background_info else None
+            # "custom" - просто маркер для покупки кастомного фона
+            if background_url and background_url != "custom":
+                path = self._first_existing([
+                    Path(background_url),
+                    Path(__file__).parent.parent.parent / background_url,
+                    Path(__file__).parent / background_url,
+                    Path("background") / background_url.split("/")[-1],
+                    Path("MRS_bot") / background_url
+                ])
+                if path is not None:
+                    async def _shop_file() -> Path:
+                        return path
+
+                    return f"shop:{active_background_key}", _shop_file
+
+        return "default", self._default_background
+
+    async def _default_background(self) -> BackgroundSource:
+        default_path = self._first_existing([
+            Path("MRS_bot/background/defolt.jpg"),
+            Path("background/defolt.jpg"),
+            Path(ProfileConfig.DEFAULT_LOCAL_BG_PATH),
+            Path(__file__).parent.parent.parent.parent / "background" / "defolt.jpg"
+        ])
+        if default_path is not None:
+            return default_path
+        logger.warning("Could not load any background, creating solid color background")
+        return Image.new("RGBA", (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT), (70, 130, 180, 255))
+
+    async def _load_background(self, source_key: str, load: Callable[[], Awaitable[Optional[BackgroundSource]]]) -> Tuple[Image.Image, bool]:
+        """(фон в размере карточки, загружен ли именно он); при недоступном источнике - дефолтный."""
+        try:
+            background = await get_background(source_key, load)
+            if background is not None:
+                return background, True
+        except Exception as e:
+            logger.error(f"Error loading background {source_key}: {e}")
+        return await get_background("default", self._default_background), source_key == "default"
+
+    async def _profile_card(self, user: types.User, profile_data: Dict[str, Any], bot: Bot,
+                            need_png: bool = False) -> Tuple[str, List[Any]]:
+        """
+        (дайджест, [png, file_id]) карточки из кэша карточек или свежей отрисовки.
+        Запись, у которой есть только file_id, отрисовывается заново, если нужен PNG.
+        """
+        active_background_key = profile_data.get('active_background', 'default')
+        logger.debug(f"Active background key: {active_background_key}")
+
+        (source_key, load), photo = await asyncio.gather(
+            self._resolve_background(user.id, active_background_key),
+            get_avatar_photo(user.id, bot),
+        )
+        card_data = dict(profile_data)
+        card_data['display_name'] = f"@{user.username}" if user.username else user.first_name
+        card_data['first_name'] = user.first_name
+        digest = card_digest(source_key, photo.file_unique_id if photo else None, card_data)
+
+        entry = get_card(digest)
+        if entry is None or (need_png and entry[0] is None):
+            (background_image, background_ok), avatar = await asyncio.gather(
+                self._load_background(source_key, load),
+                get_avatar(photo, bot),
+            )
+            png = (await render_card(background_image, avatar, card_data)).getvalue()
+            # Карточку с подменённым фоном или без скачанной аватарки не кэшируем: в следующий раз попробуем снова.
+            if background_ok and (avatar is not None or photo is None):
+                put_card(digest, png)
+            entry = [png, entry[1] if entry else None]
+        return digest, entry
+
+    async def send_profile_card(self, message: types.Message, profile_data: Dict[str, Any], bot: Bot,
+                                user: Optional[types.User] = None, **kwargs: Any) -> types.Message:
+        """
+        Отвечает на message карточкой профиля (kwargs - в answer_photo). Неизменившаяся карточка
+        отправляется по сохранённому file_id без отрисовки и загрузки.
+        """
+        user = user or message.from_user
+        digest, (png, file_id) = await self._profile_card(user, profile_data, bot)
+        if file_id is not None:
+            try:
+                return await message.answer_photo(file_id, **kwargs)
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached profile card file_id rejected, re-uploading: {e}")
+                forget_card(digest)
+                digest, (png, _) = await self._profile_card(user, profile_data, bot)
+        sent = await message.answer_photo(BufferedInputFile(png, filename="profile.png"), **kwargs)
+        if sent.photo:
+            set_file_id(digest, sent.photo[-1].file_id)
+        return sent
+
     async def generate_profile_image(self, user: types.User, profile_data: Dict[str, Any], bot: Bot) -> BytesIO:
         logger.debug(f"Starting profile image generation for user {user.id}.")
 
         try:
-            active_background_key = profile_data.get('active_background', 'default')
-            logger.debug(f"Active background key: {active_background_key}")
-
-            background_image = None
-
-            # 1. Сначала проверяем кастомные фоны
-            if active_background_key.startswith("custom:"):
-                user_id = user.id
-                async with aiosqlite.connect('profiles.db') as conn:
-                    cursor = await conn.execute('SELECT background_url FROM custom_backgrounds WHERE user_id = ?', (user_id,))
-                    custom_bg = await cursor.fetchone()
-                    
-                    if custom_bg:
-                        custom_bg_url = custom_bg[0]
-                        try:
-                            async with aiohttp.ClientSession() as session:
-                                async with session.get(custom_bg_url) as response:
-                                    if response.status == 200:
-                                        image_data = await response.read()
-                                        background_image = Image.open(BytesIO(image_data)).convert("RGBA")
-                                        logger.debug(f"Loaded custom background from URL: {custom_bg_url}")
-                        except Exception as e:
-                            logger.error(f"Error loading custom background: {e}")
-            
-            # 2. Если не кастомный, проверяем фоны из магазина
-            if background_image is None and active_background_key != 'default':
-                background_info = ShopConfig.SHOP_BACKGROUNDS.get(active_background_key)
-                logger.debug(f"Background info for {active_background_key}: {background_info}")
-                
-                if background_info and background_info.get('url'):
-                    background_url = background_info['url']
-                    try:
-                        # Если это специальный URL для кастомного фона в магазине
-                        if background_url == "custom":
-                            # Пропускаем - это просто маркер для покупки кастомного фона
-                            pass
-                        else:
-                            possible_paths = [
-                                Path(background_url),
-                                Path(__file__).parent.parent.parent / background_url,
-                                Path(__file__).parent / background_url,
-                                Path("background") / background_url.split("/")[-1],
-                                Path("MRS_bot") / background_url
-                            ]
-                            
-                            for path in possible_paths:
-                                if path.exists():
-                                    try:
-                                        background_image = Image.open(path).convert("RGBA")
-                                        logger.debug(f"Loaded shop background from local file: {path}")
-                                        break
-                                    except Exception as e:
-                                        logger.warning(f"Failed to load shop background from {path}: {e}")
-                                        continue
-                                
-                    except Exception as e:
-                        logger.error(f"Error loading shop background image: {e}")
-
-            # 3. Если фон все еще не загружен, используем дефолтный
-            if background_image is None:
-                # Пробуем несколько путей для дефолтного фона
-                default_paths = [
-                    Path("MRS_bot/background/defolt.jpg"),
-                    Path("background/defolt.jpg"),
-                    Path(ProfileConfig.DEFAULT_LOCAL_BG_PATH),
-                    Path(__file__).parent.parent.parent / "background" / "defolt.jpg"
-                ]
-                
-                for bg_path in default_paths:
-                    if bg_path.exists():
-                        try:
-                            background_image = Image.open(bg_path).convert("RGBA")
-                            logger.debug(f"Loaded default background from: {bg_path}")
-                            break
-                        except Exception as e:
-                            logger.warning(f"Failed to load default background from {bg_path}: {e}")
-                            continue
-                
-                # Если дефолтный фон тоже не загрузился, создаем простой
-                if background_image is None:
-                    logger.warning("Could not load any background, creating solid color background")
-                    background_image = Image.new("RGBA", (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT), (70, 130, 180, 255))
-
-            # Гарантируем, что background_image имеет правильный размер
-            background_image = background_image.resize((ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT))
-            
-            # Остальная часть метода без изменений...
-            card = Image.new("RGBA", (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT), (0, 0, 0, 0))
-            mask = Image.new("L", (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT), 0)
-            draw_mask = ImageDraw.Draw(mask)
-            draw_mask.rounded_rectangle([(0, 0), (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT)], radius=ProfileConfig.CARD_RADIUS, fill=255)
-            card.paste(background_image, (0, 0), mask)
-            draw = ImageDraw.Draw(card)
-
-            def get_font(size, font_path=ProfileConfig.FONT_PATH):
-                if (font_path, size) not in self.font_cache:
-                    try:
-                        font = ImageFont.truetype(font_path, size)
-                    except IOError:
-                        font = ImageFont.load_default()
-                    self.font_cache[(font_path, size)] = font
-                return self.font_cache[(font_path, size)]
-
-            font_username = get_font(30)
-            font_stats_label = get_font(20)
-            font_stats_value = get_font(22)
-            font_level_exp = get_font(18)
-            font_hp_lum = get_font(22) # Шрифт для HP, LUM, PLUM
-
-            avatar_image = None
-            
-            try:
-                user_profile_photos = await asyncio.wait_for(
-                    bot.get_user_profile_photos(user.id, limit=1),
-                    timeout=3
-                )
-                if user_profile_photos.total_count > 0:
-                    photo = user_profile_photos.photos[0][-1]
-                    file = await asyncio.wait_for(bot.get_file(photo.file_id), timeout=3)
-                    avatar_bytes = await asyncio.wait_for(bot.download_file(file.file_path), timeout=3)
-                    avatar_image = Image.open(BytesIO(avatar_bytes.getvalue())).convert("RGBA")
-                else:
-                    raise Exception("No profile photo")
-            except Exception:
-                default_avatar_path = Path(__file__).parent.parent.parent / "background" / "default_avatar.png"
-                if default_avatar_path.exists():
-                    avatar_image = Image.open(default_avatar_path).convert("RGBA")
-                else:
-                    avatar_image = Image.new("RGBA", (ProfileConfig.AVATAR_SIZE, ProfileConfig.AVATAR_SIZE), (200, 200, 200, 255))
-                    draw_avatar = ImageDraw.Draw(avatar_image)
-                    try:
-                        font = ImageFont.truetype(ProfileConfig.FONT_PATH, 40)
-                    except:
-                        font = ImageFont.load_default()
-                    initial = user.first_name[0].upper() if user.first_name else "U"
-                    draw_avatar.text((ProfileConfig.AVATAR_SIZE//2, ProfileConfig.AVATAR_SIZE//2), initial, fill=(0, 0, 0, 255), font=font, anchor="mm")
-
-            avatar_image = avatar_image.resize((ProfileConfig.AVATAR_SIZE, ProfileConfig.AVATAR_SIZE))
-            avatar_mask = Image.new("L", (ProfileConfig.AVATAR_SIZE, ProfileConfig.AVATAR_SIZE), 0)
-            draw_avatar_mask = ImageDraw.Draw(avatar_mask)
-            draw_avatar_mask.ellipse([(0, 0), (ProfileConfig.AVATAR_SIZE, ProfileConfig.AVATAR_SIZE)], fill=255)
-            card.paste(avatar_image, ProfileConfig.AVATAR_OFFSET, avatar_mask)
-
-            username_text = f"@{user.username}" if user.username else user.first_name
-            draw.text((ProfileConfig.TEXT_BLOCK_LEFT_X, ProfileConfig.USERNAME_Y), username_text, fill=ProfileConfig.TEXT_COLOR, font=font_username, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-
-            hp_current = profile_data.get('hp', 100)
-            hp_max = ProfileConfig.MAX_HP
-            lumcoins = profile_data.get('lumcoins', 0)
-            plumcoins = profile_data.get('plumcoins', 0) # <<< ДОБАВЛЕНО
-
-            hp_text = f"HP: {hp_current}/{hp_max}"
-            hp_x = ProfileConfig.AVATAR_X + ProfileConfig.AVATAR_SIZE + ProfileConfig.MARGIN // 2
-            hp_y = ProfileConfig.USERNAME_Y + 40
-            draw.text((hp_x, hp_y), hp_text, fill=ProfileConfig.TEXT_COLOR, font=font_hp_lum, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-
-            lumcoins_text = f"LUM: {lumcoins}"
-            lumcoins_y = hp_y + 30
-            draw.text((hp_x, lumcoins_y), lumcoins_text, fill=ProfileConfig.TEXT_COLOR, font=font_hp_lum, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-            
-            # <<< ДОБАВЛЕНО: Отрисовка PLUMcoins
-            plumcoins_text = f"PLUM: {plumcoins}"
-            plumcoins_y = lumcoins_y + 30
-            draw.text((hp_x, plumcoins_y), plumcoins_text, fill=ProfileConfig.TEXT_COLOR, font=font_hp_lum, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-
-
-            level = profile_data.get('level', 1)
-            exp = profile_data.get('exp', 0)
-            exp_needed_for_next_level = 100 # Заглушка, используйте вашу формулу
-            exp_percentage = exp / exp_needed_for_next_level if exp_needed_for_next_level > 0 else 0
-
-            exp_bar_x = ProfileConfig.MARGIN
-            exp_bar_y = ProfileConfig.CARD_HEIGHT - ProfileConfig.MARGIN - ProfileConfig.EXP_BAR_HEIGHT
-            exp_bar_width = ProfileConfig.CARD_WIDTH - (ProfileConfig.MARGIN * 2) - 80
-            exp_bar_height = ProfileConfig.EXP_BAR_HEIGHT
-
-            draw.rounded_rectangle([(exp_bar_x, exp_bar_y), (exp_bar_x + exp_bar_width, exp_bar_y + exp_bar_height)], radius=exp_bar_height // 2, fill=(100, 100, 100, ProfileConfig.EXP_BAR_ALPHA))
-
-            for i in range(int(exp_bar_width * exp_percentage)):
-                r = int(ProfileConfig.EXP_GRADIENT_START[0] + (ProfileConfig.EXP_GRADIENT_END[0] - ProfileConfig.EXP_GRADIENT_START[0]) * (i / (exp_bar_width * exp_percentage + 1e-6)))
-                g = int(ProfileConfig.EXP_GRADIENT_START[1] + (ProfileConfig.EXP_GRADIENT_END[1] - ProfileConfig.EXP_GRADIENT_START[1]) * (i / (exp_bar_width * exp_percentage + 1e-6)))
-                b = int(ProfileConfig.EXP_GRADIENT_START[2] + (ProfileConfig.EXP_GRADIENT_END[2] - ProfileConfig.EXP_GRADIENT_START[2]) * (i / (exp_bar_width * exp_percentage + 1e-6)))
-                draw.line([(exp_bar_x + i, exp_bar_y), (exp_bar_x + i, exp_bar_y + exp_bar_height)], fill=(r, g, b, ProfileConfig.EXP_BAR_ALPHA))
-
-            exp_text = f"Уровень: {level} | EXP: {exp}/{exp_needed_for_next_level}"
-            bbox = draw.textbbox((0, 0), exp_text, font=font_level_exp)
-            text_width = bbox[2] - bbox[0]
-            exp_text_x = exp_bar_x + (exp_bar_width - text_width) // 2
-            exp_text_y = exp_bar_y + (exp_bar_height - (bbox[3] - bbox[1])) // 2
-            draw.text((exp_text_x, exp_text_y), exp_text, fill=ProfileConfig.TEXT_COLOR, font=font_level_exp, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-
-            stats = [
-                ("Сообщения (день):", profile_data.get('daily_messages', 0)),
-                ("Сообщения (всего):", profile_data.get('total_messages', 0)),
-                ("Пламя:", profile_data.get('flames', 0)),
-            ]
-
-            current_y = ProfileConfig.RIGHT_COLUMN_TOP_Y
-            for label, value in stats:
-                bbox = draw.textbbox((0, 0), label, font=font_stats_label)
-                label_text_width = bbox[2] - bbox[0]
-                draw.text((ProfileConfig.RIGHT_COLUMN_X - label_text_width, current_y), label, fill=ProfileConfig.TEXT_COLOR, font=font_stats_label, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-                
-                value_text = str(value)
-                bbox = draw.textbbox((0, 0), value_text, font=font_stats_value)
-                value_text_width = bbox[2] - bbox[0]
-                draw.text((ProfileConfig.RIGHT_COLUMN_X - value_text_width, current_y + 25), value_text, fill=ProfileConfig.TEXT_COLOR, font=font_stats_value, stroke_width=1, stroke_fill=ProfileConfig.TEXT_SHADOW_COLOR)
-                
-                current_y += ProfileConfig.ITEM_SPACING_Y
-
-            img_byte_arr = BytesIO()
-            card.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
+            _, (png, _) = await self._profile_card(user, profile_data, bot, need_png=True)
             logger.debug(f"Profile image generated for user {user.id}.")
-            return img_byte_arr
-            
+            return BytesIO(png)
+
         except Exception as e:
             logger.error(f"Error generating profile image for user {user.id}: {e}", exc_info=True)
             card = Image.new("RGBA", (ProfileConfig.CARD_WIDTH, ProfileConfig.CARD_HEIGHT), (50, 50, 50, 255))
@@ -600,26 +501,3 @@ class ProfileManager:
             card.save(img_byte_arr, format='PNG')
             img_byte_arr.seek(0)
             return img_byte_arr
-
-
-    async def sync_profiles_with_main_db(self):
-            """Синхронизирует активные фоны профилей с основной базой данных"""
-            if self._conn is None:
-                return
-                
-            try:
-                cursor = await self._conn.execute('SELECT user_id, active_background FROM user_profiles')
-                profiles = await cursor.fetchall()
-                
-                for user_id, active_background in profiles:
-                    await set_user_active_background(user_id, active_background)
-                    
-                logger.info(f"Synced {len(profiles)} profiles with main database")
-            except Exception as e:
-                logger.error(f"Error syncing profiles with main database: {e}")
-                
-    # Этот метод здесь избыточен, т.к. он уже импортирован из database
-    # async def set_user_active_background(user_id: int, background_key: str) -> None:
-    #     """Устанавливает активный фон для пользователя в основной базе данных."""
-    #     from database import set_user_active_background as set_bg_main_db
-    #     await set_bg_main_db(user_id, background_key)
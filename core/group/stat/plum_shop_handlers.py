@@ -80,7 +80,9 @@ async def plum_shop_buy_callback(call: CallbackQuery, profile_manager: ProfileMa
             return
             
         # 1. Снимаем PLUMcoins
-        await profile_manager.update_plumcoins(user_id, -price) 
+        if not await profile_manager.update_plumcoins(user_id, -price, "shop", f"plum_shop:{item_key}"):
+            await call.answer("❌ Недостаточно PLUMcoins!", show_alert=True)
+            return
         
         # 2. Добавляем предмет в инвентарь (item_type=rpg_item)
         # Убедитесь, что `add_item_to_inventory` импортирована из `database.py` или `core/group/RPG/inventory.py`
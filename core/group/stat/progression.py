@@ -0,0 +1,66 @@
+"""
+Таблица прогрессии уровней, построенная один раз при импорте.
+
+В user_profiles хранится уровень и EXP внутри уровня. Для перехода через
+уровни используется накопленный EXP: CUMULATIVE_EXP[i] - сколько всего опыта
+нужно, чтобы с 1-го уровня дойти до уровня i + 1. Уровень по накопленному
+опыту ищется bisect за O(log n), награды в люмкоинах за диапазон уровней
+берутся из префиксных сумм. Выше ProfileConfig.MAX_LEVEL уровень не растёт,
+опыт продолжает копиться внутри последнего уровня.
+"""
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, Tuple
+
+from core.group.stat.config import ProfileConfig
+
+MAX_LEVEL = ProfileConfig.MAX_LEVEL
+
+# LEVEL_REQUIREMENTS[i] - опыт для перехода с уровня i + 1 на i + 2.
+LEVEL_REQUIREMENTS: List[int] = [ProfileConfig.LEVEL_UP_EXP_REQUIREMENT(level) for level in range(1, MAX_LEVEL)]
+CUMULATIVE_EXP: List[int] = [0] + list(accumulate(LEVEL_REQUIREMENTS))
+# CUMULATIVE_LUMCOINS[i] - люмкоины за все повышения до уровня i + 1 включительно.
+CUMULATIVE_LUMCOINS: List[int] = [0] + list(accumulate(
+    ProfileConfig.LUMCOINS_PER_LEVEL.get(level, 0) for level in range(2, MAX_LEVEL + 1)
+))
+
+
+def _clamp(level: int) -> int:
+    return max(1, min(int(level), MAX_LEVEL))
+
+
+def total_exp(level: int, exp: int) -> int:
+    """Накопленный опыт по уровню и опыту внутри уровня."""
+    return CUMULATIVE_EXP[_clamp(level) - 1] + max(0, int(exp))
+
+
+def level_from_total_exp(total: int) -> Tuple[int, int]:
+    """(уровень, опыт внутри уровня) по накопленному опыту."""
+    level = bisect_right(CUMULATIVE_EXP, max(0, int(total)))
+    return level, int(total) - CUMULATIVE_EXP[level - 1]
+
+
+def lumcoins_between(from_level: int, to_level: int) -> int:
+    """Люмкоины за повышения с from_level до to_level (уровни from_level + 1 .. to_level)."""
+    if to_level <= from_level:
+        return 0
+    return CUMULATIVE_LUMCOINS[_clamp(to_level) - 1] - CUMULATIVE_LUMCOINS[_clamp(from_level) - 1]
+
+
+def apply_exp(level: int, exp: int, gained: int) -> Tuple[int, int, int]:
+    """Начисляет gained опыта: (новый уровень, опыт внутри уровня, люмкоины за повышения)."""
+    new_exp = exp + gained
+    # Обычный случай - уровень не меняется: одно сравнение без bisect.
+    if 1 <= level < MAX_LEVEL and 0 <= new_exp < LEVEL_REQUIREMENTS[level - 1]:
+        return level, new_exp, 0
+    new_level, new_exp = level_from_total_exp(total_exp(level, exp) + gained)
+    return new_level, new_exp, lumcoins_between(_clamp(level), new_level)
+
+
+def level_progress(level: int, exp: int) -> Tuple[int, int, float]:
+    """(опыт внутри уровня, нужно до следующего, доля 0..1) для полосы опыта; на MAX_LEVEL нужно 0 и доля 1."""
+    level = _clamp(level)
+    if level >= MAX_LEVEL:
+        return exp, 0, 1.0
+    needed = LEVEL_REQUIREMENTS[level - 1]
+    return exp, needed, min(1.0, max(0, exp) / needed)
@@ -0,0 +1,294 @@
+"""
+Движок прогресса заданий.
+
+Хуки quests_handlers превращают игровые действия в события (user_id, тип
+задания, amount), а движок применяет их к индексу активных невыполненных
+заданий в памяти: user_id -> тип задания -> задания. Индекс пользователя
+загружается одним запросом по индексу при первом событии, после этого
+событие - несколько операций со словарями без обращения к БД. Индекс
+ограничен QUEST_INDEX_SIZE пользователями (LRU); пользователи с незаписанным
+прогрессом не вытесняются, а повторная загрузка (после forget()) продолжает
+ещё не записанные задания, а не строки из БД.
+
+Изменённый прогресс копится в памяти и записывается пакетом одним намерением
+писателя: раз в QUEST_FLUSH_SECONDS (run_flusher) или сразу, когда изменённых
+заданий набирается QUEST_FLUSH_BATCH. Прогресс в БД только растёт (MAX), а
+завершение засчитывается один раз (условие completed = FALSE), так что
+повторная запись безопасна. После коммита notify получает по одному
+обновлению на задание с итоговым прогрессом пакета (в боте это буфер сводок
+core/group/stat/quest_notifier.py).
+
+Кто читает задания из БД (экран заданий, получение награды, смена заданий),
+сначала вызывает flush(); после смены заданий пользователя - forget(user_id).
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+
+from core.db.quest_totals import record_completion_tx
+from core.db.writer import writer_for
+from core.group.stat.quests_config import QuestsConfig
+from database import DB_PATH, get_pool
+
+logger = logging.getLogger(__name__)
+
+QUEST_INDEX_SIZE = int(os.getenv("QUEST_INDEX_SIZE", 10000))
+QUEST_FLUSH_SECONDS = float(os.getenv("QUEST_FLUSH_SECONDS", 2))
+QUEST_FLUSH_BATCH = int(os.getenv("QUEST_FLUSH_BATCH", 500))
+
+# notify(bot, user_id, quest (QuestsConfig.quest_view), progress, completed)
+Notifier = Callable[[Bot, int, Dict[str, Any], int, bool], Awaitable[None]]
+
+
+class _ActiveQuest:
+    """Невыполненное задание пользователя в индексе."""
+
+    __slots__ = ("user_id", "user_quest_id", "quest_type", "original_id", "required", "progress", "completed",
+                 "expires", "bot")
+
+    def __init__(self, user_id: int, user_quest_id: str, quest_type: str, original_id: str, required: int,
+                 progress: int, expires: float) -> None:
+        self.user_id = user_id
+        self.user_quest_id = user_quest_id
+        self.quest_type = quest_type
+        self.original_id = original_id
+        self.required = required
+        self.progress = progress
+        self.completed = False
+        self.expires = expires
+        self.bot: Optional[Bot] = None
+
+
+def _expires_ts(expires_at: Any) -> float:
+    if not expires_at:
+        return float("inf")
+    try:
+        return datetime.fromisoformat(str(expires_at)).timestamp()
+    except ValueError:
+        return float("inf")
+
+
+def _flush_tx(conn: sqlite3.Connection, batch: List[Tuple[_ActiveQuest, int, bool]]) -> Set[str]:
+    """Записывает прогресс пакета; возвращает user_quest_id, завершённые именно этой записью."""
+    conn.executemany(
+        'UPDATE user_quests SET progress = MAX(progress, ?) WHERE user_quest_id = ? AND completed = FALSE',
+        [(progress, quest.user_quest_id) for quest, progress, completed in batch if not completed]
+    )
+    newly_completed = set()
+    now = datetime.now().isoformat()
+    for quest, progress, completed in batch:
+        if not completed:
+            continue
+        cursor = conn.execute(
+            'UPDATE user_quests SET progress = ?, completed = TRUE WHERE user_quest_id = ? AND completed = FALSE',
+            (progress, quest.user_quest_id)
+        )
+        if cursor.rowcount:
+            record_completion_tx(conn, quest.user_id, quest.quest_type, quest.original_id, now)
+            newly_completed.add(quest.user_quest_id)
+    return newly_completed
+
+
+class QuestEngine:
+    def __init__(self, notify: Optional[Notifier] = None, index_size: int = QUEST_INDEX_SIZE,
+                 flush_batch: int = QUEST_FLUSH_BATCH) -> None:
+        self._notify = notify
+        self._index_size = index_size
+        self._flush_batch = flush_batch
+        self._index: "OrderedDict[int, Dict[str, List[_ActiveQuest]]]" = OrderedDict()
+        self._loading: Dict[int, "asyncio.Future[Dict[str, List[_ActiveQuest]]]"] = {}
+        self._generation = 0
+        self._dirty: Dict[str, _ActiveQuest] = {}
+        # Пакеты, которые сейчас пишутся: их прогресс ещё не виден в БД.
+        self._in_flight: List[Dict[str, _ActiveQuest]] = []
+        # Число завершённых записей пакетов: _load по нему замечает запись, закончившуюся во время чтения.
+        self._flushes_done = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._stats = {"events": 0, "advanced": 0, "loads": 0, "reloads": 0, "flushes": 0, "rows_flushed": 0,
+                       "completions": 0, "notifications": 0}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "users": len(self._index), "pending": len(self._dirty)}
+
+    async def _load(self, user_id: int) -> Dict[str, List[_ActiveQuest]]:
+        self._stats["loads"] += 1
+        async with get_pool().acquire() as conn:
+            while True:
+                # Пакет, записанный после снимка чтения, уже ушёл из _in_flight, а строки ещё старые:
+                # если за время чтения запись завершилась, читаем заново.
+                flushes_done = self._flushes_done
+                cursor = await conn.execute(
+                    'SELECT user_quest_id, quest_type, original_quest_id, quest_kind, required_count, progress, '
+                    'expires_at FROM user_quests WHERE user_id = ? AND completed = FALSE',
+                    (user_id,)
+                )
+                rows = await cursor.fetchall()
+                if flushes_done == self._flushes_done:
+                    break
+                self._stats["reloads"] += 1
+        now = time.time()
+        quests: Dict[str, List[_ActiveQuest]] = {}
+        for user_quest_id, quest_type, original_id, quest_kind, required, progress, expires_at in rows:
+            expires = _expires_ts(expires_at)
+            if expires <= now:
+                continue
+            # Незаписанный прогресс новее строки в БД: продолжаем тот же объект, а не теряем его.
+            quest = self._unflushed(user_quest_id)
+            if quest is None:
+                quest = _ActiveQuest(user_id, user_quest_id, quest_type, original_id, required, progress, expires)
+            elif quest.completed:
+                continue
+            else:
+                quest.progress = max(quest.progress, progress)
+            quests.setdefault(quest_kind, []).append(quest)
+        return quests
+
+    def _unflushed(self, user_quest_id: str) -> Optional[_ActiveQuest]:
+        quest = self._dirty.get(user_quest_id)
+        if quest is None:
+            for batch in self._in_flight:
+                quest = batch.get(user_quest_id)
+                if quest is not None:
+                    break
+        return quest
+
+    def _evict(self) -> None:
+        """Вытесняет давно не активных пользователей сверх QUEST_INDEX_SIZE; с незаписанным прогрессом - нет."""
+        excess = len(self._index) - self._index_size
+        if excess <= 0:
+            return
+        busy = {quest.user_id for quest in self._dirty.values()}
+        victims = []
+        for user_id in self._index:
+            if len(victims) == excess:
+                break
+            if user_id not in busy:
+                victims.append(user_id)
+        for user_id in victims:
+            del self._index[user_id]
+
+    async def _user_quests(self, user_id: int) -> Dict[str, List[_ActiveQuest]]:
+        quests = self._index.get(user_id)
+        if quests is not None:
+            self._index.move_to_end(user_id)
+            return quests
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        generation = self._generation
+        pending = asyncio.ensure_future(self._load(user_id))
+        self._loading[user_id] = pending
+        try:
+            quests = await asyncio.shield(pending)
+        finally:
+            self._loading.pop(user_id, None)
+        # Задания могли смениться, пока шла загрузка: такой индекс не сохраняем.
+        if generation == self._generation:
+            self._index[user_id] = quests
+            self._evict()
+        return quests
+
+    async def emit(self, user_id: int, quest_kind: str, amount: int = 1, bot: Optional[Bot] = None) -> int:
+        """Событие для заданий типа quest_kind (поле "type" шаблона). Возвращает число продвинутых заданий."""
+        self._stats["events"] += 1
+        if amount <= 0:
+            return 0
+        quests = self._index.get(user_id)
+        if quests is None:
+            quests = await self._user_quests(user_id)
+        else:
+            self._index.move_to_end(user_id)
+        active = quests.get(quest_kind)
+        if not active:
+            return 0
+
+        now = time.time()
+        advanced = 0
+        for quest in list(active):
+            if quest.expires <= now:
+                active.remove(quest)
+                continue
+            quest.progress = min(quest.progress + amount, quest.required)
+            if bot is not None:
+                quest.bot = bot
+            if quest.progress >= quest.required:
+                quest.completed = True
+                active.remove(quest)
+            self._dirty[quest.user_quest_id] = quest
+            advanced += 1
+        self._stats["advanced"] += advanced
+        if len(self._dirty) >= self._flush_batch:
+            self._spawn(self.flush())
+        return advanced
+
+    def _spawn(self, coro: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def forget(self, user_id: Optional[int] = None) -> None:
+        """Сбрасывает индекс пользователя (или весь), например после смены его заданий."""
+        self._generation += 1
+        if user_id is None:
+            self._index.clear()
+        else:
+            self._index.pop(user_id, None)
+
+    async def flush(self) -> int:
+        """Записывает накопленный прогресс одним намерением писателя. Возвращает число заданий."""
+        if not self._dirty:
+            return 0
+        batch = [(quest, quest.progress, quest.completed) for quest in self._dirty.values()]
+        in_flight = self._dirty
+        self._dirty = {}
+        self._in_flight.append(in_flight)
+        try:
+            newly_completed = await writer_for(DB_PATH).submit(lambda conn: _flush_tx(conn, batch))
+        except Exception:
+            # Не теряем прогресс: вернём задания в очередь, не перетирая более свежие изменения.
+            for quest, _, _ in batch:
+                self._dirty.setdefault(quest.user_quest_id, quest)
+            raise
+        finally:
+            self._in_flight.remove(in_flight)
+            self._flushes_done += 1
+        self._stats["flushes"] += 1
+        self._stats["rows_flushed"] += len(batch)
+        self._stats["completions"] += len(newly_completed)
+        if self._notify is not None:
+            notices = [(quest, progress, completed) for quest, progress, completed in batch
+                       if quest.bot is not None and (not completed or quest.user_quest_id in newly_completed)]
+            if notices:
+                self._spawn(self._send_notices(notices))
+        return len(batch)
+
+    async def _send_notices(self, notices: List[Tuple[_ActiveQuest, int, bool]]) -> None:
+        for quest, progress, completed in notices:
+            try:
+                await self._notify(quest.bot, quest.user_id, QuestsConfig.quest_view(quest.original_id, quest.required),
+                                   progress, completed)
+                self._stats["notifications"] += 1
+            except Exception as e:
+                logger.warning(f"Quest notification for user {quest.user_id} failed: {e}")
+
+    async def run_flusher(self, interval: float = QUEST_FLUSH_SECONDS) -> None:
+        """Фоновая задача: периодически записывает прогресс заданий. Запускается из main()."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush quest progress: {e}")
+
+    async def close(self) -> None:
+        """Последний сброс прогресса и ожидание отправки уведомлений (при остановке бота)."""
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
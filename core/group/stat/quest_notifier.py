@@ -0,0 +1,155 @@
+"""
+Сводки уведомлений о заданиях.
+
+Движок заданий и прямые обновления прогресса раньше отправляли сообщение на
+каждое изменение, и у активных пользователей это превращалось в поток ЛС (с
+чтением БД на каждую неудачную отправку). Теперь notify() только запоминает
+последнее состояние задания в буфере пользователя: промежуточный прогресс
+перезаписывается, выполнение не теряется. Буфер отправляется одной сводкой
+не раньше чем через QUEST_NOTIFY_DELAY секунд после первого изменения (чтобы
+собрать всю серию) и не чаще раза в QUEST_NOTIFY_WINDOW секунд на
+пользователя.
+
+Сводки уходят из одной фоновой задачи (run_sender) с шагом не меньше
+1 / QUEST_NOTIFY_RATE секунды - ниже общего лимита Telegram для бота, с
+запасом для ответов на команды. TelegramRetryAfter ставит отправку на паузу
+на указанное время, сводка возвращается в очередь.
+"""
+import asyncio
+import heapq
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+QUEST_NOTIFY_WINDOW = float(os.getenv("QUEST_NOTIFY_WINDOW", 300))
+QUEST_NOTIFY_DELAY = float(os.getenv("QUEST_NOTIFY_DELAY", 5))
+QUEST_NOTIFY_RATE = float(os.getenv("QUEST_NOTIFY_RATE", 20))
+QUEST_NOTIFY_CLOSE_SECONDS = float(os.getenv("QUEST_NOTIFY_CLOSE_SECONDS", 5))
+
+# (задание в виде QuestsConfig.quest_view, прогресс, выполнено)
+QuestUpdate = Tuple[Dict[str, Any], int, bool]
+# send(bot, user_id, обновления) - одна сводка пользователю
+DigestSender = Callable[[Bot, int, List[QuestUpdate]], Awaitable[None]]
+
+
+class QuestNotifier:
+    def __init__(self, send: DigestSender, window: float = QUEST_NOTIFY_WINDOW, delay: float = QUEST_NOTIFY_DELAY,
+                 rate: float = QUEST_NOTIFY_RATE) -> None:
+        self._send = send
+        self._window = window
+        self._delay = delay
+        self._interval = 1 / rate if rate > 0 else 0.0
+        self._pending: Dict[int, Dict[str, QuestUpdate]] = {}
+        self._bots: Dict[int, Bot] = {}
+        self._last_sent: Dict[int, float] = {}
+        self._queue: List[Tuple[float, int]] = []
+        self._next_send = 0.0
+        self._pruned_at = time.monotonic()
+        self._wake = asyncio.Event()
+        self._stats = {"updates": 0, "superseded": 0, "digests": 0, "failed": 0, "retry_after": 0, "dropped": 0}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "pending_users": len(self._pending)}
+
+    async def notify(self, bot: Bot, user_id: int, quest: Dict[str, Any], progress: int,
+                     completed: bool = False) -> None:
+        """Notifier движка заданий: запоминает состояние задания до следующей сводки пользователя."""
+        self._stats["updates"] += 1
+        self._buffer(bot, user_id, quest, progress, completed)
+
+    def _buffer(self, bot: Bot, user_id: int, quest: Dict[str, Any], progress: int, completed: bool) -> None:
+        updates = self._pending.get(user_id)
+        if updates is None:
+            updates = self._pending[user_id] = {}
+            now = time.monotonic()
+            due = max(now + self._delay, self._last_sent.get(user_id, -self._window) + self._window)
+            heapq.heappush(self._queue, (due, user_id))
+            self._wake.set()
+        previous = updates.get(quest["id"])
+        if previous is not None:
+            self._stats["superseded"] += 1
+            progress = max(progress, previous[1])
+            completed = completed or previous[2]
+        updates[quest["id"]] = (quest, progress, completed)
+        self._bots[user_id] = bot
+
+    async def _send_digest(self, user_id: int) -> None:
+        if user_id not in self._pending:
+            return
+        wait = self._next_send - time.monotonic()
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Остановка во время ожидания: сводка остаётся в очереди для close().
+                heapq.heappush(self._queue, (time.monotonic(), user_id))
+                raise
+        self._next_send = max(time.monotonic(), self._next_send) + self._interval
+        updates = self._pending.pop(user_id)
+        bot = self._bots.pop(user_id)
+        try:
+            await self._send(bot, user_id, list(updates.values()))
+            self._stats["digests"] += 1
+        except (TelegramRetryAfter, asyncio.CancelledError) as e:
+            # Флуд-контроль касается всего бота: пауза для всех сводок, эта - обратно в очередь.
+            for quest, progress, completed in updates.values():
+                self._buffer(bot, user_id, quest, progress, completed)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._stats["retry_after"] += 1
+            self._next_send = time.monotonic() + e.retry_after
+            return
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.warning(f"Quest digest for user {user_id} failed: {e}")
+        self._last_sent[user_id] = time.monotonic()
+
+    def _prune_last_sent(self) -> None:
+        """Забывает отправки старше окна: они уже не задерживают следующую сводку."""
+        self._pruned_at = time.monotonic()
+        expired = self._pruned_at - self._window
+        for user_id in [u for u, ts in self._last_sent.items() if ts <= expired]:
+            del self._last_sent[user_id]
+
+    async def run_sender(self) -> None:
+        """Фоновая задача: отправка сводок по мере наступления их срока. Запускается из main()."""
+        while True:
+            self._wake.clear()
+            if not self._queue:
+                await self._wake.wait()
+                continue
+            due, user_id = self._queue[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                try:
+                    # Новое изменение может поставить в очередь более раннюю сводку.
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._queue)
+            try:
+                await self._send_digest(user_id)
+            except Exception as e:
+                logger.error(f"Quest digest sender error: {e}")
+            if time.monotonic() - self._pruned_at > self._window:
+                self._prune_last_sent()
+
+    async def close(self, timeout: float = QUEST_NOTIFY_CLOSE_SECONDS) -> None:
+        """Отправляет накопленные сводки без ожидания окна, но не дольше timeout (при остановке бота)."""
+        deadline = time.monotonic() + timeout
+        while self._queue and time.monotonic() < deadline:
+            _, user_id = heapq.heappop(self._queue)
+            try:
+                await asyncio.wait_for(self._send_digest(user_id), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+        if self._pending:
+            self._stats["dropped"] += len(self._pending)
+            logger.warning(f"Dropped quest digests for {len(self._pending)} users on shutdown")
@@ -0,0 +1,209 @@
+"""
+Плановая смена ежедневных и еженедельных заданий.
+
+Раньше задания менялись лениво: первый /quests пользователя за день удалял
+старые, вставлял новые по одному и обновлял quest_refresh_times, а хуки
+сообщений до этого видели задания прошлого периода. Теперь run_scheduler()
+просыпается к границе периода (полночь, понедельник, 1 января - см.
+QuestsConfig.period_end) и выдаёт новые задания всем пользователям, активным
+за последние QUEST_ACTIVE_DAYS дней, пакетами по QUEST_ROLLOVER_CHUNK
+пользователей - одно намерение писателя на пакет. Задания те же, что вернёт
+QuestsConfig.get_daily_quests_for_user / get_weekly_quests_for_user: seed
+зависит только от пользователя и периода.
+
+Задания текущего периода узнаются по expires_at = конец периода, поэтому
+смена идемпотентна: повторный прогон (или перезапуск бота посреди смены)
+досоздаёт только недостающее. Между границами раз в QUEST_ROLLOVER_SECONDS
+досоздаются задания пользователям, ставшим активными с прошлого прогона, а
+request(user_id) - для тех, кто открыл задания раньше этого, - будит
+планировщик. Чтение заданий из обработчиков задания не создаёт.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from core.db.writer import writer_for
+from core.group.stat.quest_engine import QuestEngine
+from core.group.stat.quests_config import QuestsConfig
+from database import DB_PATH, LAST_ACTIVE_FLUSH_SECONDS, get_pool
+
+logger = logging.getLogger(__name__)
+
+QUEST_ROLLOVER_SECONDS = float(os.getenv("QUEST_ROLLOVER_SECONDS", 60))
+QUEST_ROLLOVER_CHUNK = int(os.getenv("QUEST_ROLLOVER_CHUNK", 500))
+QUEST_ACTIVE_DAYS = float(os.getenv("QUEST_ACTIVE_DAYS", 14))
+# Пакетов в очереди писателя одновременно: пока один пишется, следующие уже сгенерированы.
+QUEST_ROLLOVER_IN_FLIGHT = int(os.getenv("QUEST_ROLLOVER_IN_FLIGHT", 4))
+
+QUEST_TYPES = ("daily", "weekly")
+
+_GENERATORS = {
+    "daily": QuestsConfig.get_daily_quests_for_user,
+    "weekly": QuestsConfig.get_weekly_quests_for_user,
+}
+
+
+def _rollover_tx(conn: sqlite3.Connection, quest_type: str, expires_at: str, user_ids: List[int],
+                 rows: List[Tuple]) -> int:
+    """Меняет задания типа quest_type у пакета пользователей; задания текущего периода не трогает."""
+    conn.executemany(
+        'DELETE FROM user_quests WHERE user_id = ? AND quest_type = ? AND expires_at IS NOT ?',
+        [(user_id, quest_type, expires_at) for user_id in user_ids]
+    )
+    cursor = conn.executemany('''
+        INSERT OR IGNORE INTO user_quests
+        (user_id, user_quest_id, original_quest_id, quest_type, quest_kind, required_count, difficulty, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    return cursor.rowcount
+
+
+class QuestRollover:
+    def __init__(self, engine: QuestEngine, chunk: int = QUEST_ROLLOVER_CHUNK,
+                 active_days: float = QUEST_ACTIVE_DAYS, in_flight: int = QUEST_ROLLOVER_IN_FLIGHT) -> None:
+        self._engine = engine
+        self._chunk = chunk
+        self._in_flight = max(1, in_flight)
+        self._active_seconds = active_days * 86400
+        self._periods: Dict[str, str] = {}
+        self._scanned_ts: Optional[float] = None
+        self._pending: Set[int] = set()
+        self._wake = asyncio.Event()
+        self._stats = {"runs": 0, "rollovers": 0, "requests": 0, "users": 0, "quests": 0, "chunks": 0,
+                       "last_run_ms": 0.0}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "pending": len(self._pending), "periods": dict(self._periods)}
+
+    def request(self, user_id: int) -> None:
+        """Пользователь без заданий текущего периода: выдать их в ближайший прогон, не дожидаясь интервала."""
+        self._stats["requests"] += 1
+        self._pending.add(user_id)
+        self._wake.set()
+
+    async def _missing(self, quest_type: str, expires_at: str, since: Optional[float] = None,
+                       user_ids: Iterable[int] = ()) -> List[int]:
+        """Пользователи без заданий текущего периода: активные с since и/или из user_ids."""
+        missing: Set[int] = set()
+        async with get_pool().acquire() as conn:
+            if since is not None:
+                cursor = await conn.execute('''
+                    SELECT u.user_id FROM users u
+                    WHERE u.last_active_ts >= ? AND NOT EXISTS (
+                        SELECT 1 FROM user_quests q
+                        WHERE q.user_id = u.user_id AND q.quest_type = ? AND q.expires_at = ?
+                    )
+                ''', (since, quest_type, expires_at))
+                missing.update(row[0] for row in await cursor.fetchall())
+            user_ids = sorted(set(user_ids) - missing)
+            for start in range(0, len(user_ids), self._chunk):
+                chunk = user_ids[start:start + self._chunk]
+                cursor = await conn.execute(
+                    f'SELECT DISTINCT user_id FROM user_quests WHERE quest_type = ? AND expires_at = ? '
+                    f'AND user_id IN ({",".join("?" * len(chunk))})',
+                    (quest_type, expires_at, *chunk)
+                )
+                has_quests = {row[0] for row in await cursor.fetchall()}
+                missing.update(user_id for user_id in chunk if user_id not in has_quests)
+        return sorted(missing)
+
+    async def rollover(self, quest_type: str, user_ids: List[int], now: Optional[datetime] = None) -> int:
+        """Выдаёт задания периода now пользователям user_ids пакетами. Возвращает число вставленных заданий."""
+        now = now or datetime.now()
+        expires_at = QuestsConfig.period_end(quest_type, now).isoformat()
+        generate = _GENERATORS[quest_type]
+        inserted = 0
+        in_flight: Deque[Tuple["asyncio.Future[int]", List[int]]] = deque()
+        for start in range(0, len(user_ids), self._chunk):
+            chunk = user_ids[start:start + self._chunk]
+            rows = [
+                (user_id, quest["user_quest_id"], quest["original_id"], quest_type, quest["type"],
+                 quest["required"]["count"], quest["difficulty"], expires_at)
+                for user_id in chunk for quest in generate(user_id, now=now)
+            ]
+            # Следующие пакеты генерируются, пока писатель ждёт окно и записывает предыдущие.
+            in_flight.append((asyncio.ensure_future(writer_for(DB_PATH).submit(
+                lambda conn, chunk=chunk, rows=rows: _rollover_tx(conn, quest_type, expires_at, chunk, rows)
+            )), chunk))
+            if len(in_flight) >= self._in_flight:
+                inserted += await self._committed(*in_flight.popleft())
+        while in_flight:
+            inserted += await self._committed(*in_flight.popleft())
+        self._stats["users"] += len(user_ids)
+        self._stats["quests"] += inserted
+        return inserted
+
+    async def _committed(self, written: "asyncio.Future[int]", user_ids: List[int]) -> int:
+        inserted = await written
+        for user_id in user_ids:
+            self._engine.forget(user_id)
+        self._stats["chunks"] += 1
+        return inserted
+
+    async def generate_for(self, user_ids: Iterable[int], now: Optional[datetime] = None) -> int:
+        """Досоздаёт недостающие задания текущего периода указанным пользователям."""
+        now = now or datetime.now()
+        user_ids = list(user_ids)
+        inserted = 0
+        for quest_type in QUEST_TYPES:
+            expires_at = QuestsConfig.period_end(quest_type, now).isoformat()
+            missing = await self._missing(quest_type, expires_at, user_ids=user_ids)
+            inserted += await self.rollover(quest_type, missing, now)
+        return inserted
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """
+        Один прогон: на новой границе периода (и при первом запуске) - все активные пользователи,
+        иначе - ставшие активными с прошлого прогона и запросившие задания.
+        """
+        started = time.perf_counter()
+        now = now or datetime.now()
+        now_ts = now.timestamp()
+        # Прогресс старых заданий - в БД до их удаления.
+        await self._engine.flush()
+        pending, self._pending = self._pending, set()
+        active_since = now_ts - self._active_seconds
+        inserted = 0
+        try:
+            for quest_type in QUEST_TYPES:
+                period = QuestsConfig.period_key(quest_type, now)
+                if self._periods.get(quest_type) != period or self._scanned_ts is None:
+                    since = active_since
+                    self._stats["rollovers"] += 1
+                else:
+                    # last_active_ts пишется пакетами с задержкой до LAST_ACTIVE_FLUSH_SECONDS - берём с запасом.
+                    since = max(active_since, self._scanned_ts - 2 * LAST_ACTIVE_FLUSH_SECONDS)
+                expires_at = QuestsConfig.period_end(quest_type, now).isoformat()
+                missing = await self._missing(quest_type, expires_at, since, pending)
+                inserted += await self.rollover(quest_type, missing, now)
+                self._periods[quest_type] = period
+        except BaseException:
+            self._pending |= pending
+            raise
+        self._scanned_ts = now_ts
+        self._stats["runs"] += 1
+        self._stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if inserted:
+            logger.info(f"Quest rollover: {inserted} quests issued in {self._stats['last_run_ms']} ms")
+        return inserted
+
+    async def run_scheduler(self, interval: float = QUEST_ROLLOVER_SECONDS) -> None:
+        """Фоновая задача: смена заданий на границах периодов и досоздание между ними. Запускается из main()."""
+        while True:
+            self._wake.clear()
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Quest rollover failed: {e}")
+            now = datetime.now()
+            until_boundary = min(QuestsConfig.period_end(quest_type, now) for quest_type in QUEST_TYPES) - now
+            timeout = max(0.1, min(interval, until_boundary.total_seconds() + 0.1))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,9 +1,10 @@
 # quests_config.py (исправленная версия)
 
 import hashlib
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import random
-from typing import Dict, List, Any
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
 class QuestsConfig:
     """Конфигурация системы заданий с фиксированными заданиями"""
@@ -27,7 +28,7 @@ class QuestsConfig:
         "hard": 1000
     }
 
-    # Ежедневные задания
+    # Ежедневные задания; required.count - диапазон (от, до), из которого выбирается требование
     DAILY_QUESTS = {
         # Социальные задания
         "social_interactions": [
@@ -37,7 +38,7 @@ class QuestsConfig:
                 "description": "Отправить {count} сообщений в чат",
                 "type": "message_count",
                 "difficulty": "easy",
-                "required": {"count": lambda: random.randint(10, 20)}
+                "required": {"count": (10, 20)}
             },
             {
                 "id": "daily_rp_actions", 
@@ -45,7 +46,7 @@ class QuestsConfig:
                 "description": "Использовать {count} RP-действий",
                 "type": "rp_actions",
                 "difficulty": "medium",
-                "required": {"count": lambda: random.randint(5, 10)}
+                "required": {"count": (5, 10)}
             },
             {
                 "id": "daily_reactions",
@@ -53,7 +54,7 @@ class QuestsConfig:
                 "description": "Использовать {count} разных эмоций (обнять, погладить и т.д.)",
                 "type": "unique_rp_actions",
                 "difficulty": "medium", 
-                "required": {"count": lambda: random.randint(3, 5)}
+                "required": {"count": (3, 5)}
             }
         ],
         
@@ -65,7 +66,7 @@ class QuestsConfig:
                 "description": "Выставить {count} предметов на рынок", 
                 "type": "market_listings",
                 "difficulty": "medium",
-                "required": {"count": lambda: random.randint(2, 4)}
+                "required": {"count": (2, 4)}
             },
             {
                 "id": "daily_market_purchases",
@@ -73,7 +74,7 @@ class QuestsConfig:
                 "description": "Купить {count} предметов на рынке",
                 "type": "market_purchases",
                 "difficulty": "medium",
-                "required": {"count": lambda: random.randint(1, 3)}
+                "required": {"count": (1, 3)}
             },
             {
                 "id": "daily_crafting",
@@ -81,7 +82,7 @@ class QuestsConfig:
                 "description": "Создать {count} предметов на верстаке",
                 "type": "crafting", 
                 "difficulty": "hard",
-                "required": {"count": lambda: random.randint(2, 4)}
+                "required": {"count": (2, 4)}
             }
         ],
         
@@ -93,7 +94,7 @@ class QuestsConfig:
                 "description": "Сыграть {count} раз в казино",
                 "type": "casino_games",
                 "difficulty": "easy",
-                "required": {"count": lambda: random.randint(3, 5)}
+                "required": {"count": (3, 5)}
             },
             {
                 "id": "daily_casino_wins",
@@ -101,7 +102,7 @@ class QuestsConfig:
                 "description": "Выиграть {count} раз в казино",
                 "type": "casino_wins",
                 "difficulty": "hard",
-                "required": {"count": lambda: random.randint(2, 3)}
+                "required": {"count": (2, 3)}
             }
         ],
         
@@ -113,7 +114,7 @@ class QuestsConfig:
                 "description": "Поработать {count} раз",
                 "type": "work",
                 "difficulty": "easy",
-                "required": {"count": lambda: random.randint(3, 5)}
+                "required": {"count": (3, 5)}
             },
             {
                 "id": "daily_exp_gain",
@@ -121,7 +122,7 @@ class QuestsConfig:
                 "description": "Получить {count} опыта",
                 "type": "exp_gain",
                 "difficulty": "medium",
-                "required": {"count": lambda: random.randint(500, 1000)}
+                "required": {"count": (500, 1000)}
             }
         ]
     }
@@ -134,7 +135,7 @@ class QuestsConfig:
             "description": "Заработать {count} LUM на рынке",
             "type": "market_profit", 
             "difficulty": "hard",
-            "required": {"count": lambda: random.randint(1000, 2000)}
+            "required": {"count": (1000, 2000)}
         },
         {
             "id": "weekly_casino_profit",
@@ -142,7 +143,7 @@ class QuestsConfig:
             "description": "Выиграть {count} LUM в казино",
             "type": "casino_profit",
             "difficulty": "hard",
-            "required": {"count": lambda: random.randint(2000, 3000)}
+            "required": {"count": (2000, 3000)}
         },
         {
             "id": "weekly_rp_master", 
@@ -150,7 +151,7 @@ class QuestsConfig:
             "description": "Использовать {count} уникальных RP-действий",
             "type": "unique_rp_actions_total",
             "difficulty": "medium",
-            "required": {"count": lambda: random.randint(15, 20)}
+            "required": {"count": (15, 20)}
         },
         {
             "id": "weekly_social_star",
@@ -158,7 +159,7 @@ class QuestsConfig:
             "description": "Набрать {count} очков активности",
             "type": "activity_score",
             "difficulty": "hard",
-            "required": {"count": lambda: random.randint(5000, 7000)}
+            "required": {"count": (5000, 7000)}
         },
         {
             "id": "weekly_craftsman",
@@ -166,114 +167,134 @@ class QuestsConfig:
             "description": "Создать {count} редких или эпических предметов",
             "type": "rare_crafting",
             "difficulty": "medium",
-            "required": {"count": lambda: random.randint(5, 8)}
+            "required": {"count": (5, 8)}
         }
     ]
 
     @staticmethod
-    def generate_daily_seed(user_id: int) -> int:
+    def period_key(quest_type: str, now: Optional[datetime] = None) -> str:
+        """Период заданий: дата для ежедневных, год и номер недели для еженедельных"""
+        return _period_strings((now or datetime.now()).date())[quest_type]
+
+    @staticmethod
+    def period_end(quest_type: str, now: Optional[datetime] = None) -> datetime:
+        """Момент смены периода: полночь следующего дня, понедельника или 1 января (с него %W начинается заново)"""
+        now = now or datetime.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if quest_type == "daily":
+            return midnight + timedelta(days=1)
+        next_monday = midnight + timedelta(days=7 - midnight.weekday())
+        return min(next_monday, midnight.replace(year=midnight.year + 1, month=1, day=1))
+
+    @staticmethod
+    def generate_daily_seed(user_id: int, now: Optional[datetime] = None) -> int:
         """Генерирует seed на основе user_id и текущей даты"""
-        today_str = datetime.now().strftime('%Y-%m-%d')
-        seed_str = f"{user_id}_{today_str}"
+        seed_str = f"{user_id}_{QuestsConfig.period_key('daily', now)}"
         return int(hashlib.md5(seed_str.encode()).hexdigest()[:8], 16)
 
     @staticmethod
-    def generate_weekly_seed(user_id: int) -> int:
+    def generate_weekly_seed(user_id: int, now: Optional[datetime] = None) -> int:
         """Генерирует seed на основе user_id и текущей недели"""
-        today = datetime.now()
-        week_str = today.strftime('%Y-%W')  # Год и номер недели
-        seed_str = f"{user_id}_{week_str}"
+        seed_str = f"{user_id}_{QuestsConfig.period_key('weekly', now)}"
         return int(hashlib.md5(seed_str.encode()).hexdigest()[:8], 16)
 
     @staticmethod
-    def generate_quest_id(quest_data: Dict[str, Any], user_id: int) -> str:
+    def generate_quest_id(quest_data: Dict[str, Any], user_id: int, now: Optional[datetime] = None) -> str:
         """Генерирует уникальный ID задания для пользователя"""
         base_id = quest_data["id"]
+        stamps = _period_strings((now or datetime.now()).date())
         # Используем дату для дневных заданий, неделю для недельных
-        if "daily" in base_id:
-            timestamp = datetime.now().strftime('%Y%m%d')
-        else:
-            timestamp = datetime.now().strftime('%Y%W')
+        timestamp = stamps["daily_stamp"] if "daily" in base_id else stamps["weekly_stamp"]
         return f"{user_id}_{base_id}_{timestamp}"
 
     @staticmethod
-    def get_daily_quests_for_user(user_id: int, count: int = DAILY_QUESTS_COUNT) -> List[Dict[str, Any]]:
-        """Получает фиксированный набор ежедневных заданий для конкретного пользователя"""
-        all_quests = []
-        for category in QuestsConfig.DAILY_QUESTS.values():
-            all_quests.extend(category)
-        
-        # Устанавливаем seed для детерминированного выбора заданий
-        seed = QuestsConfig.generate_daily_seed(user_id)
-        random.seed(seed)
-        
-        selected_quests = random.sample(all_quests, min(count, len(all_quests)))
-        
-        # Сбрасываем seed
-        random.seed()
-        
-        # Генерируем конкретные значения для заданий и уникальные ID
+    def _requirement_seed(user_id: int, quest_id: str, period: str) -> int:
+        """Seed требований задания: стабилен между перезапусками (в отличие от hash())"""
+        seed_str = f"{user_id}_{quest_id}_{period}"
+        return int(hashlib.md5(seed_str.encode()).hexdigest()[:8], 16)
+
+    @staticmethod
+    def _build_quests(templates: List[Dict[str, Any]], user_id: int, count: int, seed: int,
+                      period: str, now: Optional[datetime]) -> List[Dict[str, Any]]:
+        """Выбор и генерация заданий собственным генератором: глобальный random не трогается"""
+        selected_quests = random.Random(seed).sample(templates, min(count, len(templates)))
+
         processed_quests = []
         for quest in selected_quests:
-            quest_copy = quest.copy()
-            
-            # Устанавливаем seed для детерминированной генерации требований
-            requirement_seed = QuestsConfig.generate_daily_seed(user_id + hash(quest["id"]))
-            random.seed(requirement_seed)
-            
-            for key, value_func in quest_copy["required"].items():
-                if callable(value_func):
-                    quest_copy["required"][key] = value_func()
-            
-            # Сбрасываем seed
-            random.seed()
-                    
-            # Заполняем описание конкретными значениями
-            quest_copy["description"] = quest_copy["description"].format(**quest_copy["required"])
-            
-            # Генерируем уникальный ID для пользователя
-            quest_copy["user_quest_id"] = QuestsConfig.generate_quest_id(quest_copy, user_id)
-            quest_copy["original_id"] = quest_copy["id"]
-            
-            processed_quests.append(quest_copy)
-            
+            low, high = quest["required"]["count"]
+            # Остаток от md5 вместо Random(seed).randint: сид генератора - основная цена массовой смены заданий.
+            required_count = low + QuestsConfig._requirement_seed(user_id, quest["id"], period) % (high - low + 1)
+            quest_view = QuestsConfig.quest_view(quest["id"], required_count)
+            quest_view["user_quest_id"] = QuestsConfig.generate_quest_id(quest_view, user_id, now)
+            processed_quests.append(quest_view)
         return processed_quests
 
     @staticmethod
-    def get_weekly_quests_for_user(user_id: int, count: int = WEEKLY_QUESTS_COUNT) -> List[Dict[str, Any]]:
-        """Получает фиксированный набор еженедельных заданий для конкретного пользователя"""
-        # Устанавливаем seed для детерминированного выбора заданий
-        seed = QuestsConfig.generate_weekly_seed(user_id)
-        random.seed(seed)
-        
-        selected_quests = random.sample(QuestsConfig.WEEKLY_QUESTS, min(count, len(QuestsConfig.WEEKLY_QUESTS)))
-        
-        # Сбрасываем seed
-        random.seed()
-        
-        # Генерируем конкретные значения для заданий и уникальные ID
-        processed_quests = []
-        for quest in selected_quests:
-            quest_copy = quest.copy()
-            
-            # Устанавливаем seed для детерминированной генерации требований
-            requirement_seed = QuestsConfig.generate_weekly_seed(user_id + hash(quest["id"]))
-            random.seed(requirement_seed)
-            
-            for key, value_func in quest_copy["required"].items():
-                if callable(value_func):
-                    quest_copy["required"][key] = value_func()
-            
-            # Сбрасываем seed
-            random.seed()
-                    
-            # Заполняем описание конкретными значениями
-            quest_copy["description"] = quest_copy["description"].format(**quest_copy["required"])
-            
-            # Генерируем уникальный ID для пользователя
-            quest_copy["user_quest_id"] = QuestsConfig.generate_quest_id(quest_copy, user_id)
-            quest_copy["original_id"] = quest_copy["id"]
-            
-            processed_quests.append(quest_copy)
-            
-        return processed_quests
\ No newline at end of file
+    def get_daily_quests_for_user(user_id: int, count: int = DAILY_QUESTS_COUNT,
+                                  now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Получает фиксированный набор ежедневных заданий для конкретного пользователя (на дату now)"""
+        all_quests = []
+        for category in QuestsConfig.DAILY_QUESTS.values():
+            all_quests.extend(category)
+        return QuestsConfig._build_quests(all_quests, user_id, count, QuestsConfig.generate_daily_seed(user_id, now),
+                                          QuestsConfig.period_key("daily", now), now)
+
+    @staticmethod
+    def get_weekly_quests_for_user(user_id: int, count: int = WEEKLY_QUESTS_COUNT,
+                                   now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Получает фиксированный набор еженедельных заданий для конкретного пользователя (на неделю now)"""
+        return QuestsConfig._build_quests(QuestsConfig.WEEKLY_QUESTS, user_id, count,
+                                          QuestsConfig.generate_weekly_seed(user_id, now),
+                                          QuestsConfig.period_key("weekly", now), now)
+
+    @staticmethod
+    def get_template(original_id: str) -> Optional[Dict[str, Any]]:
+        """Шаблон задания по id из реестра (строится один раз)"""
+        return _template_registry().get(original_id)
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _describe(original_id: str, required_count: int) -> Tuple[str, str, str, str]:
+        template = _template_registry().get(original_id)
+        if template is None:
+            # Шаблон убран из конфига, а задание ещё живо: показываем id.
+            return original_id, "", "", "easy"
+        return (template["name"], template["description"].format(count=required_count),
+                template["type"], template["difficulty"])
+
+    @staticmethod
+    def quest_view(original_id: str, required_count: int) -> Dict[str, Any]:
+        """Задание в виде для показа и уведомлений: тексты берутся из шаблона, а не из БД"""
+        name, description, quest_kind, difficulty = QuestsConfig._describe(original_id, required_count)
+        return {
+            "id": original_id,
+            "original_id": original_id,
+            "name": name,
+            "description": description,
+            "type": quest_kind,
+            "difficulty": difficulty,
+            "required": {"count": required_count},
+        }
+
+
+@lru_cache(maxsize=64)
+def _period_strings(day: date) -> Dict[str, str]:
+    """Ключи периодов и метки id заданий для даты (strftime на каждое задание заметен при массовой смене)"""
+    return {
+        "daily": day.strftime('%Y-%m-%d'),
+        "weekly": day.strftime('%Y-%W'),
+        "daily_stamp": day.strftime('%Y%m%d'),
+        "weekly_stamp": day.strftime('%Y%W'),
+    }
+
+
+@lru_cache(maxsize=None)
+def _template_registry() -> Dict[str, Dict[str, Any]]:
+    """id шаблона -> шаблон, по всем ежедневным и еженедельным заданиям"""
+    registry = {}
+    for category in QuestsConfig.DAILY_QUESTS.values():
+        for quest in category:
+            registry[quest["id"]] = quest
+    for quest in QuestsConfig.WEEKLY_QUESTS:
+        registry[quest["id"]] = quest
+    return registry
@@ -4,8 +4,9 @@ import logging
 # Отключаем отладочные сообщения от aiosqlite
 logging.getLogger('aiosqlite').setLevel(logging.WARNING)
 from typing import List, Dict, Any, Optional, Tuple
-import json
-from datetime import datetime, timedelta
+import sqlite3
+import time
+from datetime import datetime
 import aiosqlite
 from aiogram import Router, types, F, Bot
 from aiogram.filters import Command
@@ -13,8 +14,18 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.markdown import hbold, hcode
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 
+from core.db.analytics import ALL_MODES
+from core.db.ledger import LedgerError, transfer_tx
+from core.db.pool import open_connection
+from core.db.quest_totals import ALL_QUESTS, record_completion_tx
+from core.db.writer import writer_for
 from core.group.stat.manager import ProfileManager
+from core.group.stat.quest_engine import QuestEngine
+from core.group.stat.quest_notifier import QuestNotifier, QuestUpdate
+from core.group.stat.quest_rollover import QuestRollover
+from database import DB_PATH, _publish_balances, get_pool
 from core.group.stat.quests_config import QuestsConfig
 
 logger = logging.getLogger(__name__)
@@ -22,131 +33,27 @@ logger = logging.getLogger(__name__)
 # Роутер для квестов
 quests_router = Router(name="quests_router")
 
-async def ensure_quests_db():
-    """Инициализация базы данных для заданий с безопасной миграцией"""
-    async with aiosqlite.connect('profiles.db') as db:
-        # Проверяем существование таблицы user_quests
-        cursor = await db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_quests'")
-        table_exists = await cursor.fetchone()
-        
-        if table_exists:
-            # Проверяем структуру существующей таблицы
-            cursor = await db.execute("PRAGMA table_info(user_quests)")
-            columns = await cursor.fetchall()
-            column_names = [column[1] for column in columns]
-            
-            # Добавляем отсутствующие столбцы
-            if 'user_quest_id' not in column_names:
-                logger.info("Добавляем отсутствующие столбцы в таблицу user_quests...")
-                
-                try:
-                    # Добавляем user_quest_id как PRIMARY KEY
-                    await db.execute('ALTER TABLE user_quests ADD COLUMN user_quest_id TEXT')
-                    
-                    # Генерируем user_quest_id для существующих записей
-                    await db.execute('''
-                        UPDATE user_quests 
-                        SET user_quest_id = 
-                            CASE 
-                                WHEN original_quest_id IS NOT NULL THEN 
-                                    original_quest_id || '_' || user_id || '_' || strftime('%s', COALESCE(created_at, datetime('now')))
-                                ELSE 
-                                    'legacy_' || user_id || '_' || strftime('%s', COALESCE(created_at, datetime('now')))
-                            END
-                        WHERE user_quest_id IS NULL
-                    ''')
-                    
-                    # Теперь делаем user_quest_id PRIMARY KEY
-                    # SQLite не поддерживает ADD PRIMARY KEY через ALTER TABLE, поэтому создаем новую таблицу
-                    await db.execute('''
-                        CREATE TABLE IF NOT EXISTS user_quests_new (
-                            user_id INTEGER,
-                            user_quest_id TEXT PRIMARY KEY,
-                            original_quest_id TEXT,
-                            quest_type TEXT,
-                            quest_data TEXT,
-                            progress INTEGER DEFAULT 0,
-                            completed BOOLEAN DEFAULT FALSE,
-                            reward_claimed BOOLEAN DEFAULT FALSE,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            expires_at TIMESTAMP
-                        )
-                    ''')
-                    
-                    # Копируем данные в новую таблицу
-                    await db.execute('''
-                        INSERT OR IGNORE INTO user_quests_new 
-                        SELECT * FROM user_quests
-                    ''')
-                    
-                    # Заменяем старую таблицу новой
-                    await db.execute('DROP TABLE user_quests')
-                    await db.execute('ALTER TABLE user_quests_new RENAME TO user_quests')
-                    
-                    logger.info("Миграция таблицы user_quests завершена")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при миграции user_quests: {e}")
-                    # Если миграция не удалась, создаем таблицу заново
-                    await db.execute('DROP TABLE IF EXISTS user_quests')
-        
-        # Создаем таблицы с правильной структурой (если они не существуют)
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_quests (
-                user_id INTEGER,
-                user_quest_id TEXT PRIMARY KEY,
-                original_quest_id TEXT,
-                quest_type TEXT,
-                quest_data TEXT,
-                progress INTEGER DEFAULT 0,
-                completed BOOLEAN DEFAULT FALSE,
-                reward_claimed BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP
-            )
-        ''')
-        
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS quests_statistics (
-                user_id INTEGER,
-                quest_type TEXT,
-                original_quest_id TEXT,
-                completed_count INTEGER DEFAULT 0,
-                last_completed TIMESTAMP,
-                PRIMARY KEY (user_id, original_quest_id)
-            )
-        ''')
-        
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS quest_refresh_times (
-                user_id INTEGER PRIMARY KEY,
-                last_daily_refresh TIMESTAMP,
-                last_weekly_refresh TIMESTAMP
-            )
-        ''')
-        
-        await db.commit()
-        logger.info("База данных заданий инициализирована")
-
-
 async def get_user_quests(user_id: int) -> Dict[str, List[Dict[str, Any]]]:
     """Получает текущие задания пользователя"""
-    async with aiosqlite.connect('profiles.db') as db:
+    async with open_connection(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
         
         now = datetime.now()
         
-        # Получаем все активные задания
+        # Получаем все активные задания (expires_at хранится в isoformat)
         cursor = await db.execute('''
-            SELECT * FROM user_quests 
+            SELECT user_quest_id, quest_type, original_quest_id, required_count, progress, completed,
+                   reward_claimed, expires_at, created_at
+            FROM user_quests
             WHERE user_id = ? AND expires_at > ?
-        ''', (user_id, now))
+        ''', (user_id, now.isoformat()))
         
         rows = await cursor.fetchall()
         
         quests = {"daily": [], "weekly": []}
         for row in rows:
-            quest_data = json.loads(row['quest_data'])
+            # Тексты задания - из реестра шаблонов QuestsConfig, в БД только поля прогресса
+            quest_data = QuestsConfig.quest_view(row['original_quest_id'], row['required_count'])
             quest_data.update({
                 'user_quest_id': row['user_quest_id'],
                 'progress': row['progress'],
@@ -159,126 +66,110 @@ async def get_user_quests(user_id: int) -> Dict[str, List[Dict[str, Any]]]:
             
         return quests
 
-async def refresh_user_quests(user_id: int, profile_manager: ProfileManager) -> None:
-    """Обновляет задания пользователя, если пришло время"""
-    async with aiosqlite.connect('profiles.db') as db:
-        db.row_factory = aiosqlite.Row
-        now = datetime.now()
-        
-        # Получаем время последнего обновления
-        cursor = await db.execute('''
-            SELECT * FROM quest_refresh_times WHERE user_id = ?
-        ''', (user_id,))
-        refresh_times = await cursor.fetchone()
-        
-        if not refresh_times:
-            # Первый раз - создаём записи
-            last_daily = (now - timedelta(days=1)).isoformat()
-            last_weekly = (now - timedelta(days=7)).isoformat()
-            await db.execute('''
-                INSERT INTO quest_refresh_times (user_id, last_daily_refresh, last_weekly_refresh)
-                VALUES (?, ?, ?)
-            ''', (user_id, last_daily, last_weekly))
-            refresh_times = {
-                'last_daily_refresh': last_daily,
-                'last_weekly_refresh': last_weekly
-            }
-        
-        # Проверяем ежедневные задания
-        last_daily = datetime.fromisoformat(refresh_times['last_daily_refresh'])
-        if (now - last_daily).days >= 1:
-            # Удаляем старые ежедневные задания
-            await db.execute('''
-                DELETE FROM user_quests 
-                WHERE user_id = ? AND quest_type = 'daily'
-            ''', (user_id,))
-            
-            # Добавляем новые
-            daily_quests = QuestsConfig.get_daily_quests_for_user(user_id)
-            for quest in daily_quests:
-                await db.execute('''
-                    INSERT INTO user_quests 
-                    (user_id, user_quest_id, original_quest_id, quest_type, quest_data, expires_at)
-                    VALUES (?, ?, ?, 'daily', ?, ?)
-                ''', (
-                    user_id,
-                    quest['user_quest_id'],
-                    quest['original_id'],
-                    json.dumps(quest),
-                    (now + timedelta(days=1)).isoformat()
-                ))
-            
-            # Обновляем время обновления
-            await db.execute('''
-                UPDATE quest_refresh_times 
-                SET last_daily_refresh = ?
-                WHERE user_id = ?
-            ''', (now.isoformat(), user_id))
-        
-        # Проверяем еженедельные задания
-        last_weekly = datetime.fromisoformat(refresh_times['last_weekly_refresh'])
-        if (now - last_weekly).days >= 7:
-            # Удаляем старые еженедельные задания
-            await db.execute('''
-                DELETE FROM user_quests 
-                WHERE user_id = ? AND quest_type = 'weekly'
-            ''', (user_id,))
-            
-            # Добавляем новые
-            weekly_quests = QuestsConfig.get_weekly_quests_for_user(user_id)
-            for quest in weekly_quests:
-                await db.execute('''
-                    INSERT INTO user_quests 
-                    (user_id, user_quest_id, original_quest_id, quest_type, quest_data, expires_at)
-                    VALUES (?, ?, ?, 'weekly', ?, ?)
-                ''', (
-                    user_id,
-                    quest['user_quest_id'],
-                    quest['original_id'],
-                    json.dumps(quest),
-                    (now + timedelta(days=7)).isoformat()
-                ))
-            
-            # Обновляем время обновления
-            await db.execute('''
-                UPDATE quest_refresh_times 
-                SET last_weekly_refresh = ?
-                WHERE user_id = ?
-            ''', (now.isoformat(), user_id))
-        
-        await db.commit()
+# Пользователи, которым нельзя написать в ЛС (не запускали бота или заблокировали), и время отказа:
+# сутки сводки о выполненных заданиях им идут сразу в последний групповой чат (user_profiles.last_group_chat_id),
+# без заведомо неудачного запроса.
+_no_private_chat: Dict[int, float] = {}
+_NO_PRIVATE_CHAT_RETRY = 86400
 
-async def notify_quest_progress(bot: Bot, user_id: int, quest_data: dict, progress: int, completed: bool = False):
-    """Отправляет уведомление о прогрессе задания"""
-    try:
-        text = f"📋 **Обновление задания**\n\n"
-        text += f"🎯 {quest_data['name']}\n"
-        text += f"└ Прогресс: {progress}/{quest_data['required']['count']}\n"
-        
+
+def format_quest_digest(updates: List[QuestUpdate]) -> str:
+    """Текст сводки: по строке на задание с итоговым прогрессом"""
+    text = "📋 **Обновление заданий**\n\n"
+    for quest, progress, completed in updates:
         if completed:
-            text += f"\n✨ **Задание выполнено!**\n"
-            text += f"💰 Используйте команду `задания` чтобы получить награду!"
-        
+            text += f"✅ {quest['name']} - выполнено!\n"
+        else:
+            text += f"🎯 {quest['name']}\n└ Прогресс: {progress}/{quest['required']['count']}\n"
+    if any(completed for _, _, completed in updates):
+        text += f"\n💰 Используйте команду `задания` чтобы получить награду!"
+    return text
+
+
+async def send_quest_digest(bot: Bot, user_id: int, updates: List[QuestUpdate]) -> None:
+    """Отправляет сводку о заданиях: в ЛС, а если нельзя - о выполненных заданиях в последний групповой чат"""
+    text = format_quest_digest(updates)
+    if time.time() - _no_private_chat.get(user_id, 0) > _NO_PRIVATE_CHAT_RETRY:
         try:
-            # Пробуем отправить в ЛС
             await bot.send_message(user_id, text, parse_mode=ParseMode.MARKDOWN)
-        except Exception as e:
-            logger.warning(f"Не удалось отправить уведомление в ЛС {user_id}: {e}")
-            # Если не получилось, попробуем найти последний групповой чат
-            async with aiosqlite.connect('profiles.db') as db:
-                cursor = await db.execute(
-                    'SELECT last_group_chat_id FROM user_profiles WHERE user_id = ?', 
-                    (user_id,)
-                )
-                result = await cursor.fetchone()
-                if result and result[0]:
-                    await bot.send_message(
-                        result[0],
-                        f"@{user_id}\n" + text,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления о прогрессе задания: {e}")
+            _no_private_chat.pop(user_id, None)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            if isinstance(e, TelegramBadRequest) and "chat not found" not in str(e).lower():
+                raise
+            logger.info(f"Не удалось отправить уведомление в ЛС {user_id}: {e}")
+            _no_private_chat[user_id] = time.time()
+    # Прогресс в группу не пишем - только выполненные задания.
+    if not any(completed for _, _, completed in updates):
+        return
+    async with open_connection(DB_PATH) as db:
+        cursor = await db.execute('SELECT last_group_chat_id FROM user_profiles WHERE user_id = ?', (user_id,))
+        result = await cursor.fetchone()
+    if result and result[0]:
+        await bot.send_message(result[0], f"@{user_id}\n" + text, parse_mode=ParseMode.MARKDOWN)
+
+# Уведомления о заданиях копятся и уходят сводками (core/group/stat/quest_notifier.py).
+quest_notifier = QuestNotifier(send=send_quest_digest)
+
+# Прогресс заданий от игровых событий: индекс в памяти и пакетная запись (core/group/stat/quest_engine.py).
+quest_engine = QuestEngine(notify=quest_notifier.notify)
+# Плановая смена заданий на границах периодов (core/group/stat/quest_rollover.py).
+quest_rollover = QuestRollover(quest_engine)
+
+def _apply_quest_progress(
+    conn: sqlite3.Connection,
+    user_id: int,
+    quest_type: str,
+    user_quest_id: str,
+    progress: Optional[int] = None,
+    increment: int = 0
+) -> Optional[Tuple[dict, int, bool]]:
+    """Применяет прогресс задания одним UPDATE внутри транзакции писателя; без commit. None - ничего не изменилось."""
+    row = conn.execute('''
+        UPDATE user_quests
+        SET progress = MIN(required_count, COALESCE(:target, progress + :increment)),
+            completed = MIN(required_count, COALESCE(:target, progress + :increment)) >= required_count
+        WHERE user_quest_id = :user_quest_id AND user_id = :user_id AND quest_type = :quest_type
+          AND completed = FALSE
+          AND (MIN(required_count, COALESCE(:target, progress + :increment)) > progress
+               OR COALESCE(:target, progress + :increment) >= required_count)
+        RETURNING original_quest_id, required_count, progress, completed
+    ''', {"target": progress, "increment": increment, "user_quest_id": user_quest_id,
+          "user_id": user_id, "quest_type": quest_type}).fetchone()
+    if row is None:
+        return None
+    original_quest_id, required_count, new_progress, completed = row
+
+    # Если задание завершено, обновляем статистику
+    if completed:
+        record_completion_tx(conn, user_id, quest_type, original_quest_id, datetime.now().isoformat())
+
+    return QuestsConfig.quest_view(original_quest_id, required_count), new_progress, bool(completed)
+
+
+async def _submit_quest_progress(
+    user_id: int,
+    quest_type: str,
+    user_quest_id: str,
+    progress: Optional[int],
+    increment: int,
+    bot: Bot = None
+) -> bool:
+    # Прямая запись в обход движка: сначала его накопленный прогресс, потом сброс индекса.
+    await quest_engine.flush()
+    result = await writer_for(DB_PATH).submit(
+        lambda conn: _apply_quest_progress(conn, user_id, quest_type, user_quest_id, progress, increment)
+    )
+    quest_engine.forget(user_id)
+    if result is None:
+        return False
+    quest_data, new_progress, completed = result
+
+    # Отправляем уведомление если есть бот (уже после коммита)
+    if bot:
+        await quest_notifier.notify(bot, user_id, quest_data, new_progress, completed)
+    return completed
+
 
 async def update_quest_progress(
     user_id: int,
@@ -288,58 +179,7 @@ async def update_quest_progress(
     bot: Bot = None
 ) -> bool:
     """Обновляет прогресс задания"""
-    async with aiosqlite.connect('profiles.db') as db:
-        cursor = await db.execute('''
-            SELECT quest_data, progress, completed
-            FROM user_quests
-            WHERE user_id = ? AND user_quest_id = ? AND quest_type = ?
-        ''', (user_id, user_quest_id, quest_type))
-        
-        quest = await cursor.fetchone()
-        if not quest:
-            return False
-            
-        quest_data = json.loads(quest[0])
-        required = quest_data['required']['count']
-        old_progress = quest[1]
-        was_completed = quest[2]
-        
-        new_progress = min(progress, required)
-        completed = new_progress >= required
-        
-        # Обновляем только если есть изменения
-        if new_progress > old_progress or (completed and not was_completed):
-            await db.execute('''
-                UPDATE user_quests
-                SET progress = ?, completed = ?
-                WHERE user_id = ? AND user_quest_id = ? AND quest_type = ?
-            ''', (new_progress, completed, user_id, user_quest_id, quest_type))
-            
-            # Если задание завершено, обновляем статистику
-            if completed and not was_completed:
-                await db.execute('''
-                    INSERT INTO quests_statistics 
-                    (user_id, quest_type, original_quest_id, completed_count, last_completed)
-                    VALUES (?, ?, ?, 1, ?)
-                    ON CONFLICT(user_id, original_quest_id) 
-                    DO UPDATE SET 
-                        completed_count = completed_count + 1,
-                        last_completed = ?
-                ''', (
-                    user_id, 
-                    quest_type, 
-                    quest_data['original_id'],
-                    datetime.now().isoformat(),
-                    datetime.now().isoformat()
-                ))
-            
-            await db.commit()
-            
-            # Отправляем уведомление если есть бот
-            if bot and (completed != was_completed or new_progress > old_progress):
-                await notify_quest_progress(bot, user_id, quest_data, new_progress, completed)
-        
-        return completed
+    return await _submit_quest_progress(user_id, quest_type, user_quest_id, progress, 0, bot)
 
 async def increment_quest_progress(
     user_id: int,
@@ -349,57 +189,7 @@ async def increment_quest_progress(
     bot: Bot = None
 ) -> bool:
     """Увеличивает прогресс задания на указанное значение"""
-    async with aiosqlite.connect('profiles.db') as db:
-        cursor = await db.execute('''
-            SELECT quest_data, progress, completed
-            FROM user_quests
-            WHERE user_id = ? AND user_quest_id = ? AND quest_type = ?
-        ''', (user_id, user_quest_id, quest_type))
-        
-        quest = await cursor.fetchone()
-        if not quest:
-            return False
-            
-        quest_data = json.loads(quest[0])
-        old_progress = quest[1]
-        was_completed = quest[2]
-        
-        new_progress = min(old_progress + increment, quest_data['required']['count'])
-        completed = new_progress >= quest_data['required']['count']
-        
-        # Обновляем только если есть изменения
-        if new_progress > old_progress or (completed and not was_completed):
-            await db.execute('''
-                UPDATE user_quests
-                SET progress = ?, completed = ?
-                WHERE user_id = ? AND user_quest_id = ? AND quest_type = ?
-            ''', (new_progress, completed, user_id, user_quest_id, quest_type))
-            
-            # Если задание завершено, обновляем статистику
-            if completed and not was_completed:
-                await db.execute('''
-                    INSERT INTO quests_statistics 
-                    (user_id, quest_type, original_quest_id, completed_count, last_completed)
-                    VALUES (?, ?, ?, 1, ?)
-                    ON CONFLICT(user_id, original_quest_id) 
-                    DO UPDATE SET 
-                        completed_count = completed_count + 1,
-                        last_completed = ?
-                ''', (
-                    user_id, 
-                    quest_type, 
-                    quest_data['original_id'],
-                    datetime.now().isoformat(),
-                    datetime.now().isoformat()
-                ))
-            
-            await db.commit()
-            
-            # Отправляем уведомление если есть бот
-            if bot and (completed != was_completed or new_progress > old_progress):
-                await notify_quest_progress(bot, user_id, quest_data, new_progress, completed)
-        
-        return completed
+    return await _submit_quest_progress(user_id, quest_type, user_quest_id, None, increment, bot)
 
 async def claim_quest_reward(
     user_id: int,
@@ -408,105 +198,112 @@ async def claim_quest_reward(
     profile_manager: ProfileManager
 ) -> Optional[Dict[str, int]]:
     """Забирает награду за выполненное задание"""
-    async with aiosqlite.connect('profiles.db') as db:
-        cursor = await db.execute('''
-            SELECT quest_data, completed, reward_claimed
-            FROM user_quests
-            WHERE user_id = ? AND user_quest_id = ? AND quest_type = ?
-        ''', (user_id, user_quest_id, quest_type))
-        
-        quest = await cursor.fetchone()
-        if not quest:
-            return None
-            
-        quest_data = json.loads(quest[0])
-        completed = quest[1]
-        reward_claimed = quest[2]
-        
-        if not completed or reward_claimed:
+    await quest_engine.flush()
+
+    def _claim(conn: sqlite3.Connection) -> Optional[Tuple[Dict[str, int], Dict[Tuple[int, str], int]]]:
+        # Отметка о получении - условный UPDATE: повторное нажатие кнопки награду не удвоит.
+        # Выплата в том же намерении: если проводка не прошла, отметка откатывается вместе с ней.
+        row = conn.execute('''
+            UPDATE user_quests
+            SET reward_claimed = TRUE
+            WHERE user_quest_id = ? AND user_id = ? AND quest_type = ? AND completed AND NOT reward_claimed
+            RETURNING difficulty
+        ''', (user_quest_id, user_id, quest_type)).fetchone()
+        if row is None:
             return None
-        
+        difficulty = row[0]
+        reason = f"quest:{user_quest_id}"
+
         # Определяем награду
-        rewards = {}
         if quest_type == 'daily':
-            rewards = QuestsConfig.DAILY_QUEST_REWARDS[quest_data['difficulty']]
-            await profile_manager.update_lumcoins(user_id, rewards['lumcoins'])
-            await profile_manager.update_exp(user_id, rewards['exp'])
+            rewards = QuestsConfig.DAILY_QUEST_REWARDS[difficulty]
+            currency, amount = "lumcoins", rewards['lumcoins']
         else:  # weekly
-            plum_reward = QuestsConfig.WEEKLY_QUEST_PLUM_REWARDS[quest_data['difficulty']]
-            await profile_manager.update_plumcoins(user_id, plum_reward)
-            rewards = {'plumcoins': plum_reward}
-        
-        # Отмечаем награду как полученную
-        await db.execute('''
-            UPDATE user_quests
-            SET reward_claimed = TRUE
-            WHERE user_id = ? AND user_quest_id = ? AND quest_type = ?
-        ''', (user_id, user_quest_id, quest_type))
-        
-        await db.commit()
-        return rewards
+            rewards = {'plumcoins': QuestsConfig.WEEKLY_QUEST_PLUM_REWARDS[difficulty]}
+            currency, amount = "plumcoins", rewards['plumcoins']
+        balance = transfer_tx(conn, "quests", user_id, amount, reason, currency)[user_id]
+        return rewards, {(user_id, currency): balance}
 
-async def get_quest_statistics(user_id: int, quest_type: str = None) -> Dict[str, Any]:
-    """Получает статистику выполнения заданий"""
-    async with aiosqlite.connect('profiles.db') as db:
-        db.row_factory = aiosqlite.Row
-        
-        if quest_type:
-            cursor = await db.execute('''
-                SELECT original_quest_id, completed_count, last_completed
-                FROM quests_statistics
-                WHERE user_id = ? AND quest_type = ?
-            ''', (user_id, quest_type))
-        else:
+    try:
+        result = await writer_for(DB_PATH).submit(_claim)
+    except LedgerError as e:
+        logger.warning(f"Quest reward {user_quest_id} for user {user_id} not paid: {e}")
+        return None
+    if result is None:
+        return None
+    rewards, balances = result
+    _publish_balances(balances)
+    if 'exp' in rewards:
+        await profile_manager.update_exp(user_id, rewards['exp'])
+    return rewards
+
+async def get_quest_statistics(user_id: int, quest_type: str = None, detailed: bool = True) -> Dict[str, Any]:
+    """Получает статистику выполнения заданий: итоги из свёрток quest_user_totals, детали - из quests_statistics"""
+    async with get_pool().acquire() as db:
+        # Итоги по типам - не больше двух строк по первичному ключу
+        cursor = await db.execute('''
+            SELECT quest_type, completed_count
+            FROM quest_user_totals
+            WHERE user_id = ? AND (? IS NULL OR quest_type = ?)
+        ''', (user_id, quest_type, quest_type))
+        quests_by_type = dict(await cursor.fetchall())
+        
+        detailed_stats = []
+        if detailed:
             cursor = await db.execute('''
                 SELECT original_quest_id, quest_type, completed_count, last_completed
                 FROM quests_statistics
-                WHERE user_id = ?
-            ''', (user_id,))
-        
-        rows = await cursor.fetchall()
-        
-        # Общая статистика
-        total_completed = 0
-        quests_by_type = {}
-        
-        for row in rows:
-            total_completed += row['completed_count']
-            quest_type = row['quest_type']
-            if quest_type not in quests_by_type:
-                quests_by_type[quest_type] = 0
-            quests_by_type[quest_type] += row['completed_count']
+                WHERE user_id = ? AND (? IS NULL OR quest_type = ?)
+            ''', (user_id, quest_type, quest_type))
+            columns = [c[0] for c in cursor.description]
+            detailed_stats = [dict(zip(columns, row)) for row in await cursor.fetchall()]
         
         return {
-            'total_completed': total_completed,
+            'total_completed': sum(quests_by_type.values()),
             'quests_by_type': quests_by_type,
-            'detailed_stats': [dict(row) for row in rows]
+            'detailed_stats': detailed_stats
         }
 
+async def get_global_quest_stats(original_quest_id: str = None) -> List[Dict[str, Any]]:
+    """Получает статистику выполнения заданий по всем пользователям из свёрток quest_totals"""
+    async with get_pool().acquire() as db:
+        if original_quest_id:
+            # Статистика по конкретному заданию
+            cursor = await db.execute('''
+                SELECT quest_type, original_quest_id, completed_count, unique_users, last_completed
+                FROM quest_totals
+                WHERE original_quest_id = ? AND quest_type != ?
+            ''', (original_quest_id, ALL_QUESTS))
+        else:
+            # Итоги по типам и общий итог (original_quest_id = '*')
+            cursor = await db.execute('''
+                SELECT quest_type, original_quest_id, completed_count, unique_users, last_completed
+                FROM quest_totals
+                WHERE original_quest_id = ?
+            ''', (ALL_QUESTS,))
+        
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
 async def get_global_command_stats(command_name: str = None) -> Dict[str, Any]:
-    """Получает глобальную статистику использования команд"""
-    async with aiosqlite.connect('profiles.db') as db:
+    """Получает глобальную статистику использования команд из свёрток analytics_action_totals"""
+    async with open_connection(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
         
         if command_name:
             # Статистика по конкретной команде
             cursor = await db.execute('''
-                SELECT COUNT(*) as usage_count, 
-                       COUNT(DISTINCT user_id) as unique_users
-                FROM analytics_interactions 
+                SELECT usage_count, unique_users
+                FROM analytics_action_totals
                 WHERE action_type = 'command' AND mode = ?
             ''', (command_name,))
         else:
-            # Общая статистика по всем командам
+            # Общая статистика по всем командам (строка mode = '*' агрегирует все режимы)
             cursor = await db.execute('''
-                SELECT action_type as command_name, 
-                       COUNT(*) as usage_count,
-                       COUNT(DISTINCT user_id) as unique_users
-                FROM analytics_interactions 
-                WHERE action_type = 'command'
-                GROUP BY action_type
-            ''')
+                SELECT action_type as command_name, usage_count, unique_users
+                FROM analytics_action_totals
+                WHERE action_type = 'command' AND mode = ?
+            ''', (ALL_MODES,))
         
         result = await cursor.fetchall()
         return [dict(row) for row in result]
@@ -530,11 +327,11 @@ async def cmd_show_quests(message: types.Message, profile_manager: ProfileManage
     """Показывает текущие задания пользователя"""
     user_id = message.from_user.id
     
-    # Обновляем задания если нужно
-    await refresh_user_quests(user_id, profile_manager)
-    
-    # Принудительно получаем актуальные данные из базы
+    # Задания выдаёт планировщик смены; прогресс из памяти движка - в БД перед чтением
+    await quest_engine.flush()
     quests = await get_user_quests(user_id)
+    if not quests['daily'] or not quests['weekly']:
+        quest_rollover.request(user_id)
     
     builder = InlineKeyboardBuilder()
     
@@ -562,7 +359,7 @@ async def cmd_show_quests(message: types.Message, profile_manager: ProfileManage
                     callback_data=f"claim_quest:daily:{quest['user_quest_id']}"
                 ))
     else:
-        text += "Нет активных ежедневных заданий\n\n"
+        text += "⏳ Задания готовятся - нажмите «Обновить» через пару секунд\n\n"
     
     # Еженедельные задания
     text += f"\n🎯 {hbold('Еженедельные задания:')}\n"
@@ -586,7 +383,7 @@ async def cmd_show_quests(message: types.Message, profile_manager: ProfileManage
                     callback_data=f"claim_quest:weekly:{quest['user_quest_id']}"
                 ))
     else:
-        text += "Нет активных еженедельных заданий\n\n"
+        text += "⏳ Задания готовятся - нажмите «Обновить» через пару секунд\n\n"
     
     # Кнопка статистики
     builder.row(InlineKeyboardButton(text="📊 Статистика", callback_data="quests_stats"))
@@ -619,7 +416,7 @@ async def refresh_quests_callback(callback: types.CallbackQuery, profile_manager
 async def show_quests_stats(callback: types.CallbackQuery):
     """Показывает статистику заданий"""
     user_id = callback.from_user.id
-    stats = await get_quest_statistics(user_id)
+    stats = await get_quest_statistics(user_id, detailed=False)
     
     text = f"📊 {hbold('Статистика заданий')}\n\n"
     text += f"✅ Всего выполнено: {stats['total_completed']}\n\n"
@@ -628,6 +425,10 @@ async def show_quests_stats(callback: types.CallbackQuery):
         type_name = "Ежедневные" if quest_type == "daily" else "Еженедельные"
         text += f"{type_name}: {count} выполнено\n"
     
+    for row in await get_global_quest_stats():
+        if row['quest_type'] == ALL_QUESTS:
+            text += f"\n🌍 Всего в боте: {row['completed_count']} выполнено у {row['unique_users']} игроков\n"
+    
     await callback.message.answer(text, parse_mode=ParseMode.MARKDOWN)
     await callback.answer()
 
@@ -689,174 +490,52 @@ async def cmd_stats(message: types.Message):
     
     await message.answer(text, parse_mode=ParseMode.MARKDOWN)
 
-# Функции для обновления прогресса заданий из других модулей
+# Функции для обновления прогресса заданий из других модулей: события движка заданий
 async def update_message_quests(user_id: int, message_count: int, bot: Bot = None):
     """Обновляет задания связанные с сообщениями"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            if quest['type'] == 'message_count' and not quest['completed']:
-                await update_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 
-                    message_count, bot
-                )
+    await quest_engine.emit(user_id, 'message_count', message_count, bot)
 
 async def update_work_quests(user_id: int, work_count: int, bot: Bot = None):
     """Обновляет задания связанные с работой"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            if quest['type'] == 'work' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 
-                    work_count, bot
-                )
+    await quest_engine.emit(user_id, 'work', work_count, bot)
 
 async def update_exp_quests(user_id: int, exp_gained: int, bot: Bot = None):
     """Обновляет задания связанные с получением опыта"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            if quest['type'] == 'exp_gain' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 
-                    exp_gained, bot
-                )
+    await quest_engine.emit(user_id, 'exp_gain', exp_gained, bot)
 
 async def update_casino_quests(user_id: int, game_type: str, won: bool = False, win_amount: int = 0, bot: Bot = None):
     """Обновляет задания связанные с казино"""
-    logger.info(f"Обновление заданий казино: user={user_id}, game={game_type}, won={won}, amount={win_amount}")
-    
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            # Для игр в казино
-            if quest['type'] == 'casino_games' and not quest['completed']:
-                logger.info(f"Обновление casino_games: {quest['name']}")
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Для выигрышей в казино
-            if quest['type'] == 'casino_wins' and won and not quest['completed']:
-                logger.info(f"Обновление casino_wins: {quest['name']}")
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Для прибыли в казино (еженедельные)
-            if quest['type'] == 'casino_profit' and won and not quest['completed']:
-                logger.info(f"Обновление casino_profit: {quest['name']}")
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], win_amount, bot
-                )
-
-async def update_rp_quests(user_id: int, action_type: str, unique_action: bool = False, bot: Bot = None):
-    """Обновляет задания связанные с RP-действиями"""
-    logger.info(f"Обновление RP заданий: user={user_id}, action={action_type}, unique={unique_action}")
-    
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            # Обычные RP-действия
-            if quest['type'] == 'rp_actions' and action_type == 'rp' and not quest['completed']:
-                logger.info(f"Обновление rp_actions: {quest['name']}")
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Уникальные RP-действия
-            if quest['type'] == 'unique_rp_actions' and unique_action and not quest['completed']:
-                logger.info(f"Обновление unique_rp_actions: {quest['name']}")
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Общее количество уникальных RP-действий (еженедельные)
-            if quest['type'] == 'unique_rp_actions_total' and unique_action and not quest['completed']:
-                logger.info(f"Обновление unique_rp_actions_total: {quest['name']}")
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
+    await quest_engine.emit(user_id, 'casino_games', 1, bot)
+    if won:
+        await quest_engine.emit(user_id, 'casino_wins', 1, bot)
+        # Прибыль в казино (еженедельные)
+        await quest_engine.emit(user_id, 'casino_profit', win_amount, bot)
 
 async def update_market_quests(user_id: int, action_type: str, count: int = 1, profit: int = 0, bot: Bot = None):
     """Обновляет задания связанные с рынком"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            # Выставление предметов на рынок
-            if quest['type'] == 'market_listings' and action_type == 'list' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], count, bot
-                )
-            
-            # Покупки на рынке
-            if quest['type'] == 'market_purchases' and action_type == 'buy' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], count, bot
-                )
-            
-            # Прибыль с рынка (еженедельные)
-            if quest['type'] == 'market_profit' and action_type == 'profit' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], profit, bot
-                )
+    if action_type == 'list':
+        await quest_engine.emit(user_id, 'market_listings', count, bot)
+    elif action_type == 'buy':
+        await quest_engine.emit(user_id, 'market_purchases', count, bot)
+    elif action_type == 'profit':
+        await quest_engine.emit(user_id, 'market_profit', profit, bot)
 
 async def update_rp_quests(user_id: int, action_type: str, unique_action: bool = False, bot: Bot = None):
     """Обновляет задания связанные с RP-действиями"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            # Обычные RP-действия
-            if quest['type'] == 'rp_actions' and action_type == 'rp' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Уникальные RP-действия
-            if quest['type'] == 'unique_rp_actions' and unique_action and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Общее количество уникальных RP-действий (еженедельные)
-            if quest['type'] == 'unique_rp_actions_total' and unique_action and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
+    if action_type == 'rp':
+        await quest_engine.emit(user_id, 'rp_actions', 1, bot)
+    if unique_action:
+        await quest_engine.emit(user_id, 'unique_rp_actions', 1, bot)
+        # Общее количество уникальных RP-действий (еженедельные)
+        await quest_engine.emit(user_id, 'unique_rp_actions_total', 1, bot)
 
 async def update_crafting_quests(user_id: int, item_rarity: str = 'common', bot: Bot = None):
     """Обновляет задания связанные с крафтом"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            # Обычный крафт
-            if quest['type'] == 'crafting' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
-            
-            # Крафт редких/эпических предметов
-            if quest['type'] == 'rare_crafting' and item_rarity in ['rare', 'epic'] and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], 1, bot
-                )
+    await quest_engine.emit(user_id, 'crafting', 1, bot)
+    # Крафт редких/эпических предметов
+    if item_rarity in ['rare', 'epic']:
+        await quest_engine.emit(user_id, 'rare_crafting', 1, bot)
 
 async def update_activity_quests(user_id: int, activity_score: int, bot: Bot = None):
     """Обновляет задания связанные с активностью"""
-    quests = await get_user_quests(user_id)
-    
-    for quest_type in ['daily', 'weekly']:
-        for quest in quests[quest_type]:
-            if quest['type'] == 'activity_score' and not quest['completed']:
-                await increment_quest_progress(
-                    user_id, quest_type, quest['user_quest_id'], activity_score, bot
-                )
+    await quest_engine.emit(user_id, 'activity_score', activity_score, bot)
@@ -5,6 +5,7 @@ import asyncio
 import importlib
 import tempfile
 from contextlib import suppress
+from datetime import datetime
 from typing import Optional
 
 from core.main.ez_main import (
@@ -13,9 +14,12 @@ from core.main.ez_main import (
     VALUE_FILE_PATH,
     OLLAMA_API_BASE_URL,
     OLLAMA_MODEL_NAME,
+    ADMIN_USER_ID,
 )
 from core.main.ollama import NeuralAPI, safe_send_message, typing_animation, fetch_random_joke, StickerManager
 from core.group.stat.manager import ProfileManager
+from core.db.querystats import format_query_stats, reset_query_stats
+from core.db.ledger import LedgerError
 import database as db
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -210,6 +214,86 @@ async def cmd_unsubscribe_value(message: Message):
     await message.reply("Вы успешно отписались от уведомлений об изменении значения.")
     await db.log_user_interaction(user_id, "unsubscribe_value_command", "command")
 
+@dp.message(Command("querystats"))
+async def cmd_query_stats(message: Message):
+    """Самые дорогие SQL-запросы по суммарному времени (только ADMIN_USER_ID). /querystats reset - сброс."""
+    if ADMIN_USER_ID is None or message.from_user.id != ADMIN_USER_ID:
+        return
+    parts = (message.text or "").split()
+    if len(parts) > 1 and parts[1].lower() == "reset":
+        reset_query_stats()
+        await message.reply("Статистика запросов сброшена.")
+        return
+    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+    # Telegram ограничивает сообщение 4096 символами.
+    await message.reply(format_query_stats(limit)[:4000], parse_mode=None)
+
+@dp.message(Command("ledger"))
+async def cmd_ledger(message: Message):
+    """
+    Журнал валют (только ADMIN_USER_ID): /ledger [user_id|счёт|all] [N] - последние проводки
+    (счёт - имя из core/db/ledger.SYSTEM_ACCOUNTS), /ledger check - сверка балансов с журналом.
+    """
+    if ADMIN_USER_ID is None or message.from_user.id != ADMIN_USER_ID:
+        return
+    parts = (message.text or "").split()[1:]
+    if parts and parts[0].lower() == "check":
+        problems = await db.verify_ledger()
+        text = "Журнал сходится с балансами." if not problems else "\n".join(problems[:50])
+        await message.reply(text[:4000], parse_mode=None)
+        return
+    account = None
+    if parts and parts[0] != "all":
+        account = int(parts[0]) if parts[0].isdigit() else parts[0]
+    limit = min(int(parts[1]), 100) if len(parts) > 1 and parts[1].isdigit() else 20
+    try:
+        entries = await db.get_ledger_entries(account=account, limit=limit)
+    except LedgerError as e:
+        await message.reply(f"Ошибка: {e}", parse_mode=None)
+        return
+    lines = [
+        f"#{e['entry_id']} {datetime.fromtimestamp(e['ts']):%d.%m %H:%M} {e['debit']} → {e['credit']}: "
+        f"{e['amount']} {e['currency']} ({e['reason']})"
+        for e in entries
+    ]
+    await message.reply(("\n".join(lines) or "Проводок нет.")[:4000], parse_mode=None)
+
+@dp.message(Command("questtotals"))
+async def cmd_quest_totals(message: Message):
+    """
+    Свёртки выполнения заданий (только ADMIN_USER_ID): /questtotals [check] - сверка с quests_statistics,
+    /questtotals rebuild - пересборка из quests_statistics.
+    """
+    if ADMIN_USER_ID is None or message.from_user.id != ADMIN_USER_ID:
+        return
+    parts = (message.text or "").split()[1:]
+    if parts and parts[0].lower() == "rebuild":
+        rows = await db.rebuild_quest_totals()
+        await message.reply(f"Свёртки заданий пересобраны: {rows} строк.", parse_mode=None)
+        return
+    problems = await db.verify_quest_totals()
+    text = "Свёртки заданий сходятся со статистикой." if not problems else "\n".join(problems[:50])
+    await message.reply(text[:4000], parse_mode=None)
+
+@dp.message(Command("syncbg"))
+async def cmd_sync_backgrounds(message: Message):
+    """
+    Сверка активных фонов (только ADMIN_USER_ID): фон, выбранный в RPG-инвентаре (user_active_background),
+    переносится в профиль (user_profiles.active_background), по которому рисуется карточка.
+    /syncbg - только показать разницу, /syncbg apply - записать.
+    """
+    if ADMIN_USER_ID is None or message.from_user.id != ADMIN_USER_ID:
+        return
+    parts = (message.text or "").split()[1:]
+    dry_run = not (parts and parts[0].lower() == "apply")
+    report = await db.sync_active_backgrounds(await db.get_rpg_active_backgrounds(), dry_run=dry_run)
+    lines = [f"{'Будет изменено' if dry_run else 'Изменено'}: {report['changed']}, без изменений: "
+             f"{report['unchanged']}, без профиля: {report['missing']}."]
+    lines += [f"{user_id}: {old} → {new}" for user_id, old, new in report.get("diff", [])[:30]]
+    if dry_run and report["changed"]:
+        lines.append("Записать: /syncbg apply")
+    await message.reply("\n".join(lines)[:4000], parse_mode=None)
+
 @dp.message(F.photo)
 async def photo_handler(message: Message):
     """Обработчик для входящих фотографий."""
@@ -1,32 +1,50 @@
 import aiosqlite
 import asyncio
+import json
+import sqlite3
 import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 import time
 import os
+from collections import OrderedDict
+
+from core.db.pool import SQLitePool, DEFAULT_POOL_SIZE
+from core.db.writer import writer_for
+from core.db.migrations import apply_migrations
+from core.db.analytics import DAY, compact_interactions, purge_expired_hourly, purge_expired_raw
+from core.db.ledger import CURRENCIES, Account, InsufficientFunds, LedgerError, check_ledger, journal_entry, journal_sql, post_tx, transfer_tx
+from core.db.maintenance import incremental_vacuum
+from core.db.quest_totals import check_quest_totals, rebuild_quest_totals_tx
+from core.group.stat.leaderboard import leaderboard
 
 logger = logging.getLogger(__name__)
 
 DB_FILE = Path("data") / "bot_database.db"
 DB_FILE.parent.mkdir(exist_ok=True)
 DB_PATH = str(DB_FILE)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", DEFAULT_POOL_SIZE))
 
-async def create_promo_table():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS used_promocodes (
-                user_id INTEGER,
-                promocode TEXT,
-                used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, promocode)
-            )
-        ''')
-        await db.commit()
+# Общий пул соединений к единой БД бота (профили, RPG и квесты живут в том же файле).
+_pool = SQLitePool(DB_PATH, size=DB_POOL_SIZE)
+# Единственный писатель для горячих записей на каждое сообщение (групповой коммит).
+_writer = writer_for(DB_PATH)
+
+
+def get_pool() -> SQLitePool:
+    return _pool
+
+
+async def open_pool() -> None:
+    await _pool.open()
+
+
+async def close_pool() -> None:
+    await _pool.close()
 
 async def check_promo_used(user_id: int, promocode: str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             "SELECT 1 FROM used_promocodes WHERE user_id = ? AND promocode = ?",
             (user_id, promocode.upper())
@@ -34,7 +52,7 @@ async def check_promo_used(user_id: int, promocode: str) -> bool:
         return await cursor.fetchone() is not None
 
 async def mark_promo_used(user_id: int, promocode: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             "INSERT OR IGNORE INTO used_promocodes (user_id, promocode) VALUES (?, ?)",
             (user_id, promocode.upper())
@@ -42,7 +60,7 @@ async def mark_promo_used(user_id: int, promocode: str):
         await db.commit()
 
 async def get_promo_use_count(promocode: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             "SELECT COUNT(*) FROM used_promocodes WHERE promocode = ?",
             (promocode.upper(),)
@@ -51,7 +69,7 @@ async def get_promo_use_count(promocode: str) -> int:
         return result[0] if result else 0
 
 async def check_user_owns_item(user_id: int, item_key: str, item_type: str) -> bool:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             'SELECT 1 FROM user_inventory WHERE user_id = ? AND item_key = ? AND item_type = ?',
             (user_id, item_key, item_type)
@@ -60,139 +78,108 @@ async def check_user_owns_item(user_id: int, item_key: str, item_type: str) -> b
         return result is not None
 
 async def initialize_database() -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT NOT NULL,
-                last_active_ts REAL DEFAULT 0
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS value_subscriptions (
-                user_id INTEGER PRIMARY KEY,
-                subscribed_ts REAL NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS dialog_history (
-                history_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp REAL NOT NULL,
-                mode TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('user', 'assistant')),
-                content TEXT NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE INDEX IF NOT EXISTS idx_dialog_history_user_ts ON dialog_history (user_id, timestamp DESC)
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_modes (
-                user_id INTEGER PRIMARY KEY,
-                mode TEXT NOT NULL DEFAULT 'saharoza',
-                rating_opportunities_count INTEGER DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS analytics_interactions (
-                interaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp REAL NOT NULL,
-                mode TEXT NOT NULL,
-                action_type TEXT NOT NULL DEFAULT 'message',
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE INDEX IF NOT EXISTS idx_interactions_user_ts_mode ON analytics_interactions (user_id, timestamp DESC, mode)
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS analytics_ratings (
-                rating_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                rated_message_id INTEGER,
-                dialog_history_id INTEGER,
-                timestamp REAL NOT NULL,
-                rating INTEGER NOT NULL CHECK(rating IN (0, 1)),
-                message_preview TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                FOREIGN KEY(dialog_history_id) REFERENCES dialog_history(history_id) ON DELETE SET NULL
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS rp_user_stats (
-                user_id INTEGER PRIMARY KEY,
-                hp INTEGER NOT NULL DEFAULT 100,
-                heal_cooldown_ts REAL NOT NULL DEFAULT 0,
-                recovery_end_ts REAL NOT NULL DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                user_id INTEGER NOT NULL,
-                item_key TEXT NOT NULL,
-                item_type TEXT NOT NULL,
-                PRIMARY KEY (user_id, item_key),
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id INTEGER PRIMARY KEY,
-                hp INTEGER DEFAULT 100,
-                level INTEGER DEFAULT 1,
-                exp INTEGER DEFAULT 0,
-                lumcoins INTEGER DEFAULT 0,
-                daily_messages INTEGER DEFAULT 0,
-                total_messages INTEGER DEFAULT 0,
-                flames INTEGER DEFAULT 0,
-                active_background TEXT DEFAULT 'default',
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-        await db.commit()
-    async with aiosqlite.connect('profiles.db') as conn:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                user_id INTEGER,
-                item_key TEXT,
-                item_type TEXT,
-                item_data TEXT,
-                acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, item_key)
-            )
-        ''')
-        await conn.commit()
-    logger.info("Database initialized successfully.")
+    """Приводит схему БД к последней версии (см. core/db/migrations.py). Вызывается один раз при старте."""
+    applied = await asyncio.to_thread(apply_migrations, DB_PATH)
+    logger.info("Database initialized successfully (%d migrations applied).", len(applied))
+
+LAST_ACTIVE_FLUSH_SECONDS = float(os.getenv("LAST_ACTIVE_FLUSH_SECONDS", 60))
+
+# Последние записанные (username, first_name) по user_id: пока они не меняются,
+# ensure_user_exists не пишет в БД. last_active_ts копится в памяти и сбрасывается
+# одним пакетным UPDATE раз в LAST_ACTIVE_FLUSH_SECONDS (см. run_last_active_flusher).
+_identity_cache: Dict[int, Tuple[Optional[str], str]] = {}
+_pending_last_active: Dict[int, float] = {}
+_identity_stats = {"skipped": 0, "written": 0, "flushed": 0}
+
+
+def get_identity_cache_stats() -> Dict[str, int]:
+    """Счётчики кэша пользователей: пропущенные/выполненные upsert и сброшенные last_active_ts."""
+    return {**_identity_stats, "size": len(_identity_cache), "pending": len(_pending_last_active)}
+
+
+def is_user_known(user_id: int) -> bool:
+    """True, если строка users для пользователя уже записана в этом процессе."""
+    return user_id in _identity_cache
+
+
+def touch_user(user_id: int, timestamp: Optional[float] = None) -> None:
+    """Отмечает активность пользователя; в БД попадёт при следующем сбросе."""
+    ts = timestamp if timestamp is not None else datetime.now().timestamp()
+    if ts > _pending_last_active.get(user_id, 0):
+        _pending_last_active[user_id] = ts
+
+
+async def flush_last_active() -> int:
+    """Записывает накопленные last_active_ts одним пакетом. Возвращает число пользователей."""
+    if not _pending_last_active:
+        return 0
+    pending = list(_pending_last_active.items())
+    _pending_last_active.clear()
+
+    def _write(db: sqlite3.Connection) -> None:
+        db.executemany(
+            'UPDATE users SET last_active_ts = MAX(COALESCE(last_active_ts, 0), ?) WHERE user_id = ?',
+            [(ts, user_id) for user_id, ts in pending]
+        )
+
+    try:
+        await _writer.submit(_write)
+    except Exception:
+        # Не теряем отметки: вернём их, не перетирая более свежие.
+        for user_id, ts in pending:
+            touch_user(user_id, ts)
+        raise
+    _identity_stats["flushed"] += len(pending)
+    return len(pending)
+
+
+async def run_last_active_flusher(interval: float = LAST_ACTIVE_FLUSH_SECONDS) -> None:
+    """Фоновая задача: периодически сбрасывает last_active_ts. Запускается из main()."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_last_active()
+        except Exception as e:
+            logger.error(f"Failed to flush last_active_ts: {e}")
+
 
 async def ensure_user_exists(user_id: int, username: Optional[str], first_name: str) -> None:
-    current_timestamp = datetime.now().timestamp()
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute('''
-            INSERT INTO users (user_id, username, first_name, last_active_ts)
-            VALUES (?, ?, ?, ?)
+    touch_user(user_id)
+    identity = (username, first_name)
+    if _identity_cache.get(user_id) == identity:
+        _identity_stats["skipped"] += 1
+        return
+
+    def _write(db: sqlite3.Connection) -> None:
+        db.execute('''
+            INSERT INTO users (user_id, username, first_name)
+            VALUES (?, ?, ?)
             ON CONFLICT(user_id) DO UPDATE SET
                 username = excluded.username,
-                first_name = excluded.first_name,
-                last_active_ts = excluded.last_active_ts
-        ''', (user_id, username, first_name, current_timestamp))
-        await db.execute('''
+                first_name = excluded.first_name
+        ''', (user_id, username, first_name))
+        db.execute('''
             INSERT OR IGNORE INTO user_modes (user_id, mode, rating_opportunities_count)
             VALUES (?, 'saharoza', 0)
         ''', (user_id,))
-        await db.execute('''
+        db.execute('''
             INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)
         ''', (user_id,))
-        await db.commit()
+
+    # Запоминаем до отправки: параллельные сообщения того же пользователя не дублируют
+    # upsert - писатель сохраняет порядок, и строка будет записана раньше их намерений.
+    _identity_cache[user_id] = identity
+    _forget_username(user_id, username)
+    try:
+        await _writer.submit(_write)
+    except Exception:
+        if _identity_cache.get(user_id) == identity:
+            del _identity_cache[user_id]
+        raise
+    _identity_stats["written"] += 1
 
 async def get_user_profile_info(user_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute('''
             SELECT u.user_id, u.username, u.first_name, u.last_active_ts,
                    up.hp, up.level, up.exp, up.lumcoins, up.daily_messages, up.total_messages, up.flames
@@ -202,7 +189,9 @@ async def get_user_profile_info(user_id: int) -> Optional[Dict[str, Any]]:
         ''', (user_id,))
         row = await cursor.fetchone()
         if row:
-            last_active_formatted = datetime.fromtimestamp(row[3]).isoformat() if row[3] and row[3] > 0 else 'N/A'
+            # Ещё не сброшенная отметка активности свежее той, что в БД.
+            last_active_ts = max(row[3] or 0, _pending_last_active.get(user_id, 0))
+            last_active_formatted = datetime.fromtimestamp(last_active_ts).isoformat() if last_active_ts > 0 else 'N/A'
             return {
                 "user_id": row[0],
                 "username": row[1],
@@ -219,49 +208,45 @@ async def get_user_profile_info(user_id: int) -> Optional[Dict[str, Any]]:
         return None
 
 async def add_value_subscriber(user_id: int) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('''
             INSERT OR IGNORE INTO value_subscriptions (user_id, subscribed_ts) VALUES (?, ?)
         ''', (user_id, datetime.now().timestamp()))
         await db.commit()
 
 async def remove_value_subscriber(user_id: int) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('DELETE FROM value_subscriptions WHERE user_id = ?', (user_id,))
         await db.commit()
 
 async def get_value_subscribers() -> List[int]:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         async with db.execute('SELECT user_id FROM value_subscriptions') as cursor:
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
 
 async def check_value_subscriber_status(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         async with db.execute('SELECT 1 FROM value_subscriptions WHERE user_id = ?', (user_id,)) as cursor:
             return await cursor.fetchone() is not None
 
 async def add_chat_history_entry(user_id: int, mode: str, user_message_content: str, bot_response_content: str) -> None:
+    """Добавляет реплики пользователя и бота. Старые записи сверх DIALOG_HISTORY_LIMIT удаляет триггер."""
     current_timestamp = datetime.now().timestamp()
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute('''
-            INSERT INTO dialog_history (user_id, timestamp, mode, role, content)
-            VALUES (?, ?, ?, 'user', ?)
-        ''', (user_id, current_timestamp - 0.001, mode, user_message_content))
-        await db.execute('''
+
+    def _write(db: sqlite3.Connection) -> None:
+        db.executemany('''
             INSERT INTO dialog_history (user_id, timestamp, mode, role, content)
-            VALUES (?, ?, ?, 'assistant', ?)
-        ''', (user_id, current_timestamp, mode, bot_response_content))
-        await db.execute('''
-            DELETE FROM dialog_history
-            WHERE history_id NOT IN (
-                SELECT history_id FROM dialog_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT 20
-            ) AND user_id = ?
-        ''', (user_id, user_id))
-        await db.commit()
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (user_id, current_timestamp - 0.001, mode, 'user', user_message_content),
+            (user_id, current_timestamp, mode, 'assistant', bot_response_content),
+        ])
+
+    await _writer.submit(_write)
 
 async def get_user_dialog_history(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         async with db.execute('''
             SELECT role, content, mode, timestamp FROM dialog_history
             WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?
@@ -287,7 +272,7 @@ async def get_ollama_dialog_history(user_id: int, limit_turns: int = 5) -> List[
     return ollama_history
 
 async def set_user_current_mode(user_id: int, mode: str) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('''
             INSERT INTO user_modes (user_id, mode) VALUES (?, ?)
             ON CONFLICT(user_id) DO UPDATE SET mode = excluded.mode
@@ -295,7 +280,7 @@ async def set_user_current_mode(user_id: int, mode: str) -> None:
         await db.commit()
 
 async def get_user_mode_and_rating_opportunities(user_id: int) -> Dict[str, Any]:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('''
             INSERT OR IGNORE INTO user_modes (user_id, mode, rating_opportunities_count)
             VALUES (?, 'saharoza', 0)
@@ -305,7 +290,7 @@ async def get_user_mode_and_rating_opportunities(user_id: int) -> Dict[str, Any]
             return {"mode": row[0], "rating_opportunities_count": row[1]}
 
 async def increment_user_rating_opportunity_count(user_id: int) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('''
             UPDATE user_modes
             SET rating_opportunities_count = rating_opportunities_count + 1
@@ -314,53 +299,279 @@ async def increment_user_rating_opportunity_count(user_id: int) -> None:
         await db.commit()
 
 async def reset_user_rating_opportunity_count(user_id: int) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('UPDATE user_modes SET rating_opportunities_count = 0 WHERE user_id = ?', (user_id,))
         await db.commit()
 
 async def log_user_interaction(user_id: int, mode: str, action_type: str = "message") -> None:
     current_timestamp = datetime.now().timestamp()
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute('''
+
+    def _write(db: sqlite3.Connection) -> None:
+        db.execute('''
             INSERT INTO analytics_interactions (user_id, timestamp, mode, action_type) VALUES (?, ?, ?, ?)
         ''', (user_id, current_timestamp, mode, action_type))
-        await db.execute('UPDATE users SET last_active_ts = ? WHERE user_id = ?', (current_timestamp, user_id))
-        await db.commit()
+
+    touch_user(user_id, current_timestamp)
+    await _writer.submit(_write)
 
 async def log_user_rating(user_id: int, rating: int, message_preview: str,
                           rated_message_id: Optional[int] = None, dialog_history_id: Optional[int] = None) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('''
             INSERT INTO analytics_ratings (user_id, timestamp, rating, message_preview, rated_message_id, dialog_history_id)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (user_id, datetime.now().timestamp(), rating, message_preview[:500], rated_message_id, dialog_history_id))
         await db.commit()
 
+ANALYTICS_COMPACT_SECONDS = float(os.getenv("ANALYTICS_COMPACT_SECONDS", 60))
+ANALYTICS_COMPACT_BATCH = int(os.getenv("ANALYTICS_COMPACT_BATCH", 5000))
+ANALYTICS_RAW_RETENTION_DAYS = float(os.getenv("ANALYTICS_RAW_RETENTION_DAYS", 7))
+ANALYTICS_HOURLY_RETENTION_DAYS = float(os.getenv("ANALYTICS_HOURLY_RETENTION_DAYS", 90))
+ANALYTICS_PURGE_BATCH = int(os.getenv("ANALYTICS_PURGE_BATCH", 5000))
+
+_analytics_stats = {"compacted": 0, "purged_raw": 0, "purged_hourly": 0}
+
+
+def get_analytics_stats() -> Dict[str, int]:
+    """Счётчики компактора: свёрнутые и удалённые по сроку хранения строки."""
+    return dict(_analytics_stats)
+
+
+async def compact_analytics(batch_size: int = ANALYTICS_COMPACT_BATCH) -> int:
+    """Сворачивает все накопленные сырые взаимодействия пачками по batch_size. Возвращает число строк."""
+    total = 0
+    while True:
+        # Каждая пачка - отдельное намерение, чтобы не держать транзакцию писателя надолго.
+        rows = await _writer.submit(lambda conn: compact_interactions(conn, batch_size))
+        total += rows
+        if rows < batch_size:
+            break
+    _analytics_stats["compacted"] += total
+    return total
+
+
+async def purge_analytics(now: Optional[float] = None, batch_size: int = ANALYTICS_PURGE_BATCH) -> Dict[str, int]:
+    """Удаляет свёрнутые сырые строки и часовые бакеты старше сроков хранения пачками по batch_size."""
+    now = now if now is not None else datetime.now().timestamp()
+    purged = {"raw": 0, "hourly": 0}
+    for key, purge, before in (("raw", purge_expired_raw, now - ANALYTICS_RAW_RETENTION_DAYS * DAY),
+                               ("hourly", purge_expired_hourly, now - ANALYTICS_HOURLY_RETENTION_DAYS * DAY)):
+        while True:
+            # Как в compact_analytics: пачка - отдельное намерение, очередь писателя не ждёт всю чистку.
+            rows = await _writer.submit(lambda conn: purge(conn, before, batch_size))
+            purged[key] += rows
+            if rows < batch_size:
+                break
+    _analytics_stats["purged_raw"] += purged["raw"]
+    _analytics_stats["purged_hourly"] += purged["hourly"]
+    return purged
+
+
+async def run_analytics_compactor(interval: float = ANALYTICS_COMPACT_SECONDS) -> None:
+    """Фоновая задача: сворачивает analytics_interactions и раз в сутки чистит старые строки. Запускается из main()."""
+    last_purge = 0.0
+    while True:
+        try:
+            await compact_analytics()
+            if time.monotonic() - last_purge >= DAY:
+                purged = await purge_analytics()
+                last_purge = time.monotonic()
+                logger.info("Analytics retention: %s", purged)
+        except Exception as e:
+            logger.error(f"Failed to compact analytics: {e}")
+        await asyncio.sleep(interval)
+
+
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", 20000))
+# Страховка от записей в обход журнала из другого процесса (GUImain).
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", 300))
+
+# Горячие балансы: (user_id, валюта) -> (баланс, истекает). Заполняются при
+# первом чтении и сквозной записью из каждой проводки (_publish_balances) и
+# записи профиля в ProfileManager, поэтому чтения в меню казино, магазинов и
+# инвестиций обходятся без запроса к БД. Промахи (нет профиля) не кэшируются.
+_balance_cache: "OrderedDict[Tuple[int, str], Tuple[int, float]]" = OrderedDict()
+_balance_epoch = 0
+_balance_stats = {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0}
+
+
+def get_balance_cache_stats() -> Dict[str, Any]:
+    lookups = _balance_stats["hits"] + _balance_stats["misses"]
+    return {**_balance_stats, "hit_rate": round(_balance_stats["hits"] / lookups, 3) if lookups else None,
+            "size": len(_balance_cache)}
+
+
+def cache_balances(user_id: int, **balances: Optional[int]) -> None:
+    """Сквозная запись свежих (только что закоммиченных) балансов; None пропускаются."""
+    expires = time.monotonic() + BALANCE_CACHE_TTL
+    for currency, balance in balances.items():
+        if balance is None:
+            continue
+        key = (user_id, currency)
+        _balance_cache[key] = (int(balance), expires)
+        _balance_cache.move_to_end(key)
+        _balance_stats["writes"] += 1
+    while len(_balance_cache) > BALANCE_CACHE_SIZE:
+        _balance_cache.popitem(last=False)
+
+
+def invalidate_balances(user_id: Optional[int] = None) -> None:
+    """Сбрасывает закэшированные балансы пользователя (или все, если user_id не задан)."""
+    global _balance_epoch
+    _balance_epoch += 1
+    _balance_stats["invalidations"] += 1
+    if user_id is None:
+        _balance_cache.clear()
+        return
+    for currency in CURRENCIES:
+        _balance_cache.pop((user_id, currency), None)
+
+
+async def get_balance(user_id: int, currency: str = "lumcoins") -> int:
+    """Баланс пользователя из кэша или из user_profiles; 0, если профиля нет."""
+    key = (user_id, currency)
+    cached = _balance_cache.get(key)
+    if cached is not None and cached[1] > time.monotonic():
+        _balance_cache.move_to_end(key)
+        _balance_stats["hits"] += 1
+        return cached[0]
+    _balance_stats["misses"] += 1
+    epoch = _balance_epoch
+    async with _pool.acquire() as db:
+        cursor = await db.execute(f'SELECT {CURRENCIES[currency]} FROM user_profiles WHERE user_id = ?', (user_id,))
+        row = await cursor.fetchone()
+    if row is None:
+        return 0
+    fresh = _balance_cache.get(key)
+    # Проводка или сброс могли случиться, пока мы читали: их значение свежее.
+    if epoch == _balance_epoch and (fresh is None or fresh is cached):
+        cache_balances(user_id, **{currency: row[0] or 0})
+        return row[0] or 0
+    return fresh[0] if fresh is not None else row[0] or 0
+
+
+def _publish_balances(balances: Dict[Tuple[int, str], int]) -> None:
+    for (user_id, currency), balance in balances.items():
+        leaderboard.update(user_id, **{currency: balance})
+        cache_balances(user_id, **{currency: balance})
+
+
+async def transfer(debit: Account, credit: Account, amount: int, reason: str,
+                   currency: str = "lumcoins") -> Dict[int, int]:
+    """
+    Единственный способ двигать валюту: перевод между счетами (user_id или имя
+    системного счёта из core/db/ledger.SYSTEM_ACCOUNTS) одной проводкой в транзакции
+    писателя. Возвращает новые балансы пользователей; InsufficientFunds при нехватке.
+    """
+    balances = await _writer.submit(lambda conn: transfer_tx(conn, debit, credit, amount, reason, currency))
+    _publish_balances({(user_id, currency): balance for user_id, balance in balances.items()})
+    return balances
+
+
+async def transfer_many(legs: List[Tuple[Account, Account, int, str, str]]) -> Dict[Tuple[int, str], int]:
+    """Несколько переводов (debit, credit, amount, reason, currency) атомарно: либо все, либо ни одного."""
+    legs = list(legs)
+    balances = await _writer.submit(lambda conn: post_tx(conn, legs))
+    _publish_balances(balances)
+    return balances
+
+
+async def adjust_balance(user_id: int, amount: int, account: str, reason: str, currency: str = "lumcoins") -> bool:
+    """
+    Начисление (amount > 0) пользователю со системного счёта account или списание
+    (amount < 0) на него. False, если средств не хватает или проводка невозможна
+    (например, у пользователя нет профиля); баланс тогда не меняется.
+    """
+    if amount == 0:
+        return True
+    try:
+        if amount > 0:
+            await transfer(account, user_id, amount, reason, currency)
+        else:
+            await transfer(user_id, account, -amount, reason, currency)
+    except InsufficientFunds:
+        logger.info(f"User {user_id} has insufficient {currency} for {reason} ({-amount}).")
+        return False
+    except LedgerError as e:
+        logger.warning(f"Balance change for user {user_id} ({amount} {currency}, {reason}) rejected: {e}")
+        return False
+    return True
+
+
+async def get_ledger_entries(account: Optional[Account] = None, currency: Optional[str] = None,
+                             reason: Optional[str] = None, since: Optional[float] = None,
+                             limit: int = 50) -> List[Dict[str, Any]]:
+    """Проводки журнала, новые первыми; фильтры по счёту, валюте, префиксу причины и времени."""
+    sql, params = journal_sql(account, currency, reason, since, limit)
+    async with _pool.acquire() as db:
+        cursor = await db.execute(sql, params)
+        return [journal_entry(row) for row in await cursor.fetchall()]
+
+
+async def verify_ledger() -> List[str]:
+    """Сверяет балансы с журналом (в потоке писателя, на согласованном снимке). Пустой список - всё сходится."""
+    return await _writer.submit(check_ledger)
+
+
+async def verify_quest_totals() -> List[str]:
+    """Сверяет свёртки выполнения заданий с quests_statistics (в потоке писателя). Пустой список - всё сходится."""
+    return await _writer.submit(check_quest_totals)
+
+
+async def rebuild_quest_totals() -> int:
+    """Пересобирает свёртки выполнения заданий из quests_statistics. Возвращает число строк quest_totals."""
+    return await _writer.submit(rebuild_quest_totals_tx)
+
+
+DIALOG_HISTORY_RETENTION_DAYS = float(os.getenv("DIALOG_HISTORY_RETENTION_DAYS", 30))
+DB_MAINTENANCE_SECONDS = float(os.getenv("DB_MAINTENANCE_SECONDS", DAY))
+# Страниц, возвращаемых файлу за один проход обслуживания (0 - все свободные).
+DB_VACUUM_MAX_PAGES = int(os.getenv("DB_VACUUM_MAX_PAGES", 0))
+
+
+async def purge_dialog_history(now: Optional[float] = None) -> int:
+    """Удаляет историю диалогов, не обновлявшуюся дольше DIALOG_HISTORY_RETENTION_DAYS."""
+    now = now if now is not None else datetime.now().timestamp()
+    before = now - DIALOG_HISTORY_RETENTION_DAYS * DAY
+    return await _writer.submit(
+        lambda conn: conn.execute('DELETE FROM dialog_history WHERE timestamp < ?', (before,)).rowcount
+    )
+
+
+async def run_db_maintenance(interval: float = DB_MAINTENANCE_SECONDS) -> None:
+    """Фоновая задача: срок хранения истории диалогов и инкрементальный VACUUM. Запускается из main()."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            purged = await purge_dialog_history()
+            vacuum = await asyncio.to_thread(incremental_vacuum, DB_PATH, DB_VACUUM_MAX_PAGES)
+            logger.info("DB maintenance: %d dialog rows purged, %s", purged, vacuum)
+        except Exception as e:
+            logger.error(f"DB maintenance failed: {e}")
+
+
 async def get_user_statistics_summary(user_id: int) -> Dict[str, Any]:
+    """Итоги пользователя из свёрток: отстают от сырых данных не более чем на ANALYTICS_COMPACT_SECONDS."""
     stats = {"count": 0, "last_mode": "N/A", "last_active": "N/A"}
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute('SELECT COUNT(*) FROM analytics_interactions WHERE user_id = ?', (user_id,)) as cursor:
-            count_row = await cursor.fetchone()
-            if count_row:
-                stats["count"] = count_row[0]
-
-        user_info = await get_user_profile_info(user_id)
-        if user_info:
-            stats["last_active"] = user_info["last_active"]
-
-        async with db.execute('SELECT mode FROM analytics_interactions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1', (user_id,)) as cursor:
-            last_interaction_mode = await cursor.fetchone()
-            if last_interaction_mode:
-                stats["last_mode"] = last_interaction_mode[0]
-            else:
-                async with db.execute('SELECT mode FROM user_modes WHERE user_id = ?', (user_id,)) as mode_cursor:
-                    current_mode = await mode_cursor.fetchone()
-                    if current_mode:
-                        stats["last_mode"] = current_mode[0]
+    # Вложенный запрос выполняем до захвата соединения, чтобы не держать два соединения пула сразу.
+    user_info = await get_user_profile_info(user_id)
+    if user_info:
+        stats["last_active"] = user_info["last_active"]
+
+    async with _pool.acquire() as db:
+        async with db.execute('SELECT interactions, last_mode FROM analytics_user_totals WHERE user_id = ?', (user_id,)) as cursor:
+            totals = await cursor.fetchone()
+        if totals:
+            stats["count"], stats["last_mode"] = totals[0], totals[1]
+        else:
+            async with db.execute('SELECT mode FROM user_modes WHERE user_id = ?', (user_id,)) as mode_cursor:
+                current_mode = await mode_cursor.fetchone()
+                if current_mode:
+                    stats["last_mode"] = current_mode[0]
     return stats
 
 async def get_user_rp_stats(user_id: int) -> Dict[str, Any]:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)', (user_id,))
         async with db.execute('SELECT hp, heal_cooldown_ts, recovery_end_ts FROM rp_user_stats WHERE user_id = ?', (user_id,)) as cursor:
             row = await cursor.fetchone()
@@ -390,7 +601,7 @@ async def update_user_rp_stats(user_id: int, **kwargs: Optional[Any]) -> None:
     query = f"UPDATE rp_user_stats SET {', '.join(updates)} WHERE user_id = ?"
     params.append(user_id)
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)', (user_id,))
         await db.execute(query, tuple(params))
         await db.commit()
@@ -415,13 +626,13 @@ async def get_users_for_hp_recovery(current_timestamp: float, min_hp_level_inclu
         FROM rp_user_stats
         WHERE hp <= ? AND recovery_end_ts > 0 AND recovery_end_ts <= ?
     """
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         async with db.execute(query, (min_hp_level_inclusive, current_timestamp)) as cursor:
             rows = await cursor.fetchall()
             return [(row[0], row[1]) for row in rows]
 
 async def add_item_to_inventory(user_id: int, item_key: str, item_type: str) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         await db.execute('''
             INSERT OR IGNORE INTO user_inventory (user_id, item_key, item_type)
             VALUES (?, ?, ?)
@@ -430,7 +641,7 @@ async def add_item_to_inventory(user_id: int, item_key: str, item_type: str) ->
     logger.info(f"Item '{item_key}' (type: {item_type}) added to inventory for user {user_id}.")
 
 async def get_user_inventory(user_id: int, item_type: str = 'background') -> List[str]:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute('''
             SELECT item_key FROM user_inventory WHERE user_id = ? AND item_type = ?
         ''', (user_id, item_type))
@@ -438,47 +649,67 @@ async def get_user_inventory(user_id: int, item_type: str = 'background') -> Lis
         return [row[0] for row in rows]
 
 async def set_user_active_background(user_id: int, background_key: str) -> None:
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _pool.acquire() as db:
         try:
-            cursor = await db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_profiles'")
-            table_exists = await cursor.fetchone()
-
-            if not table_exists:
-                await db.execute('''
-                    CREATE TABLE user_profiles (
-                        user_id INTEGER PRIMARY KEY,
-                        hp INTEGER DEFAULT 100,
-                        level INTEGER DEFAULT 1,
-                        exp INTEGER DEFAULT 0,
-                        lumcoins INTEGER DEFAULT 0,
-                        daily_messages INTEGER DEFAULT 0,
-                        total_messages INTEGER DEFAULT 0,
-                        flames INTEGER DEFAULT 0,
-                        active_background TEXT DEFAULT 'default',
-                        FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-                    )
-                ''')
-                await db.commit()
-                logger.info("Created user_profiles table in main database")
-
-            cursor = await db.execute("PRAGMA table_info(user_profiles)")
-            columns = await cursor.fetchall()
-            has_active_background = any('active_background' in column for column in columns)
-
-            if not has_active_background:
-                await db.execute('ALTER TABLE user_profiles ADD COLUMN active_background TEXT DEFAULT "default"')
-                await db.commit()
-                logger.info("Added active_background column to user_profiles table")
-
             await db.execute(
                 'UPDATE user_profiles SET active_background = ? WHERE user_id = ?',
                 (background_key, user_id)
             )
             await db.commit()
-            logger.info(f"User {user_id} active background set to '{background_key}' in main database.")
-
+            logger.info(f"User {user_id} active background set to '{background_key}'.")
         except Exception as e:
-            logger.error(f"Error setting active background in main database: {e}")
+            logger.error(f"Error setting active background for user {user_id}: {e}")
+
+
+BULK_SYNC_CHUNK = int(os.getenv("BULK_SYNC_CHUNK", 5000))
+
+
+async def sync_active_backgrounds(backgrounds: Dict[int, str], dry_run: bool = False,
+                                  chunk_size: int = BULK_SYNC_CHUNK) -> Dict[str, Any]:
+    """
+    Массовая замена set_user_active_background в цикле: одно чтение текущих фонов,
+    затем executemany только по изменившимся профилям, по chunk_size строк на намерение
+    писателя (пачки попадают в общие групповые коммиты). dry_run ничего не пишет и
+    возвращает разницу в "diff" как [(user_id, было, станет)].
+    """
+    async with _pool.acquire() as db:
+        # Все id одним параметром: json_each вместо IN (?, ?, ...) с лимитом на число переменных.
+        cursor = await db.execute(
+            'SELECT user_id, active_background FROM user_profiles WHERE user_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(backgrounds)),)
+        )
+        current = dict(await cursor.fetchall())
+
+    diff = [(user_id, current[user_id], key) for user_id, key in backgrounds.items()
+            if user_id in current and current[user_id] != key]
+    report: Dict[str, Any] = {
+        "total": len(backgrounds),
+        "changed": len(diff),
+        "unchanged": len(current) - len(diff),
+        "missing": len(backgrounds) - len(current),
+    }
+    if dry_run:
+        report["diff"] = diff
+        return report
+
+    def _apply(chunk: List[Tuple[str, int]]):
+        return lambda conn: conn.executemany(
+            'UPDATE user_profiles SET active_background = ? WHERE user_id = ?', chunk
+        ).rowcount
+
+    params = [(key, user_id) for user_id, _, key in diff]
+    await asyncio.gather(*(
+        _writer.submit(_apply(params[i:i + chunk_size])) for i in range(0, len(params), chunk_size)
+    ))
+    logger.info("Active backgrounds synced: %s", report)
+    return report
+
+
+async def get_rpg_active_backgrounds() -> Dict[int, str]:
+    """Активные фоны из RPG-инвентаря (user_active_background) - источник для sync_active_backgrounds."""
+    async with _pool.acquire() as db:
+        cursor = await db.execute('SELECT user_id, bg_key FROM user_active_background')
+        return dict(await cursor.fetchall())
 
 async def get_group_admins(group_id: int) -> List[int]:
     """Получает список администраторов группы"""
@@ -528,120 +759,97 @@ async def update_casino_stats(self, user_id: int, win_streak: int, roulette_loss
         logger.error(f"Error updating casino stats for user {user_id}: {e}")
         return False
 
-# Добавление функций для управления настройками группы
-async def create_group_settings_table():
-    """Создает/мигрирует таблицу настроек групп."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS group_settings (
-                chat_id INTEGER PRIMARY KEY,
-                bot_enabled INTEGER NOT NULL DEFAULT 1,
-                ai_enabled INTEGER NOT NULL DEFAULT 1,
-                rp_enabled INTEGER NOT NULL DEFAULT 1,
-                economy_enabled INTEGER NOT NULL DEFAULT 1,
-                casino_enabled INTEGER NOT NULL DEFAULT 1,
-                promo_enabled INTEGER NOT NULL DEFAULT 1,
-                stt_enabled INTEGER NOT NULL DEFAULT 1,
-                work_cooldown_seconds INTEGER NOT NULL DEFAULT 900,
-                transfer_cooldown_seconds INTEGER NOT NULL DEFAULT 36000
-            )
-        ''')
-
-        cursor = await db.execute("PRAGMA table_info(group_settings)")
-        columns = {col[1] for col in await cursor.fetchall()}
-        migrations = {
-            "bot_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "ai_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "rp_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "economy_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "casino_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "promo_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "stt_enabled": "INTEGER NOT NULL DEFAULT 1",
-            "work_cooldown_seconds": "INTEGER NOT NULL DEFAULT 900",
-            "transfer_cooldown_seconds": "INTEGER NOT NULL DEFAULT 36000",
-        }
-        for col, definition in migrations.items():
-            if col not in columns:
-                await db.execute(f"ALTER TABLE group_settings ADD COLUMN {col} {definition}")
-                logger.info("Added '%s' column to group_settings.", col)
+GROUP_SETTINGS_DEFAULTS: Dict[str, Any] = {
+    "bot_enabled": True,
+    "ai_enabled": True,
+    "rp_enabled": True,
+    "economy_enabled": True,
+    "casino_enabled": True,
+    "promo_enabled": True,
+    "stt_enabled": True,
+    "work_cooldown_seconds": 900,
+    "transfer_cooldown_seconds": 36000,
+}
+
+# Настройки групп читаются на каждое сообщение, а меняются только из конфига,
+# поэтому держим их в памяти: chat_id -> настройки. Загружаются лениво при первом
+# запросе и обновляются сквозной записью в set_group_setting/set_ai_status.
+_group_settings_cache: Dict[int, Dict[str, Any]] = {}
+_group_settings_stats = {"hits": 0, "misses": 0}
+
+
+def get_group_settings_cache_stats() -> Dict[str, int]:
+    """Счётчики кэша настроек групп: hits, misses и число закэшированных чатов."""
+    return {**_group_settings_stats, "size": len(_group_settings_cache)}
+
+
+def invalidate_group_settings(chat_id: Optional[int] = None) -> None:
+    """Сбрасывает кэш настроек для чата (или для всех чатов, если chat_id не задан)."""
+    if chat_id is None:
+        _group_settings_cache.clear()
+    else:
+        _group_settings_cache.pop(chat_id, None)
+
+
+async def _load_group_settings(db: aiosqlite.Connection, chat_id: int) -> Dict[str, Any]:
+    cursor = await db.execute(
+        """
+        SELECT ai_enabled, rp_enabled, economy_enabled, casino_enabled, promo_enabled, stt_enabled,
+               work_cooldown_seconds, transfer_cooldown_seconds, bot_enabled
+        FROM group_settings WHERE chat_id = ?
+        """,
+        (chat_id,),
+    )
+    row = await cursor.fetchone()
+    if not row:
+        return dict(GROUP_SETTINGS_DEFAULTS)
+    return {
+        "ai_enabled": bool(row[0]),
+        "rp_enabled": bool(row[1]),
+        "economy_enabled": bool(row[2]),
+        "casino_enabled": bool(row[3]),
+        "promo_enabled": bool(row[4]),
+        "stt_enabled": bool(row[5]),
+        "work_cooldown_seconds": int(row[6] or 900),
+        "transfer_cooldown_seconds": int(row[7] or 36000),
+        "bot_enabled": bool(row[8]),
+    }
 
-        await db.commit()
 
 async def get_ai_status(chat_id: int) -> bool:
     """Получить статус включения AI для группы. По умолчанию True."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT ai_enabled FROM group_settings WHERE chat_id = ?",
-            (chat_id,)
-        )
-        result = await cursor.fetchone()
-        # Если записи нет (result is None), возвращаем True (включено по умолчанию)
-        # Если запись есть, возвращаем результат (0 или 1), преобразованный в bool
-        return bool(result[0]) if result else True
+    settings = await get_group_settings(chat_id)
+    return settings["ai_enabled"]
 
 async def set_ai_status(chat_id: int, enabled: bool):
     """Установить статус включения AI для группы."""
     status = 1 if enabled else 0
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             "INSERT INTO group_settings (chat_id, ai_enabled) VALUES (?, ?) "
             "ON CONFLICT(chat_id) DO UPDATE SET ai_enabled = excluded.ai_enabled",
             (chat_id, status)
         )
         await db.commit()
+        _group_settings_cache[chat_id] = await _load_group_settings(db, chat_id)
 
 async def get_group_settings(chat_id: int) -> Dict[str, Any]:
-    defaults: Dict[str, Any] = {
-        "bot_enabled": True,
-        "ai_enabled": True,
-        "rp_enabled": True,
-        "economy_enabled": True,
-        "casino_enabled": True,
-        "promo_enabled": True,
-        "stt_enabled": True,
-        "work_cooldown_seconds": 900,
-        "transfer_cooldown_seconds": 36000,
-    }
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            """
-            SELECT ai_enabled, rp_enabled, economy_enabled, casino_enabled, promo_enabled, stt_enabled,
-                   work_cooldown_seconds, transfer_cooldown_seconds, bot_enabled
-            FROM group_settings WHERE chat_id = ?
-            """,
-            (chat_id,),
-        )
-        row = await cursor.fetchone()
-        if not row:
-            return defaults
-        return {
-            "ai_enabled": bool(row[0]),
-            "rp_enabled": bool(row[1]),
-            "economy_enabled": bool(row[2]),
-            "casino_enabled": bool(row[3]),
-            "promo_enabled": bool(row[4]),
-            "stt_enabled": bool(row[5]),
-            "work_cooldown_seconds": int(row[6] or 900),
-            "transfer_cooldown_seconds": int(row[7] or 36000),
-            "bot_enabled": bool(row[8]),
-        }
+    cached = _group_settings_cache.get(chat_id)
+    if cached is not None:
+        _group_settings_stats["hits"] += 1
+        return dict(cached)
+    _group_settings_stats["misses"] += 1
+    async with _pool.acquire() as db:
+        settings = await _load_group_settings(db, chat_id)
+    # Запись могла обновить кэш, пока мы читали: её значение свежее.
+    settings = _group_settings_cache.setdefault(chat_id, settings)
+    return dict(settings)
 
 async def set_group_setting(chat_id: int, field: str, value: Any) -> None:
-    allowed_fields = {
-        "ai_enabled",
-        "bot_enabled",
-        "rp_enabled",
-        "economy_enabled",
-        "casino_enabled",
-        "promo_enabled",
-        "stt_enabled",
-        "work_cooldown_seconds",
-        "transfer_cooldown_seconds",
-    }
-    if field not in allowed_fields:
+    if field not in GROUP_SETTINGS_DEFAULTS:
         raise ValueError(f"Unsupported group setting field: {field}")
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             "INSERT OR IGNORE INTO group_settings(chat_id) VALUES (?)",
             (chat_id,),
@@ -651,40 +859,7 @@ async def set_group_setting(chat_id: int, field: str, value: Any) -> None:
             (value, chat_id),
         )
         await db.commit()
-
-
-async def create_relationships_table() -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS group_relationships (
-                chat_id INTEGER NOT NULL,
-                user1_id INTEGER NOT NULL,
-                user2_id INTEGER NOT NULL,
-                relation_type TEXT NOT NULL CHECK (relation_type IN ('friend', 'romantic', 'married')),
-                intimacy_level INTEGER NOT NULL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (chat_id, user1_id, user2_id)
-            )
-            '''
-        )
-        cursor = await db.execute("PRAGMA table_info(group_relationships)")
-        columns = {col[1] for col in await cursor.fetchall()}
-        if "intimacy_level" not in columns:
-            await db.execute("ALTER TABLE group_relationships ADD COLUMN intimacy_level INTEGER NOT NULL DEFAULT 0")
-        await db.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS relationship_action_cooldowns (
-                chat_id INTEGER NOT NULL,
-                user1_id INTEGER NOT NULL,
-                user2_id INTEGER NOT NULL,
-                action_key TEXT NOT NULL,
-                last_used_ts REAL NOT NULL DEFAULT 0,
-                PRIMARY KEY (chat_id, user1_id, user2_id, action_key)
-            )
-            '''
-        )
-        await db.commit()
+        _group_settings_cache[chat_id] = await _load_group_settings(db, chat_id)
 
 
 def _normalize_pair(user_a: int, user_b: int) -> Tuple[int, int]:
@@ -693,7 +868,7 @@ def _normalize_pair(user_a: int, user_b: int) -> Tuple[int, int]:
 
 async def set_group_relationship(chat_id: int, user_a: int, user_b: int, relation_type: str) -> None:
     user1, user2 = _normalize_pair(user_a, user_b)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             '''
             INSERT INTO group_relationships (chat_id, user1_id, user2_id, relation_type)
@@ -709,7 +884,7 @@ async def set_group_relationship(chat_id: int, user_a: int, user_b: int, relatio
 
 async def get_group_relationship(chat_id: int, user_a: int, user_b: int) -> Optional[Dict[str, Any]]:
     user1, user2 = _normalize_pair(user_a, user_b)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             '''
             SELECT relation_type, intimacy_level, created_at
@@ -726,7 +901,7 @@ async def get_group_relationship(chat_id: int, user_a: int, user_b: int) -> Opti
 
 async def remove_group_relationship(chat_id: int, user_a: int, user_b: int) -> None:
     user1, user2 = _normalize_pair(user_a, user_b)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             '''
             DELETE FROM group_relationships
@@ -741,7 +916,7 @@ async def increment_relationship_intimacy(chat_id: int, user_a: int, user_b: int
     if delta <= 0:
         return None
     user1, user2 = _normalize_pair(user_a, user_b)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             '''
             UPDATE group_relationships
@@ -757,7 +932,7 @@ async def increment_relationship_intimacy(chat_id: int, user_a: int, user_b: int
 
 
 async def get_user_group_relationships(chat_id: int, user_id: int) -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             '''
             SELECT user1_id, user2_id, relation_type, intimacy_level, created_at
@@ -782,24 +957,62 @@ async def get_user_group_relationships(chat_id: int, user_id: int) -> List[Dict[
         return result
 
 
+USERNAME_CACHE_SIZE = int(os.getenv("USERNAME_CACHE_SIZE", 10000))
+
+# LRU перед индексом users.username_lower: lowercase-ник -> данные пользователя.
+# Промахи не кэшируются (пользователь может появиться позже); запись ника
+# в ensure_user_exists вытесняет старый и новый ник.
+_username_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_username_keys: Dict[int, str] = {}
+_username_stats = {"hits": 0, "misses": 0}
+
+
+def normalize_username(username: Optional[str]) -> str:
+    return (username or "").strip().lstrip("@").lower()
+
+
+def get_username_cache_stats() -> Dict[str, int]:
+    return {**_username_stats, "size": len(_username_cache)}
+
+
+def _forget_username(user_id: int, username: Optional[str]) -> None:
+    """Вытесняет из LRU новый ник пользователя и ник, под которым он был закэширован."""
+    _username_cache.pop(normalize_username(username), None)
+    cached_key = _username_keys.pop(user_id, None)
+    if cached_key is not None:
+        _username_cache.pop(cached_key, None)
+
+
 async def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
-    normalized = (username or "").strip().lstrip("@").lower()
+    normalized = normalize_username(username)
     if not normalized:
         return None
-    async with aiosqlite.connect(DB_PATH) as db:
+    cached = _username_cache.get(normalized)
+    if cached is not None:
+        _username_cache.move_to_end(normalized)
+        _username_stats["hits"] += 1
+        return dict(cached)
+    _username_stats["misses"] += 1
+    async with _pool.acquire() as db:
         cursor = await db.execute(
-            "SELECT user_id, username, first_name FROM users WHERE LOWER(username) = ? LIMIT 1",
+            "SELECT user_id, username, first_name FROM users WHERE username_lower = ?",
             (normalized,),
         )
         row = await cursor.fetchone()
-        if not row:
-            return None
-        return {"user_id": int(row[0]), "username": row[1], "first_name": row[2]}
+    if not row:
+        return None
+    user = {"user_id": int(row[0]), "username": row[1], "first_name": row[2]}
+    _username_cache[normalized] = user
+    _username_keys[user["user_id"]] = normalized
+    if len(_username_cache) > USERNAME_CACHE_SIZE:
+        _, evicted = _username_cache.popitem(last=False)
+        _username_keys.pop(evicted["user_id"], None)
+    return dict(user)
 
 
 async def get_relationship_action_last_used(chat_id: int, user_a: int, user_b: int, action_key: str) -> float:
     user1, user2 = _normalize_pair(user_a, user_b)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         cursor = await db.execute(
             '''
             SELECT last_used_ts
@@ -814,7 +1027,7 @@ async def get_relationship_action_last_used(chat_id: int, user_a: int, user_b: i
 
 async def set_relationship_action_last_used(chat_id: int, user_a: int, user_b: int, action_key: str, ts: float) -> None:
     user1, user2 = _normalize_pair(user_a, user_b)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             '''
             INSERT INTO relationship_action_cooldowns (chat_id, user1_id, user2_id, action_key, last_used_ts)
@@ -827,23 +1040,8 @@ async def set_relationship_action_last_used(chat_id: int, user_a: int, user_b: i
         await db.commit()
 
 
-async def create_duel_stats_table() -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS duel_stats (
-                user_id INTEGER PRIMARY KEY,
-                strength INTEGER NOT NULL DEFAULT 0,
-                agility INTEGER NOT NULL DEFAULT 0,
-                stamina INTEGER NOT NULL DEFAULT 0
-            )
-            '''
-        )
-        await db.commit()
-
-
 async def get_duel_stats(user_id: int) -> Dict[str, int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             "INSERT OR IGNORE INTO duel_stats (user_id) VALUES (?)",
             (user_id,),
@@ -861,7 +1059,7 @@ async def get_duel_stats(user_id: int) -> Dict[str, int]:
 
 
 async def update_duel_stats(user_id: int, strength_delta: int = 0, agility_delta: int = 0, stamina_delta: int = 0) -> Dict[str, int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _pool.acquire() as db:
         await db.execute(
             "INSERT OR IGNORE INTO duel_stats (user_id) VALUES (?)",
             (user_id,),
@@ -877,4 +1075,6 @@ async def update_duel_stats(user_id: int, strength_delta: int = 0, agility_delta
             (strength_delta, agility_delta, stamina_delta, user_id),
         )
         await db.commit()
-    return await get_duel_stats(user_id)
+    stats = await get_duel_stats(user_id)
+    leaderboard.update(user_id, strength=stats["strength"])
+    return stats
@@ -1,14 +1,15 @@
 from core.group.stat.smain import *
 from core.group.stat.config import *
 from core.group.stat.manager import ProfileManager
+from core.group.stat.backgrounds import BackgroundError, fetch_background
 from core.group.stat.shop_config import *
 import string
 import time
 import random
-from database import add_item_to_inventory, set_user_active_background, get_user_rp_stats, update_user_rp_stats, DB_PATH
+from database import add_item_to_inventory, get_user_rp_stats, update_user_rp_stats, DB_PATH
 import database as db
+from core.db.pool import open_connection
 import asyncio
-import aiosqlite
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import re
@@ -159,6 +160,13 @@ async def process_custom_bg_url(message: types.Message, profile_manager: Profile
         await message.answer("❌ Информация о покупке не найдена. Начните заново.")
         return
 
+    # Скачиваем и проверяем картинку сейчас: к отрисовке профиля она уже будет в кэше
+    try:
+        await fetch_background(url)
+    except BackgroundError as e:
+        await message.answer(f"❌ Не удалось загрузить изображение: {e}.\n\nОтправьте другую ссылку или /cancel для отмены")
+        return
+
     # Создаем клавиатуру для подтверждения
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -202,18 +210,17 @@ async def process_confirm_custom_bg(callback: types.CallbackQuery, profile_manag
         return
 
     # Списываем Lumcoins
-    await profile_manager.update_lumcoins(user_id, -purchase_info['price'])
+    if not await profile_manager.update_lumcoins(user_id, -purchase_info['price'], "shop", "background:custom"):
+        await callback.message.edit_text("❌ Недостаточно Lumcoins для покупки кастомного фона.")
+        await state.clear()
+        custom_bg_purchases.pop(user_id, None)
+        return
 
     # Добавляем кастомный фон в инвентарь
     await add_item_to_inventory(user_id, f"custom:{user_id}", 'background')
 
     # Сохраняем URL кастомного фона в отдельной таблице
-    async with aiosqlite.connect('profiles.db') as conn:
-        await conn.execute('''CREATE TABLE IF NOT EXISTS custom_backgrounds (
-            user_id INTEGER PRIMARY KEY,
-            background_url TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
+    async with open_connection(DB_PATH) as conn:
         await conn.execute('''INSERT OR REPLACE INTO custom_backgrounds (user_id, background_url)
             VALUES (?, ?)''', (user_id, url))
         await conn.commit()
@@ -260,7 +267,7 @@ async def process_activate_background(callback: types.CallbackQuery, profile_man
     if background_key_to_activate in user_backgrounds_inventory or background_key_to_activate == 'default' or background_key_to_activate.startswith("custom:"):
         # Если это кастомный фон, проверяем его наличие
         if background_key_to_activate.startswith("custom:"):
-            async with aiosqlite.connect('profiles.db') as conn:
+            async with open_connection(DB_PATH) as conn:
                 cursor = await conn.execute(
                     'SELECT background_url FROM custom_backgrounds WHERE user_id = ?',
                     (user_id,)
@@ -395,10 +402,12 @@ async def heal_hp(message: types.Message, profile_manager: ProfileManager):
         await message.reply(f"❌ Недостаточно Lumcoins для лечения. Нужно {cost} LUM, у вас {lumcoins} LUM.")
         return
 
-    # Выполняем лечение
+    # Выполняем лечение: сначала оплата, проверка баланса - в самой проводке
+    if not await profile_manager.update_lumcoins(user_id, -cost, "heal", "heal"):
+        await message.reply(f"❌ Недостаточно Lumcoins для лечения. Нужно {cost} LUM.")
+        return
     new_hp = current_hp + heal_amount
     await update_user_rp_stats(user_id, hp=new_hp)
-    await profile_manager.update_lumcoins(user_id, -cost)
 
     await message.reply(
         f"✅ Вы восстановили {heal_amount} HP за {cost} LUM!\n"
@@ -432,7 +441,7 @@ async def do_work(message: types.Message, profile_manager: ProfileManager):
     task_name, lumcoins_reward = random.choice(list(WorkConfig.WORK_TASKS.items()))
 
     # Обновление Lumcoins и времени последней работы
-    await profile_manager.update_lumcoins(user_id, lumcoins_reward)
+    await profile_manager.update_lumcoins(user_id, lumcoins_reward, "rewards", "work")
     await profile_manager.update_last_work_time(user_id, current_time)
 
     await message.reply(f"✅ Вы успешно {task_name} и заработали {lumcoins_reward} Lumcoins!")
@@ -514,9 +523,7 @@ async def process_buy_background(callback: types.CallbackQuery, profile_manager:
         await callback.message.edit_text(f"✅ У вас уже есть фон '{bg_name}'.", reply_markup=None)
         return
 
-    if user_lumcoins >= bg_price:
-        # Сначала списываем Lumcoins
-        await profile_manager.update_lumcoins(user_id, -bg_price)
+    if user_lumcoins >= bg_price and await profile_manager.update_lumcoins(user_id, -bg_price, "shop", f"background:{background_key_to_buy}"):
 
         # Добавляем в инвентарь
         await add_item_to_inventory(user_id, background_key_to_buy, 'background')
@@ -542,104 +549,40 @@ async def show_top(message: types.Message, profile_manager: ProfileManager):
     user_id = message.from_user.id
     logger.info(f"Received 'топ' command from user {user_id}.")
 
+    # В группе - рейтинг участников чата, в личке - глобальный.
+    chat_id = message.chat.id if message.chat.type in (ChatType.GROUP, ChatType.SUPERGROUP) else None
+
     # Получаем топ пользователей по уровню
-    top_users_level = await profile_manager.get_top_users_by_level(limit=10)
+    top_users_level = await profile_manager.get_top_users_by_level(limit=10, chat_id=chat_id)
 
     response_text = "🏆 **Топ 10 игроков по уровню:** 🏆\n\n"
     if top_users_level:
-        for i, user_data in enumerate(top_users_level):
+        for user_data in top_users_level:
             display_name = user_data.get('display_name', 'Неизвестный')
-            response_text += f"{i+1}. {display_name} - Уровень: {user_data['level']}, EXP: {user_data['exp']}\n"
+            response_text += f"{user_data['rank']}. {display_name} - Уровень: {user_data['level']}, EXP: {user_data['exp']}\n"
     else:
         response_text += "Пока нет данных для топа по уровню.\n"
 
     response_text += "\n💰 **Топ 10 игроков по Lumcoins:** 💰\n\n"
     # Получаем топ пользователей по Lumcoins
-    top_users_lumcoins = await profile_manager.get_top_users_by_lumcoins(limit=10)
+    top_users_lumcoins = await profile_manager.get_top_users_by_lumcoins(limit=10, chat_id=chat_id)
     if top_users_lumcoins:
-        for i, user_data in enumerate(top_users_lumcoins):
+        for user_data in top_users_lumcoins:
             display_name = user_data.get('display_name', 'Неизвестный')
-            response_text += f"{i+1}. {display_name} - Lumcoins: {user_data['lumcoins']}\n"
+            response_text += f"{user_data['rank']}. {display_name} - Lumcoins: {user_data['lumcoins']}\n"
     else:
         response_text += "Пока нет данных для топа по Lumcoins.\n"
 
+    level_rank = profile_manager.get_user_rank('level', user_id, chat_id)
+    lumcoins_rank = profile_manager.get_user_rank('lumcoins', user_id, chat_id)
+    if level_rank or lumcoins_rank:
+        response_text += (
+            f"\n📍 Ваше место: по уровню - {level_rank or '—'}, по Lumcoins - {lumcoins_rank or '—'}\n"
+        )
+
     await message.answer(response_text, parse_mode=ParseMode.MARKDOWN)
     logger.info(f"Top players list sent to user {user_id}.")
 
-async def ensure_user_exists(user_id: int, username: Optional[str], first_name: str, last_name: Optional[str] = None):
-    """
-    Убеждается, что пользователь существует в основной базе данных и в базе данных профилей.
-    Создает записи, если их нет.
-    """
-    # Подключение к основной БД бота
-    main_db_conn = None
-    try:
-        main_db_conn = await aiosqlite.connect(DB_PATH) # Используем DB_PATH из database.py
-
-        # Проверяем существование таблицы users
-        cursor = await main_db_conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        table_exists = await cursor.fetchone()
-
-        if not table_exists:
-            # Если таблицы нет, создаем её (это должно быть в initialize_database, но для надежности)
-            await main_db_conn.execute('''CREATE TABLE users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT NOT NULL,
-                last_active_ts REAL DEFAULT0
-            )''')
-            await main_db_conn.commit()
-
-        # Остальной код без изменений
-        await main_db_conn.execute('''INSERT INTO users (user_id, username, first_name, last_active_ts)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username = excluded.username,
-                first_name = excluded.first_name,
-                last_active_ts = excluded.last_active_ts''', (user_id, username, first_name, time.time()))
-
-        # Убедимся, что таблицы user_modes и rp_user_stats существуют
-        await main_db_conn.execute('''CREATE TABLE IF NOT EXISTS user_modes (
-            user_id INTEGER PRIMARY KEY,
-            mode TEXT NOT NULL DEFAULT 'saharoza',
-            rating_opportunities_count INTEGER DEFAULT0,
-            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-        )''')
-        await main_db_conn.execute('''CREATE TABLE IF NOT EXISTS rp_user_stats (
-            user_id INTEGER PRIMARY KEY,
-            hp INTEGER NOT NULL DEFAULT100,
-            heal_cooldown_ts REAL NOT NULL DEFAULT0,
-            recovery_end_ts REAL NOT NULL DEFAULT0,
-            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-        )''')
-
-        await main_db_conn.execute('''INSERT OR IGNORE INTO user_modes (user_id, mode, rating_opportunities_count)
-            VALUES (?, 'saharoza', 0)''', (user_id,))
-        await main_db_conn.execute('''INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)''', (user_id,))
-        await main_db_conn.commit()
-        logger.debug(f"User {user_id} ensured in main bot database.")
-    except Exception as e:
-        logger.error(f"Error ensuring user {user_id} in main bot database: {e}", exc_info=True)
-    finally:
-        if main_db_conn:
-            await main_db_conn.close()
-
-    # Подключение к базе данных профилей
-    profiles_db_conn = None
-    try:
-        profiles_db_conn = await aiosqlite.connect('profiles.db')
-        await profiles_db_conn.execute('''INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)''', (user_id, username, first_name, last_name))
-        await profiles_db_conn.execute('''INSERT OR IGNORE INTO user_profiles (user_id, active_background)
-            VALUES (?, 'default')''', (user_id,))
-        await profiles_db_conn.commit()
-        logger.debug(f"User {user_id} ensured in profiles database.")
-    except Exception as e:
-        logger.error(f"Error ensuring user {user_id} in profiles database: {e}", exc_info=True)
-    finally:
-        if profiles_db_conn:
-            await profiles_db_conn.close()
-
 def setup_stat_handlers(main_dp, profile_manager, database_module, sticker_manager, jokes_manager, bot_instance):
     main_dp.include_router(stat_router)
     logger.info("Registering stat router handlers.")
@@ -663,9 +606,12 @@ async def record_group_activity(message: types.Message, profile_manager: Profile
     if text.startswith('/'):
         return
     try:
-        await profile_manager.record_message(message.from_user)
-        await db.ensure_user_exists(message.from_user.id, message.from_user.username, message.from_user.first_name)
-        await db.log_user_interaction(message.from_user.id, "group_message", "message")
+        # Записи уходят в очереди писателей одновременно и попадают в один групповой коммит.
+        await asyncio.gather(
+            profile_manager.record_message(message.from_user, message.chat.id),
+            db.ensure_user_exists(message.from_user.id, message.from_user.username, message.from_user.first_name),
+            db.log_user_interaction(message.from_user.id, "group_message", "message"),
+        )
         try:
             from core.group.stat.quests_handlers import update_message_quests
             await update_message_quests(message.from_user.id, 1, message.bot)
@@ -675,20 +621,8 @@ async def record_group_activity(message: types.Message, profile_manager: Profile
         logger.error("Failed to record group activity for user %s: %s", message.from_user.id, e)
 
 
-async def _ensure_transfer_table() -> None:
-    async with aiosqlite.connect('profiles.db') as conn:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS user_transfer_cooldowns (
-                user_id INTEGER PRIMARY KEY,
-                last_transfer_ts REAL NOT NULL DEFAULT 0
-            )
-        ''')
-        await conn.commit()
-
-
 async def get_last_transfer_time(user_id: int) -> float:
-    await _ensure_transfer_table()
-    async with aiosqlite.connect('profiles.db') as conn:
+    async with open_connection(DB_PATH) as conn:
         cursor = await conn.execute(
             "SELECT last_transfer_ts FROM user_transfer_cooldowns WHERE user_id = ?",
             (user_id,)
@@ -698,8 +632,7 @@ async def get_last_transfer_time(user_id: int) -> float:
 
 
 async def update_last_transfer_time(user_id: int, timestamp: float) -> None:
-    await _ensure_transfer_table()
-    async with aiosqlite.connect('profiles.db') as conn:
+    async with open_connection(DB_PATH) as conn:
         await conn.execute(
             '''
             INSERT INTO user_transfer_cooldowns (user_id, last_transfer_ts)
@@ -712,40 +645,15 @@ async def update_last_transfer_time(user_id: int, timestamp: float) -> None:
 
 
 async def find_user_by_username(username: str):
-    normalized = (username or "").strip().lstrip("@").lower()
-    if not normalized:
+    user = await db.get_user_by_username(username)
+    if not user:
         return None
-
-    # Сначала ищем в profiles.db
-    async with aiosqlite.connect('profiles.db') as conn:
-        cursor = await conn.execute(
-            "SELECT user_id, username, first_name FROM users WHERE LOWER(username) = ? LIMIT 1",
-            (normalized,)
-        )
-        row = await cursor.fetchone()
-        if row:
-            return SimpleNamespace(
-                id=int(row[0]),
-                username=row[1],
-                first_name=row[2] or row[1] or "пользователь",
-                is_bot=False
-            )
-
-    # Фолбэк: основная БД
-    async with aiosqlite.connect(DB_PATH) as conn:
-        cursor = await conn.execute(
-            "SELECT user_id, username, first_name FROM users WHERE LOWER(username) = ? LIMIT 1",
-            (normalized,)
-        )
-        row = await cursor.fetchone()
-        if row:
-            return SimpleNamespace(
-                id=int(row[0]),
-                username=row[1],
-                first_name=row[2] or row[1] or "пользователь",
-                is_bot=False
-            )
-    return None
+    return SimpleNamespace(
+        id=user["user_id"],
+        username=user["username"],
+        first_name=user["first_name"] or user["username"] or "пользователь",
+        is_bot=False
+    )
 
 @stat_router.message(Command("give"))
 @stat_router.message(F.text.func(lambda text: isinstance(text, str) and text.strip().lower().startswith(("дать", "передать"))))
@@ -850,10 +758,10 @@ async def give_lumcoins(message: types.Message, profile_manager: ProfileManager)
 
     # Выполняем перевод
     try:
-        # Списываем у отправителя
-        await profile_manager.update_lumcoins(user_id, -amount)
-        # Зачисляем получателю
-        await profile_manager.update_lumcoins(target_user.id, amount)
+        # Списание и зачисление - одна проводка; баланс проверяется в ней же
+        if not await profile_manager.transfer_lumcoins(user_id, target_user.id, amount):
+            await message.reply("❌ Недостаточно средств!")
+            return
         # Обновляем время последнего перевода
         await update_last_transfer_time(user_id, current_time)
 
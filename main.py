@@ -45,7 +45,6 @@ from group_RPG import show_inventoryF
 from core.group.RPG.investment import show_sell_menu
 from core.group.RP.actions import RPActions
 from core.group.stat.quests_handlers import (
-    ensure_quests_db,
     update_message_quests,
     update_casino_quests,
     update_work_quests,
@@ -53,7 +52,10 @@ from core.group.stat.quests_handlers import (
     update_market_quests,
     update_rp_quests,
     update_crafting_quests,
-    update_activity_quests
+    update_activity_quests,
+    quest_engine,
+    quest_notifier,
+    quest_rollover
 )
 
 # --- Импорты из КОРНЯ проекта ---
@@ -77,6 +79,14 @@ from rp_module_refactored import (
 )
 from command import cmd_help
 import database as db
+from core.db.writer import stop_all_writers
+from core.db.merge import merge_profiles_db
+from core.db.maintenance import ensure_incremental_auto_vacuum
+from core.db.querystats import format_query_stats
+from core.group.stat.render import get_render_stats, shutdown_render_pool
+from core.group.stat.card_cache import get_card_cache_stats
+from core.group.stat.avatars import get_avatar_cache_stats
+from core.group.stat.backgrounds import close_background_session, get_background_fetch_stats
 from core.main.jokes_manager import JokesManager
 
 logger = logging.getLogger(__name__)
@@ -137,74 +147,26 @@ class TelegramRetryMiddleware(BaseMiddleware):
 # чтобы все декораторы из core.main.dec_command регистрировались
 # в том же экземпляре, который запускается в polling.
 
-async def migrate_inventory_table():
-    try:
-        import aiosqlite
-        async with aiosqlite.connect('profiles.db') as conn:
-            cursor = await conn.execute("PRAGMA table_info(user_inventory)")
-            columns = await cursor.fetchall()
-            column_names = [column[1] for column in columns]
-
-            if 'quantity' not in column_names:
-                logger.info("Добавляем столбец quantity")
-
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS user_inventory_new (
-                        user_id INTEGER,
-                        item_key TEXT,
-                        item_type TEXT,
-                        quantity INTEGER DEFAULT 1,
-                        item_data TEXT,
-                        acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        PRIMARY KEY (user_id, item_key)
-                    )
-                ''')
-
-                await conn.execute('''
-                    INSERT INTO user_inventory_new (user_id, item_key, item_type, quantity, item_data, acquired_at)
-                    SELECT user_id, item_key, item_type, 1, item_data, acquired_at
-                    FROM user_inventory
-                ''')
-
-                await conn.execute('DROP TABLE user_inventory')
-                await conn.execute('ALTER TABLE user_inventory_new RENAME TO user_inventory')
-
-                await conn.commit()
-                logger.info("✅ Миграция завершена")
-            else:
-                logger.info("✅ Таблица уже имеет quantity")
-
-    except Exception as e:
-        logger.error(f"❌ Ошибка миграции: {e}")
-
 async def main():
     logger.info("Запуск бота.")
 
+    logger.info("Инициализация БД.")
+    # Одноразовое слияние profiles.db в единую БД; после слияния ничего не делает.
+    await asyncio.to_thread(merge_profiles_db, db.DB_PATH)
+    # Однократный перевод файла в auto_vacuum=INCREMENTAL, пока к БД нет других соединений.
+    await asyncio.to_thread(ensure_incremental_auto_vacuum, db.DB_PATH)
+    await db.open_pool()
+    await db.initialize_database()
+
     profile_manager = ProfileManager()
     try:
         await profile_manager.connect()
+        await profile_manager.load_leaderboard()
         logger.info("ProfileManager подключен.")
     except Exception as e:
         logger.critical(f"Не удалось подключить ProfileManager: {e}")
         exit(1)
 
-    logger.info("Инициализация БД.")
-    await db.initialize_database()
-    await db.create_promo_table()
-    await db.create_group_settings_table()
-    await db.create_relationships_table()
-    await db.create_duel_stats_table()
-
-    logger.info("Проверка миграции...")
-    await migrate_inventory_table()
-
-    logger.info("Инициализация системы заданий...")
-    try:
-        await ensure_quests_db()
-        logger.info("✅ Система заданий инициализирована")
-    except Exception as e:
-        logger.error(f"❌ Ошибка инициализации заданий: {e}")
-
     logger.info("Инициализация RPG...")
     try:
         await initialize_on_startup()
@@ -212,6 +174,19 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Ошибка RPG: {e}")
 
+    # Пакетный сброс last_active_ts вместо UPDATE на каждое сообщение.
+    last_active_task = asyncio.create_task(db.run_last_active_flusher())
+    # Свёртки analytics_interactions для /stats и срок хранения сырых строк.
+    analytics_task = asyncio.create_task(db.run_analytics_compactor())
+    # Срок хранения истории диалогов и инкрементальный VACUUM.
+    maintenance_task = asyncio.create_task(db.run_db_maintenance())
+    # Пакетная запись прогресса заданий из индекса в памяти.
+    quest_flush_task = asyncio.create_task(quest_engine.run_flusher())
+    # Смена ежедневных и еженедельных заданий всем активным пользователям на границе периода.
+    quest_rollover_task = asyncio.create_task(quest_rollover.run_scheduler())
+    # Сводки уведомлений о заданиях с ограничением частоты отправки.
+    quest_notify_task = asyncio.create_task(quest_notifier.run_sender())
+
     logger.info("Инициализация стикеров.")
     sticker_manager_instance = StickerManager(cache_file_path=STICKERS_CACHE_FILE)
     await sticker_manager_instance.fetch_stickers(bot)
@@ -336,9 +311,39 @@ async def main():
         # for task in tasks_to_cancel:
         #     task.cancel()
 
+        last_active_task.cancel()
+        await db.flush_last_active()
+        analytics_task.cancel()
+        maintenance_task.cancel()
+        quest_flush_task.cancel()
+        quest_rollover_task.cancel()
+        await quest_engine.close()
+        quest_notify_task.cancel()
+        await quest_notifier.close()
+        await db.compact_analytics()
+        await stop_all_writers()
+        logger.info("Очереди записи в БД сброшены.")
+        logger.info("Кэш настроек групп: %s", db.get_group_settings_cache_stats())
+        logger.info("Кэш пользователей: %s", db.get_identity_cache_stats())
+        logger.info("Кэш балансов: %s", db.get_balance_cache_stats())
+        logger.info("Свёртки аналитики: %s", db.get_analytics_stats())
+        logger.info("Движок заданий: %s", quest_engine.get_stats())
+        logger.info("Смена заданий: %s", quest_rollover.get_stats())
+        logger.info("Уведомления о заданиях: %s", quest_notifier.get_stats())
+        logger.info("Самые дорогие SQL-запросы:\n%s", format_query_stats())
+        logger.info("Отрисовка карточек: %s", get_render_stats())
+        logger.info("Кэш карточек профиля: %s", get_card_cache_stats())
+        logger.info("Кэш аватарок: %s", get_avatar_cache_stats())
+        logger.info("Загрузка кастомных фонов: %s", get_background_fetch_stats())
+        await close_background_session()
+        shutdown_render_pool()
+
         await profile_manager.close()
         logger.info("ProfileManager закрыт.")
 
+        await db.close_pool()
+        logger.info("Пул соединений БД закрыт.")
+
         await bot.session.close()
         logger.info("Сессия бота закрыта.")
 
@@ -331,11 +331,13 @@ async def cmd_heal(message: types.Message, bot: Bot, profile_manager: ProfileMan
         await message.reply(f"💰 У вас недостаточно Lumcoins для лечения. Нужно {RPConfig.HEAL_COST}, у вас {lumcoins}.")
         return
 
+    # Deduct Lumcoins first: the ledger re-checks the balance atomically
+    if not await profile_manager.update_lumcoins(user_id, -RPConfig.HEAL_COST, "heal", "heal"):
+        await message.reply(f"💰 У вас недостаточно Lumcoins для лечения. Нужно {RPConfig.HEAL_COST}.")
+        return
+
     # Perform healing
     new_hp, _ = await _update_user_hp(profile_manager, user_id, RPConfig.HEAL_AMOUNT)
-    
-    # Deduct Lumcoins
-    await profile_manager.update_lumcoins(user_id, -RPConfig.HEAL_COST)
 
     # Set healing cooldown
     new_cooldown_ts = now + RPConfig.HEAL_COOLDOWN_SECONDS